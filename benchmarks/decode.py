@@ -0,0 +1,53 @@
+"""
+Benchmarks MetaAuthorize._decode in each DecodeMode, with and without a per-request memo.
+
+Run from the repository root with::
+
+    python -m benchmarks.decode [--rows 100] [--repeat 5] [--distinct 10]
+"""
+import argparse
+import copy
+import timeit
+
+from ckanext.vitality.meta_authorize import MetaAuthorize, DecodeMode
+from benchmarks.sample_data import make_pkg_dict
+
+
+def run(rows, repeat, distinct):
+    # Search pages commonly hold several datasets from the same few organisations, so only
+    # `distinct` different pkg_dicts are repeated over the page
+    page = [make_pkg_dict(i % distinct) for i in range(rows)]
+
+    full = MetaAuthorize()
+    full.decode_mode = DecodeMode.FULL
+    expected = [full._decode(copy.deepcopy(pkg_dict)) for pkg_dict in page]
+
+    print("_decode over a page of %d pkg_dicts (%d distinct), best of %d" % (rows, distinct, repeat))
+    baseline = None
+    for mode in (DecodeMode.FULL, DecodeMode.SNIFF, DecodeMode.SCHEMA):
+        for use_memo in (False, True):
+            meta_authorize = MetaAuthorize()
+            meta_authorize.decode_mode = mode
+
+            if mode is not DecodeMode.SCHEMA:
+                memo = {} if use_memo else None
+                actual = [meta_authorize._decode(copy.deepcopy(pkg_dict), memo) for pkg_dict in page]
+                assert actual == expected, "%s decoding differs from DecodeMode.FULL" % mode.name
+
+            best = None
+            for _ in range(repeat):
+                inputs = copy.deepcopy(page)
+                memo = {} if use_memo else None
+                elapsed = timeit.timeit(lambda: [meta_authorize._decode(pkg_dict, memo) for pkg_dict in inputs], number=1)
+                best = elapsed if best == None else min(best, elapsed)
+            baseline = baseline or best
+            print("  %-6s %-9s %8.1f us/row   %.1fx" % (mode.name, "memo" if use_memo else "no memo", best / rows * 1e6, baseline / best))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--distinct', type=int, default=10)
+    args = parser.parse_args()
+    run(args.rows, args.repeat, args.distinct)
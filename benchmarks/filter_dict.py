@@ -0,0 +1,69 @@
+"""
+Benchmarks MetaAuthorize.filter_dict against the flatten/unflatten implementation it replaced.
+
+Run from the repository root with::
+
+    python -m benchmarks.filter_dict [--rows 100] [--repeat 5]
+"""
+import argparse
+import copy
+import timeit
+
+from flatten_dict import flatten, unflatten
+
+from ckanext.vitality.meta_authorize import MetaAuthorize, DecodeMode
+from benchmarks.sample_data import make_pkg_dict, make_fields, make_whitelists
+
+
+def legacy_filter_dict(meta_authorize, unfiltered_content, fields, whitelist):
+    """
+    The flatten/unflatten implementation of filter_dict, kept for comparison.
+    meta_authorize should use DecodeMode.FULL to match the decoding it was paired with.
+    """
+    def is_visible(key):
+        return key in fields and fields[key] in whitelist
+
+    def test_if_flat(key, val):
+        if not isinstance(val, dict):
+            return val
+        return legacy_filter_dict(meta_authorize, val, fields, whitelist)
+
+    flattened = {k: test_if_flat(k, v) for k, v in flatten(meta_authorize._decode(unfiltered_content), reducer='path').items() if is_visible(k)}
+    return unflatten(flattened, splitter='path')
+
+
+def run(rows, repeat):
+    meta_authorize = MetaAuthorize()
+    legacy_meta_authorize = MetaAuthorize()
+    legacy_meta_authorize.decode_mode = DecodeMode.FULL
+    fields = make_fields()
+    pkg_dicts = [make_pkg_dict(i) for i in range(rows)]
+
+    print("filter_dict over %d pkg_dicts, best of %d" % (rows, repeat))
+    for template, whitelist in make_whitelists(fields).items():
+        # filter_dict decodes in place, so every run gets fresh copies
+        for pkg_dict in pkg_dicts:
+            expected = legacy_filter_dict(legacy_meta_authorize, copy.deepcopy(pkg_dict), fields, whitelist)
+            actual = meta_authorize.filter_dict(copy.deepcopy(pkg_dict), fields, whitelist)
+            assert actual == expected, "filter_dict differs from the legacy implementation for %s" % pkg_dict['id']
+
+        def time(filter):
+            best = None
+            for _ in range(repeat):
+                inputs = copy.deepcopy(pkg_dicts)
+                elapsed = timeit.timeit(lambda: [filter(pkg_dict, fields, whitelist) for pkg_dict in inputs], number=1)
+                best = elapsed if best == None else min(best, elapsed)
+            return best
+
+        legacy = time(lambda pkg_dict, fields, whitelist: legacy_filter_dict(legacy_meta_authorize, pkg_dict, fields, whitelist))
+        compiled = time(meta_authorize.filter_dict)
+        print("  %-8s legacy %8.1f us/row   compiled %8.1f us/row   %.1fx" % (
+            template, legacy / rows * 1e6, compiled / rows * 1e6, legacy / compiled))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.rows, args.repeat)
@@ -0,0 +1,119 @@
+"""
+Realistic CIOOS package dictionaries and authorization fields for the benchmarks.
+"""
+import json
+import uuid
+
+from ckanext.vitality import constants
+
+
+def make_pkg_dict(index=0, num_resources=3):
+    """
+    Returns a pkg_dict shaped like the ones CKAN passes to after_show/after_search for CIOOS datasets,
+    including the fields CIOOS stores as stringified JSON.
+    """
+    dataset_id = str(uuid.UUID(int=index + 1))
+    org_id = str(uuid.UUID(int=10 ** 6 + index % 20))
+    contact = {
+        "contact-info_email": "contact%d@example.org" % index,
+        "contact-info_online-resource_url": "https://example.org/contacts/%d" % index,
+        "individual-name": "Contact %d" % index,
+        "organisation-name": "Organisation %d" % (index % 20),
+        "position-name": "Data manager",
+        "role": "pointOfContact"
+    }
+    return {
+        "author": None,
+        "author_email": None,
+        "bbox-east-long": "-54.9435608299",
+        "bbox-north-lat": "50.23343445",
+        "bbox-south-lat": "44.33428394",
+        "bbox-west-long": "-66.9243032933",
+        "citation": {"en": "Citation for dataset %d" % index, "fr": "Citation du jeu de donnees %d" % index},
+        "cited-responsible-party": json.dumps([contact, dict(contact, role="author")]),
+        "creator_user_id": str(uuid.UUID(int=2 * 10 ** 6 + index % 50)),
+        "dataset-reference-date": json.dumps([{"type": "creation", "value": "2014-09-02"}, {"type": "revision", "value": "2018-01-02"}]),
+        "eov": ["seaSurfaceTemperature", "subSurfaceSalinity"],
+        "extras": [],
+        "frequency-of-update": "asNeeded",
+        "groups": [],
+        "id": dataset_id,
+        "isopen": True,
+        "keywords": {"en": ["ocean", "temperature", "salinity"], "fr": ["ocean", "temperature", "salinite"]},
+        "license_id": "CC-BY-4.0",
+        "license_title": "Creative Commons Attribution 4.0",
+        "license_url": "https://creativecommons.org/licenses/by/4.0/",
+        "maintainer": None,
+        "maintainer_email": None,
+        "maintenance-note": "Generated from https://example.org/erddap",
+        "metadata_created": "2021-06-14T15:03:57.193418",
+        "metadata_modified": "2022-03-02T10:22:13.541018",
+        "metadata-language": "eng",
+        "metadata-point-of-contact": json.dumps(contact),
+        "metadata-reference-date": [{"type": "creation", "value": "2021-06-14"}],
+        "name": "dataset-%d" % index,
+        "notes": json.dumps({"en": "Description of dataset %d" % index, "fr": "Description du jeu de donnees %d" % index}),
+        "notes_translated": {"en": "Description of dataset %d" % index, "fr": "Description du jeu de donnees %d" % index},
+        "num_resources": num_resources,
+        "num_tags": 3,
+        "organization": {
+            "approval_status": "approved",
+            "created": "2020-01-01T00:00:00",
+            "description": "Organisation %d" % (index % 20),
+            "id": org_id,
+            "image_url": "https://example.org/logo.png",
+            "is_organization": True,
+            "name": "organisation-%d" % (index % 20),
+            "revision_id": str(uuid.UUID(int=3 * 10 ** 6 + index % 20)),
+            "state": "active",
+            "title": "Organisation %d" % (index % 20),
+            "type": "organization"
+        },
+        "owner_org": org_id,
+        "private": False,
+        "progress": "onGoing",
+        "relationships_as_object": [],
+        "relationships_as_subject": [],
+        "resource-type": "dataset",
+        "resources": [
+            {
+                "id": str(uuid.UUID(int=4 * 10 ** 6 + index * num_resources + r)),
+                "name": "Resource %d" % r,
+                "format": "CSV",
+                "url": "https://example.org/erddap/tabledap/dataset_%d_%d.csv" % (index, r),
+                "state": "active",
+                "package_id": dataset_id,
+                "tracking_summary": {"total": 0, "recent": 0}
+            } for r in range(num_resources)
+        ],
+        "revision_id": str(uuid.UUID(int=5 * 10 ** 6 + index)),
+        "spatial": json.dumps({"type": "Polygon", "coordinates": [[[-66.9, 44.3], [-54.9, 44.3], [-54.9, 50.2], [-66.9, 50.2], [-66.9, 44.3]]]}),
+        "state": "active",
+        "tags": [{"name": t, "display_name": t, "state": "active"} for t in ("ocean", "temperature", "salinity")],
+        "temporal-extent": json.dumps({"begin": "2014-09-02", "end": "2018-01-02"}),
+        "title": json.dumps({"en": "Dataset %d" % index, "fr": "Jeu de donnees %d" % index}),
+        "title_translated": {"en": "Dataset %d" % index, "fr": "Jeu de donnees %d" % index},
+        "tracking_summary": {"total": 6, "recent": 6},
+        "type": "dataset",
+        "unique-resource-identifier-full": json.dumps({"authority": "DOI", "code": "10.0000/%d" % index, "code-space": "", "version": "1"}),
+        "url": "https://example.org/datasets/%d" % index,
+        "vertical-extent": [],
+        "xml_location_url": "https://example.org/datasets/%d.xml" % index
+    }
+
+
+def make_fields():
+    """
+    Returns the default field names and element ids of a dataset, as generated by the plugin.
+    """
+    return {name: str(uuid.uuid4()) for name in constants.DATASET_FIELDS}
+
+
+def make_whitelists(fields):
+    """
+    Returns the whitelists of the default Full and Minimal templates for fields.
+    """
+    return {
+        'Full': list(fields.values()),
+        'Minimal': [id for name, id in fields.items() if name in constants.PUBLIC_FIELDS]
+    }
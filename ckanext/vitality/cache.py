@@ -0,0 +1,361 @@
+import copy
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+'''
+Tags used to group cache entries so that writes can invalidate them precisely
+'''
+def dataset_tag(dataset_id):
+    return 'dataset:' + str(dataset_id)
+
+def user_tag(user_id):
+    return 'user:' + str(user_id)
+
+def org_tag(org_id):
+    return 'org:' + str(org_id)
+
+ROLES_TAG = 'roles'
+
+# Invalidating this tag drops every entry
+ALL_TAG = '*'
+
+_DATASET_PREFIX = dataset_tag('')
+
+
+class AccessCache(object):
+    """
+    A bounded, thread safe LRU cache with a time to live, for access decisions read from an authorization model.
+
+    ...
+
+    Every entry is stored with a set of tags (see dataset_tag, user_tag and org_tag), writes to the
+    authorization model invalidate the tags they affect rather than flushing the whole cache.
+
+    Attributes
+    ----------
+    max_size : int
+        The maximum number of entries kept, the least recently used entry is evicted first.
+    ttl : float
+        The number of seconds an entry stays valid, 0 or None to keep entries until evicted.
+
+    Methods
+    -------
+    get(key)
+        Returns a (hit, value) tuple for key.
+    set(key, value, tags)
+        Stores value under key, grouped under tags.
+    invalidate(*tags)
+        Drops every entry stored under any of tags.
+    clear()
+        Drops every entry.
+    stats()
+        Returns the hit/miss counters and current size.
+    """
+
+    def __init__(self, max_size=10000, ttl=300, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.__clock = clock
+        self.__lock = threading.RLock()
+        # key -> (expiry, value, tags)
+        self.__entries = OrderedDict()
+        # tag -> set of keys
+        self.__tags = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """
+        Looks up an entry.
+
+        Parameters
+        ----------
+        key : hashable
+            The key the entry was stored under
+
+        Returns
+        -------
+        A (hit, value) tuple, value is None on a miss. Dicts and lists are returned as shallow copies
+            so callers cannot alter the cached entry.
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry != None and (entry[0] == None or entry[0] > self.__clock()):
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return True, AccessCache.__copy(entry[1])
+            if entry != None:
+                self.__remove(key)
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value, tags=()):
+        """
+        Stores an entry, evicting the least recently used entries if the cache is full.
+
+        Parameters
+        ----------
+        key : hashable
+            The key to store the entry under
+        value : object
+            The value to cache
+        tags : iterable of strings
+            The tags to group the entry under for invalidation
+        """
+        if self.max_size <= 0:
+            return
+        expiry = self.__clock() + self.ttl if self.ttl else None
+        with self.__lock:
+            if key in self.__entries:
+                self.__remove(key)
+            tags = frozenset(tags)
+            self.__entries[key] = (expiry, AccessCache.__copy(value), tags)
+            for tag in tags:
+                self.__tags.setdefault(tag, set()).add(key)
+            while len(self.__entries) > self.max_size:
+                self.__remove(next(iter(self.__entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tags):
+        """
+        Drops every entry grouped under any of the given tags, or every entry if ALL_TAG is given.
+
+        Parameters
+        ----------
+        tags : strings
+            The tags to invalidate
+        """
+        if ALL_TAG in tags:
+            self.clear()
+            return
+        with self.__lock:
+            for tag in tags:
+                for key in list(self.__tags.get(tag, ())):
+                    self.__remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        """
+        Drops every entry.
+        """
+        with self.__lock:
+            self.invalidations += len(self.__entries)
+            self.__entries.clear()
+            self.__tags.clear()
+
+    def stats(self):
+        """
+        Returns a dictionary with the hits, misses, evictions, invalidations and size of the cache.
+        """
+        with self.__lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'size': len(self.__entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl
+            }
+
+    def __remove(self, key):
+        expiry, value, tags = self.__entries.pop(key)
+        for tag in tags:
+            keys = self.__tags.get(tag)
+            if keys != None:
+                keys.discard(key)
+                if not keys:
+                    del self.__tags[tag]
+
+    @staticmethod
+    def __copy(value):
+        if isinstance(value, (dict, list)):
+            return copy.copy(value)
+        return value
+
+
+def create_cache(opts):
+    """
+    Creates an AccessCache from the ckan.vitality.cache.* settings, or None if caching is disabled.
+
+    Parameters
+    ----------
+    opts : dict
+        A dictionary with the 'enabled', 'max_size' and 'ttl' settings
+
+    Returns
+    -------
+    An AccessCache or None
+    """
+    if not opts or str(opts.get('enabled', False)).lower() not in ('true', '1', 'yes', 'on'):
+        return None
+    return AccessCache(int(opts.get('max_size', 10000)), float(opts.get('ttl', 300)))
+
+
+class KnownDatasets(object):
+    """
+    A thread safe set of the ids of the datasets known to have templates, so that provisioning a dataset
+    that is already provisioned, e.g. when the search index is rebuilt, does not query the authorization model.
+
+    ...
+
+    Dataset ids that are UUIDs are stored as 128 bit integers, others as strings. The set is loaded once
+    with the ids of every provisioned dataset, ids are added as datasets are provisioned and discarded on
+    any invalidation of their dataset tag, here or from another worker. Only membership is meaningful:
+    a dataset missing from the set may still be provisioned and must be checked in the model.
+
+    Attributes
+    ----------
+    loaded : bool
+        Whether the set holds the ids of every provisioned dataset.
+
+    Methods
+    -------
+    begin_load()
+        Starts recording the changes made while the ids are read, see load.
+    load(dataset_ids, version)
+        Replaces the set by the ids of every provisioned dataset.
+    add(dataset_id)
+        Adds the id of a dataset that was just provisioned.
+    invalidate(*tags)
+        Discards the datasets of the given tags.
+    clear()
+        Empties the set until it is loaded again.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self.__keys = set()
+        # Changes made while loading, replayed over the loaded ids
+        self.__changes = None
+        # Incremented when cleared, a load started before is dropped
+        self.__version = 0
+        self.__lock = threading.Lock()
+
+    def __contains__(self, dataset_id):
+        return self.loaded and KnownDatasets.__key(dataset_id) in self.__keys
+
+    def __len__(self):
+        return len(self.__keys)
+
+    def begin_load(self):
+        """
+        Starts recording the changes made while the ids of the provisioned datasets are read
+
+        Returns
+        -------
+        The version to pass to load
+        """
+        with self.__lock:
+            # Loads running at the same time share the changes made since the first began
+            if self.__changes == None:
+                self.__changes = []
+            return self.__version
+
+    def load(self, dataset_ids, version):
+        """
+        Replaces the set by the ids of every provisioned dataset, then replays the changes made since begin_load.
+
+        Parameters
+        ----------
+        dataset_ids : iterable of strings
+            The ids of every provisioned dataset
+        version : int
+            The version returned by begin_load
+
+        Returns
+        -------
+        True if the set was loaded, False if it was cleared since begin_load
+        """
+        keys = set(KnownDatasets.__key(dataset_id) for dataset_id in dataset_ids)
+        with self.__lock:
+            if version != self.__version or self.__changes == None:
+                return False
+            for change, key in self.__changes:
+                change(keys, key)
+            self.__keys = keys
+            self.__changes = None
+            self.loaded = True
+            return True
+
+    def add(self, dataset_id):
+        """
+        Adds the id of a dataset that was just provisioned.
+        """
+        self.__change(set.add, KnownDatasets.__key(dataset_id))
+
+    def invalidate(self, *tags):
+        """
+        Discards the datasets of the given dataset tags, or every dataset if ALL_TAG is given.
+        """
+        if ALL_TAG in tags:
+            self.clear()
+            return
+        for tag in tags:
+            if tag.startswith(_DATASET_PREFIX):
+                self.__change(set.discard, KnownDatasets.__key(tag[len(_DATASET_PREFIX):]))
+
+    def clear(self):
+        """
+        Empties the set until it is loaded again.
+        """
+        with self.__lock:
+            self.__keys = set()
+            self.__changes = None
+            self.__version += 1
+            self.loaded = False
+
+    def __change(self, change, key):
+        with self.__lock:
+            change(self.__keys, key)
+            if self.__changes != None:
+                self.__changes.append((change, key))
+
+    @staticmethod
+    def __key(dataset_id):
+        try:
+            return uuid.UUID(str(dataset_id)).int
+        except ValueError:
+            return str(dataset_id)
+
+
+class CacheGroup(object):
+    """
+    Invalidates several caches together, for an InvalidationBus serving both an AccessCache and KnownDatasets.
+    """
+
+    def __init__(self, *caches):
+        self.caches = caches
+
+    def invalidate(self, *tags):
+        for cache in self.caches:
+            cache.invalidate(*tags)
+
+    def clear(self):
+        for cache in self.caches:
+            cache.clear()
+
+
+def create_known_datasets(opts):
+    """
+    Creates KnownDatasets from the ckan.vitality.known_datasets.* settings, or None if disabled.
+
+    Parameters
+    ----------
+    opts : dict
+        A dictionary with the 'enabled' setting
+
+    Returns
+    -------
+    KnownDatasets or None
+    """
+    if not opts or str(opts.get('enabled', False)).lower() not in ('true', '1', 'yes', 'on'):
+        return None
+    return KnownDatasets()
@@ -2,16 +2,22 @@
 Code primarily adapted from vitality_model.py, which was used with paster commands for earlier versions of ckan
 """
 import click
-from ckanext.vitality.meta_authorize import MetaAuthorize, MetaAuthorizeType
+from ckanext.vitality.meta_authorize import MetaAuthorize, MetaAuthorizeType, config_opts
+from ckanext.vitality import seeding
 import logging
 import sys
+import time
 
 from flask import current_app as app
 
 # CKAN interfacing imports
 from ckan import model
 from ckan.common import config
-from ckan.logic import get_action
+from ckan.logic import get_action, NotFound
+from ckan.lib import search
+from ckan.plugins.toolkit import asbool
+
+log = logging.getLogger(__name__)
 
 def get_commands():
     return[vitality]
@@ -48,17 +54,20 @@ MIN_ARGS = 1
 # Authorization Interface
 meta_authorize = None
 
+def model_opts():
+    """
+    Returns the options of the authorization model, loaded from the config as by the plugin. Commands write at
+    once rather than through the write behind journal, and only publish invalidations so that changes made
+    from the command line reach the caches of running workers
+    """
+    return dict(config_opts(config), cache=None, known_datasets=None, write_behind=None)
+
 @click.group()
 @click.pass_context
 def vitality(ctx):
     '''For use with the Vitality commands'''
-    # Load neo4j connection parameters from config
-    # Initalize meta_authorize
-    meta_authorize = MetaAuthorize.create(MetaAuthorizeType.GRAPH, {
-        'host': config.get('ckan.vitality.neo4j.host', "bolt://localhost:7687"),
-        'user': config.get('ckan.vitality.neo4j.user', "neo4j"),
-        'password': config.get('ckan.vitality.neo4j.password', "password")
-    })
+    # Initalize meta_authorize with the configured backend
+    meta_authorize = MetaAuthorize.create(MetaAuthorizeType[config.get('ckan.vitality.backend', "graph").upper()], model_opts())
 
     session = {
     "model": model,
@@ -75,42 +84,82 @@ def vitality(ctx):
 
     ctx.obj['meta_authorize'] = meta_authorize
     ctx.obj['session'] = session
+    ctx.obj['site_user'] = admin_user
 
     click.echo('Vitality connection initialized')
 
     pass
 
 @vitality.command()
+@click.option(u'--batch-size', default=1000, help=u'Number of users sent per transaction')
 @click.pass_context
-def seed_users(ctx):
+def seed_users(ctx, batch_size):
     # Create admin role
     ctx.obj['meta_authorize'].add_role('admin', 'admin')
     ctx.obj['meta_authorize'].add_role('public', 'public')
 
     user_list = get_action('user_list')(ctx.obj['session'],{})
     print("Got {} users".format(len(user_list)))
+    users = []
     for u in user_list:
-        user_id = u['id']
-        user_name = u['name']
-        user_email = ""
-
-        # Email not required, so check if it exists first
-        if('email' in u):
-            user_email = u['email']
-        ctx.obj['meta_authorize'].add_user(user_id, user_name, user_email)
-
-        # Admins in CKAN are marked as such
-        if u['sysadmin']:
-            ctx.obj['meta_authorize'].set_user_role(user_id, 'admin')
-
-        # TODO Figure out a better way to set GIDs?
-        ctx.obj['meta_authorize'].set_user_gid(user_id, "guest")
+        users.append({
+            'id': u['id'],
+            'username': u['name'],
+            # Email not required, so check if it exists first
+            'email': u.get('email') or "",
+            # TODO Figure out a better way to set GIDs?
+            'gid': "guest",
+            # Admins in CKAN are marked as such
+            'roles': ['admin'] if u['sysadmin'] else []
+        })
+
+    def progress(seeded):
+        click.echo("Seeded {} users".format(seeded))
+
+    started = time.monotonic()
+    total = ctx.obj['meta_authorize'].add_users(users, batch_size, progress)
+    elapsed = time.monotonic() - started
+    click.echo("Seeded {} users in {:.1f}s ({:.0f} users/s)".format(total, elapsed, total / elapsed if elapsed else total))
 
     # Create the public user & role for people not logged in.
     ctx.obj['meta_authorize'].add_user('public', 'Public')
     ctx.obj['meta_authorize'].set_user_role('public', 'public')
     return
 
+@vitality.command()
+@click.option(u'--batch-size', default=500, help=u'Number of datasets read per page of search results')
+@click.option(u'--workers', default=4, help=u'Number of datasets provisioned in parallel')
+@click.option(u'--checkpoint', default=u'vitality-seed-datasets.json', help=u'File the progress is saved to, an interrupted run resumes from it')
+@click.option(u'--restart', is_flag=True, help=u'Ignore the checkpoint and start from the first dataset')
+@click.pass_context
+def seed_datasets(ctx, batch_size, workers, checkpoint, restart):
+    '''Provisions the datasets of CKAN into the authorization model without rebuilding the search index'''
+    from ckanext.vitality.plugin import dataset_provisioning
+
+    default_access = config.get('ckan.vitality.default_access', "Minimal")
+    # The site user sees private datasets too
+    context = dict(ctx.obj['session'], user=ctx.obj['site_user']['name'])
+
+    def search_page(last_id, rows):
+        fq = '+type:dataset'
+        if last_id != None:
+            # Paging on the id rather than an offset, datasets created during the run do not shift the pages
+            fq += ' +id:{"%s" TO *]' % last_id
+        page = get_action('package_search')(dict(context), {'fq': fq, 'sort': 'id asc', 'rows': rows, 'include_private': True})
+        return page['count'], page['results']
+
+    def show(id):
+        try:
+            return get_action('package_show')(dict(context), {'id': id})
+        except NotFound:
+            return None
+
+    status = seeding.seed_datasets(ctx.obj['meta_authorize'], search_page, show, lambda pkg_dict: dataset_provisioning(pkg_dict, default_access),
+        checkpoint, batch_size=batch_size, workers=workers, restart=restart, echo=click.echo)
+    if status != 0:
+        sys.exit(status)
+
+
 @vitality.command()
 @click.pass_context
 def seed_groups(ctx):
@@ -140,16 +189,85 @@ def seed_orgs(ctx):
     return
 
 @vitality.command()
+@click.option(u'--batch-size', default=1000, help=u'Number of changes applied per transaction')
+@click.option(u'--dry-run', is_flag=True, help=u'Only report the changes')
 @click.pass_context
-def set_all_datasets_public(ctx):
-    ctx.obj['meta_authorize'].set_full_access_to_datasets("public")
+def reconcile(ctx, batch_size, dry_run):
+    '''Applies the users, organizations, groups, memberships and datasets that changed in CKAN to the authorization model'''
+    from ckanext.vitality.meta_authorize import diff_fingerprints
+    from ckanext.vitality.plugin import dataset_provisioning
+
+    meta_authorize = ctx.obj['meta_authorize']
+    started = time.monotonic()
+    deltas = diff_fingerprints(ckan_fingerprints(), meta_authorize.get_fingerprints())
+    click.echo("Compared CKAN and the authorization model in {:.1f}s".format(time.monotonic() - started))
+    for name, changes in deltas.items():
+        if changes:
+            click.echo("{:<22} {}".format(name, len(changes)))
+    if dry_run:
+        return
+
+    for user in deltas['add_users']:
+        # Same as seed-users
+        user['gid'] = "guest"
+
+    def progress(name, applied):
+        click.echo("Applied {} {}".format(applied, name))
+
+    total = meta_authorize.apply_deltas(deltas, batch_size, progress)
+
+    # New datasets, and datasets that moved to another organization, are provisioned as in seed-datasets
+    default_access = config.get('ckan.vitality.default_access', "Minimal")
+    context = dict(ctx.obj['session'], user=ctx.obj['site_user']['name'])
+    failed = 0
+    for dataset in deltas['add_datasets']:
+        try:
+            pkg_dict = get_action('package_show')(dict(context), {'id': dataset['id']})
+            meta_authorize.provision_dataset(**dataset_provisioning(pkg_dict, default_access))
+            total += 1
+        except NotFound:
+            # Deleted since
+            continue
+        except Exception as ex:
+            log.error("Could not provision dataset %s: %s", dataset['id'], ex)
+            failed += 1
+
+    click.echo("Applied {} changes in {:.1f}s".format(total, time.monotonic() - started))
+    if failed:
+        click.echo("{} datasets failed, run reconcile again to retry them".format(failed), err=True)
+        sys.exit(1)
+
+
+@vitality.command()
+@click.option(u'--batch-size', default=1000, help=u'Number of templates updated per transaction')
+@click.option(u'--background', is_flag=True, help=u'Run as a background job, see ckan jobs worker')
+@click.pass_context
+def set_all_datasets_public(ctx, batch_size, background):
+    if background:
+        from ckanext.vitality import jobs
+        job = jobs.enqueue(jobs.set_full_access_to_datasets, ["public", batch_size], "vitality set all datasets public")
+        click.echo("Queued job {}, see the vitality_job_status action".format(job.id))
+        return
+
+    def progress(updated):
+        click.echo("Updated {} templates".format(updated))
+
+    ctx.obj['meta_authorize'].set_full_access_to_datasets("public", batch_size, progress)
+    reindex_all()
     return
 
 @vitality.command()
 @click.argument(u'dataset_id')
+@click.option(u'--background', is_flag=True, help=u'Run as a background job, see ckan jobs worker')
 @click.pass_context 
-def set_dataset_private(ctx, dataset_id):
+def set_dataset_private(ctx, dataset_id, background):
+    if background:
+        from ckanext.vitality import jobs
+        job = jobs.enqueue(jobs.set_minimal_access_to_dataset, [dataset_id], "vitality set dataset private " + dataset_id)
+        click.echo("Queued job {}, see the vitality_job_status action".format(job.id))
+        return
     ctx.obj['meta_authorize'].set_minimal_access_to_dataset(dataset_id)
+    reindex(dataset_id)
     return
 
 @vitality.command()
@@ -159,6 +277,7 @@ def set_dataset_private(ctx, dataset_id):
 @click.pass_context 
 def set_element_access_for_template(ctx, dataset_id, template_name, element_name):
     ctx.obj['meta_authorize'].set_element_access_for_template(dataset_id, template_name, element_name)
+    reindex(dataset_id)
 
     
 @vitality.command()
@@ -167,4 +286,131 @@ def set_element_access_for_template(ctx, dataset_id, template_name, element_name
 @click.argument(u'element_name')
 @click.pass_context 
 def delete_element_access_for_template(ctx, dataset_id, template_name, element_name):
-    ctx.obj['meta_authorize'].delete_element_access_for_template(dataset_id, template_name, element_name)
\ No newline at end of file
+    ctx.obj['meta_authorize'].delete_element_access_for_template(dataset_id, template_name, element_name)
+    reindex(dataset_id)
+
+
+@vitality.command()
+@click.option(u'--check', is_flag=True, help=u'Only report the status of the constraints and indexes')
+@click.pass_context
+def init_schema(ctx, check):
+    '''Creates the Neo4j constraints and indexes used by vitality, then reports their status'''
+    failed = False
+    if not check:
+        for result in ctx.obj['meta_authorize'].init_schema():
+            if result['error'] != None:
+                failed = True
+                click.echo("Could not create {} {}: {}".format(result['kind'], result['name'], result['error']), err=True)
+
+    for status in ctx.obj['meta_authorize'].get_schema_status():
+        click.echo("{:<10} {:<34} :{}({}) {}".format(status['kind'], status['name'], status['label'], status['property'], status['state']))
+        if status['state'] != 'ONLINE':
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+@vitality.command()
+@click.option(u'--batch-size', default=1000, help=u'Number of elements folded per transaction')
+@click.pass_context
+def share_elements(ctx, batch_size):
+    '''Folds the per dataset elements into shared elements, see ckan.vitality.neo4j.element_mode'''
+    def progress(name, folded):
+        click.echo("Folded {} {} elements".format(folded, name))
+
+    total = ctx.obj['meta_authorize'].share_elements(batch_size, progress)
+    click.echo("Folded {} elements into shared elements".format(total))
+
+
+@vitality.command()
+@click.option(u'--batch-size', default=1000, help=u'Number of templates updated per transaction')
+@click.pass_context
+def list_template_fields(ctx, batch_size):
+    '''Lists the visible elements of each template in a property, see ckan.vitality.neo4j.template_mode'''
+    def progress(listed):
+        click.echo("Listed the fields of {} templates".format(listed))
+
+    total = ctx.obj['meta_authorize'].list_template_fields(batch_size, progress)
+    click.echo("Listed the fields of {} templates in total".format(total))
+
+
+@vitality.command()
+@click.option(u'--import-graph', is_flag=True, help=u'Also copy the access model from Neo4j into the tables')
+@click.pass_context
+def init_sql(ctx, import_graph):
+    '''Creates the tables of the SQL authorization model in the CKAN database, see ckan.vitality.backend'''
+    sql = MetaAuthorize.create(MetaAuthorizeType.SQL, {})
+    sql.init_tables()
+    click.echo("Created the vitality tables")
+    if import_graph:
+        total = sql.import_snapshot(MetaAuthorize.create(MetaAuthorizeType.GRAPH, model_opts()).export_snapshot())
+        click.echo("Imported {} datasets from Neo4j".format(total))
+
+
+@vitality.command()
+@click.option(u'--output', default=None, help=u'Path of the snapshot file, defaults to ckan.vitality.mmap.path')
+@click.pass_context
+def publish_snapshot(ctx, output):
+    '''Exports the access model from Neo4j to the snapshot file mapped by the mmap backend'''
+    from ckanext.vitality.impl.mmap_meta_auth import write_snapshot
+
+    path = output or config.get('ckan.vitality.mmap.path', "vitality.snapshot")
+    total = write_snapshot(MetaAuthorize.create(MetaAuthorizeType.GRAPH, model_opts()).export_snapshot(), path)
+    click.echo("Published {} datasets to {}".format(total, path))
+
+
+def ckan_fingerprints():
+    """
+    Reads the fingerprints of the active users, organizations, groups, memberships and datasets of CKAN
+    from its database, see MetaAuthorize.get_fingerprints
+    """
+    fingerprints = {'users': set(), 'admins': set(), 'organizations': set(), 'org_members': set(), 'groups': set(), 'group_members': set(), 'datasets': set()}
+    for id, name, email, sysadmin in model.Session.query(model.User.id, model.User.name, model.User.email, model.User.sysadmin).filter(model.User.state == 'active'):
+        fingerprints['users'].add((id, name or '', email or ''))
+        if sysadmin:
+            fingerprints['admins'].add(id)
+
+    organizations = set()
+    for id, name, is_organization in model.Session.query(model.Group.id, model.Group.name, model.Group.is_organization).filter(model.Group.state == 'active'):
+        if is_organization:
+            organizations.add(id)
+            fingerprints['organizations'].add((id, name or ''))
+        else:
+            fingerprints['groups'].add(id)
+
+    members = model.Session.query(model.Member.group_id, model.Member.table_id).filter(model.Member.table_name == 'user', model.Member.state == 'active')
+    for group_id, user_id in members:
+        if group_id in organizations:
+            # Sysadmins do not get the member role, see add_org
+            if user_id not in fingerprints['admins']:
+                fingerprints['org_members'].add((group_id, user_id))
+        elif group_id in fingerprints['groups']:
+            fingerprints['group_members'].add((group_id, user_id))
+
+    datasets = model.Session.query(model.Package.id, model.Package.owner_org).filter(model.Package.state == 'active', model.Package.type == 'dataset')
+    fingerprints['datasets'].update(datasets)
+    return fingerprints
+
+
+def reindex(dataset_id):
+    """
+    Rebuilds the search index document of a dataset, so that the public projection
+    stored by before_index reflects changes made from the command line.
+    """
+    if not asbool(config.get('ckan.vitality.public_projection', True)):
+        return
+    search.rebuild(dataset_id)
+    click.echo("Reindexed " + dataset_id)
+
+
+def reindex_all():
+    """
+    Rebuilds the search index documents of every dataset, after a change to the access of all of them,
+    committing once at the end rather than per dataset
+    """
+    if not asbool(config.get('ckan.vitality.public_projection', True)):
+        return
+    search.rebuild(defer_commit=True)
+    search.commit()
+    click.echo("Reindexed all datasets")
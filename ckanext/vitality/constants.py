@@ -199,4 +199,7 @@ STRINGIFIED_FIELDS = [
     "notes",
     "cited-responsible-party",
     "dataset-reference-date"
-]
\ No newline at end of file
+]
+
+# Search index field holding the public projection of a dataset, see VitalityPlugin.before_index
+PUBLIC_VIEW_FIELD = "vitality_public_view"
@@ -0,0 +1,776 @@
+import logging
+import threading
+import time
+import uuid
+
+from ckanext.vitality.cache import CacheGroup
+from ckanext.vitality.meta_authorize import MetaAuthorize, ViewDecision, ElementMode
+from ckanext.vitality.impl.graph_meta_auth import shared_element_id
+
+log = logging.getLogger(__name__)
+
+# Namespace of the ids of the member roles of organizations added without a source model
+MEMBER_ROLE_NAMESPACE = uuid.UUID('1b1f0e8c-4c0e-4a43-9f5a-2d4f3e9e5a71')
+
+
+class _Template(object):
+    """
+    A template of the bitset model
+
+    Attributes
+    ----------
+    id : string
+        The id/uuid of the template
+    name : string
+        The name of the template, e.g. 'Full' or 'Minimal'
+    dataset_id : string
+        The id/uuid of the dataset the template belongs to
+    mask : int
+        The visible fields, bit n is set if the field path with ordinal n is visible
+    roles : set
+        The ids of the roles using the template
+    """
+    __slots__ = ('id', 'name', 'dataset_id', 'mask', 'roles')
+
+    def __init__(self, id, name, dataset_id, mask=0, roles=None):
+        self.id = id
+        self.name = name
+        self.dataset_id = dataset_id
+        self.mask = mask
+        self.roles = set(roles or [])
+
+
+class _Dataset(object):
+    """
+    A dataset of the bitset model
+
+    Attributes
+    ----------
+    id : string
+        The id/uuid of the dataset
+    owner : string
+        The id/uuid of the organization owning the dataset
+    harvest_source : string
+        The id/uuid of the harvest source of the dataset, None if it was not harvested
+    fields : dict
+        The field paths of the dataset to their element ids
+    templates : list
+        The _Templates of the dataset
+    """
+    __slots__ = ('id', 'owner', 'harvest_source', 'fields', 'templates')
+
+    def __init__(self, id, owner=None, harvest_source=None):
+        self.id = id
+        self.owner = owner
+        self.harvest_source = harvest_source
+        self.fields = {}
+        self.templates = []
+
+
+class _BitsetMetaAuth(MetaAuthorize):
+    """
+    An in memory authorization model answering access checks with bit operations and dict lookups
+
+    Every field path known to the model is assigned an ordinal, the whitelist of a template is an int
+    with the bits of its visible fields set. Users, roles, templates and datasets are held in dicts,
+    so resolving what a user can see of a dataset does not leave the process.
+
+    The model is loaded from a snapshot, see _GraphMetaAuth.export_snapshot. When given a source
+    model, writes are made to the source first then replayed in memory, and calls the bitset model
+    does not answer itself (e.g. get_user_by_username or set_dataset_name) are passed to the source.
+
+    Writes made by other processes are not replayed. Given the InvalidationBus of the source, the model
+    subscribes to it and reloads from the source on the next read after another process wrote, at most
+    once every refresh_interval seconds. With max_age set the snapshot is also reloaded once it is older
+    than max_age seconds, which bounds how long a lost message leaves the model stale.
+    """
+
+    def __init__(self, source=None, snapshot=None, max_age=0, clock=time.monotonic, invalidation=None, refresh_interval=1):
+        self.source = source
+        self.max_age = max_age
+        self.refresh_interval = refresh_interval
+        self.invalidation = invalidation
+        self.__clock = clock
+        self.__lock = threading.RLock()
+        self.__stale = False
+        if snapshot == None and source != None:
+            snapshot = source.export_snapshot()
+        self.load_snapshot(snapshot or {})
+        if invalidation != None:
+            # The bus may already invalidate the access cache of the source
+            invalidation.cache = CacheGroup(*[cache for cache in (invalidation.cache, self) if cache != None])
+            invalidation.ensure_subscribed()
+
+    def __getattr__(self, name):
+        # Only called for attributes the bitset model does not have
+        source = self.__dict__.get('source')
+        if source == None or name.startswith('_'):
+            raise AttributeError("%s has no attribute %s" % (self.__class__.__name__, name))
+        return getattr(source, name)
+
+    def load_snapshot(self, snapshot):
+        """
+        Replaces the model with the one of a snapshot
+
+        Parameters
+        ----------
+        snapshot : dict
+            A snapshot, as returned by _GraphMetaAuth.export_snapshot
+        """
+        ordinals = {}
+        paths = []
+        datasets = {}
+        templates = {}
+        for dataset_id, entry in snapshot.get('datasets', {}).items():
+            dataset = _Dataset(dataset_id, entry.get('owner'), entry.get('harvest_source'))
+            dataset.fields = dict(entry.get('fields', {}))
+            names = {id: name for name, id in dataset.fields.items()}
+            for template_id, template_entry in entry.get('templates', {}).items():
+                mask = 0
+                for id in template_entry.get('visible', []):
+                    if id in names:
+                        mask |= 1 << _BitsetMetaAuth.__ordinal(ordinals, paths, names[id])
+                template = _Template(template_id, template_entry.get('name'), dataset_id, mask, template_entry.get('roles'))
+                dataset.templates.append(template)
+                templates[template_id] = template
+            datasets[dataset_id] = dataset
+        roles = {}
+        role_orgs = {}
+        for role_id, entry in snapshot.get('roles', {}).items():
+            roles[role_id] = entry.get('name')
+            role_orgs[role_id] = set(entry.get('orgs', []))
+        user_roles = {user_id: set(role_ids) for user_id, role_ids in snapshot.get('users', {}).items()}
+        orgs = set(snapshot.get('organizations', {}))
+        orgs.update(dataset.owner for dataset in datasets.values() if dataset.owner != None)
+        for org_ids in role_orgs.values():
+            orgs.update(org_ids)
+
+        with self.__lock:
+            self.__ordinals = ordinals
+            self.__paths = paths
+            self.__datasets = datasets
+            self.__templates = templates
+            self.__roles = roles
+            self.__role_orgs = role_orgs
+            self.__user_roles = user_roles
+            self.__orgs = orgs
+            self.__checked_at = self.__clock()
+        log.info("Loaded %d datasets, %d templates and %d field paths into the bitset authorization model", len(datasets), len(templates), len(paths))
+
+    def export_snapshot(self):
+        """
+        Returns a snapshot of the model, in the format of _GraphMetaAuth.export_snapshot
+        Only the access model is held in memory, the names of organizations are None
+        """
+        with self.__lock:
+            datasets = {}
+            for dataset in self.__datasets.values():
+                datasets[dataset.id] = {
+                    'owner': dataset.owner,
+                    'harvest_source': dataset.harvest_source,
+                    'fields': dict(dataset.fields),
+                    'templates': {template.id: {
+                        'name': template.name,
+                        'roles': sorted(template.roles),
+                        'visible': self.__ids(dataset, template.mask)
+                    } for template in dataset.templates}
+                }
+            return {
+                'users': {user_id: sorted(role_ids) for user_id, role_ids in self.__user_roles.items()},
+                'organizations': {org_id: None for org_id in self.__orgs},
+                'roles': {role_id: {'name': name, 'orgs': sorted(self.__role_orgs.get(role_id, ()))} for role_id, name in self.__roles.items()},
+                'datasets': datasets
+            }
+
+    def refresh(self):
+        """
+        Reloads the model from a new snapshot of the source, does nothing without a source
+        """
+        if self.source != None:
+            self.load_snapshot(self.source.export_snapshot())
+
+    def invalidate(self, *tags):
+        """
+        Marks the model as stale when another process wrote to the source, see InvalidationBus
+        """
+        self.__stale = True
+
+    def clear(self):
+        """
+        Marks the model as stale when the bus (re)subscribes, messages may have been missed
+        """
+        self.__stale = True
+
+    def __check_age(self):
+        """
+        Refreshes the model if another process wrote since the last refresh, at most once every refresh_interval
+        seconds, or if it was last refreshed more than max_age seconds ago
+        """
+        if self.invalidation != None:
+            self.invalidation.ensure_subscribed()
+        age = self.__clock() - self.__checked_at
+        if (self.__stale and age >= self.refresh_interval) or (self.max_age and age > self.max_age):
+            # Writes arriving during the reload mark the model stale again
+            self.__stale = False
+            self.__checked_at = self.__clock()
+            self.refresh()
+
+    @staticmethod
+    def __ordinal(ordinals, paths, path):
+        """
+        Returns the ordinal of a field path, assigning the next one to new paths
+        """
+        ordinal = ordinals.get(path)
+        if ordinal == None:
+            ordinal = ordinals[path] = len(paths)
+            paths.append(path)
+        return ordinal
+
+    def __mask(self, names):
+        """
+        Returns the mask with the bits of the given field paths set
+        """
+        mask = 0
+        for name in names:
+            mask |= 1 << self.__ordinal(self.__ordinals, self.__paths, name)
+        return mask
+
+    def __ids(self, dataset, mask):
+        """
+        Returns the element ids of the dataset's fields whose bits are set in mask
+        """
+        paths = self.__paths
+        fields = dataset.fields
+        return [fields[paths[ordinal]] for ordinal in _bits(mask) if paths[ordinal] in fields]
+
+    def __user_templates(self, dataset, user_id):
+        """
+        Returns the templates of the dataset used by one of the user's roles
+        """
+        roles = self.__user_roles.get(user_id)
+        if not roles:
+            return []
+        return [template for template in dataset.templates if not template.roles.isdisjoint(roles)]
+
+    @staticmethod
+    def __unrestricted(templates):
+        # Mirrors _GraphMetaAuth: a user without a template is unrestricted, otherwise the first template decides
+        return not templates or templates[0].name == 'Full'
+
+    def __visible_mask(self, templates):
+        mask = 0
+        for template in templates:
+            mask |= template.mask
+        return mask
+
+    def __element_ids(self, fields):
+        """
+        Returns fields with the ids the source gives its elements, see ElementMode
+        """
+        if getattr(self.source, 'element_mode', None) is not ElementMode.SHARED:
+            return fields
+        return {name: shared_element_id(name) for name in fields}
+
+    def add_dataset(self, dataset_id, owner_id, dname=None):
+        """
+        Adds a dataset owned by an organization, existing datasets are left as they are
+        """
+        if self.source != None:
+            self.source.add_dataset(dataset_id, owner_id, dname)
+        with self.__lock:
+            if dataset_id not in self.__datasets:
+                self.__datasets[dataset_id] = _Dataset(dataset_id, owner_id)
+
+    def add_group(self, group_id, users):
+        """
+        Groups do not affect access, they are only added to the source
+        """
+        if self.source != None:
+            self.source.add_group(group_id, users)
+
+    def add_metadata_fields(self, dataset_id, fields, template_id):
+        """
+        Adds the fields a dataset does not have yet, visible to the given template
+
+        Parameters
+        ----------
+        dataset_id : string
+            The id/uuid of the dataset to add the fields to
+        fields : set
+            A set of tuples with the name of the new field and a generated uuid
+        template_id : string
+            The id/uuid of the full template for the dataset
+        """
+        if self.source != None:
+            self.source.add_metadata_fields(dataset_id, fields, template_id)
+        with self.__lock:
+            dataset = self.__datasets.get(dataset_id)
+            template = self.__templates.get(template_id)
+            if dataset == None:
+                return
+            new_fields = self.__element_ids({f[0]: str(f[1]) for f in fields if f[0] not in dataset.fields})
+            dataset.fields.update(new_fields)
+            if template != None:
+                template.mask |= self.__mask(new_fields)
+
+    def add_org(self, org_id, users, org_name=None):
+        """
+        Adds an organization with a member role, given to the users that are not admins
+        """
+        if self.source != None:
+            self.source.add_org(org_id, users, org_name)
+        with self.__lock:
+            if org_id in self.__orgs:
+                return
+            self.__orgs.add(org_id)
+            # The id of the member role is generated by the source, or derived from the organization id
+            roles = self.source.get_roles(org_id) if self.source != None else {'member': str(uuid.uuid5(MEMBER_ROLE_NAMESPACE, org_id))}
+            for name, role_id in roles.items():
+                self.__roles[role_id] = name
+                self.__role_orgs.setdefault(role_id, set()).add(org_id)
+                if name != 'member':
+                    continue
+                for user in users:
+                    user_roles = self.__user_roles.setdefault(user['id'], set())
+                    if 'admin' not in user_roles:
+                        user_roles.add(role_id)
+
+    def add_role(self, id, name=None):
+        """
+        Adds a role
+        """
+        if self.source != None:
+            self.source.add_role(id, name)
+        with self.__lock:
+            self.__roles[id] = name
+            self.__role_orgs.setdefault(id, set())
+
+    def add_user(self, user_id, user_name=None, user_email=None, gid=None):
+        """
+        Adds a user without roles, existing users are left as they are
+        """
+        if self.source != None:
+            self.source.add_user(user_id, user_name, user_email, gid)
+        with self.__lock:
+            self.__user_roles.setdefault(user_id, set())
+
+    def add_template(self, dataset_id, template_id, template_name=None, template_description=None):
+        """
+        Adds a template without visible fields to a dataset
+        """
+        if self.source != None:
+            self.source.add_template(dataset_id, template_id, template_name, template_description)
+        with self.__lock:
+            self.__add_template(dataset_id, template_id, template_name)
+
+    def __add_template(self, dataset_id, template_id, template_name, mask=0, roles=None):
+        dataset = self.__datasets.get(dataset_id)
+        if dataset == None:
+            return None
+        template = _Template(template_id, template_name, dataset_id, mask, roles)
+        dataset.templates.append(template)
+        self.__templates[template_id] = template
+        return template
+
+    def add_template_full(self, dataset_id, template_id, template_name, fields, template_description=None):
+        """
+        Adds a template seeing all the given fields to a dataset that has no templates
+        """
+        if self.source != None:
+            self.source.add_template_full(dataset_id, template_id, template_name, fields, template_description)
+        with self.__lock:
+            dataset = self.__datasets.get(dataset_id)
+            if dataset == None or dataset.templates:
+                return
+            fields = self.__element_ids(fields)
+            dataset.fields.update(fields)
+            self.__add_template(dataset_id, template_id, template_name, self.__mask(fields))
+
+    def provision_dataset(self, dataset_id, owner_id, dname=None, harvest_id=None, descriptions=None, templates=None):
+        """
+        Adds a dataset along with its templates, fields and template access, see _GraphMetaAuth.provision_dataset
+
+        Returns
+        -------
+        True if the templates were created, False if the dataset already had templates
+        """
+        created = None
+        if self.source != None:
+            created = self.source.provision_dataset(dataset_id, owner_id, dname, harvest_id, descriptions, templates)
+        local = self.__provision(dataset_id, owner_id, harvest_id, templates)
+        return local if created == None else created
+
+    def provision_datasets(self, datasets):
+        """
+        Provisions several datasets, in a single transaction of the source when it batches them, see provision_dataset
+
+        Returns
+        -------
+        The ids of the datasets whose templates were created
+        """
+        created = None
+        if self.source != None:
+            created = self.source.provision_datasets(datasets)
+        local = [dataset['dataset_id'] for dataset in datasets
+            if self.__provision(dataset['dataset_id'], dataset['owner_id'], dataset.get('harvest_id'), dataset.get('templates'))]
+        return local if created == None else created
+
+    def __provision(self, dataset_id, owner_id, harvest_id, templates):
+        """
+        Adds a dataset to the model held in memory, returns True if its templates were added
+        """
+        with self.__lock:
+            dataset = self.__datasets.get(dataset_id)
+            if dataset == None:
+                dataset = self.__datasets[dataset_id] = _Dataset(dataset_id, owner_id, harvest_id)
+            elif harvest_id != None:
+                dataset.harvest_source = harvest_id
+            if dataset.templates:
+                return False
+            org_roles = [role_id for role_id, org_ids in self.__role_orgs.items() if owner_id in org_ids]
+            for template in templates or []:
+                fields = self.__element_ids(template.get('fields', {}))
+                dataset.fields.update(fields)
+                roles = set(template.get('roles', []))
+                if template.get('org_roles'):
+                    roles.update(org_roles)
+                self.__add_template(dataset_id, template['id'], template.get('name'), self.__mask(fields), roles)
+        return True
+
+    def delete_dataset(self, dataset_id):
+        """
+        Deletes a dataset along with its templates
+        """
+        if self.source != None:
+            self.source.delete_dataset(dataset_id)
+        with self.__lock:
+            self.__delete_dataset(dataset_id)
+
+    def __delete_dataset(self, dataset_id):
+        dataset = self.__datasets.pop(dataset_id, None)
+        if dataset == None:
+            return
+        for template in dataset.templates:
+            self.__templates.pop(template.id, None)
+
+    def delete_element_access_for_template(self, dataset_id, template_name, element_name):
+        """
+        Hides a field from a template, fields cannot be hidden from the Full template
+        """
+        if self.source != None:
+            self.source.delete_element_access_for_template(dataset_id, template_name, element_name)
+        if template_name == "Full":
+            return
+        with self.__lock:
+            for template in self.__dataset_templates(dataset_id, template_name):
+                template.mask &= ~self.__mask([element_name])
+
+    def delete_harvest(self, harvest_id, batch_size=5000, progress=None):
+        """
+        Deletes all datasets of a harvest source, batch_size and progress are passed to the source,
+        whose counts are returned
+        """
+        counts = None
+        if self.source != None:
+            counts = self.source.delete_harvest(harvest_id, batch_size, progress)
+        with self.__lock:
+            for dataset_id in [dataset.id for dataset in self.__datasets.values() if dataset.harvest_source == harvest_id]:
+                self.__delete_dataset(dataset_id)
+        return counts
+
+    def delete_organization(self, org_id):
+        """
+        Deletes an organization, the roles it managed are kept
+        """
+        if self.source != None:
+            self.source.delete_organization(org_id)
+        with self.__lock:
+            self.__orgs.discard(org_id)
+            for org_ids in self.__role_orgs.values():
+                org_ids.discard(org_id)
+
+    def delete_user(self, user_id):
+        """
+        Deletes a user
+        """
+        if self.source != None:
+            self.source.delete_user(user_id)
+        with self.__lock:
+            self.__user_roles.pop(user_id, None)
+
+    def detach_user_role(self, user_id, role_id):
+        """
+        Takes a role away from a user
+        """
+        if self.source != None:
+            self.source.detach_user_role(user_id, role_id)
+        with self.__lock:
+            self.__user_roles.get(user_id, set()).discard(role_id)
+
+    def get_admins(self):
+        """
+        Returns a list of the ids of the users with the admin role
+        """
+        self.__check_age()
+        return [user_id for user_id, role_ids in self.__user_roles.items() if 'admin' in role_ids]
+
+    def get_orgs(self):
+        """
+        Returns a list of organization ids
+        """
+        self.__check_age()
+        return list(self.__orgs)
+
+    def get_dataset(self, dataset_id):
+        """
+        Returns the dataset id if the dataset exists and None if it does not
+        """
+        self.__check_age()
+        return dataset_id if dataset_id in self.__datasets else None
+
+    def get_metadata_fields(self, dataset_id):
+        """
+        Returns a dictionary of the dataset's field names to their element ids
+        """
+        self.__check_age()
+        dataset = self.__datasets.get(dataset_id)
+        return dict(dataset.fields) if dataset != None else {}
+
+    def get_public_fields(self, dataset_id):
+        """
+        Returns the names of the dataset's fields visible to the public
+        """
+        self.__check_age()
+        dataset = self.__datasets.get(dataset_id)
+        if dataset == None:
+            return []
+        mask = self.__visible_mask(self.__user_templates(dataset, 'public'))
+        return [path for path in (self.__paths[ordinal] for ordinal in _bits(mask)) if path in dataset.fields]
+
+    def get_roles(self, org_id=None):
+        """
+        Returns a dictionary of role names to ids, of the roles managed by an organization if one is given
+        """
+        self.__check_age()
+        return {name: role_id for role_id, name in self.__roles.items() if org_id == None or org_id in self.__role_orgs.get(role_id, ())}
+
+    def get_templates(self, dataset_id):
+        """
+        Returns a dictionary of the dataset's template names to their ids
+        """
+        self.__check_age()
+        dataset = self.__datasets.get(dataset_id)
+        return {template.name: template.id for template in dataset.templates} if dataset != None else {}
+
+    def get_template_access_for_role(self, dataset_id, role_id):
+        """
+        Returns the name of the dataset's template used by a role, None if it uses none
+        """
+        self.__check_age()
+        dataset = self.__datasets.get(dataset_id)
+        if dataset != None:
+            for template in dataset.templates:
+                if role_id in template.roles:
+                    return str(template.name)
+        return None
+
+    def get_template_access_for_user(self, dataset_id, user_id):
+        """
+        Returns the name of the dataset's template used by one of the user's roles, None if there is none
+        """
+        self.__check_age()
+        dataset = self.__datasets.get(dataset_id)
+        templates = self.__user_templates(dataset, user_id) if dataset != None else []
+        return str(templates[0].name) if templates else None
+
+    def get_users(self):
+        """
+        Returns a list of all user ids
+        """
+        self.__check_age()
+        return list(self.__user_roles)
+
+    def get_visible_fields(self, dataset_id, user_id):
+        """
+        Returns the element ids of the dataset's fields visible to a user
+        """
+        self.__check_age()
+        dataset = self.__datasets.get(dataset_id)
+        if dataset == None:
+            return []
+        return self.__ids(dataset, self.__visible_mask(self.__user_templates(dataset, user_id)))
+
+    def is_unrestricted(self, dataset_id):
+        """
+        Checks if the public has 'Full' template access to a dataset
+        """
+        return self.is_unrestricted_for_user(dataset_id, 'public')
+
+    def is_unrestricted_for_user(self, dataset_id, user_id):
+        """
+        Checks if a user has 'Full' template access to a dataset
+        """
+        self.__check_age()
+        dataset = self.__datasets.get(dataset_id)
+        return self.__unrestricted(self.__user_templates(dataset, user_id) if dataset != None else [])
+
+    def resolve_view(self, dataset_id, user_id):
+        """
+        Resolves the access a user has to a dataset, None if the dataset does not exist
+        """
+        return self.resolve_views([dataset_id], user_id).get(dataset_id)
+
+    def resolve_views(self, dataset_ids, user_id):
+        """
+        Resolves the access a user has to several datasets
+
+        Returns
+        -------
+        A dictionary of dataset ids to ViewDecisions, datasets that do not exist are left out
+        """
+        self.__check_age()
+        result = {}
+        for dataset_id in dataset_ids:
+            dataset = self.__datasets.get(dataset_id)
+            if dataset == None:
+                continue
+            public_templates = self.__user_templates(dataset, 'public')
+            user_templates = self.__user_templates(dataset, user_id)
+            public_mask = self.__visible_mask(public_templates)
+            result[dataset_id] = ViewDecision.build(
+                self.__unrestricted(public_templates) or self.__unrestricted(user_templates),
+                dataset.fields,
+                self.__ids(dataset, self.__visible_mask(user_templates)),
+                [path for path in (self.__paths[ordinal] for ordinal in _bits(public_mask)) if path in dataset.fields]
+            )
+        return result
+
+    def set_dataset_harvest_id(self, dataset_id, harvest_id):
+        """
+        Sets the harvest source id of a dataset
+        """
+        if self.source != None:
+            self.source.set_dataset_harvest_id(dataset_id, harvest_id)
+        with self.__lock:
+            dataset = self.__datasets.get(dataset_id)
+            if dataset != None:
+                dataset.harvest_source = harvest_id
+
+    def set_element_access_for_template(self, dataset_id, template_name, element_name):
+        """
+        Makes a field of the dataset visible to one of its templates
+        """
+        if self.source != None:
+            self.source.set_element_access_for_template(dataset_id, template_name, element_name)
+        if template_name == "Full":
+            return
+        with self.__lock:
+            dataset = self.__datasets.get(dataset_id)
+            if dataset == None or element_name not in dataset.fields:
+                return
+            for template in self.__dataset_templates(dataset_id, template_name):
+                template.mask |= self.__mask([element_name])
+
+    def __dataset_templates(self, dataset_id, template_name):
+        dataset = self.__datasets.get(dataset_id)
+        return [template for template in dataset.templates if template.name == template_name] if dataset != None else []
+
+    def set_template_access(self, role_id, template_id):
+        """
+        Makes a role use a template, instead of any other template of the same dataset
+        """
+        if self.source != None:
+            self.source.set_template_access(role_id, template_id)
+        with self.__lock:
+            self.__bind_role_to_template(role_id, self.__templates.get(template_id))
+
+    def __bind_role_to_template(self, role_id, template):
+        if template == None:
+            return
+        for other in self.__datasets[template.dataset_id].templates:
+            other.roles.discard(role_id)
+        template.roles.add(role_id)
+
+    def set_full_access_to_datasets(self, role_id, batch_size=1000, progress=None):
+        """
+        Makes a role use the 'Full' template of every dataset, batch_size and progress are passed to the source
+        """
+        if self.source != None:
+            self.source.set_full_access_to_datasets(role_id, batch_size, progress)
+        with self.__lock:
+            for template in list(self.__templates.values()):
+                if template.name == "Full":
+                    self.__bind_role_to_template(role_id, template)
+
+    def set_user_role(self, user_id, role_id):
+        """
+        Gives a role to a user
+        """
+        if self.source != None:
+            self.source.set_user_role(user_id, role_id)
+        with self.__lock:
+            self.__user_roles.setdefault(user_id, set()).add(role_id)
+
+    def set_visible_fields(self, template_id, whitelist):
+        """
+        Replaces the fields visible to a template
+
+        Parameters
+        ----------
+        template_id : string
+            The id/uuid of the template
+        whitelist : dict
+            The field names to their element ids
+        """
+        if self.source != None:
+            self.source.set_visible_fields(template_id, whitelist)
+        with self.__lock:
+            template = self.__templates.get(template_id)
+            if template != None:
+                template.mask = self.__mask(whitelist)
+
+    def __source(self, name):
+        """
+        Returns the source model, for the methods MetaAuthorize defines that would otherwise not reach it
+        """
+        if self.source == None:
+            raise NotImplementedError("Class %s doesn't implement %s without a source" % (self.__class__.__name__, name))
+        return self.source
+
+    def apply_deltas(self, deltas, batch_size=1000, progress=None):
+        """
+        Applies the deltas to the source, then reloads the model as they may touch any dataset
+        """
+        total = self.__source('apply_deltas').apply_deltas(deltas, batch_size, progress)
+        self.refresh()
+        return total
+
+    def get_fingerprints(self):
+        """
+        Returns the fingerprints of the source, the model does not hold the dataset properties they cover
+        """
+        return self.__source('get_fingerprints').get_fingerprints()
+
+    def get_groups(self):
+        """
+        Groups do not affect access, they are only read from the source
+        """
+        return self.__source('get_groups').get_groups()
+
+    def share_elements(self, batch_size=1000, progress=None):
+        """
+        Folds the source's per dataset elements into shared elements, then reloads the model as element ids changed
+        """
+        total = self.source.share_elements(batch_size, progress)
+        self.refresh()
+        return total
+
+
+def _bits(mask):
+    """
+    Yields the ordinals of the bits set in mask, lowest first
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
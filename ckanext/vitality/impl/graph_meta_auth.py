@@ -2,23 +2,262 @@ import logging
 from operator import truediv
 from os import stat
 from re import template
-from ckanext.vitality.meta_authorize import MetaAuthorize
+from ckanext.vitality.meta_authorize import MetaAuthorize, ViewDecision, ElementMode, TemplateMode
 from neo4j import GraphDatabase
 import uuid 
 from ckanext.vitality import constants
+from ckanext.vitality.cache import dataset_tag, user_tag, org_tag, ROLES_TAG, ALL_TAG
+from ckanext.vitality.impl import queries
 
 log = logging.getLogger(__name__)
 
+# Namespace of the ids of shared elements, see shared_element_id
+SHARED_ELEMENT_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "https://github.com/cioos-atlantic/ckanext-vitality/element")
+
+
+def shared_element_id(name):
+    """
+    Returns the id of the shared element for the field name, the same in every database
+    """
+    return str(uuid.uuid5(SHARED_ELEMENT_NAMESPACE, name))
+
+
+def _element_properties(name, id, shared=False):
+    """
+    Returns the properties of a new element, shared elements are marked as such so that deleting a dataset keeps them
+    """
+    properties = {'name': name, 'id': id}
+    if name in constants.MINIMUM_FIELDS:
+        properties['required'] = True
+    if shared:
+        properties['shared'] = True
+    return properties
+
+
+def _safe_name(value):
+    """
+    Keeps the letters, digits and spaces of value, as names have always been stored
+    https://stackoverflow.com/questions/7406102/create-sane-safe-filename-from-any-unsafe-string
+    """
+    return "".join([c for c in value if c.isalpha() or c.isdigit() or c==' ']).rstrip()
+
+
+def _dataset_properties(dname, harvest_id):
+    """
+    Returns the properties set when a dataset is created and the ones set on every provisioning
+    """
+    properties = {}
+    if dname != None:
+        # Create a safe dataset name if one is passed
+        properties['name'] = _safe_name(dname)
+    updates = {}
+    if harvest_id != None:
+        updates['harvest_source'] = harvest_id
+    return properties, updates
+
+
+def _template_rows(templates, shared=False, listed=False):
+    """
+    Returns the rows of PROVISION_TEMPLATES and PROVISION_TEMPLATE_ACCESS for the templates of a dataset,
+    and the rows of PROVISION_ELEMENTS for the elements of their fields
+    """
+    template_rows = []
+    elements = {}
+    for template in templates:
+        template_properties = {}
+        if template.get('name') != None:
+            template_properties['name'] = str(template['name'])
+        if template.get('description') != None:
+            template_properties['description'] = str(template['description'])
+        if listed:
+            template_properties['visible'] = [str(id) for id in template.get('fields', {}).values()]
+        template_rows.append({
+            'id': template['id'],
+            'properties': template_properties,
+            'roles': list(template.get('roles', [])),
+            'org_roles': bool(template.get('org_roles', False))
+        })
+        for name, id in template.get('fields', {}).items():
+            if name not in elements:
+                element_properties = _element_properties(name, str(id), shared)
+                elements[name] = {'properties': element_properties, 'templates': []}
+            # When listed, elements are only linked to the first template, the one that links them to the dataset
+            if not listed or not elements[name]['templates']:
+                elements[name]['templates'].append(template['id'])
+    return template_rows, list(elements.values())
+
+
+def _description_properties(descriptions):
+    """
+    Returns the dataset properties holding the descriptions, one per language
+    """
+    return {'description_' + language: _safe_name(description) for language, description in (descriptions or {}).items()}
+
 class _GraphMetaAuth(MetaAuthorize):
     """ Graph database authorization settings.
+
+    Reads of access decisions are served from an optional AccessCache, writes invalidate the entries they affect
+    and publish the invalidation to other workers through an optional InvalidationBus.
+
+    With ElementMode.SHARED, new elements are created once per field name with the id given by shared_element_id,
+    and referenced by the templates of every dataset. Ids passed in for new fields are replaced by those ids.
+
+    With TemplateMode.PROPERTY, the elements a template can see are listed in its visible property, read and written
+    at once. can_see relationships then only link elements to the template that created them, i.e. to their dataset.
+
+    With KnownDatasets, provisioning a dataset known to have templates and checking that it exists do not query
+    the graph. The ids of the provisioned datasets are read once, writes to a dataset discard it until provisioned again.
+
+    A driver can be given in place of the uri and credentials, e.g. the in process FakeDriver of tests/fake_neo4j.py.
     """
 
-    def __init__(self, uri, user, password):
-        self.driver = GraphDatabase.driver(uri, auth=(user, password))
+    def __init__(self, uri, user, password, cache=None, invalidation=None, element_mode=ElementMode.DATASET, template_mode=TemplateMode.EDGES, driver=None, known_datasets=None):
+        self.driver = driver if driver != None else GraphDatabase.driver(uri, auth=(user, password))
+        self.cache = cache
+        self.invalidation = invalidation
+        self.known_datasets = known_datasets
+        self.element_mode = element_mode
+        self.template_mode = template_mode
         
     def __close(self):
         self.driver.close()
 
+    def __cached(self, key, tags, loader):
+        """
+        Returns the cached value for key, calling loader and caching its result under tags on a miss
+        """
+        if self.cache == None:
+            return loader()
+        hit, value = self.__cache_get(key)
+        if not hit:
+            value = loader()
+            self.cache.set(key, value, tags)
+        return value
+
+    def __cache_get(self, key):
+        """
+        Looks key up in the cache, making sure this process listens for invalidations first
+        """
+        if self.invalidation != None:
+            self.invalidation.ensure_subscribed()
+        return self.cache.get(key)
+
+    def __invalidate(self, *tags):
+        """
+        Drops the cached entries grouped under any of tags, here and in the other workers
+        """
+        if self.cache != None:
+            self.cache.invalidate(*tags)
+        if self.known_datasets != None:
+            self.known_datasets.invalidate(*tags)
+        if self.invalidation != None:
+            self.invalidation.publish(tags)
+
+    def __known(self, dataset_id):
+        """
+        Whether the dataset is known to have templates, reading the provisioned datasets on first use
+        """
+        if self.known_datasets == None:
+            return False
+        if not self.known_datasets.loaded:
+            if self.invalidation != None:
+                self.invalidation.ensure_subscribed()
+            version = self.known_datasets.begin_load()
+            with self.driver.session() as session:
+                dataset_ids = session.read_transaction(self.__read_provisioned_datasets)
+            if self.known_datasets.load(dataset_ids, version):
+                log.info("Loaded %d provisioned datasets", len(self.known_datasets))
+        return dataset_id in self.known_datasets
+
+    def __invalidate_template(self, template_id):
+        """
+        Drops the cached entries of the dataset that has the given template
+        """
+        if self.cache == None and self.invalidation == None:
+            return
+        with self.driver.session() as session:
+            dataset_id = session.read_transaction(self.__get_template_dataset, template_id)
+        if dataset_id != None:
+            self.__invalidate(dataset_tag(dataset_id))
+
+    def __shared(self):
+        return self.element_mode is ElementMode.SHARED
+
+    def __listed(self):
+        return self.template_mode is TemplateMode.PROPERTY
+
+    def __element_ids(self, fields):
+        """
+        Returns fields, a dictionary of new field names to ids, with the ids of shared elements when they are shared
+        """
+        if not self.__shared():
+            return fields
+        return {name: shared_element_id(name) for name in fields}
+
+    def __read(self, query, *args):
+        """
+        Runs query in a read transaction of a new session
+        """
+        with self.driver.session() as session:
+            return session.read_transaction(query, *args)
+
+    def get_cache_stats(self):
+        """
+        Returns the hit/miss counters of the access cache, or None if caching is disabled
+        """
+        if self.cache == None:
+            return None
+        return self.cache.stats()
+
+    def init_schema(self):
+        """
+        Creates the uniqueness constraints and indexes the queries look nodes up by, existing ones are left as they are
+
+        Returns
+        -------
+        A list with a dictionary per constraint/index, holding its 'kind', 'name', 'label', 'property'
+            and the 'error' that prevented its creation, if any
+        """
+        results = []
+        for kind, statement, entries in (
+            ('constraint', queries.CREATE_UNIQUE_CONSTRAINT, queries.SCHEMA_CONSTRAINTS),
+            ('index', queries.CREATE_INDEX, queries.SCHEMA_INDEXES)
+        ):
+            for name, label, property in entries:
+                result = {'kind': kind, 'name': name, 'label': label, 'property': property, 'error': None}
+                try:
+                    # Schema changes cannot share a transaction with other changes, each gets its own
+                    with self.driver.session() as session:
+                        session.write_transaction(self.__run_schema, statement.format(name=name, label=label, property=property))
+                except Exception as ex:
+                    # Typically duplicate ids preventing a uniqueness constraint
+                    log.error("Could not create %s %s: %s", kind, name, ex)
+                    result['error'] = str(ex)
+                results.append(result)
+        return results
+
+    def get_schema_status(self):
+        """
+        Reports whether the constraints and indexes created by init_schema exist, matching them by label and property
+
+        Returns
+        -------
+        A list with a dictionary per constraint/index, holding its 'kind', 'name', 'label', 'property'
+            and 'state', the index state reported by Neo4j (e.g. ONLINE, POPULATING) or MISSING
+        """
+        schema = self.__read(self.__read_schema)
+        results = []
+        for kind, entries in (('constraint', queries.SCHEMA_CONSTRAINTS), ('index', queries.SCHEMA_INDEXES)):
+            for name, label, property in entries:
+                results.append({
+                    'kind': kind,
+                    'name': name,
+                    'label': label,
+                    'property': property,
+                    'state': schema.get((kind, label, property), 'MISSING')
+                })
+        return results
+
     def add_dataset(self, dataset_id, owner_id, dname=None):
         """
         Adds a dataset to the database and assigns an organization owner
@@ -36,6 +275,7 @@ class _GraphMetaAuth(MetaAuthorize):
                 return
             session.write_transaction(self.__write_dataset, dataset_id, dname)
             session.write_transaction(self.__bind_dataset_to_org, owner_id, dataset_id)
+        self.__invalidate(dataset_tag(dataset_id))
 
 
     def add_group(self, group_id, users):
@@ -77,7 +317,9 @@ class _GraphMetaAuth(MetaAuthorize):
             for f in fields:
                 # Only add the new field if a field with that name doesn't already exist
                 if f[0] not in existing_names:
-                    session.write_transaction(self.__write_metadata_field, f[0], str(f[1]), template_id)
+                    id = shared_element_id(f[0]) if self.__shared() else str(f[1])
+                    session.write_transaction(self.__write_metadata_field, f[0], id, template_id, self.__shared(), self.__listed())
+        self.__invalidate(dataset_tag(dataset_id))
 
     def add_org(self, org_id, users, org_name=None):        
         """
@@ -104,6 +346,7 @@ class _GraphMetaAuth(MetaAuthorize):
             for user in users:
                 if not session.read_transaction(self.__has_role, user['id'], 'admin'):
                     session.write_transaction(self.__bind_user_to_role, user['id'], member_id)
+        self.__invalidate(org_tag(org_id), ROLES_TAG, *[user_tag(user['id']) for user in users])
 
     def add_role(self, id, name=None):        
         """
@@ -118,6 +361,7 @@ class _GraphMetaAuth(MetaAuthorize):
         """
         with self.driver.session() as session:
             session.write_transaction(self.__write_role, id, name)
+        self.__invalidate(ROLES_TAG)
 
     def add_user(self, user_id, user_name = None, user_email = None, gid = None):
         """
@@ -139,6 +383,37 @@ class _GraphMetaAuth(MetaAuthorize):
             if session.read_transaction(self.__get_user_by_id, user_id) != None:
                 return
             session.write_transaction(self.__write_user, user_id, user_name, user_email, gid)
+        self.__invalidate(user_tag(user_id))
+
+    def add_users(self, users, batch_size=1000, progress=None):
+        """
+        Adds several users, sending each batch in a single transaction
+        Same as add_user, then set_user_role for each role and set_user_gid, for every user. Roles managed by an
+            organization are added to the roles the user has in that organization rather than replacing them
+
+        Parameters
+        ----------
+        users : list of dicts
+            The users, with their 'id' and optional 'username', 'email', 'gid' and 'roles' (a list of role ids)
+        batch_size : int
+            The number of users sent per transaction
+        progress : function
+            Called with the number of users seeded after each batch (optional)
+
+        Returns
+        -------
+        The number of users seeded
+        """
+        total = 0
+        with self.driver.session() as session:
+            for start in range(0, len(users), batch_size):
+                batch = users[start:start + batch_size]
+                seeded = session.write_transaction(self.__seed_users, batch)
+                total += seeded
+                self.__invalidate(*[user_tag(user['id']) for user in batch])
+                if progress != None:
+                    progress(seeded)
+        return total
 
     def add_template(self, dataset_id, template_id, template_name=None, template_description=None):
         """
@@ -158,6 +433,7 @@ class _GraphMetaAuth(MetaAuthorize):
         with self.driver.session() as session:
             session.write_transaction(self.__write_template, template_id, template_name, template_description)
             session.write_transaction(self.__bind_template_to_dataset, template_id, dataset_id)        
+        self.__invalidate(dataset_tag(dataset_id))
     
     # TODO Generate fields separately and set instead of two different instantiation methods
     def add_template_full(self, dataset_id, template_id, template_name, fields, template_description = None):
@@ -185,13 +461,85 @@ class _GraphMetaAuth(MetaAuthorize):
             # Add full template
             self.add_template(dataset_id, template_id, template_name, template_description)
             # Fullcreate the fields as well
-            for name,id in fields.items():
-                session.write_transaction(self.__write_metadata_field, name, id, template_id)
+            for name,id in self.__element_ids(fields).items():
+                session.write_transaction(self.__write_metadata_field, name, id, template_id, self.__shared(), self.__listed())
+        self.__invalidate(dataset_tag(dataset_id))
+
+    def provision_dataset(self, dataset_id, owner_id, dname=None, harvest_id=None, descriptions=None, templates=None):
+        """
+        Adds a dataset along with its templates, elements and template access in a single transaction
+        Replaces add_dataset, set_dataset_harvest_id, set_dataset_description, add_template(_full),
+            set_visible_fields and set_template_access calls, each of which ran its own transactions
+
+        As with those calls, an existing dataset is not recreated and templates are only created
+            for a dataset that has none. A dataset in known_datasets is skipped without a query, its
+            harvest source and owner are left as they are
+
+        Parameters
+        ----------
+        dataset_id : string
+            The UUID of the dataset to create
+        owner_id : string
+            The UUID of the organization that owns the dataset
+        dname : string
+            The name of the dataset (optional)
+        harvest_id : string
+            The harvest source id of the dataset (optional)
+        descriptions : dict
+            Descriptions of the dataset with the language as key (optional)
+        templates : list
+            A list of template dictionaries, each with an 'id', 'name', 'description', the 'fields'
+            it can see as a dictionary of element names to ids, the ids of the 'roles' that use it and
+            whether the roles managed by the owner organization use it ('org_roles'). Elements are
+            created for the fields of all templates
+
+        Returns
+        -------
+        True if the templates were created, False if the dataset already had templates
+        """
+        if templates and self.__known(dataset_id):
+            return False
+        templates = [dict(template, fields=self.__element_ids(template.get('fields', {}))) for template in templates or []]
+        with self.driver.session() as session:
+            created = session.write_transaction(self.__provision_dataset, dataset_id, owner_id, dname, harvest_id, descriptions, templates, self.__shared(), self.__listed())
+        self.__invalidate(dataset_tag(dataset_id))
+        if templates and self.known_datasets != None:
+            self.known_datasets.add(dataset_id)
+        return created
+
+    def provision_datasets(self, datasets):
+        """
+        Provisions several datasets in a single transaction, with one query per step for all of them
+        rather than one transaction per dataset, see provision_dataset
+
+        Parameters
+        ----------
+        datasets : list
+            Dictionaries of the provision_dataset arguments. When a dataset id is listed more than once,
+            the last arguments are used
+
+        Returns
+        -------
+        The ids of the datasets whose templates were created
+        """
+        datasets = list(dict((dataset['dataset_id'], dict(dataset, templates=[dict(template, fields=self.__element_ids(template.get('fields', {})))
+            for template in dataset.get('templates') or []])) for dataset in datasets).values())
+        datasets = [dataset for dataset in datasets if not (dataset['templates'] and self.__known(dataset['dataset_id']))]
+        if not datasets:
+            return []
+        with self.driver.session() as session:
+            created = session.write_transaction(self.__provision_datasets, datasets, self.__shared(), self.__listed())
+        self.__invalidate(*[dataset_tag(dataset['dataset_id']) for dataset in datasets])
+        if self.known_datasets != None:
+            for dataset in datasets:
+                if dataset['templates']:
+                    self.known_datasets.add(dataset['dataset_id'])
+        return created
 
     def delete_dataset(self, dataset_id):
         """
         Deletes an dataset given its ID
-        Also removes associated templates and elements
+        Also removes associated templates and elements, except shared elements
         
         Parameters
         ----------
@@ -200,6 +548,7 @@ class _GraphMetaAuth(MetaAuthorize):
         """
         with self.driver.session() as session:
             session.write_transaction(self.__delete_dataset, dataset_id)
+        self.__invalidate(dataset_tag(dataset_id))
 
     def delete_element_access_for_template(self, dataset_id, template_name, element_name):
         """ 
@@ -221,24 +570,52 @@ class _GraphMetaAuth(MetaAuthorize):
                 templates = session.read_transaction(self.__read_templates, dataset_id)
                 
                 if(template_name in templates and element_name in elements):
-                    session.write_transaction(self.__detach_fields_from_template, templates[template_name], elements[element_name])
+                    session.write_transaction(self.__detach_fields_from_template, templates[template_name], elements[element_name], self.__listed())
             else:
                 log.warn("Cannot detach element from Full template. Exiting...")
+        self.__invalidate(dataset_tag(dataset_id))
 
-    def delete_harvest(self, harvest_id):
+    def delete_harvest(self, harvest_id, batch_size=5000, progress=None):
         """
-        Deletes all datasets associated with a specific harvest id
-        Triggered when clearing a harvest
+        Deletes all datasets associated with a specific harvest id, with their templates and elements
+        but for the shared elements. Triggered when clearing a harvest
         
         Parameters
         ----------
         harvest_id : string
             The id/uuid of the harvest to delete associated datasets
+        batch_size : int
+            The number of nodes deleted per transaction
+        progress : function
+            Called with the number of nodes deleted so far after each transaction (optional)
+
+        Returns
+        -------
+        A dictionary with the number of 'datasets', 'templates' and 'elements' deleted
         """
+        counts = {'datasets': 0, 'templates': 0, 'elements': 0}
+
+        def deleted(kind, count):
+            counts[kind] += count
+            if progress != None and count:
+                progress(sum(counts.values()))
+
         with self.driver.session() as session:
-            records = session.read_transaction(self.__read_harvest_datasets, harvest_id)
-            for record in records:
-                self.delete_dataset(record)
+            for kind, query in [('elements', queries.DELETE_HARVEST_ELEMENTS), ('templates', queries.DELETE_HARVEST_TEMPLATES)]:
+                while True:
+                    count = session.write_transaction(self.__delete_harvest_batch, query, harvest_id, batch_size)
+                    deleted(kind, count)
+                    if count < batch_size:
+                        break
+            while True:
+                dataset_ids = session.write_transaction(self.__delete_harvest_datasets, harvest_id, batch_size)
+                self.__invalidate(*[dataset_tag(dataset_id) for dataset_id in dataset_ids])
+                deleted('datasets', len(dataset_ids))
+                if len(dataset_ids) < batch_size:
+                    break
+        log.info("Deleted %d datasets, %d templates and %d elements of harvest source %s",
+            counts['datasets'], counts['templates'], counts['elements'], harvest_id)
+        return counts
 
     def delete_organization(self, org_id):
         """
@@ -251,6 +628,9 @@ class _GraphMetaAuth(MetaAuthorize):
         """
         with self.driver.session() as session:
             session.write_transaction(self.__delete_organization, org_id)
+        # The decisions of its members and on its datasets are tagged by user and dataset, not by organization,
+        #   and deleting organizations is rare enough to drop every entry rather than reading them first
+        self.__invalidate(ALL_TAG)
             
     def delete_user(self, user_id):
         """
@@ -263,6 +643,7 @@ class _GraphMetaAuth(MetaAuthorize):
         """
         with self.driver.session() as session:
             session.write_transaction(self.__delete_user, user_id)
+        self.__invalidate(user_tag(user_id))
 
     def detach_user_role(self, user_id, role_id):
         """
@@ -277,6 +658,7 @@ class _GraphMetaAuth(MetaAuthorize):
         """
         with self.driver.session() as session:
             session.write_transaction(self.__detach_user_from_role, user_id, role_id)
+        self.__invalidate(user_tag(user_id))
 
     def get_admins(self):
         """ 
@@ -306,6 +688,8 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         The dataset id if it exists and None if it does not
         """
+        if self.__known(dataset_id):
+            return dataset_id
         with self.driver.session() as session:
             return session.read_transaction(self.__get_dataset, dataset_id)
 
@@ -322,8 +706,8 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         The dataset id if it exists and None if it does not
         """
-        with self.driver.session() as session:
-            return session.read_transaction(self.__read_elements, dataset_id)
+        return self.__cached(('get_metadata_fields', dataset_id), [dataset_tag(dataset_id)],
+            lambda: self.__read(self.__read_elements, dataset_id))
 
     def get_organization(self, organization_id):
         """ 
@@ -354,9 +738,10 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         An organization object (name and id) if one exists, and none if one does not
         """
-        public_field_ids =  self.get_visible_fields(dataset_id, user_id='public')
-        public_field_names = [f[0].encode("utf-8") for f in self.get_metadata_fields(dataset_id).items() if f[1] in public_field_ids]
-        return public_field_names
+        def load():
+            public_field_ids =  self.get_visible_fields(dataset_id, user_id='public')
+            return [f[0].encode("utf-8") for f in self.get_metadata_fields(dataset_id).items() if f[1] in public_field_ids]
+        return self.__cached(('get_public_fields', dataset_id), [dataset_tag(dataset_id), user_tag('public')], load)
 
     def get_roles(self, org_id = None):
         """ 
@@ -371,8 +756,8 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         A list of all roles (if no org provided) or roles owned by an organization (if org provided)
         """
-        with self.driver.session() as session:
-            return session.read_transaction(self.__read_roles, org_id)
+        return self.__cached(('get_roles', org_id), [org_tag(org_id), ROLES_TAG],
+            lambda: self.__read(self.__read_roles, org_id))
 
 
     def get_private_dataset(self, dataset_id):
@@ -422,8 +807,8 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         A dictionary of the templates with the name as the key and the id as the value
         """
-        with self.driver.session() as session:
-            return session.read_transaction(self.__read_templates, dataset_id)    
+        return self.__cached(('get_templates', dataset_id), [dataset_tag(dataset_id)],
+            lambda: self.__read(self.__read_templates, dataset_id))
             
     def get_template_access_for_role(self, dataset_id, role_id):
         """ 
@@ -529,8 +914,8 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         A list of element UUIDs representing the visible fields
         """
-        with self.driver.session() as session:
-            return session.read_transaction(self.__read_visible_fields, dataset_id, user_id)
+        return self.__cached(('get_visible_fields', dataset_id, user_id), [dataset_tag(dataset_id), user_tag(user_id)],
+            lambda: self.__read(self.__read_visible_fields, dataset_id, user_id, self.__listed()))
 
     def is_unrestricted(self, dataset_id):
         """ 
@@ -545,8 +930,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         True if the template name of the public role is set to 'Full', False otherwise
         """
-        with self.driver.session() as session:
-            return session.read_transaction(self.__is_unrestricted_for_user, dataset_id, 'public')
+        return self.is_unrestricted_for_user(dataset_id, 'public')
     
     def is_unrestricted_for_user(self, dataset_id, user_id):
         """ 
@@ -563,8 +947,61 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         True if the template name of the user's role is set to 'Full', False otherwise
         """
+        return self.__cached(('is_unrestricted_for_user', dataset_id, user_id), [dataset_tag(dataset_id), user_tag(user_id)],
+            lambda: self.__read(self.__is_unrestricted_for_user, dataset_id, user_id))
+
+    def resolve_view(self, dataset_id, user_id):
+        """ 
+        Resolves the access a user has to a dataset with a single query
+
+        Parameters
+        ----------
+        dataset_id : string
+            The id/uuid of the dataset to check
+        user_id : string
+            The id/uuid of the user to check access for, 'public' for anonymous users
+
+        Returns
+        -------
+        A ViewDecision for the user, None if the dataset does not exist
+        """
+        return self.resolve_views([dataset_id], user_id).get(dataset_id)
+
+    def resolve_views(self, dataset_ids, user_id):
+        """ 
+        Resolves the access a user has to several datasets with a single query
+
+        Parameters
+        ----------
+        dataset_ids : list
+            The ids/uuids of the datasets to check
+        user_id : string
+            The id/uuid of the user to check access for, 'public' for anonymous users
+
+        Returns
+        -------
+        A dictionary of dataset ids to ViewDecisions, datasets that do not exist are left out
+        """
+        result = {}
+        missing = []
+        for dataset_id in dataset_ids:
+            hit, decision = (False, None) if self.cache == None else self.__cache_get(('resolve_view', dataset_id, user_id))
+            if not hit:
+                missing.append(dataset_id)
+            elif decision != None:
+                result[dataset_id] = decision
+        if not missing:
+            return result
         with self.driver.session() as session:
-            return session.read_transaction(self.__is_unrestricted_for_user, dataset_id, user_id)
+            resolved = session.read_transaction(self.__resolve_views, missing, user_id, self.__listed())
+        for dataset_id in missing:
+            decision = resolved.get(dataset_id)
+            # Datasets that are not in the model are cached as None until add_dataset invalidates them
+            if self.cache != None:
+                self.cache.set(('resolve_view', dataset_id, user_id), decision, [dataset_tag(dataset_id), user_tag(user_id), user_tag('public')])
+            if decision != None:
+                result[dataset_id] = decision
+        return result
 
     def set_dataset_description(self, dataset_id, language, description):
         """ 
@@ -631,11 +1068,12 @@ class _GraphMetaAuth(MetaAuthorize):
                 templates = session.read_transaction(self.__read_templates, dataset_id)
                 
                 if(template_name in templates and element_name in elements):
-                    session.write_transaction(self.__bind_fields_to_template, templates[template_name], {element_name : elements[element_name]}, overwrite=False)
+                    session.write_transaction(self.__bind_fields_to_template, templates[template_name], {element_name : elements[element_name]}, False, self.__listed())
                 else:
                     log.info("Provided template name or element name does not exist")
             else:
                 log.info("Full templates already connected to every element in the dataset")
+        self.__invalidate(dataset_tag(dataset_id))
 
     def set_template_access(self, role_id, template_id):
         """ 
@@ -650,6 +1088,7 @@ class _GraphMetaAuth(MetaAuthorize):
         """
         with self.driver.session() as session:
             session.write_transaction(self.__bind_role_to_template, role_id, template_id)
+        self.__invalidate_template(template_id)
 
     # Used to set access for users to edit org settings on the landing page
     def set_admin_form_access(self, user_id, org_id):
@@ -721,6 +1160,7 @@ class _GraphMetaAuth(MetaAuthorize):
         """
         with self.driver.session() as session:
             session.write_transaction(self.__bind_user_to_role, user_id, role_id)
+        self.__invalidate(user_tag(user_id))
 
     def set_visible_fields(self, template_id, whitelist):
         """ 
@@ -734,7 +1174,8 @@ class _GraphMetaAuth(MetaAuthorize):
             A list of UUIDs of the fields in the database
         """
         with self.driver.session() as session:
-            session.write_transaction(self.__bind_fields_to_template, template_id, whitelist)
+            session.write_transaction(self.__bind_fields_to_template, template_id, whitelist, True, self.__listed())
+        self.__invalidate_template(template_id)
 
     def set_organization_name(self, org_id, org_name):
         """ 
@@ -750,45 +1191,258 @@ class _GraphMetaAuth(MetaAuthorize):
         with self.driver.session() as session:
             session.write_transaction(self.__set_organization_name, org_id, org_name)
 
-    def set_full_access_to_datasets(self, role_id):
+    def set_full_access_to_datasets(self, role_id, batch_size=1000, progress=None):
         """ 
         Sets the template access to 'Full' for the given role for all datasets
+        Runs in batches of at most batch_size templates per transaction and can be interrupted and run again
 
         Parameters
         ----------
         role_id : string
             The id/uuid of the role in the database
+        batch_size : int
+            The number of templates updated per transaction
+        progress : function
+            Called with the number of templates updated so far after each batch (optional)
+
+        Returns
+        -------
+        The number of templates updated
         """
+        total = 0
         with self.driver.session() as session:
-            # Get all datasets
-            # Get their full template
-            # For each template
-            templates = session.read_transaction(self.__read_all_templates, "Full")
-            for template in templates:
-                session.write_transaction(self.__bind_role_to_template, role_id, template)
+            while True:
+                updated = session.write_transaction(self.__access_batch, queries.FULL_ACCESS_BATCH, batch_size, role_id=role_id)
+                total += updated
+                if progress != None and updated:
+                    progress(total)
+                if updated < batch_size:
+                    break
+        self.__invalidate(ALL_TAG)
+        return total
     
-    def set_minimal_access_to_dataset(self, dataset_id):
+    def share_elements(self, batch_size=1000, progress=None):
+        """
+        Folds the per dataset elements (ElementMode.DATASET) into shared elements, one per field name
+        Templates seeing a per dataset element see the shared element instead, the per dataset element is deleted
+        Runs in batches of at most batch_size elements per transaction and can be interrupted and run again
+
+        Parameters
+        ----------
+        batch_size : int
+            The number of elements folded per transaction
+        progress : function
+            Called with the field name and the number of elements folded after each batch (optional)
+
+        Returns
+        -------
+        The number of per dataset elements folded
+        """
+        total = 0
+        with self.driver.session() as session:
+            names = session.read_transaction(self.__read_dataset_element_names)
+            for name in names:
+                id = shared_element_id(name)
+                session.write_transaction(self.__write_shared_element, name, id)
+                while True:
+                    folded = session.write_transaction(self.__fold_elements, name, id, batch_size)
+                    total += folded
+                    if progress != None and folded:
+                        progress(name, folded)
+                    if folded < batch_size:
+                        break
+        # Element ids changed for every dataset
+        self.__invalidate(ALL_TAG)
+        return total
+
+    def export_snapshot(self):
+        """
+        Reads the access model, i.e. the users, roles, datasets, elements and templates, in a single transaction
+        The snapshot holds plain dicts and lists of strings so that it can be stored as JSON
+
+        Returns
+        -------
+        A dictionary with
+            'users': user ids to the ids of their roles
+            'profiles': user ids to their 'username', 'email' and 'gid'
+            'organizations': organization ids to their names
+            'roles': role ids to their 'name' and the ids of the organizations managing them ('orgs')
+            'datasets': dataset ids to their 'name', 'owner', 'harvest_source', 'fields' (element names to ids) and
+                'templates' (template ids to their 'name', the ids of the 'roles' using them and of the elements 'visible' to them)
+        """
+        with self.driver.session() as session:
+            return session.read_transaction(self.__read_snapshot, self.__listed())
+
+    def get_fingerprints(self):
+        """
+        Reads the fingerprints of the users, organizations, groups, memberships and datasets in a single transaction
+
+        Returns
+        -------
+        A dictionary of sets, see MetaAuthorize.get_fingerprints
+        """
+        with self.driver.session() as session:
+            return session.read_transaction(self.__read_fingerprints)
+
+    def apply_deltas(self, deltas, batch_size=1000, progress=None):
+        """
+        Applies the changes computed by diff_fingerprints, sending each batch of users, memberships and deleted
+        datasets in a single transaction. Organizations and groups are added one by one as add_org and add_group
+        do, the administrators get access to the new organizations on the admin form as with `ckan vitality seed-orgs`
+
+        Parameters
+        ----------
+        deltas : dict
+            The changes, see diff_fingerprints. 'add_users' may hold a 'gid' for each user, 'add_datasets' is ignored
+        batch_size : int
+            The number of changes applied per transaction
+        progress : function
+            Called with the name of the change and the number of changes applied after each batch (optional)
+
+        Returns
+        -------
+        The number of changes applied
+        """
+        def report(name):
+            return None if progress == None else lambda applied: progress(name, applied)
+
+        def members(key, kind):
+            return [{key: id, 'user_id': user_id} for id, user_id in deltas.get(kind, [])]
+
+        total = 0
+        with self.driver.session() as session:
+            # Users first, the memberships below refer to them
+            total += self.__apply_batches(session, queries.RECONCILE_DELETE_USERS, 'ids', deltas.get('delete_users', []),
+                lambda id: [user_tag(id)], batch_size, report('delete_users'))
+        total += self.add_users(deltas.get('add_users', []), batch_size, report('add_users'))
+        with self.driver.session() as session:
+            total += self.__apply_batches(session, queries.RECONCILE_UPDATE_USERS, 'users', deltas.get('update_users', []),
+                lambda user: [user_tag(user['id'])], batch_size, report('update_users'))
+
+        for org in deltas.get('add_orgs', []):
+            self.add_org(org['id'], [], org['name'])
+            for admin in self.get_admins():
+                self.set_admin_form_access(admin, org['id'])
+        for org in deltas.get('rename_orgs', []):
+            self.set_organization_name(org['id'], org['name'])
+        for org_id in deltas.get('delete_orgs', []):
+            self.delete_organization(org_id)
+        for group_id in deltas.get('add_groups', []):
+            self.add_group(group_id, [])
+        for name in ['add_orgs', 'rename_orgs', 'delete_orgs', 'add_groups']:
+            total += len(deltas.get(name, []))
+            if progress != None and deltas.get(name):
+                progress(name, len(deltas[name]))
+
+        with self.driver.session() as session:
+            total += self.__apply_batches(session, queries.RECONCILE_DELETE_GROUPS, 'ids', deltas.get('delete_groups', []),
+                lambda id: [], batch_size, report('delete_groups'))
+            total += self.__apply_batches(session, queries.RECONCILE_BIND_ADMINS, 'ids', deltas.get('add_admins', []),
+                lambda id: [user_tag(id)], batch_size, report('add_admins'))
+            total += self.__apply_batches(session, queries.RECONCILE_DETACH_ADMINS, 'ids', deltas.get('remove_admins', []),
+                lambda id: [user_tag(id)], batch_size, report('remove_admins'))
+            total += self.__apply_batches(session, queries.RECONCILE_BIND_ORG_MEMBERS, 'members', members('org_id', 'add_org_members'),
+                lambda member: [user_tag(member['user_id'])], batch_size, report('add_org_members'))
+            total += self.__apply_batches(session, queries.RECONCILE_DETACH_ORG_MEMBERS, 'members', members('org_id', 'remove_org_members'),
+                lambda member: [user_tag(member['user_id'])], batch_size, report('remove_org_members'))
+            total += self.__apply_batches(session, queries.RECONCILE_BIND_GROUP_MEMBERS, 'members', members('group_id', 'add_group_members'),
+                lambda member: [], batch_size, report('add_group_members'))
+            total += self.__apply_batches(session, queries.RECONCILE_DETACH_GROUP_MEMBERS, 'members', members('group_id', 'remove_group_members'),
+                lambda member: [], batch_size, report('remove_group_members'))
+            total += self.__apply_batches(session, queries.RECONCILE_DELETE_DATASETS, 'ids', deltas.get('delete_datasets', []),
+                lambda id: [dataset_tag(id)], batch_size, report('delete_datasets'))
+        return total
+
+    def __apply_batches(self, session, query, parameter, rows, tags, batch_size, progress):
+        """
+        Runs an UNWIND query over the rows, one write transaction per batch of at most batch_size rows
+
+        Parameters
+        ----------
+        session : neo4j.Session
+            The session running the transactions
+        query : string
+            The query, unwinding the parameter
+        parameter : string
+            The name of the list parameter of the query
+        rows : list
+            The values of the parameter
+        tags : function
+            Returns the cache tags invalidated by a row
+        batch_size : int
+            The number of rows per transaction
+        progress : function
+            Called with the number of rows after each batch (optional)
+
+        Returns
+        -------
+        The number of rows
+        """
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            session.write_transaction(self.__run_batch, query, parameter, batch)
+            self.__invalidate(*[tag for row in batch for tag in tags(row)])
+            if progress != None:
+                progress(len(batch))
+        return len(rows)
+
+    def list_template_fields(self, batch_size=1000, progress=None):
+        """
+        Lists the elements each template can see in its visible property, for TemplateMode.PROPERTY
+        Templates that already have the property are skipped, the can_see relationships are kept
+
+        Parameters
+        ----------
+        batch_size : int
+            The number of templates updated per transaction
+        progress : function
+            Called with the number of templates updated after each batch (optional)
+
+        Returns
+        -------
+        The number of templates updated
+        """
+        total = 0
+        with self.driver.session() as session:
+            while True:
+                listed = session.write_transaction(self.__list_template_fields, batch_size)
+                total += listed
+                if progress != None and listed:
+                    progress(listed)
+                if listed < batch_size:
+                    break
+        self.__invalidate(ALL_TAG)
+        return total
+
+    def set_minimal_access_to_dataset(self, dataset_id, batch_size=1000, progress=None):
         """ 
         Sets the template access to 'private' for all roles except admins and members of the dataset owner
+        Runs in batches of at most batch_size roles per transaction
 
         Parameters
         ----------
         dataset_id : string
             The id/uuid of the dataset
+        batch_size : int
+            The number of roles updated per transaction
+        progress : function
+            Called with the number of roles updated so far after each batch (optional)
+
+        Returns
+        -------
+        The number of roles updated
         """
+        total = 0
         with self.driver.session() as session:
-            org_id = session.read_transaction(self.__get_dataset_owner, dataset_id)
-            org_roles = self.get_roles(org_id)
-            minimal_template = self.get_templates(dataset_id)["Minimal"]
-            all_roles = self.get_roles()
-            full_access_roles = ['admin']
-
-            for role in org_roles:
-                full_access_roles.append(org_roles[role])
-
-            for role in all_roles:
-                if role not in full_access_roles:
-                    session.write_transaction(self.__bind_role_to_template, all_roles[role], minimal_template)
+            while True:
+                updated = session.write_transaction(self.__access_batch, queries.MINIMAL_ACCESS_BATCH, batch_size, dataset_id=dataset_id)
+                total += updated
+                if progress != None and updated:
+                    progress(total)
+                if updated < batch_size:
+                    break
+        self.__invalidate(dataset_tag(dataset_id))
+        return total
 
     @staticmethod
     def __get_dataset_owner(tx, id):
@@ -804,7 +1458,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         The organization ID that owns the dataset
         """
-        records = tx.run("MATCH (d:dataset {id:'"+id+"'})<-[owns]-(o:organization) return o.id as id")
+        records = tx.run(queries.GET_DATASET_OWNER, id=id)
         for record in records:
             return record['id']
         return None
@@ -823,11 +1477,22 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         The dataset id if it exists, None if it does not
         """
-        records = tx.run("MATCH (d:dataset {id:'"+id+"'}) return d.id as id")
+        records = tx.run(queries.GET_DATASET, id=id)
         for record in records:
             return record['id']
         return None
 
+    @staticmethod
+    def __read_provisioned_datasets(tx):
+        """
+        Returns the ids of the datasets that have templates, see KnownDatasets
+
+        Returns
+        -------
+        A list of dataset IDs (String)
+        """
+        return [record['id'] for record in tx.run(queries.READ_PROVISIONED_DATASETS)]
+
     @staticmethod
     def __get_group(tx, id):
         """ 
@@ -842,7 +1507,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         The group id if it exists, None if it does not
         """
-        records = tx.run("MATCH (g:group {id:'"+id+"'}) return g.id as id")   
+        records = tx.run(queries.GET_GROUP, id=id)   
         for record in records:
             return record['id']
         return None
@@ -861,7 +1526,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         An object with the organization id and name if it exists, None if it does not
         """
-        records = tx.run("MATCH (o:organization {id:'"+id+"'}) return o.id AS id, o.name AS name")      
+        records = tx.run(queries.GET_ORG_BY_ID, id=id)      
         for record in records:
             return record    
         return None
@@ -880,7 +1545,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         An object with the organization id and name if it exists, None if it does not
         """
-        records = tx.run("MATCH (o:organization {name:'"+name+"'}) return o.id AS id, o.name AS name")      
+        records = tx.run(queries.GET_ORG_BY_NAME, name=name)      
         for record in records:
             return record    
         return None
@@ -899,7 +1564,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         An object with the id and name of the private dataset if it exists, None if it does not
         """
-        records = tx.run("MATCH (x:dataset {id:'"+id+"'})<-[:has_public_dataset]-(y:dataset) return y.id as id, y.name as name")      
+        records = tx.run(queries.GET_PRIVATE_DATASET, id=id)      
         for record in records:
             return record    
         return None
@@ -918,11 +1583,30 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         An object with the id and name of the public dataset if it exists, None if it does not
         """
-        records = tx.run("MATCH (x:dataset {id:'"+id+"'})-[:has_public_dataset]->(y:dataset) return y.id as id, y.name as name")      
+        records = tx.run(queries.GET_PUBLIC_DATASET, id=id)      
         for record in records:
             return record    
         return
 
+    @staticmethod
+    def __get_template_dataset(tx, template_id):
+        """ 
+        Given a template id, runs a query to return the id of the dataset that has the template
+
+        Parameters
+        ----------
+        template_id : string
+            The id/uuid of the template
+
+        Returns
+        -------
+        The dataset id as a string if the template belongs to a dataset, None if it does not
+        """
+        records = tx.run(queries.GET_TEMPLATE_DATASET, template_id=template_id)
+        for record in records:
+            return record['id']
+        return None
+
     @staticmethod
     def __get_template_name(tx, template_id):
         """ 
@@ -937,7 +1621,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         The template name as a string if the dataset exists, None if it does not
         """
-        records = tx.run("MATCH (t:template {id:'"+template_id+"'}) return t.name AS name")
+        records = tx.run(queries.GET_TEMPLATE_NAME, template_id=template_id)
         for record in records:
             return record['name']
         return None
@@ -958,7 +1642,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         The id of the template as a string if a relationship exists, None if it does not
         """
-        records = tx.run("MATCH (:dataset {id:'"+dataset_id+"'})-[:has_template]->(t:template)<-[:uses_template]-(:role {id:'"+role_id+"'}) return t.id as id")
+        records = tx.run(queries.GET_TEMPLATE_ACCESS_FOR_ROLE, dataset_id=dataset_id, role_id=role_id)
         for record in records:
             return record['id']
         return None
@@ -979,7 +1663,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         The id of the template as a string if a relationship exists, None if it does not
         """
-        records = tx.run("MATCH (:dataset {id:'"+dataset_id+"'})-[:has_template]->(t:template)<-[:uses_template]-(:role)<-[:has_role]-(u:user {id:'"+user_id+"'}) return t.id as id")
+        records = tx.run(queries.GET_TEMPLATE_ACCESS_FOR_USER, dataset_id=dataset_id, user_id=user_id)
         for record in records:
             return record['id']
 
@@ -997,7 +1681,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         An object with the user id and name if it exists, None if it does not
         """
-        records = tx.run("MATCH (u:user {id:'"+id+"'}) return u.id as id, u.username as username, u.email as email")   
+        records = tx.run(queries.GET_USER_BY_ID, id=id)   
         for record in records:
             return record
         return None
@@ -1016,7 +1700,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         An object with the user id and name if it exists, None if it does not
         """
-        records = tx.run("MATCH (u:user {username:'"+username+"'}) return u.id as id, u.username as username, u.email as email")   
+        records = tx.run(queries.GET_USER_BY_USERNAME, username=username)   
         for record in records:
             return record
         return None
@@ -1037,7 +1721,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         True if the template access is named 'Full' and false if template access is any other form
         """
-        records = tx.run("MATCH (:dataset {id:'"+dataset_id+"'})-[:has_template]->(t:template)<-[:uses_template]-(:role)<-[:has_role]-(:user {id:'"+user_id+"'}) return t.name as name")
+        records = tx.run(queries.IS_UNRESTRICTED_FOR_USER, dataset_id=dataset_id, user_id=user_id)
         for record in records:
             if record['name'] == 'Full':
                 return True
@@ -1060,7 +1744,7 @@ class _GraphMetaAuth(MetaAuthorize):
         A dictionary of elements where each element name is the key and the id is the value
         """
         result = {}
-        for record in tx.run("MATCH (:dataset {id:'"+dataset_id +"'})-[:has_template]->(t:template)-[:can_see]->(e:element) RETURN DISTINCT e.name AS name, e.id AS id"):
+        for record in tx.run(queries.READ_ELEMENTS, dataset_id=dataset_id):
             result[record['name']] = record['id']
         return result
 
@@ -1082,10 +1766,10 @@ class _GraphMetaAuth(MetaAuthorize):
         # TODO This case is unused but may break if all roles are returned as many will share names
         # Possible to make a dictionary on the higher level to return per organization?
         if(org_id==None):
-            for record in tx.run("MATCH (r:role) RETURN r.name AS name, r.id AS id"):
+            for record in tx.run(queries.READ_ROLES):
                 result[record['name']] = record['id']
         else:
-            for record in tx.run("MATCH (r:role)<-[:manages_role]-(o:organization {id:'"+ org_id +"'}) RETURN r.name AS name, r.id AS id"):
+            for record in tx.run(queries.READ_ROLES_FOR_ORG, org_id=org_id):
                 result[record['name']] = record['id']
         return result
 
@@ -1105,7 +1789,7 @@ class _GraphMetaAuth(MetaAuthorize):
         A dictionary of templates with the template name as the key and template id as the value.
         """
         result = {}
-        for record in tx.run("MATCH (t:template)<-[:has_template]-(d:dataset {id:'"+ dataset_id +"'}) RETURN t.name AS name, t.id AS id"):
+        for record in tx.run(queries.READ_TEMPLATES, dataset_id=dataset_id):
             result[record['name']] = record['id']
         return result
 
@@ -1128,31 +1812,50 @@ class _GraphMetaAuth(MetaAuthorize):
         # Possible to make a dictionary on the higher level to return per dataset?
         results = []
         if (template_name==None):
-            for record in tx.run("MATCH (t:template) RETURN t.id AS id"):
+            for record in tx.run(queries.READ_ALL_TEMPLATES):
                 results.append(record['id'])
         else:
-            for record in tx.run("MATCH (t:template {name:'" + template_name + "'}) RETURN t.id AS id"):
+            for record in tx.run(queries.READ_ALL_TEMPLATES_BY_NAME, name=template_name):
                 results.append(record['id'])
         return results
 
     @staticmethod
-    def __read_harvest_datasets (tx, harvest_id):
-        """ 
-        Returns all datasets associated with the given harvest id
+    def __delete_harvest_batch(tx, query, harvest_id, batch_size):
+        """
+        Deletes one batch of the elements or templates of the datasets of a harvest source, see delete_harvest
 
         Parameters
         ----------
+        query : string
+            DELETE_HARVEST_ELEMENTS or DELETE_HARVEST_TEMPLATES
         harvest_id : string
             The id of the harvest associated with the datasets
+        batch_size : int
+            The maximum number of nodes to delete
 
         Returns
         -------
-        A list of dataset IDs (String)
+        The number of nodes deleted
         """
-        result = []
-        for record in tx.run("MATCH (d:dataset {harvest_source:'"+ harvest_id +"'}) RETURN d.id AS id"):
-            result.append(record['id'])
-        return result
+        return tx.run(query, harvest_id=harvest_id, batch_size=batch_size).single()['deleted']
+
+    @staticmethod
+    def __delete_harvest_datasets(tx, harvest_id, batch_size):
+        """
+        Deletes one batch of the datasets of a harvest source, once their templates and elements are deleted
+
+        Parameters
+        ----------
+        harvest_id : string
+            The id of the harvest associated with the datasets
+        batch_size : int
+            The maximum number of datasets to delete
+
+        Returns
+        -------
+        A list of the deleted dataset IDs (String)
+        """
+        return tx.run(queries.DELETE_HARVEST_DATASETS, harvest_id=harvest_id, batch_size=batch_size).single()['ids']
 
     @staticmethod
     def __read_users(tx):
@@ -1164,7 +1867,7 @@ class _GraphMetaAuth(MetaAuthorize):
         A list of all user ids in the database
         """
         result = []
-        for record in tx.run("MATCH (u:user) RETURN u.id as id"):
+        for record in tx.run(queries.READ_USERS):
             result.append(record['id'])
         return result
 
@@ -1178,12 +1881,12 @@ class _GraphMetaAuth(MetaAuthorize):
         A list of all user ids for CKAN sysadmins in the database
         """
         result = []
-        for record in tx.run("MATCH (:role {id:'admin'})<-[:has_role]-(u:user) return u.id AS id"):
+        for record in tx.run(queries.READ_USERS_ADMINS):
             result.append(record['id'])
         return result
 
     @staticmethod
-    def __read_visible_fields(tx, dataset_id, user_id):
+    def __read_visible_fields(tx, dataset_id, user_id, listed=False):
         """ 
         Returns a list of all fields in a dataset that are accessible for the provided user
 
@@ -1193,16 +1896,68 @@ class _GraphMetaAuth(MetaAuthorize):
             The id/uuid of the dataset to check visible fields for
         user_id : string
             The id/uuid of the user to check permissions for
+        listed : bool
+            Whether the visible elements are listed in a template property (TemplateMode.PROPERTY)
 
         Returns
         -------
         A list of element IDs that the user has access to
         """
         result = []
-        for record in tx.run("MATCH (u:user {id:'"+user_id+"'})-[:has_role]->(r:role)-[:uses_template]->(t:template)<-[:has_template]-(d:dataset {id:'"+dataset_id+"'}), (t)-[:can_see]->(e:element) return e.id AS id"):
+        for record in tx.run(queries.READ_VISIBLE_FIELDS_PROPERTY if listed else queries.READ_VISIBLE_FIELDS, dataset_id=dataset_id, user_id=user_id):
             result.append(record['id'])
         return result
 
+    @staticmethod
+    def __resolve_views(tx, dataset_ids, user_id, listed=False):
+        """ 
+        Runs a query collecting, for each dataset, its elements along with the templates and visible
+        elements of both the given user and the public user
+
+        Parameters
+        ----------
+        dataset_ids : list
+            The ids/uuids of the datasets to check
+        user_id : string
+            The id/uuid of the user to check access for
+        listed : bool
+            Whether the visible elements are listed in a template property (TemplateMode.PROPERTY)
+
+        Returns
+        -------
+        A dictionary of dataset ids to ViewDecisions, datasets that do not exist are left out
+        """
+        result = {}
+        records = tx.run(queries.RESOLVE_VIEWS_PROPERTY if listed else queries.RESOLVE_VIEWS, dataset_ids=dataset_ids, user_id=user_id)
+        for record in records:
+            result[record['id']] = _GraphMetaAuth.__view_decision(record)
+        return result
+
+    @staticmethod
+    def __view_decision(record):
+        """ 
+        Builds a ViewDecision from a record with elements, template names and visible element ids
+
+        Mirrors __is_unrestricted_for_user: a user without a template is unrestricted, otherwise
+            the first template found decides
+
+        Parameters
+        ----------
+        record : Record
+            A record with the elements, public_templates, user_templates, public_visible and visible keys
+
+        Returns
+        -------
+        A ViewDecision
+        """
+        fields = {name: id for name, id in record['elements']}
+        public_templates = record['public_templates']
+        user_templates = record['user_templates']
+        unrestricted = (not public_templates or public_templates[0] == 'Full') or (not user_templates or user_templates[0] == 'Full')
+        public_ids = set(record['public_visible'])
+        public_fields = [name for name, id in fields.items() if id in public_ids]
+        return ViewDecision.build(unrestricted, fields, record['visible'], public_fields)
+
     @staticmethod
     def __write_dataset(tx,id,dname=None):
         """ 
@@ -1219,14 +1974,241 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         None
         """
+        properties = {}
         if dname != None:
             # Create a safe dataset name if one is passed
-            # https://stackoverflow.com/questions/7406102/create-sane-safe-filename-from-any-unsafe-string
-            result = tx.run("CREATE (:dataset { id: '"+id+"', name:'"+"".join([c for c in dname if c.isalpha() or c.isdigit() or c==' ']).rstrip()+"'})")
-        else:
-            result = tx.run("CREATE (:dataset { id: '"+id+"'})")
+            properties['name'] = _safe_name(dname)
+        tx.run(queries.WRITE_DATASET, id=id, properties=properties)
         return
 
+    @staticmethod
+    def __provision_dataset(tx, dataset_id, owner_id, dname, harvest_id, descriptions, templates, shared=False, listed=False):
+        """
+        Creates a dataset if it does not exist, then its templates, elements and template access if it has no templates
+        Each step is a single query, batched with UNWIND
+
+        Parameters
+        ----------
+        See provision_dataset
+
+        Returns
+        -------
+        True if the templates were created, False if the dataset already had templates
+        """
+        properties, updates = _dataset_properties(dname, harvest_id)
+        record = tx.run(queries.PROVISION_DATASET, dataset_id=dataset_id, owner_id=owner_id, properties=properties, updates=updates).single()
+        if record['has_templates'] or not templates:
+            return False
+
+        template_rows, elements = _template_rows(templates, shared, listed)
+        tx.run(queries.PROVISION_TEMPLATES, dataset_id=dataset_id, properties=_description_properties(descriptions), templates=template_rows)
+        tx.run(queries.PROVISION_SHARED_ELEMENTS if shared else queries.PROVISION_ELEMENTS, elements=elements)
+        tx.run(queries.PROVISION_TEMPLATE_ACCESS, owner_id=owner_id, templates=template_rows)
+        return True
+
+    @staticmethod
+    def __provision_datasets(tx, datasets, shared=False, listed=False):
+        """
+        Creates the datasets that do not exist, then the templates, elements and template access of
+        those that have no templates. Each step is a single query over all the datasets
+
+        Parameters
+        ----------
+        datasets : list
+            Dictionaries of the provision_dataset arguments, with distinct dataset ids
+        shared : bool
+            Whether elements are shared between datasets (ElementMode.SHARED)
+        listed : bool
+            Whether the visible elements are listed in a template property (TemplateMode.PROPERTY)
+
+        Returns
+        -------
+        The ids of the datasets whose templates were created
+        """
+        rows = []
+        for dataset in datasets:
+            properties, updates = _dataset_properties(dataset.get('dname'), dataset.get('harvest_id'))
+            rows.append({'id': dataset['dataset_id'], 'owner_id': dataset['owner_id'], 'properties': properties, 'updates': updates})
+        existing = set(record['id'] for record in tx.run(queries.PROVISION_DATASETS, datasets=rows) if record['has_templates'])
+
+        dataset_rows = []
+        template_rows = []
+        elements = []
+        for dataset in datasets:
+            if dataset['dataset_id'] in existing or not dataset.get('templates'):
+                continue
+            dataset_templates, dataset_elements = _template_rows(dataset['templates'], shared, listed)
+            dataset_rows.append({'id': dataset['dataset_id'], 'properties': _description_properties(dataset.get('descriptions')), 'templates': dataset_templates})
+            template_rows += [dict(row, owner_id=dataset['owner_id']) for row in dataset_templates]
+            elements += dataset_elements
+        if not dataset_rows:
+            return []
+        tx.run(queries.PROVISION_DATASETS_TEMPLATES, datasets=dataset_rows)
+        tx.run(queries.PROVISION_SHARED_ELEMENTS if shared else queries.PROVISION_ELEMENTS, elements=elements)
+        tx.run(queries.PROVISION_DATASETS_TEMPLATE_ACCESS, templates=template_rows)
+        return [row['id'] for row in dataset_rows]
+
+    @staticmethod
+    def __read_dataset_element_names(tx):
+        """
+        Returns the distinct names of the elements that are not shared
+
+        Returns
+        -------
+        A list of element names
+        """
+        return [record['name'] for record in tx.run(queries.READ_DATASET_ELEMENT_NAMES)]
+
+    @staticmethod
+    def __write_shared_element(tx, name, id):
+        """
+        Creates the shared element for a field name, unless it exists
+
+        Parameters
+        ----------
+        name : string
+            The name of the field
+        id : string
+            The id of the shared element, from shared_element_id
+
+        Returns
+        -------
+        None
+        """
+        tx.run(queries.WRITE_SHARED_ELEMENT, id=id, properties=_element_properties(name, id, True))
+
+    @staticmethod
+    def __access_batch(tx, query, batch_size, **parameters):
+        """
+        Runs one batch of a bulk access change, see set_full_access_to_datasets
+
+        Parameters
+        ----------
+        query : string
+            FULL_ACCESS_BATCH or MINIMAL_ACCESS_BATCH
+        batch_size : int
+            The maximum number of templates or roles to update
+
+        Returns
+        -------
+        The number of templates or roles updated
+        """
+        return tx.run(query, batch_size=batch_size, **parameters).single()['updated']
+
+    @staticmethod
+    def __fold_elements(tx, name, id, batch_size):
+        """
+        Moves the template relationships of up to batch_size per dataset elements named name to the shared element, deleting them
+
+        Parameters
+        ----------
+        name : string
+            The name of the field
+        id : string
+            The id of the shared element
+        batch_size : int
+            The maximum number of elements to fold
+
+        Returns
+        -------
+        The number of elements folded
+        """
+        record = tx.run(queries.FOLD_ELEMENTS, name=name, id=id, batch_size=batch_size).single()
+        return record['folded'] if record != None else 0
+
+    @staticmethod
+    def __read_snapshot(tx, listed=False):
+        """
+        Runs the queries reading the access model, see export_snapshot
+
+        Parameters
+        ----------
+        listed : bool
+            Whether the visible elements are listed in a template property (TemplateMode.PROPERTY)
+
+        Returns
+        -------
+        The snapshot dictionary
+        """
+        snapshot = {'users': {}, 'profiles': {}, 'organizations': {}, 'roles': {}, 'datasets': {}}
+        for record in tx.run(queries.SNAPSHOT_USERS):
+            snapshot['users'][record['id']] = list(record['roles'])
+            snapshot['profiles'][record['id']] = {'username': record['username'], 'email': record['email'], 'gid': record['gid']}
+        for record in tx.run(queries.SNAPSHOT_ORGANIZATIONS):
+            snapshot['organizations'][record['id']] = record['name']
+        for record in tx.run(queries.SNAPSHOT_ROLES):
+            snapshot['roles'][record['id']] = {'name': record['name'], 'orgs': list(record['orgs'])}
+        for record in tx.run(queries.SNAPSHOT_DATASETS):
+            snapshot['datasets'][record['id']] = {
+                'name': record['name'],
+                'owner': record['owner'],
+                'harvest_source': record['harvest_source'],
+                'fields': {name: id for name, id in record['elements']},
+                'templates': {}
+            }
+        for record in tx.run(queries.SNAPSHOT_TEMPLATES_PROPERTY if listed else queries.SNAPSHOT_TEMPLATES):
+            dataset = snapshot['datasets'].get(record['dataset_id'])
+            if dataset != None:
+                dataset['templates'][record['id']] = {'name': record['name'], 'roles': list(record['roles']), 'visible': list(record['visible'])}
+        return snapshot
+
+    @staticmethod
+    def __read_fingerprints(tx):
+        """
+        Runs the queries reading the fingerprints, see get_fingerprints
+
+        Returns
+        -------
+        The fingerprints dictionary
+        """
+        fingerprints = {'users': set(), 'admins': set(), 'organizations': set(), 'org_members': set(), 'groups': set(), 'group_members': set(), 'datasets': set()}
+        for record in tx.run(queries.FINGERPRINT_USERS):
+            fingerprints['users'].add((record['id'], record['username'] or '', record['email'] or ''))
+            if record['admin']:
+                fingerprints['admins'].add(record['id'])
+        for record in tx.run(queries.FINGERPRINT_ORGANIZATIONS):
+            fingerprints['organizations'].add((record['id'], record['name'] or ''))
+            fingerprints['org_members'].update((record['id'], user_id) for user_id in record['members'])
+        for record in tx.run(queries.FINGERPRINT_GROUPS):
+            fingerprints['groups'].add(record['id'])
+            fingerprints['group_members'].update((record['id'], user_id) for user_id in record['members'])
+        for record in tx.run(queries.FINGERPRINT_DATASETS):
+            fingerprints['datasets'].add((record['id'], record['owner']))
+        return fingerprints
+
+    @staticmethod
+    def __run_batch(tx, query, parameter, batch):
+        """
+        Runs a query unwinding a batch of rows, see apply_deltas
+
+        Parameters
+        ----------
+        query : string
+            The query to run
+        parameter : string
+            The name of the list parameter of the query
+        batch : list
+            The rows
+        """
+        tx.run(query, **{parameter: batch})
+
+    @staticmethod
+    def __list_template_fields(tx, batch_size):
+        """
+        Sets the visible property of up to batch_size templates that do not have one from their can_see relationships
+
+        Parameters
+        ----------
+        batch_size : int
+            The maximum number of templates to update
+
+        Returns
+        -------
+        The number of templates updated
+        """
+        record = tx.run(queries.LIST_TEMPLATE_FIELDS, batch_size=batch_size).single()
+        return record['listed'] if record != None else 0
+
     @staticmethod
     def __write_group(tx, id):
         """ 
@@ -1241,11 +2223,11 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         None
         """
-        result = tx.run("CREATE (g:group {id:'"+id+"'})")
+        tx.run(queries.WRITE_GROUP, id=id)
         return
 
     @staticmethod
-    def __write_metadata_field(tx, name, id, template_id):
+    def __write_metadata_field(tx, name, id, template_id, shared=False, listed=False):
         """ 
         Creates a metadata field/element with the provided ID and name and attached to the template_id
         The template_id provided should be the full template id for the dataset, as it is required to
@@ -1260,15 +2242,22 @@ class _GraphMetaAuth(MetaAuthorize):
             The id/uuid of the newly created element
         template_id : string
             The id/uuid of the full template for the dataset that the element will be linked to
+        shared : bool
+            Whether the element is shared between datasets, in which case an existing element with the id is linked instead
+        listed : bool
+            Whether the visible elements are listed in a template property (TemplateMode.PROPERTY)
 
         Returns
         -------
         None
         """
-        if name in constants.MINIMUM_FIELDS:
-            result = tx.run("MATCH (t:template {id:'"+template_id+"'}) CREATE (t)-[:can_see]->(:element {name:'"+name+"',id:'"+id+"',required:true})")
+        properties = _element_properties(name, id, shared)
+        if shared:
+            tx.run(queries.WRITE_SHARED_METADATA_FIELD, id=id, template_id=template_id, properties=properties)
         else:
-            result = tx.run("MATCH (t:template {id:'"+template_id+"'}) CREATE (t)-[:can_see]->(:element {name:'"+name+"',id:'"+id+"'})")
+            tx.run(queries.WRITE_METADATA_FIELD, template_id=template_id, properties=properties)
+        if listed:
+            tx.run(queries.ADD_TEMPLATE_FIELDS, template_id=template_id, element_ids=[id])
         return
 
     @staticmethod
@@ -1287,10 +2276,10 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         None
         """
+        properties = {}
         if org_name != None:
-            result = tx.run("CREATE (o:organization {id:'"+id+"', name:'"+str(org_name)+"'})")
-        else:
-            result = tx.run("CREATE (o:organization {id:'"+id+"'})")
+            properties['name'] = str(org_name)
+        tx.run(queries.WRITE_ORG, id=id, properties=properties)
         return
 
     @staticmethod
@@ -1310,13 +2299,13 @@ class _GraphMetaAuth(MetaAuthorize):
         If the role id already exists, return the role id
         If the role does not already exist, returns None
         """
-        records = tx.run("MATCH (r:role {id:'"+id+"'}) return r.id as id")
+        records = tx.run(queries.GET_ROLE, id=id)
         for record in records:
             return record['id']
-        if(name==None):
-            tx.run("CREATE (r:role {id:'"+id+"'})")
-        else:
-            tx.run("CREATE (r:role {id:'"+id+"', name:'"+ str(name) +"'})")
+        properties = {}
+        if(name!=None):
+            properties['name'] = str(name)
+        tx.run(queries.WRITE_ROLE, id=id, properties=properties)
         return None
 
     @staticmethod
@@ -1338,15 +2327,15 @@ class _GraphMetaAuth(MetaAuthorize):
         If the template id already exists, returns the template id
         If the template does not exist, returns None
         """
-        records = tx.run("MATCH (t:template {id:'"+id+"'}) return t.id AS id")
+        records = tx.run(queries.GET_TEMPLATE, id=id)
         for record in records:
             return record['id']
-        properties = ""
+        properties = {}
         if(name!=None):
-            properties+= ", name:'"+ str(name) +"'"
+            properties['name'] = str(name)
         if(description!=None):
-            properties+= ", description:'"+ str(description) +"'"
-        tx.run("CREATE (t:template {id:'"+id+ "'" + properties + "})")
+            properties['description'] = str(description)
+        tx.run(queries.WRITE_TEMPLATE, id=id, properties=properties)
         return None
 
     @staticmethod
@@ -1371,17 +2360,17 @@ class _GraphMetaAuth(MetaAuthorize):
         If the user id already exists, returns the template user
         If the user does not exist, returns None
         """
-        records = tx.run("MATCH (u:user {id:'"+id+"'}) return u.id AS id")
+        records = tx.run(queries.GET_USER, id=id)
         for record in records:
             return record['id']
-        extra_properties = ""
+        properties = {}
         if(username):
-            extra_properties += ", username: '" + username + "'"
+            properties['username'] = username
         if(email):
-            extra_properties += ", email: '" + email +"'"
+            properties['email'] = email
         if(gid):
-            extra_properties += ", gid: '" + gid + "'"
-        result = tx.run("CREATE (u:user {id:'"+id+"'" +extra_properties + "})")
+            properties['gid'] = gid
+        tx.run(queries.WRITE_USER, id=id, properties=properties)
         return
 
     #TODO Might be worth adding a check to see if the deletion objects actually delete/actually exist?
@@ -1401,7 +2390,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         None
         """
-        result = tx.run("MATCH (d:dataset {id: '"+id+"'})-[:has_template]->(t:template)-[:can_see]->(e:element) detach delete d,t,e")
+        tx.run(queries.DELETE_DATASET, id=id)
         return
         
     
@@ -1421,7 +2410,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         None
         """
-        result = tx.run("MATCH (o:organization {id: '"+id+"'}) detach delete o")
+        tx.run(queries.DELETE_ORGANIZATION, id=id)
         return
 
     @staticmethod
@@ -1439,7 +2428,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         None
         """
-        result = tx.run("MATCH (u:user {id: '"+id+"'}) detach delete u")
+        tx.run(queries.DELETE_USER, id=id)
         return
 
     @staticmethod
@@ -1462,7 +2451,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         None
         """
-        result = tx.run("MATCH (d:dataset {id: '"+id+"'}) set d.description_"+language+"='"+"".join([c for c in description if c.isalpha() or c.isdigit() or c==' ']).rstrip()+"'")
+        tx.run(queries.SET_DATASET_PROPERTIES, id=id, properties={'description_' + language: _safe_name(description)})
         return
 
     @staticmethod
@@ -1482,7 +2471,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         None
         """
-        result = tx.run("MATCH (d:dataset {id: '"+id+"'}) set d.name='"+"".join([c for c in name if c.isalpha() or c.isdigit() or c==' ']).rstrip()+"'")
+        tx.run(queries.SET_DATASET_PROPERTIES, id=id, properties={'name': _safe_name(name)})
         return
 
     @staticmethod
@@ -1502,7 +2491,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         None
         """
-        tx.run("MATCH (d:dataset {id:'" + id + "'}) SET d.harvest_source ='" + harvest_id + "'")
+        tx.run(queries.SET_DATASET_PROPERTIES, id=id, properties={'harvest_source': harvest_id})
 
     @staticmethod
     def __set_user_gid(tx, id, gid):
@@ -1521,7 +2510,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         None
         """
-        tx.run("MATCH (u:user {id:'"+id+"'}) SET u.gid = '"+"".join([c for c in gid if c.isalpha() or c.isdigit() or c==' ']).rstrip()+"'")   
+        tx.run(queries.SET_USER_PROPERTIES, id=id, properties={'gid': _safe_name(gid)})   
 
     @staticmethod
     def __set_user_username(tx, id, username):
@@ -1540,7 +2529,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         None
         """
-        tx.run("MATCH (u:user {id:'"+id+"'}) SET u.username = '"+"".join([c for c in username if c.isalpha() or c.isdigit() or c==' ']).rstrip()+"'") 
+        tx.run(queries.SET_USER_PROPERTIES, id=id, properties={'username': _safe_name(username)}) 
 
     @staticmethod
     def __set_user_email(tx, id, email):
@@ -1559,7 +2548,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         None
         """
-        tx.run("MATCH (u:user {id:'"+id+"'}) SET u.email = '"+"".join([c for c in email if c.isalpha() or c.isdigit() or c==' ']).rstrip()+"'")   
+        tx.run(queries.SET_USER_PROPERTIES, id=id, properties={'email': _safe_name(email)})   
 
 
     @staticmethod
@@ -1574,11 +2563,11 @@ class _GraphMetaAuth(MetaAuthorize):
         name : string
             The value to set the 'name' field to
         """
-        records = tx.run("MATCH (o:organization {id:'"+id+"'}) set o.name ='"+"".join([c for c in name if c.isalpha() or c.isdigit() or c==' ']).rstrip()+"'")
+        tx.run(queries.SET_ORGANIZATION_NAME, id=id, name=_safe_name(name))
         return
 
     @staticmethod
-    def __bind_fields_to_template(tx, template_id, whitelist, overwrite = True):  
+    def __bind_fields_to_template(tx, template_id, whitelist, overwrite = True, listed = False):  
         """ 
         Sets a list of elements to a template's visibility permissions
         Deletes all prior visibility relationships the template has
@@ -1591,21 +2580,26 @@ class _GraphMetaAuth(MetaAuthorize):
             A dict of elements that will be visible to the template with the name as the key and id as the value
         overwrite : bool
             Whether to overwrite all existing visibility relationships or to append
+        listed : bool
+            Whether the visible elements are listed in a template property (TemplateMode.PROPERTY)
 
         Returns
         -------
         None
         """
+        if listed:
+            tx.run(queries.SET_TEMPLATE_FIELDS if overwrite else queries.ADD_TEMPLATE_FIELDS, template_id=template_id, element_ids=list(whitelist.values()))
+            return
         # First remove all existing 'can_see' relationships between the template, dataset and its elements
         if overwrite:
-            tx.run("MATCH (e:element)<-[c:can_see]-(t:template {id:'"+template_id+"'}) DELETE c")
+            tx.run(queries.DETACH_ALL_FIELDS_FROM_TEMPLATE, template_id=template_id)
         for name,id in whitelist.items():
             if not overwrite:
-                records = tx.run("MATCH (e:element {id:'"+id+"'})<-[c:can_see]-(t:template {id:'"+template_id+"'}) return c")
+                records = tx.run(queries.GET_TEMPLATE_FIELD, element_id=id, template_id=template_id)
                 exists = len(list(records))
                 if exists:
                     continue
-            result = tx.run("MATCH (e:element {id:'"+id+"'}), (t:template {id:'"+template_id+"'}) CREATE (t)-[:can_see]->(e)")
+            tx.run(queries.BIND_FIELD_TO_TEMPLATE, element_id=id, template_id=template_id)
         return
 
     @staticmethod
@@ -1628,12 +2622,12 @@ class _GraphMetaAuth(MetaAuthorize):
         Otherwise, returns None
         """
         # Checks to see if relationship already exists
-        records = tx.run("MATCH (o:organization {id:'"+org_id+"'})-[w:owns]->(d:dataset {id:'"+dataset_id+"'}) RETURN w")
+        records = tx.run(queries.GET_DATASET_ORG, org_id=org_id, dataset_id=dataset_id)
         for record in records:
             return record['id']
         # Checks if dataset already owned, if so clears existing edge and adds new one
-        tx.run("MATCH (d:dataset {id:'"+dataset_id+"'})<-[w:owns]-(o:organization) DELETE w")
-        result = tx.run("MATCH (o:organization {id:'"+org_id+"'}), (d:dataset {id:'"+dataset_id+"'}) CREATE (o)-[:owns]->(d)")
+        tx.run(queries.DETACH_DATASET_FROM_ORGS, dataset_id=dataset_id)
+        tx.run(queries.BIND_DATASET_TO_ORG, org_id=org_id, dataset_id=dataset_id)
         return
 
     @staticmethod
@@ -1652,7 +2646,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         None
         """
-        result = tx.run("MATCH (o:organization {id:'"+org_id+"'}), (r:role {id:'"+role_id+"'}) CREATE (o)-[:manages_role]->(r)")
+        tx.run(queries.BIND_ROLE_TO_ORG, role_id=role_id, org_id=org_id)
         return
 
     @staticmethod
@@ -1682,8 +2676,8 @@ class _GraphMetaAuth(MetaAuthorize):
         for record in records:
             return
         """
-        tx.run("MATCH (t:template {id:'"+template_id+"'})<-[:has_template]-(d:dataset), (r:role {id:'"+role_id+"'})-[u:uses_template]->(:template)<-[:has_template]-(d) DELETE u")
-        result = tx.run("MATCH (r:role {id:'"+role_id+"'}), (t:template {id:'"+template_id+"'}) CREATE (r)-[:uses_template]->(t)")
+        tx.run(queries.DETACH_ROLE_FROM_DATASET_TEMPLATES, role_id=role_id, template_id=template_id)
+        tx.run(queries.BIND_ROLE_TO_TEMPLATE, role_id=role_id, template_id=template_id)
         return
 
     @staticmethod
@@ -1704,11 +2698,11 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         None
         """
-        records = tx.run("MATCH (t:template {id:'"+template_id+"'})<-[h:has_template]-(d:dataset) RETURN h")
+        records = tx.run(queries.GET_TEMPLATE_OWNER, template_id=template_id)
         for record in records:
             return
-        tx.run("MATCH (t:template {id:'"+template_id+"'})<-[h:has_template]-(d:dataset {id:'"+dataset_id+"'}) DELETE h")
-        result = tx.run("MATCH (t:template {id:'"+template_id+"'}), (d:dataset {id:'"+dataset_id+"'}) CREATE (d)-[:has_template]->(t)")
+        tx.run(queries.DETACH_TEMPLATE_FROM_DATASET, template_id=template_id, dataset_id=dataset_id)
+        tx.run(queries.BIND_TEMPLATE_TO_DATASET, template_id=template_id, dataset_id=dataset_id)
         return    
 
     @staticmethod
@@ -1727,7 +2721,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         None
         """
-        result = tx.run("MATCH (g:group {id:'"+group_id+"'}), (u:user {id:'"+user_id+"'}) CREATE (g)-[:has_member]->(u)")
+        tx.run(queries.BIND_USER_TO_GROUP, group_id=group_id, user_id=user_id)
         return
 
     @staticmethod
@@ -1747,9 +2741,36 @@ class _GraphMetaAuth(MetaAuthorize):
         None
         """
         # Not used in CKAN, but needed for Vitality admin form permissions
-        tx.run("MATCH (u:user {id:'"+user_id+"'}), (o:organization {id:'"+org_id+"'}) CREATE (u)-[:serves]->(o)")
+        tx.run(queries.BIND_USER_TO_ORG, user_id=user_id, org_id=org_id)
         return
 
+    @staticmethod
+    def __seed_users(tx, users):
+        """
+        Runs a query adding a batch of users, their roles and gid
+
+        Parameters
+        ----------
+        users : list of dicts
+            The users, see add_users
+
+        Returns
+        -------
+        The number of users in the batch
+        """
+        rows = []
+        for user in users:
+            properties = {}
+            if user.get('username'):
+                properties['username'] = user['username']
+            if user.get('email'):
+                properties['email'] = user['email']
+            updates = {}
+            if user.get('gid') != None:
+                updates['gid'] = _safe_name(user['gid'])
+            rows.append({'id': user['id'], 'properties': properties, 'updates': updates, 'roles': list(user.get('roles', []))})
+        return tx.run(queries.SEED_USERS, users=rows).single()['seeded']
+
     @staticmethod
     def __bind_user_to_role(tx, user_id, role_id):
         """ 
@@ -1770,16 +2791,16 @@ class _GraphMetaAuth(MetaAuthorize):
         None
         """
         # Check if edge already exists
-        records = tx.run("MATCH (r:role {id:'"+role_id+"'})<-[h:has_role]-(u:user {id:'"+user_id+"'}) RETURN h")
+        records = tx.run(queries.HAS_ROLE, user_id=user_id, role_id=role_id)
         for record in records:
             return
         # Check to see if user is already given a role in the organization, and if so delete those edges
-        tx.run("MATCH (r:role {id:'"+role_id+"'})<-[:manages_role]-(o:organization), (u:user {id:'"+user_id+"'})-[h:has_role]->(:role)<-[:manages_role]-(o) DELETE h")
-        result = tx.run("MATCH (r:role {id:'"+role_id+"'}), (u:user {id:'"+user_id+"'}) CREATE (u)-[:has_role]->(r)")
+        tx.run(queries.DETACH_USER_FROM_ORG_ROLES, user_id=user_id, role_id=role_id)
+        tx.run(queries.BIND_USER_TO_ROLE, user_id=user_id, role_id=role_id)
         return
 
     @staticmethod
-    def __detach_fields_from_template(tx, template_id, element_id):  
+    def __detach_fields_from_template(tx, template_id, element_id, listed = False):  
         """ 
         Sets a list of elements to a template's visibility permissions
         Deletes all prior visibility relationships the template has
@@ -1790,16 +2811,21 @@ class _GraphMetaAuth(MetaAuthorize):
             The id/uuid of the template to set new visibility relationships for
         element_id : string
             The id/uuid of the element to detach from the template
+        listed : bool
+            Whether the visible elements are listed in a template property (TemplateMode.PROPERTY)
 
         Returns
         -------
         None
         """
+        if listed:
+            tx.run(queries.REMOVE_TEMPLATE_FIELD, template_id=template_id, element_id=element_id)
+            return
         # First remove all existing 'can_see' relationships between the template, dataset and its elements
-        records = tx.run("MATCH (e:element {id:'"+element_id+"'})<-[c:can_see]-(t:template {id:'"+template_id+"'}) return c")
+        records = tx.run(queries.GET_TEMPLATE_FIELD, element_id=element_id, template_id=template_id)
         exists = len(list(records))
         if exists:
-            result = tx.run("MATCH (e:element {id:'"+element_id+"'})<-[c:can_see]-(t:template {id:'"+template_id+"'}) delete c")
+            tx.run(queries.DETACH_FIELD_FROM_TEMPLATE, element_id=element_id, template_id=template_id)
         return
 
     @staticmethod
@@ -1818,7 +2844,7 @@ class _GraphMetaAuth(MetaAuthorize):
         -------
         None
         """
-        tx.run("MATCH (r:role {id:'"+role_id+"'})<-[h:has_role]-(u:user {id:'"+user_id+"'}) delete h")
+        tx.run(queries.DETACH_USER_FROM_ROLE, user_id=user_id, role_id=role_id)
         return
 
     @staticmethod
@@ -1838,12 +2864,55 @@ class _GraphMetaAuth(MetaAuthorize):
         True if user has access to the role, False if they do not
         """
         # Checks if user has a specific role
-        records = tx.run("MATCH (u:user {id:'"+user_id+"'})-[h:has_role]->(r:role {id:'"+role_id+"'}) RETURN h")
+        records = tx.run(queries.HAS_ROLE, user_id=user_id, role_id=role_id)
         for record in records:
             return True
         else:
             return False
 
+    @staticmethod
+    def __run_schema(tx, statement):
+        """
+        Runs a schema statement (CREATE CONSTRAINT/INDEX)
+
+        Parameters
+        ----------
+        statement : string
+            The statement to run
+
+        Returns
+        -------
+        None
+        """
+        tx.run(statement)
+
+    @staticmethod
+    def __read_schema(tx):
+        """
+        Runs queries listing the constraints and indexes of the database
+
+        Returns
+        -------
+        A dictionary of ('constraint' or 'index', label, property) to the state of the backing index,
+            only single label and single property entries are listed
+        """
+        unique = set()
+        for record in tx.run(queries.SHOW_CONSTRAINTS):
+            if record['type'] in ('UNIQUENESS', 'NODE_KEY'):
+                unique.add(record['name'])
+        result = {}
+        for record in tx.run(queries.SHOW_INDEXES):
+            labels = record['labelsOrTypes'] or []
+            properties = record['properties'] or []
+            if len(labels) != 1 or len(properties) != 1:
+                continue
+            if record['owningConstraint'] in unique:
+                result[('constraint', labels[0], properties[0])] = record['state']
+            # Indexes backing a constraint serve lookups just as well
+            if ('index', labels[0], properties[0]) not in result or record['owningConstraint'] == None:
+                result[('index', labels[0], properties[0])] = record['state']
+        return result
+
 if __name__ == "__main__":
     greeter = _GraphMetaAuth("bolt://localhost:7687", "neo4j", "password")
     greeter.print_greeting("hello, world")
@@ -0,0 +1,585 @@
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+from ckanext.vitality.meta_authorize import MetaAuthorize, ViewDecision
+from ckanext.vitality.impl.bitset_meta_auth import _bits
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'VITALITY'
+VERSION = 1
+# Index of a missing string, e.g. a dataset without a harvest source
+NONE = 0xFFFFFFFF
+
+# The sections of a snapshot file, in the order of the header
+STRINGS = 0 # u32 offsets into BLOB, one more than there are strings
+BLOB = 1 # utf-8 bytes of every distinct id and name
+DATASETS = 2 # _DATASET records sorted by id
+FIELDS = 3 # _FIELD records, contiguous per dataset
+TEMPLATES = 4 # _TEMPLATE records, contiguous per dataset in the order access is decided
+REFS = 5 # u32 string indexes of the roles of templates and users, and of the organizations of roles
+MASKS = 6 # Visible field bitmaps of templates, (field count + 7) // 8 bytes wide, bit i is field i of the dataset
+USERS = 7 # _USER records sorted by id
+ROLES = 8 # _ROLE records sorted by id
+ORGS = 9 # _ORG records sorted by id
+SECTIONS = 10
+
+# Magic, version, then the offset and length of each section
+_HEADER = struct.Struct('<8sI4x' + 'QQ' * SECTIONS)
+_U32 = struct.Struct('<I')
+# id, owner, harvest source, first field, field count, first template, template count
+_DATASET = struct.Struct('<7I')
+# name, element id
+_FIELD = struct.Struct('<2I')
+# id, name, dataset, mask offset, first role ref, role count
+_TEMPLATE = struct.Struct('<6I')
+# id, first role ref, role count
+_USER = struct.Struct('<3I')
+# id, name, first organization ref, organization count
+_ROLE = struct.Struct('<4I')
+# id, name
+_ORG = struct.Struct('<2I')
+
+
+def _pack(snapshot):
+    """
+    Packs a snapshot, as returned by _GraphMetaAuth.export_snapshot, into the bytes of a snapshot file
+    """
+    strings = {}
+    blob = bytearray()
+    offsets = [0]
+
+    def intern(value):
+        if value == None:
+            return NONE
+        index = strings.get(value)
+        if index == None:
+            blob.extend(value.encode('utf-8'))
+            offsets.append(len(blob))
+            index = strings[value] = len(strings)
+        return index
+
+    def key(item):
+        return item[0].encode('utf-8')
+
+    refs = []
+
+    def ref(values):
+        start = len(refs)
+        refs.extend(intern(value) for value in values)
+        return start, len(refs) - start
+
+    roles = {role_id: dict(entry) for role_id, entry in snapshot.get('roles', {}).items()}
+    orgs = dict(snapshot.get('organizations', {}))
+    datasets = bytearray()
+    fields = bytearray()
+    templates = bytearray()
+    masks = bytearray()
+    field_count = 0
+    template_count = 0
+    for index, (dataset_id, dataset) in enumerate(sorted(snapshot.get('datasets', {}).items(), key=key)):
+        names = list(dataset.get('fields', {}).items())
+        ordinals = {id: ordinal for ordinal, (name, id) in enumerate(names)}
+        width = (len(names) + 7) // 8
+        for name, id in names:
+            fields += _FIELD.pack(intern(name), intern(id))
+        dataset_templates = list(dataset.get('templates', {}).items())
+        for template_id, template in dataset_templates:
+            mask = 0
+            for id in template.get('visible', []):
+                if id in ordinals:
+                    mask |= 1 << ordinals[id]
+            for role_id in template.get('roles', []):
+                roles.setdefault(role_id, {'name': None, 'orgs': []})
+            templates += _TEMPLATE.pack(intern(template_id), intern(template.get('name')), index, len(masks), *ref(template.get('roles', [])))
+            masks += mask.to_bytes(width, 'little')
+        if dataset.get('owner') != None:
+            orgs.setdefault(dataset['owner'], None)
+        datasets += _DATASET.pack(intern(dataset_id), intern(dataset.get('owner')), intern(dataset.get('harvest_source')),
+            field_count, len(names), template_count, len(dataset_templates))
+        field_count += len(names)
+        template_count += len(dataset_templates)
+
+    users = bytearray()
+    for user_id, role_ids in sorted(snapshot.get('users', {}).items(), key=key):
+        for role_id in role_ids:
+            roles.setdefault(role_id, {'name': None, 'orgs': []})
+        users += _USER.pack(intern(user_id), *ref(role_ids))
+    role_records = bytearray()
+    for role_id, role in sorted(roles.items(), key=key):
+        for org_id in role.get('orgs', []):
+            orgs.setdefault(org_id, None)
+        role_records += _ROLE.pack(intern(role_id), intern(role.get('name')), *ref(role.get('orgs', [])))
+    org_records = bytearray()
+    for org_id, name in sorted(orgs.items(), key=key):
+        org_records += _ORG.pack(intern(org_id), intern(name))
+
+    sections = [
+        b''.join(_U32.pack(offset) for offset in offsets),
+        bytes(blob),
+        bytes(datasets),
+        bytes(fields),
+        bytes(templates),
+        b''.join(_U32.pack(index) for index in refs),
+        bytes(masks),
+        bytes(users),
+        bytes(role_records),
+        bytes(org_records)
+    ]
+    header = []
+    offset = _HEADER.size
+    for section in sections:
+        header += [offset, len(section)]
+        offset += len(section)
+    return _HEADER.pack(MAGIC, VERSION, *header) + b''.join(sections)
+
+
+def write_snapshot(snapshot, path):
+    """
+    Publishes a snapshot file, replacing the previous one atomically
+
+    The file is written next to path then renamed over it, readers holding the previous file
+    keep reading it until they notice the new one.
+
+    Parameters
+    ----------
+    snapshot : dict
+        A snapshot, as returned by _GraphMetaAuth.export_snapshot
+    path : string
+        The path of the snapshot file
+
+    Returns
+    -------
+    The number of datasets in the snapshot
+    """
+    data = _pack(snapshot)
+    fd, temp = tempfile.mkstemp(prefix=os.path.basename(path) + '.', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp, 0o644)
+        os.replace(temp, path)
+    except Exception:
+        os.unlink(temp)
+        raise
+    return len(snapshot.get('datasets', {}))
+
+
+class _SnapshotFile(object):
+    """
+    Read access to the records of a snapshot file, or of the bytes of one
+    """
+
+    def __init__(self, buffer, file_id=None):
+        self.buffer = buffer
+        self.file_id = file_id
+        header = _HEADER.unpack_from(buffer, 0)
+        if header[0] != MAGIC or header[1] != VERSION:
+            raise ValueError("Not a version %d vitality snapshot" % VERSION)
+        self.offsets = header[2::2]
+        self.lengths = header[3::2]
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            # The mapping stays valid once the file is closed, or replaced by a newer snapshot
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, (stat.st_dev, stat.st_ino))
+
+    def count(self, section, record):
+        return self.lengths[section] // record.size
+
+    def record(self, section, record, index):
+        return record.unpack_from(self.buffer, self.offsets[section] + index * record.size)
+
+    def ref(self, index):
+        return _U32.unpack_from(self.buffer, self.offsets[REFS] + index * 4)[0]
+
+    def refs(self, start, count):
+        return [self.ref(index) for index in range(start, start + count)]
+
+    def raw(self, index):
+        start, end = struct.unpack_from('<2I', self.buffer, self.offsets[STRINGS] + index * 4)
+        base = self.offsets[BLOB]
+        return self.buffer[base + start:base + end]
+
+    def string(self, index):
+        return None if index == NONE else self.raw(index).decode('utf-8')
+
+    def find(self, section, record, id):
+        """
+        Returns the record of a sorted section with the given id, None if there is none
+        """
+        if id == None:
+            return None
+        key = id.encode('utf-8')
+        low = 0
+        high = self.count(section, record)
+        while low < high:
+            middle = (low + high) // 2
+            found = self.record(section, record, middle)
+            raw = self.raw(found[0])
+            if raw == key:
+                return found
+            if raw < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def records(self, section, record):
+        return (self.record(section, record, index) for index in range(self.count(section, record)))
+
+    def mask(self, template, width):
+        start = self.offsets[MASKS] + template[3]
+        return int.from_bytes(self.buffer[start:start + width], 'little')
+
+
+_EMPTY = _SnapshotFile(_pack({}))
+
+
+class _MmapMetaAuth(MetaAuthorize):
+    """
+    A read only authorization model answering access checks from a memory mapped snapshot file
+
+    The snapshot is published by `ckan vitality publish-snapshot`, see write_snapshot for the format.
+    Every worker of a host maps the same file, so they share one copy in the page cache and start
+    without parsing it. When given a source model, writes and the calls this model does not answer
+    (e.g. get_user_by_username) are passed to the source, writes are only seen by the readers once
+    a new snapshot is published. Reads of the datasets, organizations and users the snapshot lacks,
+    e.g. created since it was published, are passed to the source too.
+
+    Parameters
+    ----------
+    path : string
+        The path of the snapshot file
+    source : MetaAuthorize
+        The model writes are made to
+    check_interval : float
+        Seconds between checks for a newly published snapshot, 0 to never check
+    """
+
+    def __init__(self, path, source=None, check_interval=1, clock=time.monotonic):
+        self.path = path
+        self.source = source
+        self.check_interval = check_interval
+        self.__clock = clock
+        self.__snapshot = _EMPTY
+        self.__checked_at = clock()
+        self.reload()
+
+    def __getattr__(self, name):
+        # Only called for attributes the mapped model does not have
+        source = self.__dict__.get('source')
+        if source == None or name.startswith('_'):
+            raise AttributeError("%s has no attribute %s" % (self.__class__.__name__, name))
+        return getattr(source, name)
+
+    def reload(self):
+        """
+        Maps the snapshot file if it was replaced since it was last mapped
+
+        Returns
+        -------
+        True if a new snapshot was mapped
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            if self.__snapshot is _EMPTY:
+                log.warning("No vitality snapshot at %s, run `ckan vitality publish-snapshot`", self.path)
+            return False
+        if (stat.st_dev, stat.st_ino) == self.__snapshot.file_id:
+            return False
+        # Readers holding the previous mapping finish with it, it is unmapped once released
+        self.__snapshot = _SnapshotFile.open(self.path)
+        log.info("Mapped the vitality snapshot %s, %d datasets", self.path, self.__snapshot.count(DATASETS, _DATASET))
+        return True
+
+    def __current(self):
+        """
+        Returns the mapped snapshot, checking for a newer one every check_interval seconds
+        """
+        if self.check_interval and self.__clock() - self.__checked_at > self.check_interval:
+            self.__checked_at = self.__clock()
+            self.reload()
+        return self.__snapshot
+
+    @staticmethod
+    def __fields(snapshot, dataset):
+        """
+        Returns a list of the (name, element id) pairs of a dataset's fields, in bit order
+        """
+        return [(snapshot.string(name), snapshot.string(id)) for name, id in
+            (snapshot.record(FIELDS, _FIELD, index) for index in range(dataset[3], dataset[3] + dataset[4]))]
+
+    @staticmethod
+    def __templates(snapshot, dataset):
+        return [snapshot.record(TEMPLATES, _TEMPLATE, index) for index in range(dataset[5], dataset[5] + dataset[6])]
+
+    @staticmethod
+    def __user_roles(snapshot, user_id):
+        user = snapshot.find(USERS, _USER, user_id)
+        return set(snapshot.refs(user[1], user[2])) if user != None else set()
+
+    @staticmethod
+    def __user_templates(snapshot, dataset, roles):
+        """
+        Returns the templates of the dataset used by one of the roles, given as string indexes
+        """
+        if not roles:
+            return []
+        return [template for template in _MmapMetaAuth.__templates(snapshot, dataset) if not roles.isdisjoint(snapshot.refs(template[4], template[5]))]
+
+    @staticmethod
+    def __unrestricted(snapshot, templates):
+        # Mirrors _GraphMetaAuth: a user without a template is unrestricted, otherwise the first template decides
+        return not templates or snapshot.string(templates[0][1]) == 'Full'
+
+    @staticmethod
+    def __visible(snapshot, dataset, templates):
+        """
+        Returns the indexes of the dataset's fields visible to one of the templates
+        """
+        width = (dataset[4] + 7) // 8
+        mask = 0
+        for template in templates:
+            mask |= snapshot.mask(template, width)
+        return list(_bits(mask))
+
+    def __source(self, name):
+        """
+        Returns the source model, for the methods MetaAuthorize defines that would otherwise not reach it
+        """
+        if self.source == None:
+            raise NotImplementedError("Class %s doesn't implement %s without a source" % (self.__class__.__name__, name))
+        return self.source
+
+    def __missing(self, name, default, *args):
+        """
+        Answers a read about an id the snapshot lacks from the source, default without a source
+        """
+        if self.source == None:
+            return default
+        return getattr(self.source, name)(*args)
+
+    @staticmethod
+    def __has_user(snapshot, user_id):
+        return snapshot.find(USERS, _USER, user_id) != None
+
+    def add_dataset(self, dataset_id, owner_id, dname=None):
+        return self.__source('add_dataset').add_dataset(dataset_id, owner_id, dname)
+
+    def add_group(self, group_id, users):
+        return self.__source('add_group').add_group(group_id, users)
+
+    def add_metadata_fields(self, dataset_id, fields, template_id):
+        return self.__source('add_metadata_fields').add_metadata_fields(dataset_id, fields, template_id)
+
+    def add_org(self, org_id, users, org_name=None):
+        return self.__source('add_org').add_org(org_id, users, org_name)
+
+    def add_user(self, user_id, user_name=None, user_email=None, gid=None):
+        return self.__source('add_user').add_user(user_id, user_name, user_email, gid)
+
+    def get_groups(self):
+        return self.__source('get_groups').get_groups()
+
+    def get_fingerprints(self):
+        return self.__source('get_fingerprints').get_fingerprints()
+
+    def apply_deltas(self, deltas, batch_size=1000, progress=None):
+        return self.__source('apply_deltas').apply_deltas(deltas, batch_size, progress)
+
+    def provision_dataset(self, dataset_id, owner_id, dname=None, harvest_id=None, descriptions=None, templates=None):
+        return self.__source('provision_dataset').provision_dataset(dataset_id, owner_id, dname, harvest_id, descriptions, templates)
+
+    def provision_datasets(self, datasets):
+        return self.__source('provision_datasets').provision_datasets(datasets)
+
+    def set_visible_fields(self, template_id, whitelist):
+        return self.__source('set_visible_fields').set_visible_fields(template_id, whitelist)
+
+    def get_admins(self):
+        """
+        Returns a list of the ids of the users with the admin role
+        """
+        snapshot = self.__current()
+        admin = snapshot.find(ROLES, _ROLE, 'admin')
+        if admin == None:
+            return []
+        return [snapshot.string(user[0]) for user in snapshot.records(USERS, _USER) if admin[0] in snapshot.refs(user[1], user[2])]
+
+    def get_orgs(self):
+        """
+        Returns a list of organization ids
+        """
+        snapshot = self.__current()
+        return [snapshot.string(org[0]) for org in snapshot.records(ORGS, _ORG)]
+
+    def get_organization(self, organization_id):
+        """
+        Returns the id and name of an organization, None if it does not exist
+        """
+        snapshot = self.__current()
+        org = snapshot.find(ORGS, _ORG, organization_id)
+        if org == None:
+            return self.__missing('get_organization', None, organization_id)
+        return {'id': organization_id, 'name': snapshot.string(org[1])}
+
+    def get_dataset(self, dataset_id):
+        """
+        Returns the dataset id if the dataset exists and None if it does not
+        """
+        if self.__current().find(DATASETS, _DATASET, dataset_id) == None:
+            return self.__missing('get_dataset', None, dataset_id)
+        return dataset_id
+
+    def get_metadata_fields(self, dataset_id):
+        """
+        Returns a dictionary of the dataset's field names to their element ids
+        """
+        snapshot = self.__current()
+        dataset = snapshot.find(DATASETS, _DATASET, dataset_id)
+        if dataset == None:
+            return self.__missing('get_metadata_fields', {}, dataset_id)
+        return dict(self.__fields(snapshot, dataset))
+
+    def get_public_fields(self, dataset_id):
+        """
+        Returns the names of the dataset's fields visible to the public
+        """
+        snapshot = self.__current()
+        dataset = snapshot.find(DATASETS, _DATASET, dataset_id)
+        if dataset == None:
+            return self.__missing('get_public_fields', [], dataset_id)
+        fields = self.__fields(snapshot, dataset)
+        templates = self.__user_templates(snapshot, dataset, self.__user_roles(snapshot, 'public'))
+        return [fields[index][0] for index in self.__visible(snapshot, dataset, templates)]
+
+    def get_roles(self, org_id=None):
+        """
+        Returns a dictionary of role names to ids, of the roles managed by an organization if one is given
+        """
+        snapshot = self.__current()
+        org = snapshot.find(ORGS, _ORG, org_id)
+        if org_id != None and org == None:
+            return self.__missing('get_roles', {}, org_id)
+        return {snapshot.string(role[1]): snapshot.string(role[0]) for role in snapshot.records(ROLES, _ROLE)
+            if org == None or org[0] in snapshot.refs(role[2], role[3])}
+
+    def get_templates(self, dataset_id):
+        """
+        Returns a dictionary of the dataset's template names to their ids
+        """
+        snapshot = self.__current()
+        dataset = snapshot.find(DATASETS, _DATASET, dataset_id)
+        if dataset == None:
+            return self.__missing('get_templates', {}, dataset_id)
+        return {snapshot.string(template[1]): snapshot.string(template[0]) for template in self.__templates(snapshot, dataset)}
+
+    def get_template_access_for_role(self, dataset_id, role_id):
+        """
+        Returns the name of the dataset's template used by a role, None if it uses none
+        """
+        snapshot = self.__current()
+        dataset = snapshot.find(DATASETS, _DATASET, dataset_id)
+        role = snapshot.find(ROLES, _ROLE, role_id)
+        if dataset == None or role == None:
+            return self.__missing('get_template_access_for_role', None, dataset_id, role_id)
+        templates = self.__user_templates(snapshot, dataset, set([role[0]]))
+        return snapshot.string(templates[0][1]) if templates else None
+
+    def get_template_access_for_user(self, dataset_id, user_id):
+        """
+        Returns the name of the dataset's template used by one of the user's roles, None if there is none
+        """
+        snapshot = self.__current()
+        dataset = snapshot.find(DATASETS, _DATASET, dataset_id)
+        if dataset == None or not self.__has_user(snapshot, user_id):
+            return self.__missing('get_template_access_for_user', None, dataset_id, user_id)
+        templates = self.__user_templates(snapshot, dataset, self.__user_roles(snapshot, user_id))
+        return snapshot.string(templates[0][1]) if templates else None
+
+    def get_users(self):
+        """
+        Returns a list of all user ids
+        """
+        snapshot = self.__current()
+        return [snapshot.string(user[0]) for user in snapshot.records(USERS, _USER)]
+
+    def get_visible_fields(self, dataset_id, user_id):
+        """
+        Returns the element ids of the dataset's fields visible to a user
+        """
+        snapshot = self.__current()
+        dataset = snapshot.find(DATASETS, _DATASET, dataset_id)
+        if dataset == None or not self.__has_user(snapshot, user_id):
+            return self.__missing('get_visible_fields', [], dataset_id, user_id)
+        fields = self.__fields(snapshot, dataset)
+        templates = self.__user_templates(snapshot, dataset, self.__user_roles(snapshot, user_id))
+        return [fields[index][1] for index in self.__visible(snapshot, dataset, templates)]
+
+    def is_unrestricted(self, dataset_id):
+        """
+        Checks if the public has 'Full' template access to a dataset
+        """
+        return self.is_unrestricted_for_user(dataset_id, 'public')
+
+    def is_unrestricted_for_user(self, dataset_id, user_id):
+        """
+        Checks if a user has 'Full' template access to a dataset
+        """
+        snapshot = self.__current()
+        dataset = snapshot.find(DATASETS, _DATASET, dataset_id)
+        if dataset == None or not self.__has_user(snapshot, user_id):
+            if self.source != None:
+                return self.source.is_unrestricted_for_user(dataset_id, user_id)
+        return self.__unrestricted(snapshot, self.__user_templates(snapshot, dataset, self.__user_roles(snapshot, user_id)) if dataset != None else [])
+
+    def resolve_view(self, dataset_id, user_id):
+        """
+        Resolves the access a user has to a dataset, None if the dataset does not exist
+        """
+        return self.resolve_views([dataset_id], user_id).get(dataset_id)
+
+    def resolve_views(self, dataset_ids, user_id):
+        """
+        Resolves the access a user has to several datasets
+
+        Returns
+        -------
+        A dictionary of dataset ids to ViewDecisions, datasets that do not exist are left out. The datasets
+        the snapshot lacks, or all of them for a user it lacks, are resolved by the source
+        """
+        snapshot = self.__current()
+        if self.source != None and not self.__has_user(snapshot, user_id):
+            return self.source.resolve_views(dataset_ids, user_id)
+        public_roles = self.__user_roles(snapshot, 'public')
+        user_roles = self.__user_roles(snapshot, user_id)
+        result = {}
+        missing = []
+        for dataset_id in dataset_ids:
+            dataset = snapshot.find(DATASETS, _DATASET, dataset_id)
+            if dataset == None:
+                missing.append(dataset_id)
+                continue
+            fields = self.__fields(snapshot, dataset)
+            public_templates = self.__user_templates(snapshot, dataset, public_roles)
+            user_templates = self.__user_templates(snapshot, dataset, user_roles)
+            result[dataset_id] = ViewDecision.build(
+                self.__unrestricted(snapshot, public_templates) or self.__unrestricted(snapshot, user_templates),
+                fields,
+                [fields[index][1] for index in self.__visible(snapshot, dataset, user_templates)],
+                [fields[index][0] for index in self.__visible(snapshot, dataset, public_templates)]
+            )
+        if missing and self.source != None:
+            result.update(self.source.resolve_views(missing, user_id))
+        return result
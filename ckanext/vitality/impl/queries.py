@@ -0,0 +1,528 @@
+"""
+Cypher queries run by _GraphMetaAuth.
+
+Every value is passed as a $parameter rather than inlined in the query text, so that each query
+has a single text Neo4j can plan once and serve from its query cache. Queries are named after the
+_GraphMetaAuth transaction function that runs them.
+"""
+
+# Reads
+
+GET_DATASET_OWNER = "MATCH (d:dataset {id:$id})<-[:owns]-(o:organization) RETURN o.id AS id"
+
+GET_DATASET = "MATCH (d:dataset {id:$id}) RETURN d.id AS id"
+
+GET_GROUP = "MATCH (g:group {id:$id}) RETURN g.id AS id"
+
+GET_ORG_BY_ID = "MATCH (o:organization {id:$id}) RETURN o.id AS id, o.name AS name"
+
+GET_ORG_BY_NAME = "MATCH (o:organization {name:$name}) RETURN o.id AS id, o.name AS name"
+
+GET_PRIVATE_DATASET = "MATCH (x:dataset {id:$id})<-[:has_public_dataset]-(y:dataset) RETURN y.id AS id, y.name AS name"
+
+GET_PUBLIC_DATASET = "MATCH (x:dataset {id:$id})-[:has_public_dataset]->(y:dataset) RETURN y.id AS id, y.name AS name"
+
+GET_TEMPLATE_DATASET = "MATCH (d:dataset)-[:has_template]->(t:template {id:$template_id}) RETURN d.id AS id"
+
+GET_TEMPLATE_NAME = "MATCH (t:template {id:$template_id}) RETURN t.name AS name"
+
+GET_TEMPLATE_ACCESS_FOR_ROLE = (
+    "MATCH (:dataset {id:$dataset_id})-[:has_template]->(t:template)<-[:uses_template]-(:role {id:$role_id}) "
+    "RETURN t.id AS id"
+)
+
+GET_TEMPLATE_ACCESS_FOR_USER = (
+    "MATCH (:dataset {id:$dataset_id})-[:has_template]->(t:template)<-[:uses_template]-(:role)<-[:has_role]-(:user {id:$user_id}) "
+    "RETURN t.id AS id"
+)
+
+GET_USER_BY_ID = "MATCH (u:user {id:$id}) RETURN u.id AS id, u.username AS username, u.email AS email"
+
+GET_USER_BY_USERNAME = "MATCH (u:user {username:$username}) RETURN u.id AS id, u.username AS username, u.email AS email"
+
+IS_UNRESTRICTED_FOR_USER = (
+    "MATCH (:dataset {id:$dataset_id})-[:has_template]->(t:template)<-[:uses_template]-(:role)<-[:has_role]-(:user {id:$user_id}) "
+    "RETURN t.name AS name"
+)
+
+READ_ELEMENTS = (
+    "MATCH (:dataset {id:$dataset_id})-[:has_template]->(:template)-[:can_see]->(e:element) "
+    "RETURN DISTINCT e.name AS name, e.id AS id"
+)
+
+READ_ROLES = "MATCH (r:role) RETURN r.name AS name, r.id AS id"
+
+READ_ROLES_FOR_ORG = "MATCH (r:role)<-[:manages_role]-(:organization {id:$org_id}) RETURN r.name AS name, r.id AS id"
+
+READ_TEMPLATES = "MATCH (t:template)<-[:has_template]-(:dataset {id:$dataset_id}) RETURN t.name AS name, t.id AS id"
+
+READ_ALL_TEMPLATES = "MATCH (t:template) RETURN t.id AS id"
+
+READ_ALL_TEMPLATES_BY_NAME = "MATCH (t:template {name:$name}) RETURN t.id AS id"
+
+# The datasets with templates, loaded into KnownDatasets
+READ_PROVISIONED_DATASETS = "MATCH (d:dataset) WHERE EXISTS { MATCH (d)-[:has_template]->(:template) } RETURN d.id AS id"
+
+READ_HARVEST_DATASETS = "MATCH (d:dataset {harvest_source:$harvest_id}) RETURN d.id AS id"
+
+READ_USERS = "MATCH (u:user) RETURN u.id AS id"
+
+READ_USERS_ADMINS = "MATCH (:role {id:'admin'})<-[:has_role]-(u:user) RETURN u.id AS id"
+
+READ_VISIBLE_FIELDS = (
+    "MATCH (:user {id:$user_id})-[:has_role]->(:role)-[:uses_template]->(t:template)<-[:has_template]-(:dataset {id:$dataset_id}), "
+    "(t)-[:can_see]->(e:element) "
+    "RETURN e.id AS id"
+)
+
+# TemplateMode.PROPERTY, the ids of the visible elements are listed in the template's visible property
+READ_VISIBLE_FIELDS_PROPERTY = (
+    "MATCH (:user {id:$user_id})-[:has_role]->(:role)-[:uses_template]->(t:template)<-[:has_template]-(:dataset {id:$dataset_id}) "
+    "UNWIND coalesce(t.visible, []) AS id "
+    "RETURN id"
+)
+
+_RESOLVE_VIEWS_TEMPLATES = (
+    "UNWIND $dataset_ids AS dataset_id "
+    "MATCH (d:dataset {id:dataset_id}) "
+    "WITH d, "
+    "[(d)-[:has_template]->(t:template)<-[:uses_template]-(:role)<-[:has_role]-(:user {id:'public'}) | t] AS public_templates, "
+    "[(d)-[:has_template]->(t:template)<-[:uses_template]-(:role)<-[:has_role]-(:user {id:$user_id}) | t] AS user_templates "
+    "RETURN d.id AS id, "
+    "[(d)-[:has_template]->(:template)-[:can_see]->(e:element) | [e.name, e.id]] AS elements, "
+    "[t IN public_templates | t.name] AS public_templates, "
+    "[t IN user_templates | t.name] AS user_templates, "
+)
+
+RESOLVE_VIEWS = _RESOLVE_VIEWS_TEMPLATES + (
+    "reduce(ids = [], t IN public_templates | ids + [(t)-[:can_see]->(e:element) | e.id]) AS public_visible, "
+    "reduce(ids = [], t IN user_templates | ids + [(t)-[:can_see]->(e:element) | e.id]) AS visible"
+)
+
+RESOLVE_VIEWS_PROPERTY = _RESOLVE_VIEWS_TEMPLATES + (
+    "reduce(ids = [], t IN public_templates | ids + coalesce(t.visible, [])) AS public_visible, "
+    "reduce(ids = [], t IN user_templates | ids + coalesce(t.visible, [])) AS visible"
+)
+
+HAS_ROLE = "MATCH (:user {id:$user_id})-[h:has_role]->(:role {id:$role_id}) RETURN h"
+
+# Writes, optional properties are passed as a $properties map
+
+WRITE_DATASET = "CREATE (d:dataset {id:$id}) SET d += $properties"
+
+WRITE_GROUP = "CREATE (:group {id:$id})"
+
+WRITE_METADATA_FIELD = "MATCH (t:template {id:$template_id}) CREATE (t)-[:can_see]->(e:element) SET e = $properties"
+
+WRITE_SHARED_METADATA_FIELD = (
+    "MATCH (t:template {id:$template_id}) "
+    "MERGE (e:element {id:$id}) "
+    "ON CREATE SET e = $properties "
+    "MERGE (t)-[:can_see]->(e)"
+)
+
+WRITE_ORG = "CREATE (o:organization {id:$id}) SET o += $properties"
+
+GET_ROLE = "MATCH (r:role {id:$id}) RETURN r.id AS id"
+
+WRITE_ROLE = "CREATE (r:role {id:$id}) SET r += $properties"
+
+GET_TEMPLATE = "MATCH (t:template {id:$id}) RETURN t.id AS id"
+
+WRITE_TEMPLATE = "CREATE (t:template {id:$id}) SET t += $properties"
+
+GET_USER = "MATCH (u:user {id:$id}) RETURN u.id AS id"
+
+WRITE_USER = "CREATE (u:user {id:$id}) SET u += $properties"
+
+# Shared elements (ElementMode.SHARED) are used by other datasets and are kept
+# The templates and elements are optional, with TemplateMode.PROPERTY a template may have no can_see edge
+DELETE_DATASET = (
+    "MATCH (d:dataset {id:$id}) "
+    "OPTIONAL MATCH (d)-[:has_template]->(t:template) "
+    "OPTIONAL MATCH (t)-[:can_see]->(e:element) WHERE e.shared IS NULL "
+    "DETACH DELETE d, t, e"
+)
+
+DELETE_ORGANIZATION = "MATCH (o:organization {id:$id}) DETACH DELETE o"
+
+DELETE_USER = "MATCH (u:user {id:$id}) DETACH DELETE u"
+
+# Property names cannot be parameters, the language specific description is set through a map
+SET_DATASET_PROPERTIES = "MATCH (d:dataset {id:$id}) SET d += $properties"
+
+SET_USER_PROPERTIES = "MATCH (u:user {id:$id}) SET u += $properties"
+
+SET_ORGANIZATION_NAME = "MATCH (o:organization {id:$id}) SET o.name = $name"
+
+# Relationships
+
+DETACH_ALL_FIELDS_FROM_TEMPLATE = "MATCH (:element)<-[c:can_see]-(:template {id:$template_id}) DELETE c"
+
+GET_TEMPLATE_FIELD = "MATCH (:element {id:$element_id})<-[c:can_see]-(:template {id:$template_id}) RETURN c"
+
+BIND_FIELD_TO_TEMPLATE = "MATCH (e:element {id:$element_id}), (t:template {id:$template_id}) CREATE (t)-[:can_see]->(e)"
+
+DETACH_FIELD_FROM_TEMPLATE = "MATCH (:element {id:$element_id})<-[c:can_see]-(:template {id:$template_id}) DELETE c"
+
+# TemplateMode.PROPERTY, elements stay linked to the template that created them so that they belong to the dataset
+
+SET_TEMPLATE_FIELDS = "MATCH (t:template {id:$template_id}) SET t.visible = $element_ids"
+
+ADD_TEMPLATE_FIELDS = (
+    "MATCH (t:template {id:$template_id}) "
+    "SET t.visible = coalesce(t.visible, []) + [id IN $element_ids WHERE NOT id IN coalesce(t.visible, [])]"
+)
+
+REMOVE_TEMPLATE_FIELD = "MATCH (t:template {id:$template_id}) SET t.visible = [id IN coalesce(t.visible, []) WHERE id <> $element_id]"
+
+GET_DATASET_ORG = "MATCH (:organization {id:$org_id})-[w:owns]->(:dataset {id:$dataset_id}) RETURN id(w) AS id"
+
+DETACH_DATASET_FROM_ORGS = "MATCH (:dataset {id:$dataset_id})<-[w:owns]-(:organization) DELETE w"
+
+BIND_DATASET_TO_ORG = "MATCH (o:organization {id:$org_id}), (d:dataset {id:$dataset_id}) CREATE (o)-[:owns]->(d)"
+
+BIND_ROLE_TO_ORG = "MATCH (o:organization {id:$org_id}), (r:role {id:$role_id}) CREATE (o)-[:manages_role]->(r)"
+
+DETACH_ROLE_FROM_DATASET_TEMPLATES = (
+    "MATCH (:template {id:$template_id})<-[:has_template]-(d:dataset), "
+    "(:role {id:$role_id})-[u:uses_template]->(:template)<-[:has_template]-(d) "
+    "DELETE u"
+)
+
+BIND_ROLE_TO_TEMPLATE = "MATCH (r:role {id:$role_id}), (t:template {id:$template_id}) CREATE (r)-[:uses_template]->(t)"
+
+GET_TEMPLATE_OWNER = "MATCH (:template {id:$template_id})<-[h:has_template]-(:dataset) RETURN h"
+
+DETACH_TEMPLATE_FROM_DATASET = "MATCH (:template {id:$template_id})<-[h:has_template]-(:dataset {id:$dataset_id}) DELETE h"
+
+BIND_TEMPLATE_TO_DATASET = "MATCH (t:template {id:$template_id}), (d:dataset {id:$dataset_id}) CREATE (d)-[:has_template]->(t)"
+
+BIND_USER_TO_GROUP = "MATCH (g:group {id:$group_id}), (u:user {id:$user_id}) CREATE (g)-[:has_member]->(u)"
+
+BIND_USER_TO_ORG = "MATCH (u:user {id:$user_id}), (o:organization {id:$org_id}) CREATE (u)-[:serves]->(o)"
+
+DETACH_USER_FROM_ORG_ROLES = (
+    "MATCH (:role {id:$role_id})<-[:manages_role]-(o:organization), "
+    "(:user {id:$user_id})-[h:has_role]->(:role)<-[:manages_role]-(o) "
+    "DELETE h"
+)
+
+BIND_USER_TO_ROLE = "MATCH (r:role {id:$role_id}), (u:user {id:$user_id}) CREATE (u)-[:has_role]->(r)"
+
+DETACH_USER_FROM_ROLE = "MATCH (:role {id:$role_id})<-[h:has_role]-(:user {id:$user_id}) DELETE h"
+
+# Provisioning, run together in the single transaction of _GraphMetaAuth.provision_dataset
+# Existence checks use EXISTS { MATCH ... }, which Neo4j 4.4 only allows in WHERE, so values returned use a
+#   pattern comprehension rather than the deprecated exists(pattern)
+
+PROVISION_DATASET = (
+    "MERGE (d:dataset {id:$dataset_id}) "
+    "ON CREATE SET d += $properties "
+    "SET d += $updates "
+    "WITH d "
+    "CALL { "
+    "WITH d "
+    "MATCH (o:organization {id:$owner_id}) "
+    "WHERE NOT EXISTS { MATCH (d)<-[:owns]-(:organization) } "
+    "CREATE (o)-[:owns]->(d) "
+    "} "
+    "RETURN size([(d)-[:has_template]->(t:template) | t.id]) > 0 AS has_templates"
+)
+
+PROVISION_TEMPLATES = (
+    "MATCH (d:dataset {id:$dataset_id}) "
+    "SET d += $properties "
+    "WITH d "
+    "UNWIND $templates AS template "
+    "CREATE (d)-[:has_template]->(t:template {id:template.id}) "
+    "SET t += template.properties"
+)
+
+PROVISION_ELEMENTS = (
+    "UNWIND $elements AS element "
+    "CREATE (e:element) "
+    "SET e = element.properties "
+    "WITH e, element "
+    "UNWIND element.templates AS template_id "
+    "MATCH (t:template {id:template_id}) "
+    "CREATE (t)-[:can_see]->(e)"
+)
+
+PROVISION_SHARED_ELEMENTS = (
+    "UNWIND $elements AS element "
+    "MERGE (e:element {id:element.properties.id}) "
+    "ON CREATE SET e = element.properties "
+    "WITH e, element "
+    "UNWIND element.templates AS template_id "
+    "MATCH (t:template {id:template_id}) "
+    "MERGE (t)-[:can_see]->(e)"
+)
+
+PROVISION_TEMPLATE_ACCESS = (
+    "UNWIND $templates AS template "
+    "MATCH (t:template {id:template.id}) "
+    "OPTIONAL MATCH (:organization {id:$owner_id})-[:manages_role]->(org_role:role) WHERE template.org_roles "
+    "WITH t, template, collect(org_role.id) AS org_role_ids "
+    "UNWIND template.roles + org_role_ids AS role_id "
+    "MATCH (r:role {id:role_id}) "
+    "MERGE (r)-[:uses_template]->(t)"
+)
+
+# Bulk provisioning of several datasets in a single transaction, see _GraphMetaAuth.provision_datasets. Same as
+#   PROVISION_DATASET, PROVISION_TEMPLATES and PROVISION_TEMPLATE_ACCESS with a row per dataset, the elements
+#   of all datasets are created by PROVISION_ELEMENTS or PROVISION_SHARED_ELEMENTS
+
+PROVISION_DATASETS = (
+    "UNWIND $datasets AS dataset "
+    "MERGE (d:dataset {id:dataset.id}) "
+    "ON CREATE SET d += dataset.properties "
+    "SET d += dataset.updates "
+    "WITH d, dataset "
+    "CALL { "
+    "WITH d, dataset "
+    "MATCH (o:organization {id:dataset.owner_id}) "
+    "WHERE NOT EXISTS { MATCH (d)<-[:owns]-(:organization) } "
+    "CREATE (o)-[:owns]->(d) "
+    "} "
+    "RETURN dataset.id AS id, size([(d)-[:has_template]->(t:template) | t.id]) > 0 AS has_templates"
+)
+
+PROVISION_DATASETS_TEMPLATES = (
+    "UNWIND $datasets AS dataset "
+    "MATCH (d:dataset {id:dataset.id}) "
+    "SET d += dataset.properties "
+    "WITH d, dataset "
+    "UNWIND dataset.templates AS template "
+    "CREATE (d)-[:has_template]->(t:template {id:template.id}) "
+    "SET t += template.properties"
+)
+
+PROVISION_DATASETS_TEMPLATE_ACCESS = (
+    "UNWIND $templates AS template "
+    "MATCH (t:template {id:template.id}) "
+    "OPTIONAL MATCH (:organization {id:template.owner_id})-[:manages_role]->(org_role:role) WHERE template.org_roles "
+    "WITH t, template, collect(org_role.id) AS org_role_ids "
+    "UNWIND template.roles + org_role_ids AS role_id "
+    "MATCH (r:role {id:role_id}) "
+    "MERGE (r)-[:uses_template]->(t)"
+)
+
+# Bulk seeding, one transaction per batch of users, see _GraphMetaAuth.add_users. Mirrors add_user
+# (properties set on create only), set_user_role for roles not managed by an organization, and set_user_gid
+
+SEED_USERS = (
+    "UNWIND $users AS user "
+    "MERGE (u:user {id:user.id}) "
+    "ON CREATE SET u += user.properties "
+    "SET u += user.updates "
+    "WITH u, user "
+    "CALL { "
+    "WITH u, user "
+    "UNWIND user.roles AS role_id "
+    "MATCH (r:role {id:role_id}) "
+    "MERGE (u)-[:has_role]->(r) "
+    "RETURN count(r) AS roles "
+    "} "
+    "RETURN count(u) AS seeded"
+)
+
+# Reconciliation with CKAN, see _GraphMetaAuth.get_fingerprints and _GraphMetaAuth.apply_deltas
+
+FINGERPRINT_USERS = (
+    "MATCH (u:user) "
+    "RETURN u.id AS id, u.username AS username, u.email AS email, size([(u)-[:has_role]->(r:role {id:'admin'}) | r.id]) > 0 AS admin"
+)
+
+FINGERPRINT_ORGANIZATIONS = (
+    "MATCH (o:organization) "
+    "RETURN o.id AS id, o.name AS name, [(o)-[:manages_role]->(:role {name:'member'})<-[:has_role]-(u:user) | u.id] AS members"
+)
+
+FINGERPRINT_GROUPS = "MATCH (g:group) RETURN g.id AS id, [(g)-[:has_member]->(u:user) | u.id] AS members"
+
+FINGERPRINT_DATASETS = "MATCH (d:dataset) RETURN d.id AS id, head([(o:organization)-[:owns]->(d) | o.id]) AS owner"
+
+RECONCILE_DELETE_USERS = "UNWIND $ids AS id MATCH (u:user {id:id}) DETACH DELETE u"
+
+RECONCILE_UPDATE_USERS = "UNWIND $users AS user MATCH (u:user {id:user.id}) SET u.username = user.username, u.email = user.email"
+
+RECONCILE_BIND_ADMINS = "UNWIND $ids AS id MATCH (r:role {id:'admin'}), (u:user {id:id}) MERGE (u)-[:has_role]->(r)"
+
+RECONCILE_DETACH_ADMINS = "UNWIND $ids AS id MATCH (:role {id:'admin'})<-[h:has_role]-(:user {id:id}) DELETE h"
+
+RECONCILE_BIND_ORG_MEMBERS = (
+    "UNWIND $members AS member "
+    "MATCH (:organization {id:member.org_id})-[:manages_role]->(r:role {name:'member'}), (u:user {id:member.user_id}) "
+    "MERGE (u)-[:has_role]->(r)"
+)
+
+RECONCILE_DETACH_ORG_MEMBERS = (
+    "UNWIND $members AS member "
+    "MATCH (:organization {id:member.org_id})-[:manages_role]->(:role {name:'member'})<-[h:has_role]-(:user {id:member.user_id}) "
+    "DELETE h"
+)
+
+RECONCILE_DELETE_GROUPS = "UNWIND $ids AS id MATCH (g:group {id:id}) DETACH DELETE g"
+
+RECONCILE_BIND_GROUP_MEMBERS = (
+    "UNWIND $members AS member "
+    "MATCH (g:group {id:member.group_id}), (u:user {id:member.user_id}) "
+    "MERGE (g)-[:has_member]->(u)"
+)
+
+RECONCILE_DETACH_GROUP_MEMBERS = "UNWIND $members AS member MATCH (:group {id:member.group_id})-[h:has_member]->(:user {id:member.user_id}) DELETE h"
+
+# Same as DELETE_DATASET, also for datasets without templates
+RECONCILE_DELETE_DATASETS = (
+    "UNWIND $ids AS id "
+    "MATCH (d:dataset {id:id}) "
+    "OPTIONAL MATCH (d)-[:has_template]->(t:template) "
+    "OPTIONAL MATCH (t)-[:can_see]->(e:element) WHERE e.shared IS NULL "
+    "DETACH DELETE d, t, e"
+)
+
+# Deletion of the datasets of a harvest source, through the vitality_dataset_harvest_source index. Each query
+#   deletes at most $batch_size nodes and is run repeatedly until it deletes less, see _GraphMetaAuth.delete_harvest.
+#   The elements go first and the datasets last, so an interrupted run leaves no node out of reach of the next one
+
+DELETE_HARVEST_ELEMENTS = (
+    "MATCH (:dataset {harvest_source:$harvest_id})-[:has_template]->(:template)-[:can_see]->(e:element) "
+    "WHERE e.shared IS NULL "
+    "WITH DISTINCT e LIMIT $batch_size "
+    "DETACH DELETE e "
+    "RETURN count(e) AS deleted"
+)
+
+DELETE_HARVEST_TEMPLATES = (
+    "MATCH (:dataset {harvest_source:$harvest_id})-[:has_template]->(t:template) "
+    "WITH DISTINCT t LIMIT $batch_size "
+    "DETACH DELETE t "
+    "RETURN count(t) AS deleted"
+)
+
+DELETE_HARVEST_DATASETS = (
+    "MATCH (d:dataset {harvest_source:$harvest_id}) "
+    "WITH d, d.id AS id LIMIT $batch_size "
+    "DETACH DELETE d "
+    "RETURN collect(id) AS ids"
+)
+
+# Bulk access changes, each run repeatedly until it updates less than $batch_size templates or roles,
+#   see _GraphMetaAuth.set_full_access_to_datasets and _GraphMetaAuth.set_minimal_access_to_dataset
+
+FULL_ACCESS_BATCH = (
+    "MATCH (r:role {id:$role_id}) "
+    "MATCH (d:dataset)-[:has_template]->(t:template {name:'Full'}) WHERE NOT (r)-[:uses_template]->(t) "
+    "WITH r, d, t LIMIT $batch_size "
+    "OPTIONAL MATCH (r)-[u:uses_template]->(:template)<-[:has_template]-(d) "
+    "DELETE u "
+    "WITH DISTINCT r, t "
+    "CREATE (r)-[:uses_template]->(t) "
+    "RETURN count(t) AS updated"
+)
+
+MINIMAL_ACCESS_BATCH = (
+    "MATCH (d:dataset {id:$dataset_id})-[:has_template]->(m:template {name:'Minimal'}) "
+    "MATCH (r:role) WHERE r.id <> 'admin' AND NOT (r)-[:uses_template]->(m) "
+    "AND NOT (r)<-[:manages_role]-(:organization)-[:owns]->(d) "
+    "WITH d, m, r LIMIT $batch_size "
+    "OPTIONAL MATCH (r)-[u:uses_template]->(:template)<-[:has_template]-(d) "
+    "DELETE u "
+    "WITH DISTINCT m, r "
+    "CREATE (r)-[:uses_template]->(m) "
+    "RETURN count(r) AS updated"
+)
+
+# Migration from per dataset to shared elements, see _GraphMetaAuth.share_elements
+
+READ_DATASET_ELEMENT_NAMES = "MATCH (e:element) WHERE e.shared IS NULL RETURN DISTINCT e.name AS name"
+
+WRITE_SHARED_ELEMENT = "MERGE (e:element {id:$id}) ON CREATE SET e = $properties"
+
+FOLD_ELEMENTS = (
+    "MATCH (s:element {id:$id}) "
+    "MATCH (e:element {name:$name}) WHERE e.shared IS NULL "
+    "WITH s, e LIMIT $batch_size "
+    "CALL { "
+    "WITH s, e "
+    "MATCH (t:template)-[:can_see]->(e) "
+    "MERGE (t)-[:can_see]->(s) "
+    "RETURN count(t) AS templates "
+    "} "
+    # Templates listing the element (TemplateMode.PROPERTY) list the shared element instead
+    "CALL { "
+    "WITH s, e "
+    "MATCH (d:dataset)-[:has_template]->(:template)-[:can_see]->(e) "
+    "WITH DISTINCT s, e, d "
+    "MATCH (d)-[:has_template]->(t:template) WHERE e.id IN t.visible "
+    "SET t.visible = [id IN t.visible | CASE WHEN id = e.id THEN s.id ELSE id END] "
+    "RETURN count(t) AS listed "
+    "} "
+    "DETACH DELETE e "
+    "RETURN count(e) AS folded"
+)
+
+# Migration from visibility edges to the visible property, see _GraphMetaAuth.list_template_fields
+
+LIST_TEMPLATE_FIELDS = (
+    "MATCH (t:template) WHERE t.visible IS NULL "
+    "WITH t LIMIT $batch_size "
+    "SET t.visible = [(t)-[:can_see]->(e:element) | e.id] "
+    "RETURN count(t) AS listed"
+)
+
+# Snapshot of the access model, see _GraphMetaAuth.export_snapshot
+
+SNAPSHOT_USERS = (
+    "MATCH (u:user) "
+    "RETURN u.id AS id, u.username AS username, u.email AS email, u.gid AS gid, [(u)-[:has_role]->(r:role) | r.id] AS roles"
+)
+
+SNAPSHOT_ORGANIZATIONS = "MATCH (o:organization) RETURN o.id AS id, o.name AS name"
+
+SNAPSHOT_ROLES = "MATCH (r:role) RETURN r.id AS id, r.name AS name, [(o:organization)-[:manages_role]->(r) | o.id] AS orgs"
+
+SNAPSHOT_DATASETS = (
+    "MATCH (d:dataset) "
+    "RETURN d.id AS id, d.name AS name, d.harvest_source AS harvest_source, head([(o:organization)-[:owns]->(d) | o.id]) AS owner, "
+    "[(d)-[:has_template]->(:template)-[:can_see]->(e:element) | [e.name, e.id]] AS elements"
+)
+
+_SNAPSHOT_TEMPLATES = (
+    "MATCH (d:dataset)-[:has_template]->(t:template) "
+    "RETURN d.id AS dataset_id, t.id AS id, t.name AS name, [(r:role)-[:uses_template]->(t) | r.id] AS roles, "
+)
+
+SNAPSHOT_TEMPLATES = _SNAPSHOT_TEMPLATES + "[(t)-[:can_see]->(e:element) | e.id] AS visible"
+
+SNAPSHOT_TEMPLATES_PROPERTY = _SNAPSHOT_TEMPLATES + "coalesce(t.visible, []) AS visible"
+
+# Schema, created by `ckan vitality init-schema`. Labels and property names cannot be parameters,
+# the statements are formatted from the (name, label, property) entries below
+
+SCHEMA_CONSTRAINTS = [
+    ("vitality_dataset_id", "dataset", "id"),
+    ("vitality_element_id", "element", "id"),
+    ("vitality_group_id", "group", "id"),
+    ("vitality_organization_id", "organization", "id"),
+    ("vitality_role_id", "role", "id"),
+    ("vitality_template_id", "template", "id"),
+    ("vitality_user_id", "user", "id"),
+]
+
+SCHEMA_INDEXES = [
+    ("vitality_dataset_harvest_source", "dataset", "harvest_source"),
+    ("vitality_element_name", "element", "name"),
+    ("vitality_organization_name", "organization", "name"),
+    ("vitality_template_name", "template", "name"),
+    ("vitality_user_username", "user", "username"),
+]
+
+CREATE_UNIQUE_CONSTRAINT = "CREATE CONSTRAINT {name} IF NOT EXISTS FOR (n:{label}) REQUIRE n.{property} IS UNIQUE"
+
+CREATE_INDEX = "CREATE INDEX {name} IF NOT EXISTS FOR (n:{label}) ON (n.{property})"
+
+SHOW_CONSTRAINTS = "SHOW CONSTRAINTS YIELD name, type, labelsOrTypes, properties RETURN name, type, labelsOrTypes, properties"
+
+SHOW_INDEXES = "SHOW INDEXES YIELD name, type, state, labelsOrTypes, properties, owningConstraint RETURN name, type, state, labelsOrTypes, properties, owningConstraint"
@@ -1,118 +1,574 @@
+import fcntl
 import json
 import logging
 import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
 
+from ckanext.vitality.impl.bitset_meta_auth import _BitsetMetaAuth
 from ckanext.vitality.meta_authorize import MetaAuthorize
 
 log = logging.getLogger(__name__)
 
-class _SimpleMetaAuth(MetaAuthorize):
+SNAPSHOT_FILE = 'vitality_snapshot.json'
+JOURNAL_FILE = 'vitality_journal.jsonl'
+LOCK_FILE = 'vitality.lock'
 
-    '''
-    A dict of dataset ids and their fields
-    '''
-    __dataset_fields = {}
 
-    '''
-    A ledger of whitelists:
-        dataset_id -> user_id -> dict of visible fields
-    '''
-    __ledger = {}
+def _jsonable(value):
+    """
+    Converts the values json cannot serialize found in write arguments, e.g. the set of (name, uuid) tuples of add_metadata_fields
+    """
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError("Cannot journal a %s" % type(value).__name__)
 
 
-    '''
-    A list of all known user ids
-    '''
-    __users = []
+class _SimpleMetaAuth(_BitsetMetaAuth):
+    """
+    An embedded authorization model for single node installs and tests, no database required
 
-    '''
-    A list of all known group ids
-    '''
-    __groups = []
+    Held in memory as a _BitsetMetaAuth, along with the user, organization and group details it does not keep.
+    Every write is appended to a journal file then applied, and the journal is compacted into a snapshot file
+    every compact_every writes. On start the snapshot is loaded and the journal replayed on top of it.
 
-    '''
-    A list of all known org ids
-    '''
-    __orgs = []
+    Several processes can share the files: writes are serialized with a lock file, and each process replays
+    the entries written by the others before its next write, or on a read once poll_interval seconds passed.
 
-    '''
-    NOTE: Groups and Orgs don't do anything in Simple Meta Auth, they're not even persisted.
-    '''
+    Parameters
+    ----------
+    path : string
+        The directory holding the snapshot, journal and lock files
+    compact_every : int
+        The number of journal entries written before compacting, 0 to never compact
+    poll_interval : float
+        Seconds between checks for entries written by other processes, 0 to only check before writes
+    """
 
-    def add_group(self, group_id):
+    def __init__(self, path='.', compact_every=1000, poll_interval=1, clock=time.monotonic):
+        self.path = path
+        self.compact_every = compact_every
+        self.__journal_lock = threading.RLock()
+        # Sequence number of the last entry applied
+        self.__seq = 0
+        # Device and inode of the journal read so far, compaction replaces the file
+        self.__journal_id = None
+        self.__offset = 0
+        self.__entries = 0
+        _BitsetMetaAuth.__init__(self, max_age=poll_interval, clock=clock)
+        with self.__journal_lock:
+            self.__catch_up(reload=True)
+
+    def __file(self, name):
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def __locked(self):
+        """
+        Holds the journal lock of this process and the lock file shared with the other processes
+        """
+        with self.__journal_lock:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            with open(self.__file(LOCK_FILE), 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def load_snapshot(self, snapshot):
+        """
+        Replaces the model with the one of a snapshot, including the details of users, organizations,
+            groups and datasets the bitset model does not keep
+        """
+        self.__profiles = {user_id: dict(profile) for user_id, profile in snapshot.get('profiles', {}).items()}
+        self.__usernames = {profile.get('username'): user_id for user_id, profile in self.__profiles.items() if profile.get('username') != None}
+        self.__org_names = dict(snapshot.get('organizations', {}))
+        self.__groups = {group_id: set(user_ids) for group_id, user_ids in snapshot.get('groups', {}).items()}
+        self.__admin_forms = {user_id: set(org_ids) for user_id, org_ids in snapshot.get('admin_forms', {}).items()}
+        self.__dataset_names = {}
+        self.__descriptions = {}
+        for dataset_id, dataset in snapshot.get('datasets', {}).items():
+            if dataset.get('name') != None:
+                self.__dataset_names[dataset_id] = dataset['name']
+            if dataset.get('descriptions'):
+                self.__descriptions[dataset_id] = dict(dataset['descriptions'])
+        _BitsetMetaAuth.load_snapshot(self, snapshot)
+
+    def export_snapshot(self):
+        """
+        Returns a snapshot of the model, in the format of _GraphMetaAuth.export_snapshot with the
+            groups, admin form access and dataset descriptions added
+        """
+        snapshot = _BitsetMetaAuth.export_snapshot(self)
+        for dataset_id, dataset in snapshot['datasets'].items():
+            dataset['name'] = self.__dataset_names.get(dataset_id)
+            dataset['descriptions'] = dict(self.__descriptions.get(dataset_id, {}))
+        snapshot['profiles'] = {user_id: dict(profile) for user_id, profile in self.__profiles.items() if user_id in snapshot['users']}
+        snapshot['organizations'] = {org_id: self.__org_names.get(org_id) for org_id in snapshot['organizations']}
+        snapshot['groups'] = {group_id: sorted(user_ids) for group_id, user_ids in self.__groups.items()}
+        snapshot['admin_forms'] = {user_id: sorted(org_ids) for user_id, org_ids in self.__admin_forms.items() if user_id in snapshot['users']}
+        return snapshot
+
+    def refresh(self):
+        """
+        Applies the journal entries written by other processes
+        """
+        with self.__journal_lock:
+            self.__catch_up()
+
+    def __catch_up(self, reload=False):
+        """
+        Applies the journal entries not applied yet, reloading the snapshot first if another process compacted the journal
+        """
+        try:
+            journal = open(self.__file(JOURNAL_FILE), 'rb')
+        except (IOError, OSError):
+            journal = None
+        try:
+            stat = os.fstat(journal.fileno()) if journal != None else None
+            journal_id = (stat.st_dev, stat.st_ino) if stat != None else None
+            if reload or journal_id != self.__journal_id:
+                self.__read_snapshot_file()
+                self.__journal_id = journal_id
+                self.__offset = 0
+                self.__entries = 0
+            if journal == None or stat.st_size == self.__offset:
+                return
+            journal.seek(self.__offset)
+            for line in journal:
+                # The last line may still be being written by another process
+                if not line.endswith(b'\n'):
+                    break
+                self.__offset += len(line)
+                self.__entries += 1
+                entry = json.loads(line.decode('utf-8'))
+                if entry['seq'] <= self.__seq:
+                    continue
+                self.__apply(entry['op'], entry['args'])
+                self.__seq = entry['seq']
+        finally:
+            if journal != None:
+                journal.close()
+
+    def __read_snapshot_file(self):
+        """
+        Loads the snapshot file, or an empty model if there is none
+        """
+        snapshot = {}
+        if os.path.exists(self.__file(SNAPSHOT_FILE)):
+            with open(self.__file(SNAPSHOT_FILE), 'r') as f:
+                snapshot = json.load(f)
+        self.load_snapshot(snapshot)
+        self.__seq = snapshot.get('seq', 0)
+
+    def __apply(self, op, args):
+        """
+        Applies a write to the model in memory
+        """
+        apply = getattr(self, '_apply_' + op, None)
+        if apply == None:
+            log.warning("Skipping unknown vitality journal entry %s", op)
+            return None
+        return apply(*args)
+
+    def __commit(self, op, *args):
+        """
+        Appends a write to the journal then applies it
+
+        Returns
+        -------
+        The result of the write
+        """
+        with self.__locked():
+            self.__catch_up()
+            line = json.dumps({'seq': self.__seq + 1, 'op': op, 'args': args}, default=_jsonable) + '\n'
+            with open(self.__file(JOURNAL_FILE), 'ab') as journal:
+                journal.write(line.encode('utf-8'))
+                journal.flush()
+                stat = os.fstat(journal.fileno())
+            # Nothing else was appended since catching up, the lock file is held
+            self.__journal_id = (stat.st_dev, stat.st_ino)
+            self.__offset = stat.st_size
+            self.__entries += 1
+            self.__seq += 1
+            result = self.__apply(op, args)
+            if self.compact_every and self.__entries >= self.compact_every:
+                self.__compact()
+        return result
+
+    def compact(self):
+        """
+        Writes the model to the snapshot file and starts a new, empty, journal
+        """
+        with self.__locked():
+            self.__catch_up()
+            self.__compact()
+
+    def __compact(self):
+        snapshot = self.export_snapshot()
+        snapshot['seq'] = self.__seq
+        # The snapshot is replaced before the journal, a process reading in between skips the entries by seq
+        with open(self.__file(SNAPSHOT_FILE + '.tmp'), 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(self.__file(SNAPSHOT_FILE + '.tmp'), self.__file(SNAPSHOT_FILE))
+        open(self.__file(JOURNAL_FILE + '.tmp'), 'wb').close()
+        os.replace(self.__file(JOURNAL_FILE + '.tmp'), self.__file(JOURNAL_FILE))
+        stat = os.stat(self.__file(JOURNAL_FILE))
+        self.__journal_id = (stat.st_dev, stat.st_ino)
+        self.__offset = 0
+        self.__entries = 0
+        log.info("Compacted the vitality journal at seq %d", self.__seq)
+
+    # Writes, journaled then applied by the _apply_ method of the same name
+
+    def add_dataset(self, dataset_id, owner_id, dname=None):
+        self.__commit('add_dataset', dataset_id, owner_id, dname)
+
+    def _apply_add_dataset(self, dataset_id, owner_id, dname=None):
+        # Replayed writes do not call the public reads, they would replay the journal again
+        _BitsetMetaAuth.add_dataset(self, dataset_id, owner_id, dname)
+        if dname != None:
+            self.__dataset_names.setdefault(dataset_id, dname)
+
+    def add_group(self, group_id, users):
+        self.__commit('add_group', group_id, [{'id': user['id']} for user in users])
+
+    def _apply_add_group(self, group_id, users):
         if group_id not in self.__groups:
-            self.__groups.append(group_id)
+            self.__groups[group_id] = set(user['id'] for user in users)
+
+    def add_metadata_fields(self, dataset_id, fields, template_id):
+        return self.__commit('add_metadata_fields', dataset_id, fields, template_id)
+
+    _apply_add_metadata_fields = _BitsetMetaAuth.add_metadata_fields
+
+    def add_org(self, org_id, users, org_name=None):
+        self.__commit('add_org', org_id, [{'id': user['id']} for user in users], org_name)
+
+    def _apply_add_org(self, org_id, users, org_name=None):
+        _BitsetMetaAuth.add_org(self, org_id, users, org_name)
+        if self.__org_names.get(org_id) == None:
+            self.__org_names[org_id] = org_name
+
+    def add_role(self, id, name=None):
+        self.__commit('add_role', id, name)
+
+    _apply_add_role = _BitsetMetaAuth.add_role
+
+    def add_user(self, user_id, user_name=None, user_email=None, gid=None):
+        self.__commit('add_user', user_id, user_name, user_email, gid)
+
+    def _apply_add_user(self, user_id, user_name=None, user_email=None, gid=None):
+        if user_id in self.__profiles:
+            return
+        _BitsetMetaAuth.add_user(self, user_id)
+        self.__profiles[user_id] = {'username': user_name, 'email': user_email, 'gid': gid}
+        if user_name != None:
+            self.__usernames[user_name] = user_id
+
+    def add_template(self, dataset_id, template_id, template_name=None, template_description=None):
+        self.__commit('add_template', dataset_id, template_id, template_name, template_description)
+
+    _apply_add_template = _BitsetMetaAuth.add_template
+
+    def add_template_full(self, dataset_id, template_id, template_name, fields, template_description=None):
+        self.__commit('add_template_full', dataset_id, template_id, template_name, fields, template_description)
+
+    _apply_add_template_full = _BitsetMetaAuth.add_template_full
+
+    def provision_dataset(self, dataset_id, owner_id, dname=None, harvest_id=None, descriptions=None, templates=None):
+        return self.__commit('provision_dataset', dataset_id, owner_id, dname, harvest_id, descriptions, templates)
+
+    # Each dataset is journaled on its own
+    provision_datasets = MetaAuthorize.provision_datasets
+
+    def _apply_provision_dataset(self, dataset_id, owner_id, dname=None, harvest_id=None, descriptions=None, templates=None):
+        created = _BitsetMetaAuth.provision_dataset(self, dataset_id, owner_id, dname, harvest_id, descriptions, templates)
+        if dname != None:
+            self.__dataset_names.setdefault(dataset_id, dname)
+        if created and descriptions:
+            self.__descriptions.setdefault(dataset_id, {}).update(descriptions)
+        return created
+
+    def delete_dataset(self, dataset_id):
+        self.__commit('delete_dataset', dataset_id)
+
+    def _apply_delete_dataset(self, dataset_id):
+        _BitsetMetaAuth.delete_dataset(self, dataset_id)
+        self.__dataset_names.pop(dataset_id, None)
+        self.__descriptions.pop(dataset_id, None)
+
+    def delete_element_access_for_template(self, dataset_id, template_name, element_name):
+        self.__commit('delete_element_access_for_template', dataset_id, template_name, element_name)
+
+    _apply_delete_element_access_for_template = _BitsetMetaAuth.delete_element_access_for_template
+
+    def delete_harvest(self, harvest_id, batch_size=5000, progress=None):
+        self.__commit('delete_harvest', harvest_id)
+
+    _apply_delete_harvest = _BitsetMetaAuth.delete_harvest
+
+    def delete_organization(self, org_id):
+        self.__commit('delete_organization', org_id)
+
+    def _apply_delete_organization(self, org_id):
+        _BitsetMetaAuth.delete_organization(self, org_id)
+        self.__org_names.pop(org_id, None)
+        for org_ids in self.__admin_forms.values():
+            org_ids.discard(org_id)
+
+    def delete_user(self, user_id):
+        self.__commit('delete_user', user_id)
+
+    def _apply_delete_user(self, user_id):
+        _BitsetMetaAuth.delete_user(self, user_id)
+        profile = self.__profiles.pop(user_id, None)
+        if profile != None:
+            self.__usernames.pop(profile.get('username'), None)
+        self.__admin_forms.pop(user_id, None)
+        for user_ids in self.__groups.values():
+            user_ids.discard(user_id)
+
+    def detach_user_role(self, user_id, role_id):
+        self.__commit('detach_user_role', user_id, role_id)
+
+    _apply_detach_user_role = _BitsetMetaAuth.detach_user_role
+
+    def set_dataset_description(self, dataset_id, language, description):
+        self.__commit('set_dataset_description', dataset_id, language, description)
+
+    def _apply_set_dataset_description(self, dataset_id, language, description):
+        self.__descriptions.setdefault(dataset_id, {})[language] = description
+
+    def set_dataset_name(self, dataset_id, dataset_name):
+        self.__commit('set_dataset_name', dataset_id, dataset_name)
+
+    def _apply_set_dataset_name(self, dataset_id, dataset_name):
+        self.__dataset_names[dataset_id] = dataset_name
+
+    def set_dataset_harvest_id(self, dataset_id, harvest_id):
+        self.__commit('set_dataset_harvest_id', dataset_id, harvest_id)
+
+    _apply_set_dataset_harvest_id = _BitsetMetaAuth.set_dataset_harvest_id
+
+    def set_element_access_for_template(self, dataset_id, template_name, element_name):
+        self.__commit('set_element_access_for_template', dataset_id, template_name, element_name)
+
+    _apply_set_element_access_for_template = _BitsetMetaAuth.set_element_access_for_template
+
+    def set_template_access(self, role_id, template_id):
+        self.__commit('set_template_access', role_id, template_id)
+
+    _apply_set_template_access = _BitsetMetaAuth.set_template_access
+
+    def set_admin_form_access(self, user_id, org_id):
+        self.__commit('set_admin_form_access', user_id, org_id)
+
+    def _apply_set_admin_form_access(self, user_id, org_id):
+        self.__admin_forms.setdefault(user_id, set()).add(org_id)
+
+    def set_user_gid(self, id, gid):
+        self.__commit('set_user_gid', id, gid)
+
+    def _apply_set_user_gid(self, id, gid):
+        if id in self.__profiles:
+            self.__profiles[id]['gid'] = gid
+
+    def set_user_username(self, id, username):
+        self.__commit('set_user_username', id, username)
+
+    def _apply_set_user_username(self, id, username):
+        if id not in self.__profiles:
+            return
+        self.__usernames.pop(self.__profiles[id].get('username'), None)
+        self.__profiles[id]['username'] = username
+        self.__usernames[username] = id
+
+    def set_user_email(self, id, email):
+        self.__commit('set_user_email', id, email)
+
+    def _apply_set_user_email(self, id, email):
+        if id in self.__profiles:
+            self.__profiles[id]['email'] = email
+
+    def set_user_role(self, user_id, role_id):
+        self.__commit('set_user_role', user_id, role_id)
+
+    _apply_set_user_role = _BitsetMetaAuth.set_user_role
+
+    def set_visible_fields(self, template_id, whitelist):
+        self.__commit('set_visible_fields', template_id, whitelist)
+
+    _apply_set_visible_fields = _BitsetMetaAuth.set_visible_fields
+
+    def set_organization_name(self, org_id, org_name):
+        self.__commit('set_organization_name', org_id, org_name)
+
+    def _apply_set_organization_name(self, org_id, org_name):
+        if org_id in self.__org_names:
+            self.__org_names[org_id] = org_name
+
+    def set_full_access_to_datasets(self, role_id, batch_size=1000, progress=None):
+        self.__commit('set_full_access_to_datasets', role_id)
+
+    _apply_set_full_access_to_datasets = _BitsetMetaAuth.set_full_access_to_datasets
+
+    # Reads of the details the bitset model does not keep
+
+    def get_cache_stats(self):
+        """
+        There is no access cache, the model is held in memory
+        """
+        return None
 
     def get_groups(self):
-        return self.__groups
-
-    def add_org(self, org_id):
-        if org_id not in self.__orgs:
-            self.__orgs.append(org_id)
-    
-    def get_orgs(self):
-        return self.__orgs
-
-    def add_user(self, user_id):
-        log.info("Adding user " + str(user_id))
-        log.info("Authorization model has " + str(len(self.__users)) + " users")
-        if user_id not in self.__users:
-            self.__users.append(user_id)
-        self.__save()
-    
-    def get_users(self):
-        return self.__users
-
-    def get_metadata_fields(self, dataset_id):
-        log.info("dataset roster size: " + str(len(self.__dataset_fields)))
-        log.info("ledger size: " + str(len(self.__ledger)))
-
-        return self.__dataset_fields[dataset_id]
-
-    def get_visible_fields(self, dataset_id, user_id):
-        return self.__ledger[dataset_id][user_id].values()
-
-    def add_dataset(self, dataset_id, fields):
-        log.info("Adding dataset " + dataset_id + " with "+ str(len(fields)) +" fields to authorization model")
-        self.__dataset_fields[dataset_id] = fields
-        self.__save()
-
-    def set_visible_fields(self, dataset_id, user_id, whitelist):
-        # Create the dataset entry if it does not exist
-        if dataset_id  not in self.__ledger:
-            self.__ledger[dataset_id] = {}
-        self.__ledger[dataset_id][user_id] = whitelist
-        self.__save()
-
-    def __save(self):
-        f_dataset = open("simple_auth_model_datasets.json","wb")
-        json.dump(self.__dataset_fields, f_dataset)
-        f_dataset.flush()
-        f_dataset.close()
-
-        f_ledger = open("simple_auth_model_ledger.json", "wb")
-        json.dump(self.__ledger, f_ledger)
-        f_ledger.flush()
-        f_ledger.close()
-
-        f_users = open("simple_auth_model_users.json", "wb")
-        json.dump(self.__users,f_users)
-        f_users.flush()
-        f_users.close()
-
-    def __load(self):
-
-        if os.path.exists("simple_auth_model_datasets.json"):
-            f_dataset = open("simple_auth_model_datasets.json","rb")
-            self.__dataset_fields = json.load(f_dataset)
-            f_dataset.close()
-
-        if os.path.exists("simple_auth_model_ledger.json"):
-            f_ledger = open("simple_auth_model_ledger.json", "rb")
-            self.__ledger = json.load(f_ledger)
-            f_ledger.close()
-
-        if os.path.exists("simple_auth_model_users.json"):
-            f_users = open("simple_auth_model_users.json", "rb")
-            self.__users = json.load(f_users)
-            f_users.close()
\ No newline at end of file
+        """
+        Returns a list of group ids
+        """
+        return list(self.__groups)
+
+    def get_organization(self, organization_id):
+        """
+        Returns the id and name of an organization, None if it does not exist
+        """
+        if organization_id not in self.get_orgs():
+            return None
+        return {'id': organization_id, 'name': self.__org_names.get(organization_id)}
+
+    def get_private_dataset(self, dataset_id):
+        """
+        Related public and private datasets are not tracked by this model
+        """
+        return None
+
+    def get_public_dataset(self, dataset_id):
+        """
+        Related public and private datasets are not tracked by this model
+        """
+        return None
+
+    def get_user(self, id):
+        """
+        Returns the id, username and email of a user, None if the user does not exist
+        """
+        profile = self.__profiles.get(id)
+        if profile == None:
+            return None
+        return {'id': id, 'username': profile.get('username'), 'email': profile.get('email')}
+
+    def get_user_by_username(self, username):
+        """
+        Returns the id, username and email of a user, None if the user does not exist
+        """
+        user_id = self.__usernames.get(username)
+        return self.get_user(user_id) if user_id != None else None
+
+    # Reconciliation with CKAN, see `ckan vitality reconcile`
+
+    def get_fingerprints(self):
+        """
+        Reads the fingerprints of the users, organizations, groups, memberships and datasets held in memory
+
+        Returns
+        -------
+        A dictionary of sets, see MetaAuthorize.get_fingerprints
+        """
+        self.refresh()
+        with self.__journal_lock:
+            snapshot = self.export_snapshot()
+        fingerprints = {'users': set(), 'admins': set(), 'organizations': set(), 'org_members': set(), 'groups': set(), 'group_members': set(), 'datasets': set()}
+        for user_id, role_ids in snapshot['users'].items():
+            profile = snapshot['profiles'].get(user_id, {})
+            fingerprints['users'].add((user_id, profile.get('username') or '', profile.get('email') or ''))
+            if 'admin' in role_ids:
+                fingerprints['admins'].add(user_id)
+            for role_id in role_ids:
+                role = snapshot['roles'].get(role_id, {})
+                if role.get('name') == 'member':
+                    fingerprints['org_members'].update((org_id, user_id) for org_id in role.get('orgs', []))
+        fingerprints['organizations'] = set((org_id, name or '') for org_id, name in snapshot['organizations'].items())
+        fingerprints['groups'] = set(snapshot['groups'])
+        fingerprints['group_members'] = set((group_id, user_id) for group_id, user_ids in snapshot['groups'].items() for user_id in user_ids)
+        fingerprints['datasets'] = set((dataset_id, dataset['owner']) for dataset_id, dataset in snapshot['datasets'].items())
+        return fingerprints
+
+    def apply_deltas(self, deltas, batch_size=1000, progress=None):
+        """
+        Applies the changes computed by diff_fingerprints as a single journal entry, batch_size is not used
+
+        Parameters
+        ----------
+        deltas : dict
+            The changes, see diff_fingerprints. 'add_datasets' is ignored, the datasets are provisioned by seed-datasets
+        batch_size : int
+            Not used, the changes are applied in memory
+        progress : function
+            Called with the name of the change and the number of changes applied for each kind of change (optional)
+
+        Returns
+        -------
+        The number of changes applied
+        """
+        deltas = {name: changes for name, changes in deltas.items() if name != 'add_datasets'}
+        total = self.__commit('apply_deltas', deltas)
+        if progress != None:
+            for name, changes in deltas.items():
+                if changes:
+                    progress(name, len(changes))
+        return total
+
+    def _apply_apply_deltas(self, deltas):
+        # In the order of _GraphMetaAuth.apply_deltas, users first as the memberships refer to them
+        for user_id in deltas.get('delete_users', []):
+            self._apply_delete_user(user_id)
+        for user in deltas.get('add_users', []):
+            self._apply_add_user(user['id'], user.get('username'), user.get('email'), user.get('gid'))
+            if 'admin' in user.get('roles', []):
+                _BitsetMetaAuth.set_user_role(self, user['id'], 'admin')
+        for user in deltas.get('update_users', []):
+            self._apply_set_user_username(user['id'], user['username'])
+            self._apply_set_user_email(user['id'], user['email'])
+
+        admins = [user_id for user_id, role_ids in _BitsetMetaAuth.export_snapshot(self)['users'].items() if 'admin' in role_ids]
+        for org in deltas.get('add_orgs', []):
+            self._apply_add_org(org['id'], [], org['name'])
+            for admin in admins:
+                self._apply_set_admin_form_access(admin, org['id'])
+        for org in deltas.get('rename_orgs', []):
+            self._apply_set_organization_name(org['id'], org['name'])
+        for org_id in deltas.get('delete_orgs', []):
+            self._apply_delete_organization(org_id)
+        for group_id in deltas.get('add_groups', []):
+            self._apply_add_group(group_id, [])
+        for group_id in deltas.get('delete_groups', []):
+            self.__groups.pop(group_id, None)
+
+        for user_id in deltas.get('add_admins', []):
+            if user_id in self.__profiles:
+                _BitsetMetaAuth.set_user_role(self, user_id, 'admin')
+        for user_id in deltas.get('remove_admins', []):
+            _BitsetMetaAuth.detach_user_role(self, user_id, 'admin')
+        member_roles = {}
+        for role_id, role in _BitsetMetaAuth.export_snapshot(self)['roles'].items():
+            if role['name'] == 'member':
+                member_roles.update((org_id, role_id) for org_id in role['orgs'])
+        for org_id, user_id in deltas.get('add_org_members', []):
+            if org_id in member_roles and user_id in self.__profiles:
+                _BitsetMetaAuth.set_user_role(self, user_id, member_roles[org_id])
+        for org_id, user_id in deltas.get('remove_org_members', []):
+            if org_id in member_roles:
+                _BitsetMetaAuth.detach_user_role(self, user_id, member_roles[org_id])
+        for group_id, user_id in deltas.get('add_group_members', []):
+            if group_id in self.__groups and user_id in self.__profiles:
+                self.__groups[group_id].add(user_id)
+        for group_id, user_id in deltas.get('remove_group_members', []):
+            self.__groups.get(group_id, set()).discard(user_id)
+        for dataset_id in deltas.get('delete_datasets', []):
+            self._apply_delete_dataset(dataset_id)
+        return sum(len(changes) for changes in deltas.values())
@@ -0,0 +1,834 @@
+import logging
+import uuid
+
+from sqlalchemy import MetaData, Table, Column, UnicodeText, select, and_, literal, null, union_all
+
+from ckanext.vitality.meta_authorize import MetaAuthorize, ViewDecision
+
+log = logging.getLogger(__name__)
+
+'''
+Tables of the SQL authorization model, created by `ckan vitality init-sql`.
+Names are prefixed with vitality_ as CKAN already has user and group tables.
+'''
+metadata = MetaData()
+
+dataset_table = Table('vitality_dataset', metadata,
+    Column('id', UnicodeText, primary_key=True),
+    Column('name', UnicodeText),
+    Column('owner_id', UnicodeText, index=True),
+    Column('harvest_source', UnicodeText, index=True),
+    Column('public_dataset_id', UnicodeText, index=True)
+)
+
+dataset_description_table = Table('vitality_dataset_description', metadata,
+    Column('dataset_id', UnicodeText, primary_key=True),
+    Column('language', UnicodeText, primary_key=True),
+    Column('description', UnicodeText)
+)
+
+# Shared elements (ElementMode.SHARED) have the same id in every dataset
+element_table = Table('vitality_element', metadata,
+    Column('dataset_id', UnicodeText, primary_key=True),
+    Column('name', UnicodeText, primary_key=True),
+    Column('id', UnicodeText, nullable=False, index=True)
+)
+
+template_table = Table('vitality_template', metadata,
+    Column('id', UnicodeText, primary_key=True),
+    Column('dataset_id', UnicodeText, nullable=False, index=True),
+    Column('name', UnicodeText),
+    Column('description', UnicodeText)
+)
+
+template_field_table = Table('vitality_template_field', metadata,
+    Column('template_id', UnicodeText, primary_key=True),
+    Column('element_id', UnicodeText, primary_key=True, index=True)
+)
+
+role_table = Table('vitality_role', metadata,
+    Column('id', UnicodeText, primary_key=True),
+    Column('name', UnicodeText),
+    # The organization managing the role, None for the public and admin roles
+    Column('org_id', UnicodeText, index=True)
+)
+
+role_template_table = Table('vitality_role_template', metadata,
+    Column('role_id', UnicodeText, primary_key=True),
+    Column('template_id', UnicodeText, primary_key=True, index=True)
+)
+
+user_table = Table('vitality_user', metadata,
+    Column('id', UnicodeText, primary_key=True),
+    Column('username', UnicodeText, index=True),
+    Column('email', UnicodeText),
+    Column('gid', UnicodeText)
+)
+
+user_role_table = Table('vitality_user_role', metadata,
+    Column('user_id', UnicodeText, primary_key=True),
+    Column('role_id', UnicodeText, primary_key=True, index=True)
+)
+
+organization_table = Table('vitality_organization', metadata,
+    Column('id', UnicodeText, primary_key=True),
+    Column('name', UnicodeText, index=True)
+)
+
+# Users with access to the admin form of an organization
+user_organization_table = Table('vitality_user_organization', metadata,
+    Column('user_id', UnicodeText, primary_key=True),
+    Column('org_id', UnicodeText, primary_key=True)
+)
+
+group_table = Table('vitality_group', metadata,
+    Column('id', UnicodeText, primary_key=True)
+)
+
+group_member_table = Table('vitality_group_member', metadata,
+    Column('group_id', UnicodeText, primary_key=True),
+    Column('user_id', UnicodeText, primary_key=True)
+)
+
+
+# Number of ids or rows per statement when importing a snapshot
+_IMPORT_BATCH_SIZE = 500
+
+
+def _user_templates(user_ids):
+    """
+    Returns the join of the users' roles to the templates they use
+    """
+    return user_role_table.join(role_template_table, role_template_table.c.role_id == user_role_table.c.role_id) \
+        .join(template_table, template_table.c.id == role_template_table.c.template_id), user_role_table.c.user_id.in_(user_ids)
+
+
+class _SqlMetaAuth(MetaAuthorize):
+    """
+    An authorization model stored in indexed tables of a relational database, CKAN's own by default
+
+    Mirrors the graph model of _GraphMetaAuth: datasets have templates, templates see elements (template_field),
+    roles use templates (role_template) and users have roles (user_role). Each access check is a single query
+    joining these tables through their indexes.
+
+    Parameters
+    ----------
+    engine : Engine
+        The SQLAlchemy engine of the database, None to use CKAN's (ckan.model.meta.engine) once it is initialized
+    """
+
+    def __init__(self, engine=None):
+        self.engine = engine
+
+    def __engine(self):
+        if self.engine == None:
+            from ckan.model import meta
+            self.engine = meta.engine
+        return self.engine
+
+    def __read(self, query):
+        with self.__engine().connect() as connection:
+            return connection.execute(query).fetchall()
+
+    def __first(self, query):
+        with self.__engine().connect() as connection:
+            return connection.execute(query).first()
+
+    def __write(self, *statements):
+        """
+        Runs statements in a single transaction
+        """
+        with self.__engine().begin() as connection:
+            for statement in statements:
+                connection.execute(statement)
+
+    def init_tables(self):
+        """
+        Creates the tables and indexes that do not exist yet
+        """
+        metadata.create_all(self.__engine())
+
+    def import_snapshot(self, snapshot):
+        """
+        Loads a snapshot of another model into the tables in a single transaction, see _GraphMetaAuth.export_snapshot
+        Existing rows with the same ids are replaced
+
+        Parameters
+        ----------
+        snapshot : dict
+            A snapshot, as returned by _GraphMetaAuth.export_snapshot
+
+        Returns
+        -------
+        The number of datasets imported
+        """
+        profiles = snapshot.get('profiles', {})
+        rows = {
+            user_table: [dict(profiles.get(user_id, {}), id=user_id) for user_id in snapshot.get('users', {})],
+            user_role_table: [{'user_id': user_id, 'role_id': role_id} for user_id, role_ids in snapshot.get('users', {}).items() for role_id in set(role_ids)],
+            organization_table: [{'id': org_id, 'name': name} for org_id, name in snapshot.get('organizations', {}).items()],
+            role_table: [{'id': role_id, 'name': role.get('name'), 'org_id': (role.get('orgs') or [None])[0]} for role_id, role in snapshot.get('roles', {}).items()],
+            dataset_table: [],
+            element_table: [],
+            template_table: [],
+            template_field_table: [],
+            role_template_table: []
+        }
+        for dataset_id, dataset in snapshot.get('datasets', {}).items():
+            rows[dataset_table].append({'id': dataset_id, 'name': dataset.get('name'), 'owner_id': dataset.get('owner'), 'harvest_source': dataset.get('harvest_source')})
+            rows[element_table].extend({'id': id, 'dataset_id': dataset_id, 'name': name} for name, id in dataset.get('fields', {}).items())
+            for template_id, template in dataset.get('templates', {}).items():
+                rows[template_table].append({'id': template_id, 'dataset_id': dataset_id, 'name': template.get('name')})
+                rows[template_field_table].extend({'template_id': template_id, 'element_id': id} for id in set(template.get('visible', [])))
+                rows[role_template_table].extend({'role_id': role_id, 'template_id': template_id} for role_id in set(template.get('roles', [])))
+
+        user_ids = list(snapshot.get('users', {}))
+        dataset_ids = list(snapshot.get('datasets', {}))
+        with self.__engine().begin() as connection:
+            # Replace what the model already holds of the imported datasets, users, roles and organizations
+            for start in range(0, max(len(user_ids), len(dataset_ids), 1), _IMPORT_BATCH_SIZE):
+                users = user_ids[start:start + _IMPORT_BATCH_SIZE]
+                for statement in self.__delete_datasets(dataset_ids[start:start + _IMPORT_BATCH_SIZE]) + [
+                        user_table.delete().where(user_table.c.id.in_(users)),
+                        user_role_table.delete().where(user_role_table.c.user_id.in_(users))]:
+                    connection.execute(statement)
+            connection.execute(role_table.delete().where(role_table.c.id.in_(list(snapshot.get('roles', {})))))
+            connection.execute(organization_table.delete().where(organization_table.c.id.in_(list(snapshot.get('organizations', {})))))
+            for table, table_rows in rows.items():
+                for start in range(0, len(table_rows), _IMPORT_BATCH_SIZE):
+                    connection.execute(table.insert(), table_rows[start:start + _IMPORT_BATCH_SIZE])
+        return len(rows[dataset_table])
+
+    def get_fingerprints(self):
+        """
+        Reads the fingerprints of the users, organizations, groups, memberships and datasets with one query
+            per kind, see MetaAuthorize.get_fingerprints
+        """
+        org_members = select([role_table.c.org_id, user_role_table.c.user_id]).select_from(
+            user_role_table.join(role_table, role_table.c.id == user_role_table.c.role_id)).where(and_(
+            role_table.c.name == 'member', role_table.c.org_id != None))
+        return {
+            'users': set((row.id, row.username or '', row.email or '') for row in self.__read(select([user_table.c.id, user_table.c.username, user_table.c.email]))),
+            'admins': set(self.get_admins()),
+            'organizations': set((row.id, row.name or '') for row in self.__read(select([organization_table.c.id, organization_table.c.name]))),
+            'org_members': set((row.org_id, row.user_id) for row in self.__read(org_members)),
+            'groups': set(self.get_groups()),
+            'group_members': set((row.group_id, row.user_id) for row in self.__read(select([group_member_table.c.group_id, group_member_table.c.user_id]))),
+            'datasets': set((row.id, row.owner_id) for row in self.__read(select([dataset_table.c.id, dataset_table.c.owner_id])))
+        }
+
+    def apply_deltas(self, deltas, batch_size=1000, progress=None):
+        """
+        Applies the changes computed by diff_fingerprints in the order of _GraphMetaAuth.apply_deltas, the statements
+        of each batch of at most batch_size changes in a single transaction. Organizations are added one by one as
+        add_org does, the administrators get access to the new organizations on the admin form
+
+        Parameters
+        ----------
+        deltas : dict
+            The changes, see diff_fingerprints. 'add_datasets' is ignored
+        batch_size : int
+            The number of changes applied per transaction
+        progress : function
+            Called with the name of the change and the number of changes applied after each batch (optional)
+
+        Returns
+        -------
+        The number of changes applied
+        """
+        def member_roles(org_id):
+            return select([role_table.c.id]).where(and_(role_table.c.org_id == org_id, role_table.c.name == 'member'))
+
+        def delete_users(ids):
+            return [table.delete().where(column.in_(ids)) for table, column in ((user_table, user_table.c.id),
+                (user_role_table, user_role_table.c.user_id), (user_organization_table, user_organization_table.c.user_id),
+                (group_member_table, group_member_table.c.user_id))]
+
+        def add_users(users):
+            return [user_table.insert().values([{'id': user['id'], 'username': user.get('username'), 'email': user.get('email'), 'gid': user.get('gid')} for user in users])]
+
+        def update_users(users):
+            return [user_table.update().where(user_table.c.id == user['id']).values(username=user['username'], email=user['email']) for user in users]
+
+        def delete_groups(ids):
+            return [group_member_table.delete().where(group_member_table.c.group_id.in_(ids)), group_table.delete().where(group_table.c.id.in_(ids))]
+
+        def add_admins(ids):
+            # Only the users the model has get the role, existing admins keep it
+            return [
+                user_role_table.delete().where(and_(user_role_table.c.role_id == 'admin', user_role_table.c.user_id.in_(ids))),
+                user_role_table.insert().from_select(['user_id', 'role_id'], select([user_table.c.id, literal('admin')]).where(user_table.c.id.in_(ids)))
+            ]
+
+        def remove_admins(ids):
+            return [user_role_table.delete().where(and_(user_role_table.c.role_id == 'admin', user_role_table.c.user_id.in_(ids)))]
+
+        def remove_org_members(members):
+            return [user_role_table.delete().where(and_(user_role_table.c.user_id == user_id, user_role_table.c.role_id.in_(member_roles(org_id))))
+                for org_id, user_id in members]
+
+        def add_org_members(members):
+            statements = remove_org_members(members)
+            for org_id, user_id in members:
+                statements.append(user_role_table.insert().from_select(['user_id', 'role_id'], select([user_table.c.id, role_table.c.id]).where(and_(
+                    user_table.c.id == user_id, role_table.c.org_id == org_id, role_table.c.name == 'member'))))
+            return statements
+
+        def remove_group_members(members):
+            return [group_member_table.delete().where(and_(group_member_table.c.group_id == group_id, group_member_table.c.user_id == user_id))
+                for group_id, user_id in members]
+
+        def add_group_members(members):
+            statements = remove_group_members(members)
+            for group_id, user_id in members:
+                statements.append(group_member_table.insert().from_select(['group_id', 'user_id'], select([group_table.c.id, user_table.c.id]).where(and_(
+                    group_table.c.id == group_id, user_table.c.id == user_id))))
+            return statements
+
+        total = 0
+        # Users first, the memberships below refer to them
+        for name, statements in (('delete_users', delete_users), ('add_users', add_users), ('update_users', update_users)):
+            total += self.__apply_batches(name, deltas.get(name, []), statements, batch_size, progress)
+
+        for org in deltas.get('add_orgs', []):
+            self.add_org(org['id'], [], org['name'])
+            for admin in self.get_admins():
+                self.set_admin_form_access(admin, org['id'])
+        for org in deltas.get('rename_orgs', []):
+            self.set_organization_name(org['id'], org['name'])
+        for org_id in deltas.get('delete_orgs', []):
+            self.delete_organization(org_id)
+        for group_id in deltas.get('add_groups', []):
+            self.add_group(group_id, [])
+        for name in ['add_orgs', 'rename_orgs', 'delete_orgs', 'add_groups']:
+            total += len(deltas.get(name, []))
+            if progress != None and deltas.get(name):
+                progress(name, len(deltas[name]))
+
+        for name, statements in (('delete_groups', delete_groups), ('add_admins', add_admins), ('remove_admins', remove_admins),
+                ('add_org_members', add_org_members), ('remove_org_members', remove_org_members),
+                ('add_group_members', add_group_members), ('remove_group_members', remove_group_members),
+                ('delete_datasets', self.__delete_datasets)):
+            total += self.__apply_batches(name, deltas.get(name, []), statements, batch_size, progress)
+        return total
+
+    def __apply_batches(self, name, rows, statements, batch_size, progress):
+        """
+        Runs the statements of each batch of at most batch_size rows in a single transaction
+
+        Returns
+        -------
+        The number of rows
+        """
+        for start in range(0, len(rows), batch_size):
+            batch = list(rows[start:start + batch_size])
+            self.__write(*statements(batch))
+            if progress != None:
+                progress(name, len(batch))
+        return len(rows)
+
+    def add_dataset(self, dataset_id, owner_id, dname=None):
+        """
+        Adds a dataset owned by an organization, existing datasets are left as they are
+        """
+        if self.get_dataset(dataset_id) != None:
+            return
+        self.__write(dataset_table.insert().values(id=dataset_id, owner_id=owner_id, name=dname))
+
+    def add_group(self, group_id, users):
+        """
+        Adds a group and its members, existing groups are left as they are
+        """
+        if self.__first(select([group_table.c.id]).where(group_table.c.id == group_id)) != None:
+            return
+        self.__write(group_table.insert().values(id=group_id),
+            *[group_member_table.insert().values(group_id=group_id, user_id=user['id']) for user in users])
+
+    def get_groups(self):
+        """
+        Returns a list of group ids
+        """
+        return [row.id for row in self.__read(select([group_table.c.id]))]
+
+    def add_metadata_fields(self, dataset_id, fields, template_id):
+        """
+        Adds the fields a dataset does not have yet, visible to the given template
+
+        Parameters
+        ----------
+        dataset_id : string
+            The id/uuid of the dataset to add the fields to
+        fields : set
+            A set of tuples with the name of the new field and a generated uuid
+        template_id : string
+            The id/uuid of the full template for the dataset
+        """
+        existing = self.get_metadata_fields(dataset_id)
+        statements = []
+        for name, id in dict(fields).items():
+            if name in existing:
+                continue
+            statements.append(element_table.insert().values(id=str(id), dataset_id=dataset_id, name=name))
+            statements.append(template_field_table.insert().values(template_id=template_id, element_id=str(id)))
+        self.__write(*statements)
+
+    def add_org(self, org_id, users, org_name=None):
+        """
+        Adds an organization with a member role, given to the users that are not admins
+        """
+        if self.get_organization(org_id) != None:
+            return
+        member_id = str(uuid.uuid4())
+        admins = set(self.get_admins())
+        self.__write(
+            organization_table.insert().values(id=org_id, name=org_name),
+            role_table.insert().values(id=member_id, name="member", org_id=org_id),
+            *[user_role_table.insert().values(user_id=user['id'], role_id=member_id) for user in users if user['id'] not in admins])
+
+    def get_orgs(self):
+        """
+        Returns a list of organization ids
+        """
+        return [row.id for row in self.__read(select([organization_table.c.id]))]
+
+    def add_role(self, id, name=None):
+        """
+        Adds a role
+        """
+        self.__write(role_table.insert().values(id=id, name=name))
+
+    def add_user(self, user_id, user_name=None, user_email=None, gid=None):
+        """
+        Adds a user, existing users are left as they are
+        """
+        if self.get_user(user_id) != None:
+            return
+        self.__write(user_table.insert().values(id=user_id, username=user_name, email=user_email, gid=gid))
+
+    def add_template(self, dataset_id, template_id, template_name=None, template_description=None):
+        """
+        Adds a template without visible fields to a dataset
+        """
+        self.__write(template_table.insert().values(id=template_id, dataset_id=dataset_id, name=template_name, description=template_description))
+
+    def add_template_full(self, dataset_id, template_id, template_name, fields, template_description=None):
+        """
+        Adds a template seeing all the given fields to a dataset that has no templates
+        """
+        if self.get_templates(dataset_id):
+            log.info("templates exist already")
+            return
+        statements = [template_table.insert().values(id=template_id, dataset_id=dataset_id, name=template_name, description=template_description)]
+        for name, id in fields.items():
+            statements.append(element_table.insert().values(id=str(id), dataset_id=dataset_id, name=name))
+            statements.append(template_field_table.insert().values(template_id=template_id, element_id=str(id)))
+        self.__write(*statements)
+
+    def provision_dataset(self, dataset_id, owner_id, dname=None, harvest_id=None, descriptions=None, templates=None):
+        """
+        Adds a dataset along with its templates, elements and template access in a single transaction,
+            see _GraphMetaAuth.provision_dataset
+
+        Returns
+        -------
+        True if the templates were created, False if the dataset already had templates
+        """
+        with self.__engine().begin() as connection:
+            dataset = connection.execute(select([dataset_table.c.id]).where(dataset_table.c.id == dataset_id)).first()
+            if dataset == None:
+                connection.execute(dataset_table.insert().values(id=dataset_id, name=dname, owner_id=owner_id, harvest_source=harvest_id))
+            elif harvest_id != None:
+                connection.execute(dataset_table.update().where(dataset_table.c.id == dataset_id).values(harvest_source=harvest_id))
+            if connection.execute(select([template_table.c.id]).where(template_table.c.dataset_id == dataset_id).limit(1)).first() != None:
+                return False
+
+            for language, description in (descriptions or {}).items():
+                connection.execute(dataset_description_table.insert().values(dataset_id=dataset_id, language=language, description=description))
+            org_roles = [row.id for row in connection.execute(select([role_table.c.id]).where(role_table.c.org_id == owner_id))]
+            elements = {}
+            template_rows = []
+            template_fields = []
+            role_templates = []
+            for template in templates or []:
+                template_rows.append({'id': template['id'], 'dataset_id': dataset_id, 'name': template.get('name'), 'description': template.get('description')})
+                for name, id in template.get('fields', {}).items():
+                    elements.setdefault(name, str(id))
+                    template_fields.append({'template_id': template['id'], 'element_id': elements[name]})
+                roles = set(template.get('roles', []))
+                if template.get('org_roles'):
+                    roles.update(org_roles)
+                role_templates.extend({'role_id': role_id, 'template_id': template['id']} for role_id in roles)
+            for table, rows in ((template_table, template_rows), (template_field_table, template_fields), (role_template_table, role_templates)):
+                if rows:
+                    connection.execute(table.insert(), rows)
+            if elements:
+                connection.execute(element_table.insert(), [{'id': id, 'dataset_id': dataset_id, 'name': name} for name, id in elements.items()])
+        return True
+
+    def delete_dataset(self, dataset_id):
+        """
+        Deletes a dataset along with its templates and elements
+        """
+        self.__write(*self.__delete_datasets([dataset_id]))
+
+    @staticmethod
+    def __delete_datasets(dataset_ids):
+        """
+        Returns the statements deleting the datasets whose ids are selected by dataset_ids
+        """
+        template_ids = select([template_table.c.id]).where(template_table.c.dataset_id.in_(dataset_ids))
+        return [
+            role_template_table.delete().where(role_template_table.c.template_id.in_(template_ids)),
+            template_field_table.delete().where(template_field_table.c.template_id.in_(template_ids)),
+            template_table.delete().where(template_table.c.dataset_id.in_(dataset_ids)),
+            element_table.delete().where(element_table.c.dataset_id.in_(dataset_ids)),
+            dataset_description_table.delete().where(dataset_description_table.c.dataset_id.in_(dataset_ids)),
+            dataset_table.delete().where(dataset_table.c.id.in_(dataset_ids))
+        ]
+
+    def delete_element_access_for_template(self, dataset_id, template_name, element_name):
+        """
+        Hides a field from a template, fields cannot be hidden from the Full template
+        """
+        if template_name == "Full":
+            log.warning("Cannot detach element from Full template. Exiting...")
+            return
+        templates = self.get_templates(dataset_id)
+        elements = self.get_metadata_fields(dataset_id)
+        if template_name in templates and element_name in elements:
+            self.__write(template_field_table.delete().where(and_(
+                template_field_table.c.template_id == templates[template_name],
+                template_field_table.c.element_id == elements[element_name])))
+
+    def delete_harvest(self, harvest_id, batch_size=5000, progress=None):
+        """
+        Deletes all datasets of a harvest source in a single transaction whatever the batch_size
+        """
+        # The dataset ids are read first as the last statement deletes the rows the subquery selects
+        dataset_ids = [row.id for row in self.__read(select([dataset_table.c.id]).where(dataset_table.c.harvest_source == harvest_id))]
+        if dataset_ids:
+            self.__write(*self.__delete_datasets(dataset_ids))
+
+    def delete_organization(self, org_id):
+        """
+        Deletes an organization, the roles it managed are kept
+        """
+        self.__write(
+            organization_table.delete().where(organization_table.c.id == org_id),
+            user_organization_table.delete().where(user_organization_table.c.org_id == org_id),
+            role_table.update().where(role_table.c.org_id == org_id).values(org_id=None))
+
+    def delete_user(self, user_id):
+        """
+        Deletes a user along with their roles
+        """
+        self.__write(
+            user_table.delete().where(user_table.c.id == user_id),
+            user_role_table.delete().where(user_role_table.c.user_id == user_id),
+            user_organization_table.delete().where(user_organization_table.c.user_id == user_id),
+            group_member_table.delete().where(group_member_table.c.user_id == user_id))
+
+    def detach_user_role(self, user_id, role_id):
+        """
+        Takes a role away from a user
+        """
+        self.__write(user_role_table.delete().where(and_(user_role_table.c.user_id == user_id, user_role_table.c.role_id == role_id)))
+
+    def get_admins(self):
+        """
+        Returns a list of the ids of the users with the admin role
+        """
+        return [row.user_id for row in self.__read(select([user_role_table.c.user_id]).where(user_role_table.c.role_id == 'admin'))]
+
+    def get_dataset(self, dataset_id):
+        """
+        Returns the dataset id if the dataset exists and None if it does not
+        """
+        row = self.__first(select([dataset_table.c.id]).where(dataset_table.c.id == dataset_id))
+        return row.id if row != None else None
+
+    def get_metadata_fields(self, dataset_id):
+        """
+        Returns a dictionary of the dataset's field names to their element ids
+        """
+        return {row.name: row.id for row in self.__read(select([element_table.c.name, element_table.c.id]).where(element_table.c.dataset_id == dataset_id))}
+
+    def get_organization(self, organization_id):
+        """
+        Returns the id and name of an organization, None if it does not exist
+        """
+        row = self.__first(select([organization_table.c.id, organization_table.c.name]).where(organization_table.c.id == organization_id))
+        return dict(row) if row != None else None
+
+    def get_public_fields(self, dataset_id):
+        """
+        Returns the names of the dataset's fields visible to the public
+        """
+        public_ids = set(self.get_visible_fields(dataset_id, 'public'))
+        return [name for name, id in self.get_metadata_fields(dataset_id).items() if id in public_ids]
+
+    def get_roles(self, org_id=None):
+        """
+        Returns a dictionary of role names to ids, of the roles managed by an organization if one is given
+        """
+        query = select([role_table.c.name, role_table.c.id])
+        if org_id != None:
+            query = query.where(role_table.c.org_id == org_id)
+        return {row.name: row.id for row in self.__read(query)}
+
+    def get_private_dataset(self, dataset_id):
+        """
+        Returns the id and name of the private dataset whose public version is dataset_id, None if there is none
+        """
+        row = self.__first(select([dataset_table.c.id, dataset_table.c.name]).where(dataset_table.c.public_dataset_id == dataset_id))
+        return dict(row) if row != None else None
+
+    def get_public_dataset(self, dataset_id):
+        """
+        Returns the id and name of the public version of a dataset, None if there is none
+        """
+        public = dataset_table.alias('public')
+        row = self.__first(select([public.c.id, public.c.name]).select_from(
+            dataset_table.join(public, public.c.id == dataset_table.c.public_dataset_id)).where(dataset_table.c.id == dataset_id))
+        return dict(row) if row != None else None
+
+    def get_templates(self, dataset_id):
+        """
+        Returns a dictionary of the dataset's template names to their ids
+        """
+        return {row.name: row.id for row in self.__read(select([template_table.c.name, template_table.c.id]).where(template_table.c.dataset_id == dataset_id))}
+
+    def get_template_access_for_role(self, dataset_id, role_id):
+        """
+        Returns the name of the dataset's template used by a role, None if it uses none
+        """
+        row = self.__first(select([template_table.c.name]).select_from(
+            template_table.join(role_template_table, role_template_table.c.template_id == template_table.c.id)).where(and_(
+            template_table.c.dataset_id == dataset_id, role_template_table.c.role_id == role_id)))
+        return str(row.name) if row != None else None
+
+    def get_template_access_for_user(self, dataset_id, user_id):
+        """
+        Returns the name of the dataset's template used by one of the user's roles, None if there is none
+        """
+        joined, users = _user_templates([user_id])
+        row = self.__first(select([template_table.c.name]).select_from(joined).where(and_(users, template_table.c.dataset_id == dataset_id)))
+        return str(row.name) if row != None else None
+
+    def get_user(self, id):
+        """
+        Returns the id, username and email of a user, None if the user does not exist
+        """
+        row = self.__first(select([user_table.c.id, user_table.c.username, user_table.c.email]).where(user_table.c.id == id))
+        return dict(row) if row != None else None
+
+    def get_user_by_username(self, username):
+        """
+        Returns the id, username and email of a user, None if the user does not exist
+        """
+        row = self.__first(select([user_table.c.id, user_table.c.username, user_table.c.email]).where(user_table.c.username == username))
+        return dict(row) if row != None else None
+
+    def get_users(self):
+        """
+        Returns a list of all user ids
+        """
+        return [row.id for row in self.__read(select([user_table.c.id]))]
+
+    def get_visible_fields(self, dataset_id, user_id):
+        """
+        Returns the element ids of the dataset's fields visible to a user
+        """
+        joined, users = _user_templates([user_id])
+        query = select([template_field_table.c.element_id]).distinct().select_from(
+            joined.join(template_field_table, template_field_table.c.template_id == template_table.c.id)).where(and_(
+            users, template_table.c.dataset_id == dataset_id))
+        return [row.element_id for row in self.__read(query)]
+
+    def is_unrestricted(self, dataset_id):
+        """
+        Checks if the public has 'Full' template access to a dataset
+        """
+        return self.is_unrestricted_for_user(dataset_id, 'public')
+
+    def is_unrestricted_for_user(self, dataset_id, user_id):
+        """
+        Checks if a user has 'Full' template access to a dataset, users without a template are unrestricted
+        """
+        name = self.get_template_access_for_user(dataset_id, user_id)
+        return name == None or name == 'Full'
+
+    def resolve_view(self, dataset_id, user_id):
+        """
+        Resolves the access a user has to a dataset with a single query, None if the dataset does not exist
+        """
+        return self.resolve_views([dataset_id], user_id).get(dataset_id)
+
+    def resolve_views(self, dataset_ids, user_id):
+        """
+        Resolves the access a user has to several datasets with a single query
+
+        The query is a union of the datasets, their elements, and the templates and visible elements of
+            both the user and the public user, told apart by the kind column
+
+        Returns
+        -------
+        A dictionary of dataset ids to ViewDecisions, datasets that do not exist are left out
+        """
+        if not dataset_ids:
+            return {}
+        joined, users = _user_templates([user_id, 'public'])
+        in_datasets = template_table.c.dataset_id.in_(dataset_ids)
+        query = union_all(
+            select([literal('d').label('kind'), dataset_table.c.id.label('dataset_id'), null().label('user_id'), null().label('name'), null().label('id')])
+                .where(dataset_table.c.id.in_(dataset_ids)),
+            select([literal('e'), element_table.c.dataset_id, null(), element_table.c.name, element_table.c.id])
+                .where(element_table.c.dataset_id.in_(dataset_ids)),
+            select([literal('t'), template_table.c.dataset_id, user_role_table.c.user_id, template_table.c.name, template_table.c.id])
+                .select_from(joined).where(and_(users, in_datasets)),
+            select([literal('v'), template_table.c.dataset_id, user_role_table.c.user_id, null(), template_field_table.c.element_id])
+                .select_from(joined.join(template_field_table, template_field_table.c.template_id == template_table.c.id)).where(and_(users, in_datasets))
+        )
+        rows = self.__read(query)
+        datasets = {row.dataset_id: {'fields': {}, 'templates': {}, 'visible': {}} for row in rows if row.kind == 'd'}
+        for row in rows:
+            dataset = datasets.get(row.dataset_id)
+            if dataset == None:
+                continue
+            if row.kind == 'e':
+                dataset['fields'][row.name] = row.id
+            elif row.kind == 't':
+                dataset['templates'].setdefault(row.user_id, []).append(row.name)
+            elif row.kind == 'v':
+                dataset['visible'].setdefault(row.user_id, set()).add(row.id)
+
+        result = {}
+        for dataset_id, dataset in datasets.items():
+            # Mirrors is_unrestricted_for_user: a user without a template is unrestricted, otherwise the first template decides
+            public_templates = dataset['templates'].get('public', [])
+            user_templates = dataset['templates'].get(user_id, [])
+            unrestricted = (not public_templates or public_templates[0] == 'Full') or (not user_templates or user_templates[0] == 'Full')
+            public_ids = dataset['visible'].get('public', set())
+            result[dataset_id] = ViewDecision.build(
+                unrestricted,
+                dataset['fields'],
+                dataset['visible'].get(user_id, set()),
+                [name for name, id in dataset['fields'].items() if id in public_ids]
+            )
+        return result
+
+    def set_dataset_description(self, dataset_id, language, description):
+        """
+        Sets the description of a dataset in a given language
+        """
+        self.__write(
+            dataset_description_table.delete().where(and_(dataset_description_table.c.dataset_id == dataset_id, dataset_description_table.c.language == language)),
+            dataset_description_table.insert().values(dataset_id=dataset_id, language=language, description=description))
+
+    def set_dataset_name(self, dataset_id, dataset_name):
+        """
+        Sets the name of a dataset
+        """
+        self.__write(dataset_table.update().where(dataset_table.c.id == dataset_id).values(name=dataset_name))
+
+    def set_dataset_harvest_id(self, dataset_id, harvest_id):
+        """
+        Sets the harvest source id of a dataset
+        """
+        self.__write(dataset_table.update().where(dataset_table.c.id == dataset_id).values(harvest_source=harvest_id))
+
+    def set_element_access_for_template(self, dataset_id, template_name, element_name):
+        """
+        Makes a field of the dataset visible to one of its templates, unless it already is
+        """
+        if template_name == "Full":
+            log.info("Full templates already connected to every element in the dataset")
+            return
+        templates = self.get_templates(dataset_id)
+        elements = self.get_metadata_fields(dataset_id)
+        if template_name not in templates or element_name not in elements:
+            log.info("Provided template name or element name does not exist")
+            return
+        self.__write(
+            template_field_table.delete().where(and_(template_field_table.c.template_id == templates[template_name], template_field_table.c.element_id == elements[element_name])),
+            template_field_table.insert().values(template_id=templates[template_name], element_id=elements[element_name]))
+
+    def set_template_access(self, role_id, template_id):
+        """
+        Makes a role use a template, instead of any other template of the same dataset
+        """
+        self.__write(*self.__bind_role_to_template(role_id, [template_id]))
+
+    @staticmethod
+    def __bind_role_to_template(role_id, template_ids):
+        """
+        Returns the statements making a role use the given templates instead of the other templates of their datasets
+        """
+        dataset_ids = select([template_table.c.dataset_id]).where(template_table.c.id.in_(template_ids))
+        dataset_templates = select([template_table.c.id]).where(template_table.c.dataset_id.in_(dataset_ids))
+        return [
+            role_template_table.delete().where(and_(role_template_table.c.role_id == role_id, role_template_table.c.template_id.in_(dataset_templates))),
+            role_template_table.insert().from_select(['role_id', 'template_id'],
+                select([literal(role_id), template_table.c.id]).where(template_table.c.id.in_(template_ids)))
+        ]
+
+    def set_admin_form_access(self, user_id, org_id):
+        """
+        Gives a user access to the admin form of an organization
+        """
+        self.__write(
+            user_organization_table.delete().where(and_(user_organization_table.c.user_id == user_id, user_organization_table.c.org_id == org_id)),
+            user_organization_table.insert().values(user_id=user_id, org_id=org_id))
+
+    def set_user_gid(self, id, gid):
+        """
+        Sets the GID (Google ID) of a user
+        """
+        self.__write(user_table.update().where(user_table.c.id == id).values(gid=gid))
+
+    def set_user_username(self, id, username):
+        """
+        Sets the CKAN username of a user
+        """
+        self.__write(user_table.update().where(user_table.c.id == id).values(username=username))
+
+    def set_user_email(self, id, email):
+        """
+        Sets the email address of a user
+        """
+        self.__write(user_table.update().where(user_table.c.id == id).values(email=email))
+
+    def set_user_role(self, user_id, role_id):
+        """
+        Gives a role to a user, unless they already have it
+        """
+        self.__write(
+            user_role_table.delete().where(and_(user_role_table.c.user_id == user_id, user_role_table.c.role_id == role_id)),
+            user_role_table.insert().values(user_id=user_id, role_id=role_id))
+
+    def set_visible_fields(self, template_id, whitelist):
+        """
+        Replaces the fields visible to a template
+
+        Parameters
+        ----------
+        template_id : string
+            The id/uuid of the template
+        whitelist : dict
+            The field names to their element ids
+        """
+        self.__write(
+            template_field_table.delete().where(template_field_table.c.template_id == template_id),
+            *[template_field_table.insert().values(template_id=template_id, element_id=id) for id in set(whitelist.values())])
+
+    def set_organization_name(self, org_id, org_name):
+        """
+        Sets the name of an organization
+        """
+        self.__write(organization_table.update().where(organization_table.c.id == org_id).values(name=org_name))
+
+    def set_full_access_to_datasets(self, role_id, batch_size=1000, progress=None):
+        """
+        Makes a role use the 'Full' template of every dataset, in a single transaction whatever the batch_size
+        """
+        self.__write(*self.__bind_role_to_template(role_id, select([template_table.c.id]).where(template_table.c.name == "Full")))
@@ -0,0 +1,373 @@
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from ckanext.vitality.meta_authorize import MetaAuthorize
+
+log = logging.getLogger(__name__)
+
+# The writes _WriteBehindMetaAuth queues: method name to the kind of entity written, the index of the
+#   argument holding its id, and the indexes of the arguments a later call has to match to replace a
+#   pending one (None if calls never replace each other)
+MUTATIONS = {
+    'add_user': ('user', 0, None),
+    'delete_user': ('user', 0, None),
+    'set_user_username': ('user', 0, (0,)),
+    'set_user_email': ('user', 0, (0,)),
+    'set_user_gid': ('user', 0, (0,)),
+    'set_user_role': ('user', 0, None),
+    'detach_user_role': ('user', 0, None),
+    'set_admin_form_access': ('user', 0, None),
+    'add_org': ('organization', 0, None),
+    'set_organization_name': ('organization', 0, (0,)),
+    'delete_organization': ('organization', 0, None),
+    'set_dataset_name': ('dataset', 0, (0,)),
+    'set_dataset_description': ('dataset', 0, (0, 1)),
+    'delete_dataset': ('dataset', 0, None),
+    'delete_harvest': ('harvest', 0, None),
+}
+
+# Deleting an entity drops the pending writes replacing its properties
+DELETIONS = frozenset(['delete_user', 'delete_organization', 'delete_dataset'])
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS mutation ("
+    "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "entity TEXT NOT NULL, "
+    "method TEXT NOT NULL, "
+    "args TEXT NOT NULL, "
+    "key TEXT, "
+    "attempts INTEGER NOT NULL DEFAULT 0, "
+    "failed INTEGER NOT NULL DEFAULT 0)"
+)
+
+
+class _WriteBehindMetaAuth(MetaAuthorize):
+    """
+    Queues the writes made to an authorization model in a SQLite journal and applies them in the background,
+    so that CKAN actions do not wait for the target model to commit
+
+    Writes are applied in the order they were queued by a single consumer at a time, the workers sharing
+    the journal take turns through a lock file. A write replacing a property, e.g. set_dataset_name, drops
+    the pending write of the same property and deleting an entity drops the pending writes of its properties.
+    A write failing max_attempts times is marked as failed, logged and left in the journal.
+    Reads are answered by the target model, call flush first to read the writes queued so far.
+    Provisioning a dataset is not queued, it waits for the queued writes first so that the organization
+    and roles it links to are in the target model.
+
+    Parameters
+    ----------
+    target : MetaAuthorize
+        The model writes are applied to
+    path : string
+        The path of the SQLite journal
+    poll_interval : float
+        Seconds between checks for writes queued by other workers, and between attempts of a failing write
+    max_attempts : int
+        The number of attempts of a write before it is marked as failed
+    start : bool
+        Whether to apply the writes from a background thread, otherwise see apply_pending
+    flush_timeout : float
+        Seconds provisioning a dataset waits for the queued writes, None to wait until they are applied
+    """
+
+    def __init__(self, target, path='vitality_write_behind.db', poll_interval=1, max_attempts=5, start=True, flush_timeout=10):
+        self.target = target
+        self.path = path
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.start = start
+        self.flush_timeout = flush_timeout
+        self.__lock = threading.Lock()
+        self.__applied = threading.Condition()
+        self.__wake = threading.Event()
+        self.__closed = threading.Event()
+        self.__pid = None
+        connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        try:
+            # Readers do not block the worker appending writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(SCHEMA)
+            connection.execute("CREATE INDEX IF NOT EXISTS mutation_key ON mutation (key)")
+            connection.execute("CREATE INDEX IF NOT EXISTS mutation_entity ON mutation (entity)")
+        finally:
+            connection.close()
+
+    def __getattr__(self, name):
+        # Only called for attributes this model does not have, i.e. the reads of the target
+        target = self.__dict__.get('target')
+        if target == None or name.startswith('_'):
+            raise AttributeError("%s has no attribute %s" % (self.__class__.__name__, name))
+        return getattr(target, name)
+
+    def __connect(self, write=True):
+        return _Connection(self.path, write)
+
+    def __ensure_started(self):
+        """
+        Starts the consumer thread once per process, forked workers do not inherit the thread of their parent
+        """
+        if not self.start or self.__pid == os.getpid():
+            return
+        with self.__lock:
+            if self.__pid == os.getpid():
+                return
+            self.__pid = os.getpid()
+            thread = threading.Thread(target=self.__consume, name='vitality-write-behind')
+            thread.daemon = True
+            thread.start()
+
+    def enqueue(self, method, *args):
+        """
+        Appends a write to the journal
+
+        Parameters
+        ----------
+        method : string
+            The name of the method of the target model, one of MUTATIONS
+        args : list
+            Its arguments, which have to be JSON serializable
+
+        Returns
+        -------
+        The sequence number of the write
+        """
+        kind, index, key_indexes = MUTATIONS[method]
+        entity = '%s:%s' % (kind, args[index])
+        key = None
+        if key_indexes != None:
+            key = json.dumps([method] + [args[i] for i in key_indexes])
+        with self.__connect() as connection:
+            if key != None:
+                connection.execute("DELETE FROM mutation WHERE key = ? AND attempts = 0", (key,))
+            if method in DELETIONS:
+                connection.execute("DELETE FROM mutation WHERE entity = ? AND key IS NOT NULL AND attempts = 0", (entity,))
+            seq = connection.execute("INSERT INTO mutation (entity, method, args, key) VALUES (?, ?, ?, ?)",
+                (entity, method, json.dumps(args), key)).lastrowid
+        self.__ensure_started()
+        self.__wake.set()
+        return seq
+
+    def fence(self):
+        """
+        Returns the sequence number of the last write queued by any worker, see flush
+        """
+        with self.__connect(False) as connection:
+            return connection.execute("SELECT coalesce(max(seq), 0) FROM mutation").fetchone()[0]
+
+    def pending(self, fence=None):
+        """
+        Returns the number of writes left to apply, up to the fence if given. Failed writes are not counted
+        """
+        with self.__connect(False) as connection:
+            return connection.execute("SELECT count(*) FROM mutation WHERE failed = 0 AND seq <= ?",
+                (fence if fence != None else 2 ** 62,)).fetchone()[0]
+
+    def failed(self):
+        """
+        Returns the writes that failed max_attempts times, as (seq, method, args) tuples
+        """
+        with self.__connect(False) as connection:
+            return [(seq, method, json.loads(args)) for seq, method, args in
+                connection.execute("SELECT seq, method, args FROM mutation WHERE failed = 1 ORDER BY seq")]
+
+    def flush(self, timeout=None, fence=None):
+        """
+        Waits until the writes queued before the fence, by default every write queued so far, are applied
+
+        Parameters
+        ----------
+        timeout : float
+            Seconds to wait at most, None to wait until they are applied
+        fence : int
+            The sequence number to wait for, see fence
+
+        Returns
+        -------
+        True if the writes were applied, False if the timeout expired first
+        """
+        if fence == None:
+            fence = self.fence()
+        deadline = None if timeout == None else time.monotonic() + timeout
+        if not self.start:
+            self.apply_pending()
+        self.__ensure_started()
+        while self.pending(fence) > 0:
+            wait = self.poll_interval
+            if deadline != None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return False
+            self.__wake.set()
+            with self.__applied:
+                self.__applied.wait(wait)
+            if not self.start:
+                self.apply_pending()
+        return True
+
+    def apply_pending(self, blocking=True):
+        """
+        Applies the queued writes in order, until none are left or one fails
+
+        Parameters
+        ----------
+        blocking : bool
+            Whether to wait for the worker applying writes, if any, to be done
+
+        Returns
+        -------
+        The number of writes applied, or None if another worker is applying them and blocking is False
+        """
+        with self.__lock, open(self.path + '.lock', 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                return None
+            try:
+                return self.__apply_pending()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+                with self.__applied:
+                    self.__applied.notify_all()
+
+    def __apply_pending(self):
+        applied = 0
+        while True:
+            with self.__connect(False) as connection:
+                rows = connection.execute("SELECT seq, method, args, attempts FROM mutation WHERE failed = 0 ORDER BY seq LIMIT 100").fetchall()
+            if not rows:
+                return applied
+            for seq, method, args, attempts in rows:
+                try:
+                    getattr(self.target, method)(*json.loads(args))
+                except Exception as ex:
+                    attempts += 1
+                    failed = attempts >= self.max_attempts
+                    with self.__connect() as connection:
+                        connection.execute("UPDATE mutation SET attempts = ?, failed = ? WHERE seq = ?", (attempts, int(failed), seq))
+                    if failed:
+                        log.error("Vitality write %s%r failed %d times, giving up: %s", method, tuple(json.loads(args)), attempts, ex)
+                        continue
+                    log.warning("Vitality write %s%r failed, retrying: %s", method, tuple(json.loads(args)), ex)
+                    return applied
+                with self.__connect() as connection:
+                    connection.execute("DELETE FROM mutation WHERE seq = ?", (seq,))
+                applied += 1
+
+    def close(self):
+        """
+        Stops the consumer thread of this process, the writes left are applied by the other workers or on the next start
+        """
+        self.__closed.set()
+        self.__wake.set()
+
+    def __consume(self):
+        while True:
+            self.__wake.wait(self.poll_interval)
+            self.__wake.clear()
+            if self.__closed.is_set():
+                return
+            try:
+                self.apply_pending(blocking=False)
+            except Exception as ex:
+                log.error("Could not apply the vitality write behind journal %s: %s", self.path, ex)
+
+    # Calls MetaAuthorize defines, answered by the target
+
+    def add_dataset(self, dataset_id, owner_id, dname=None):
+        return self.target.add_dataset(dataset_id, owner_id, dname)
+
+    def add_group(self, group_id, users):
+        return self.target.add_group(group_id, users)
+
+    def add_metadata_fields(self, dataset_id, fields, template_id):
+        return self.target.add_metadata_fields(dataset_id, fields, template_id)
+
+    def add_users(self, users, batch_size=1000, progress=None):
+        return self.target.add_users(users, batch_size, progress)
+
+    def apply_deltas(self, deltas, batch_size=1000, progress=None):
+        return self.target.apply_deltas(deltas, batch_size, progress)
+
+    def get_fingerprints(self):
+        return self.target.get_fingerprints()
+
+    def get_groups(self):
+        return self.target.get_groups()
+
+    def get_metadata_fields(self, dataset_id):
+        return self.target.get_metadata_fields(dataset_id)
+
+    def get_orgs(self):
+        return self.target.get_orgs()
+
+    def get_public_fields(self, dataset_id):
+        return self.target.get_public_fields(dataset_id)
+
+    def get_users(self):
+        return self.target.get_users()
+
+    def get_visible_fields(self, dataset_id, user_id):
+        return self.target.get_visible_fields(dataset_id, user_id)
+
+    def provision_dataset(self, dataset_id, owner_id, dname=None, harvest_id=None, descriptions=None, templates=None):
+        self.__flush_before_provisioning(1)
+        return self.target.provision_dataset(dataset_id, owner_id, dname, harvest_id, descriptions, templates)
+
+    def provision_datasets(self, datasets):
+        self.__flush_before_provisioning(len(datasets))
+        return self.target.provision_datasets(datasets)
+
+    def __flush_before_provisioning(self, count):
+        """
+        Waits for the queued writes, e.g. the organization a new dataset belongs to, which provisioning
+        links the dataset to and grants the roles of
+        """
+        if not self.flush(self.flush_timeout):
+            log.warning("Provisioning %d datasets before the queued vitality writes are applied, their organization access may be missing", count)
+
+    def resolve_view(self, dataset_id, user_id):
+        return self.target.resolve_view(dataset_id, user_id)
+
+    def resolve_views(self, dataset_ids, user_id):
+        return self.target.resolve_views(dataset_ids, user_id)
+
+    def set_visible_fields(self, template_id, whitelist):
+        return self.target.set_visible_fields(template_id, whitelist)
+
+
+def _queued(method):
+    def queue(self, *args):
+        self.enqueue(method, *args)
+    queue.__name__ = method
+    queue.__doc__ = "Queues %s, see _WriteBehindMetaAuth" % method
+    return queue
+
+
+for _method in MUTATIONS:
+    setattr(_WriteBehindMetaAuth, _method, _queued(_method))
+
+
+class _Connection(object):
+    """
+    A SQLite connection running a single transaction, committed on exit. Write transactions take
+    the write lock at once so that the deletes and insert of enqueue are not interleaved with another worker's
+    """
+
+    def __init__(self, path, write=True):
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.write = write
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE" if self.write else "BEGIN")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            self.connection.execute("ROLLBACK" if exc_type != None else "COMMIT")
+        finally:
+            self.connection.close()
@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CHANNEL = 'ckanext-vitality:invalidate'
+
+
+class InvalidationBus(object):
+    """
+    Shares access cache invalidations between CKAN worker processes.
+
+    ...
+
+    Every write to the authorization model publishes the cache tags it affects, each worker holding
+    an AccessCache subscribes and drops the matching entries. Messages published by a worker are
+    ignored by that same worker as it already invalidated its own cache.
+
+    Delivery is best effort, the cache time to live bounds how long a lost message can leave an
+    entry stale. The local cache is cleared whenever the subscription is (re)established.
+
+    Attributes
+    ----------
+    transport : RedisTransport or LocalTransport
+        Carries the messages between workers.
+    channel : string
+        The name of the channel messages are published on.
+    cache : AccessCache
+        The cache to invalidate on incoming messages, None for publish only buses.
+
+    Methods
+    -------
+    publish(tags)
+        Publishes tags to the other workers.
+    ensure_subscribed()
+        Subscribes to the channel if this process has not done so yet.
+    """
+
+    def __init__(self, transport, channel=DEFAULT_CHANNEL, cache=None):
+        self.transport = transport
+        self.channel = channel
+        self.cache = cache
+        self.__instance = uuid.uuid4().hex
+        self.__pid = None
+        self.__lock = threading.Lock()
+        self.ensure_subscribed()
+
+    @property
+    def origin(self):
+        """
+        Identifies this bus in this process, forked workers share the bus object of their parent.
+        """
+        return '%s:%d' % (self.__instance, os.getpid())
+
+    def publish(self, tags):
+        """
+        Publishes the cache tags invalidated by a write.
+
+        Parameters
+        ----------
+        tags : iterable of strings
+            The invalidated tags
+        """
+        try:
+            self.transport.publish(self.channel, json.dumps({'origin': self.origin, 'tags': list(tags)}))
+        except Exception as ex:
+            log.warning("Could not publish vitality cache invalidation: %s", ex)
+
+    def ensure_subscribed(self):
+        """
+        Subscribes to the channel once per process, forked workers do not inherit the listener of their parent.
+        """
+        if self.cache == None or self.__pid == os.getpid():
+            return
+        with self.__lock:
+            if self.__pid == os.getpid():
+                return
+            self.__pid = os.getpid()
+            self.transport.subscribe(self.channel, self.__receive, self.__reset)
+
+    def __receive(self, message):
+        try:
+            message = json.loads(message)
+        except (TypeError, ValueError):
+            log.warning("Ignoring malformed vitality cache invalidation %s", message)
+            return
+        if message.get('origin') != self.origin:
+            self.cache.invalidate(*message.get('tags', []))
+
+    def __reset(self):
+        # Messages may have been missed while not subscribed
+        self.cache.clear()
+
+
+class RedisTransport(object):
+    """
+    Carries invalidation messages over Redis pub/sub, using the Redis instance configured for CKAN by default.
+    """
+
+    def __init__(self, connection=None):
+        if connection == None:
+            from ckan.lib.redis import connect_to_redis
+            connection = connect_to_redis()
+        self.connection = connection
+
+    def publish(self, channel, message):
+        self.connection.publish(channel, message)
+
+    def subscribe(self, channel, callback, on_connect=None):
+        """
+        Starts a daemon thread calling callback with every message published on channel.
+        on_connect is called each time the subscription is (re)established.
+        """
+        thread = threading.Thread(target=self.__listen, args=(channel, callback, on_connect), name='vitality-invalidation')
+        thread.daemon = True
+        thread.start()
+
+    def __listen(self, channel, callback, on_connect):
+        while True:
+            try:
+                pubsub = self.connection.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(channel)
+                if on_connect != None:
+                    on_connect()
+                for message in pubsub.listen():
+                    if message.get('type') == 'message':
+                        data = message['data']
+                        callback(data.decode('utf-8') if isinstance(data, bytes) else data)
+            except Exception as ex:
+                log.warning("Vitality cache invalidation subscription lost, retrying: %s", ex)
+                time.sleep(1)
+
+
+class LocalTransport(object):
+    """
+    Delivers invalidation messages synchronously within the current process, for tests and single process deployments.
+    """
+
+    def __init__(self):
+        self.subscribers = {}
+
+    def publish(self, channel, message):
+        for callback in list(self.subscribers.get(channel, [])):
+            callback(message)
+
+    def subscribe(self, channel, callback, on_connect=None):
+        self.subscribers.setdefault(channel, []).append(callback)
+        if on_connect != None:
+            on_connect()
+
+
+def create_bus(opts, cache=None):
+    """
+    Creates an InvalidationBus from the ckan.vitality.invalidation.* settings, or None if disabled.
+
+    Parameters
+    ----------
+    opts : dict
+        A dictionary with the 'transport' ('redis' or 'none') and 'channel' settings
+    cache : AccessCache
+        The local cache to invalidate, None to only publish
+
+    Returns
+    -------
+    An InvalidationBus or None
+    """
+    if not opts:
+        return None
+    transport = str(opts.get('transport', 'none')).lower()
+    if transport == 'none':
+        return None
+    if transport != 'redis':
+        log.error("Unknown vitality invalidation transport %s, cache invalidations will not be shared!", transport)
+        return None
+    try:
+        return InvalidationBus(RedisTransport(), opts.get('channel') or DEFAULT_CHANNEL, cache)
+    except Exception as ex:
+        log.error("Could not connect the vitality invalidation bus, cache invalidations will not be shared: %s", ex)
+        return None
@@ -0,0 +1,140 @@
+"""
+Background jobs running the bulk operations of the authorization model outside of the web workers,
+see `ckan jobs worker` and the vitality_job_status action
+"""
+import logging
+
+import ckan.plugins as plugins
+import ckan.plugins.toolkit as toolkit
+from ckan.common import config
+from ckan.lib import search
+from ckan.lib.jobs import job_from_id
+from rq import get_current_job
+
+log = logging.getLogger(__name__)
+
+
+def enqueue(function, args, title):
+    """
+    Enqueues a job on the ckan.vitality.jobs.queue queue
+
+    Parameters
+    ----------
+    function : function
+        One of the jobs below
+    args : list
+        The arguments of the job
+    title : string
+        The title shown by `ckan jobs list`
+
+    Returns
+    -------
+    The rq job
+    """
+    return toolkit.enqueue_job(function, args, title=title, queue=config.get('ckan.vitality.jobs.queue', "default"),
+        rq_kwargs={'timeout': int(config.get('ckan.vitality.jobs.timeout', 3600))})
+
+
+def job_status(job_id):
+    """
+    Returns the status and progress of a job, see the vitality_job_status action
+
+    Parameters
+    ----------
+    job_id : string
+        The id of the job
+
+    Returns
+    -------
+    A dictionary with the 'id', 'title', 'status' ('queued', 'started', 'finished' or 'failed'), 'progress'
+        (the 'operation' and the number of items 'done' so far, None until the first batch), 'result',
+        'error' and the 'enqueued_at', 'started_at' and 'ended_at' times
+    """
+    try:
+        job = job_from_id(job_id)
+    except KeyError:
+        raise toolkit.ObjectNotFound("Job not found")
+    error = None
+    if job.is_failed and job.exc_info:
+        error = job.exc_info.strip().split('\n')[-1]
+    return {
+        'id': job.id,
+        'title': job.meta.get('title'),
+        'status': job.get_status(),
+        'progress': job.meta.get('progress'),
+        'result': job.result,
+        'error': error,
+        'enqueued_at': _isoformat(job.enqueued_at),
+        'started_at': _isoformat(job.started_at),
+        'ended_at': _isoformat(job.ended_at)
+    }
+
+
+def delete_harvest(harvest_id, batch_size=5000):
+    """
+    Deletes the datasets of a harvest source with their templates and elements, see harvest_source_clear
+
+    Returns
+    -------
+    The number of datasets, templates and elements deleted with the graph model
+    """
+    return _meta_authorize().delete_harvest(harvest_id, batch_size, _progress('delete_harvest'))
+
+
+def set_full_access_to_datasets(role_id, batch_size=1000):
+    """
+    Makes a role use the 'Full' template of every dataset, then reindexes them all, see
+    `ckan vitality set-all-datasets-public`
+
+    Returns
+    -------
+    The number of templates updated
+    """
+    updated = _meta_authorize().set_full_access_to_datasets(role_id, batch_size, _progress('set_full_access_to_datasets'))
+    if toolkit.asbool(config.get('ckan.vitality.public_projection', True)):
+        search.rebuild(defer_commit=True)
+        search.commit()
+    return updated
+
+
+def set_minimal_access_to_dataset(dataset_id, batch_size=1000):
+    """
+    Makes every role but the admins and the members of the owner use the 'Minimal' template of a dataset,
+    then reindexes it, see `ckan vitality set-dataset-private`
+
+    Returns
+    -------
+    The number of roles updated
+    """
+    updated = _meta_authorize().set_minimal_access_to_dataset(dataset_id, batch_size, _progress('set_minimal_access_to_dataset'))
+    if toolkit.asbool(config.get('ckan.vitality.public_projection', True)):
+        search.rebuild(dataset_id)
+    return updated
+
+
+def _meta_authorize():
+    """
+    Returns the authorization model of the plugin, jobs write to it at once rather than through the
+    write behind journal, whose pending writes are applied first
+    """
+    meta_authorize = plugins.get_plugin('vitality').meta_authorize
+    meta_authorize.flush()
+    return getattr(meta_authorize, 'target', meta_authorize)
+
+
+def _progress(operation):
+    """
+    Returns a progress callback saving the number of items done so far in the meta of the current job
+    """
+    job = get_current_job()
+
+    def progress(done):
+        log.info("%s: %d done", operation, done)
+        if job != None:
+            job.meta['progress'] = {'operation': operation, 'done': done}
+            job.save_meta()
+    return progress
+
+
+def _isoformat(value):
+    return value.isoformat() if value != None else None
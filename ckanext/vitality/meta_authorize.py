@@ -1,10 +1,12 @@
 from enum import Enum
+from collections import namedtuple
+from types import MappingProxyType
 import logging
 import json
 import copy
 from . import constants
 from flatten_dict import flatten
-from flatten_dict import unflatten
+import functools
 import uuid
 
 
@@ -12,12 +14,180 @@ import uuid
 Enumeration of MetaAuthorize implementations 
 '''
 class MetaAuthorizeType(Enum):
-    SIMPLE = 0 # JSON file based
+    SIMPLE = 0 # In memory, journaled to JSON files
     GRAPH = 1 # Neo4J based
+    BITSET = 2 # In memory, loaded from a Neo4J snapshot
+    SQL = 3 # Tables in the CKAN database
+    MMAP = 4 # Read only, mapped from a published snapshot file
+
+'''
+Enumeration of the ways _decode finds stringified JSON in a package dict
+'''
+class DecodeMode(Enum):
+    FULL = 0 # Attempt to parse every string
+    SNIFF = 1 # Only parse strings starting with '{' or '[', same result as FULL
+    SCHEMA = 2 # As SNIFF, but only top level keys in constants.STRINGIFIED_FIELDS
+
+'''
+Enumeration of the ways _GraphMetaAuth stores the elements (metadata fields) of datasets
+'''
+class ElementMode(Enum):
+    DATASET = 0 # One element node per field per dataset, with random ids
+    SHARED = 1 # One element node per field for all datasets, with ids derived from the field name
+
+'''
+Enumeration of the ways _GraphMetaAuth stores which elements a template can see
+'''
+class TemplateMode(Enum):
+    EDGES = 0 # A can_see relationship per visible element
+    PROPERTY = 1 # The ids of the visible elements listed in the template's visible property
+
+_STRINGIFIED_FIELDS = frozenset(constants.STRINGIFIED_FIELDS)
 
 log = logging.getLogger(__name__)
 
 
+class ViewDecision(namedtuple('ViewDecision', ['unrestricted', 'fields', 'visible', 'public_fields'])):
+    """
+    Immutable answer to "what may this user see of this dataset", resolved in one go.
+
+    Attributes
+    ----------
+    unrestricted : bool
+        True if the dataset is unrestricted for the public or for the user, in which case
+        the package should be returned unfiltered.
+    fields : mapping
+        Read-only mapping of the dataset's field names to their element ids.
+    visible : frozenset
+        The element ids the user can see.
+    public_fields : tuple
+        The names of the fields anonymous (public) users can see.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def build(cls, unrestricted, fields, visible, public_fields):
+        """
+        Creates a ViewDecision, copying its arguments into immutable containers.
+        """
+        return cls(bool(unrestricted), MappingProxyType(dict(fields)), frozenset(visible), tuple(public_fields))
+
+    @property
+    def public_visible(self):
+        """
+        The element ids anonymous (public) users can see.
+        """
+        return frozenset(self.fields[name] for name in self.public_fields if name in self.fields)
+
+
+# Users of the authorization model that are not CKAN users, never deleted when reconciling
+RESERVED_USERS = frozenset(['public'])
+
+
+def diff_fingerprints(source, target):
+    """
+    Computes the changes making the target fingerprints, see MetaAuthorize.get_fingerprints, equal to the source ones
+
+    Parameters
+    ----------
+    source : dict
+        The fingerprints read from CKAN
+    target : dict
+        The fingerprints read from the authorization model
+
+    Returns
+    -------
+    A dictionary of sorted lists, see MetaAuthorize.apply_deltas. Datasets owned by another organization
+    are both in 'delete_datasets' and 'add_datasets', as their templates are provisioned for their owner
+    """
+    def by_id(fingerprints):
+        return {fingerprint[0]: fingerprint for fingerprint in fingerprints}
+
+    users, known_users = by_id(source['users']), by_id(target['users'])
+    orgs, known_orgs = by_id(source['organizations']), by_id(target['organizations'])
+    datasets = source['datasets'] - target['datasets']
+    deleted_orgs = set(known_orgs) - set(orgs)
+    deleted_users = set(known_users) - set(users) - RESERVED_USERS
+    return {
+        'add_users': [{'id': id, 'username': username, 'email': email} for id, username, email in sorted(users[id] for id in set(users) - set(known_users))],
+        'update_users': [{'id': id, 'username': username, 'email': email} for id, username, email in sorted(source['users'] - target['users']) if id in known_users],
+        'delete_users': sorted(deleted_users),
+        'add_admins': sorted(source['admins'] - target['admins']),
+        'remove_admins': sorted(target['admins'] - source['admins'] - deleted_users),
+        'add_orgs': [{'id': id, 'name': name} for id, name in sorted(orgs[id] for id in set(orgs) - set(known_orgs))],
+        'rename_orgs': [{'id': id, 'name': name} for id, name in sorted(source['organizations'] - target['organizations']) if id in known_orgs],
+        'delete_orgs': sorted(deleted_orgs),
+        'add_org_members': sorted(source['org_members'] - target['org_members']),
+        'remove_org_members': sorted((org_id, user_id) for org_id, user_id in target['org_members'] - source['org_members']
+            if org_id not in deleted_orgs and user_id not in deleted_users),
+        'add_groups': sorted(source['groups'] - target['groups']),
+        'delete_groups': sorted(target['groups'] - source['groups']),
+        'add_group_members': sorted(source['group_members'] - target['group_members']),
+        'remove_group_members': sorted((group_id, user_id) for group_id, user_id in target['group_members'] - source['group_members']
+            if group_id in source['groups'] and user_id not in deleted_users),
+        'add_datasets': [{'id': id, 'owner': owner} for id, owner in sorted(datasets, key=lambda dataset: dataset[0])],
+        'delete_datasets': sorted(id for id, owner in target['datasets'] - source['datasets'])
+    }
+
+
+def config_opts(config):
+    """
+    Reads the options of MetaAuthorize.create from the ckan.vitality.* settings, shared by the plugin and the commands
+
+    Parameters
+    ----------
+    config : dict
+        The CKAN config
+
+    Returns
+    -------
+    A dictionary of options, see MetaAuthorize.create
+    """
+    # Invalidations are only shared when a worker keeps state for them to drop
+    stateful = any(str(config.get(name, False)).lower() in ('true', '1', 'yes', 'on')
+        for name in ('ckan.vitality.cache.enabled', 'ckan.vitality.known_datasets.enabled'))
+    stateful = stateful or str(config.get('ckan.vitality.backend', "graph")).lower() == "bitset"
+    return {
+        'host': config.get('ckan.vitality.neo4j.host', "bolt://localhost:7687"),
+        'user': config.get('ckan.vitality.neo4j.user', "neo4j"),
+        'password': config.get('ckan.vitality.neo4j.password', "password"),
+        'element_mode': config.get('ckan.vitality.neo4j.element_mode', "dataset"),
+        'template_mode': config.get('ckan.vitality.neo4j.template_mode', "edges"),
+        'cache': {
+            'enabled': config.get('ckan.vitality.cache.enabled', False),
+            'max_size': config.get('ckan.vitality.cache.max_size', 10000),
+            'ttl': config.get('ckan.vitality.cache.ttl', 300)
+        },
+        'known_datasets': {
+            'enabled': config.get('ckan.vitality.known_datasets.enabled', False)
+        },
+        'bitset': {
+            'max_age': config.get('ckan.vitality.bitset.max_age', 60),
+            'refresh_interval': config.get('ckan.vitality.bitset.refresh_interval', 1)
+        },
+        'mmap': {
+            'path': config.get('ckan.vitality.mmap.path', "vitality.snapshot"),
+            'check_interval': config.get('ckan.vitality.mmap.check_interval', 1)
+        },
+        'simple': {
+            'path': config.get('ckan.vitality.simple.path', "."),
+            'compact_every': config.get('ckan.vitality.simple.compact_every', 1000),
+            'poll_interval': config.get('ckan.vitality.simple.poll_interval', 1)
+        },
+        'invalidation': {
+            'transport': config.get('ckan.vitality.invalidation.transport', "redis" if stateful else "none"),
+            'channel': config.get('ckan.vitality.invalidation.channel', "ckanext-vitality:invalidate:" + config.get('ckan.site_id', "default"))
+        },
+        'write_behind': {
+            'enabled': config.get('ckan.vitality.write_behind.enabled', False),
+            'path': config.get('ckan.vitality.write_behind.path', "vitality_write_behind.db"),
+            'poll_interval': config.get('ckan.vitality.write_behind.poll_interval', 1),
+            'max_attempts': config.get('ckan.vitality.write_behind.max_attempts', 5),
+            'flush_timeout': config.get('ckan.vitality.write_behind.flush_timeout', 10)
+        }
+    }
+
+
 
 class MetaAuthorize(object):
     """ 
@@ -49,23 +219,80 @@ class MetaAuthorize(object):
 
     """
 
+    # How _decode finds stringified JSON, see DecodeMode
+    decode_mode = DecodeMode.SNIFF
+
     @staticmethod
     def create(type, opts):
         # Do imports in create to avoid circular imports
         from ckanext.vitality.impl.simple_meta_auth import _SimpleMetaAuth
         from ckanext.vitality.impl.graph_meta_auth import  _GraphMetaAuth
+        from ckanext.vitality.impl.bitset_meta_auth import _BitsetMetaAuth
+        from ckanext.vitality.impl.sql_meta_auth import _SqlMetaAuth
+        from ckanext.vitality.impl.mmap_meta_auth import _MmapMetaAuth
+        from ckanext.vitality.impl.write_behind_meta_auth import _WriteBehindMetaAuth
+        from ckanext.vitality.cache import create_cache, create_known_datasets, CacheGroup
+        from ckanext.vitality.invalidation import create_bus
 
         result = None
         if type is MetaAuthorizeType.SIMPLE:
-            result = _SimpleMetaAuth()
-            result.__load()
+            simple = opts.get('simple') or {}
+            result = _SimpleMetaAuth(simple.get('path', '.'), compact_every=int(simple.get('compact_every', 1000)),
+                poll_interval=float(simple.get('poll_interval', 1)))
         elif type is MetaAuthorizeType.GRAPH:
-            result = _GraphMetaAuth(opts['host'], opts['user'],  opts['password'])
+            cache = create_cache(opts.get('cache'))
+            known_datasets = create_known_datasets(opts.get('known_datasets'))
+            # The datasets written by other workers are discarded from known_datasets as their cache entries are
+            invalidated = CacheGroup(*[c for c in (cache, known_datasets) if c != None]) if known_datasets != None else cache
+            result = _GraphMetaAuth(opts.get('host'), opts.get('user'), opts.get('password'), cache=cache, invalidation=create_bus(opts.get('invalidation'), invalidated),
+                known_datasets=known_datasets,
+                element_mode=ElementMode[str(opts.get('element_mode', 'dataset')).upper()],
+                template_mode=TemplateMode[str(opts.get('template_mode', 'edges')).upper()],
+                driver=opts.get('driver'))
+        elif type is MetaAuthorizeType.BITSET:
+            # Writes go to the graph and are replayed in memory, reads are answered from memory
+            source = MetaAuthorize.create(MetaAuthorizeType.GRAPH, dict(opts, write_behind=None)) if opts.get('host') else None
+            bitset = opts.get('bitset') or {}
+            # Writes of other processes arrive on the bus of the source
+            result = _BitsetMetaAuth(source, snapshot=opts.get('snapshot'), max_age=float(bitset.get('max_age', 60)),
+                invalidation=source.invalidation if source != None else None, refresh_interval=float(bitset.get('refresh_interval', 1)))
+        elif type is MetaAuthorizeType.SQL:
+            # CKAN's engine unless one is given, the tables are created by `ckan vitality init-sql`
+            result = _SqlMetaAuth(opts.get('engine'))
+        elif type is MetaAuthorizeType.MMAP:
+            # Writes go to the graph, reads are answered from the snapshot published by `ckan vitality publish-snapshot`
+            source = MetaAuthorize.create(MetaAuthorizeType.GRAPH, dict(opts, write_behind=None)) if opts.get('host') else None
+            mapped = opts.get('mmap') or {}
+            result = _MmapMetaAuth(mapped.get('path', 'vitality.snapshot'), source, check_interval=float(mapped.get('check_interval', 1)))
         else:
             log.error("Unknown MetaAuthorize Implementation type!")
 
+        write_behind = opts.get('write_behind') or {}
+        if result != None and str(write_behind.get('enabled', False)).lower() in ('true', '1', 'yes', 'on'):
+            # Writes are queued in a local journal and applied in the background, see flush. Only the outer
+            #   model is wrapped, the sources of the bitset and mmap models are created without it
+            result = _WriteBehindMetaAuth(result, write_behind.get('path', 'vitality_write_behind.db'),
+                poll_interval=float(write_behind.get('poll_interval', 1)), max_attempts=int(write_behind.get('max_attempts', 5)),
+                flush_timeout=float(write_behind.get('flush_timeout', 10)))
+
         return result
 
+    def flush(self, timeout=None):
+        """
+        Waits until the writes made so far are applied, for the models applying writes in the background.
+        Writes are applied at once by default, there is nothing to wait for.
+
+        Parameters
+        ----------
+        timeout : float
+            Seconds to wait at most, None to wait until they are applied
+
+        Returns
+        -------
+        True if the writes were applied, False if the timeout expired first
+        """
+        return True
+
     def add_org(self, org_id, users, org_name):
         """ 
         Add an organization to the authorization model with org_id.
@@ -99,6 +326,41 @@ class MetaAuthorize(object):
 
         raise NotImplementedError("Class %s doesn't implement add_user(self, user_id)" % (self.__class__.__name__))
 
+    def add_users(self, users, batch_size=1000, progress=None):
+        """
+        Add several users to the authorization model, e.g. when seeding it from CKAN.
+
+        Implementations backed by a remote store should override this to send each batch in one round trip,
+        this default adds each user in turn.
+
+        Parameters
+        ----------
+        users : list of dicts
+            The users, with their 'id' and optional 'username', 'email', 'gid' and 'roles' (a list of role ids).
+            The username and email of existing users are left as they are.
+        batch_size : int
+            The number of users added per batch
+        progress : function
+            Called with the number of users added after each batch (optional)
+
+        Returns
+        -------
+        The number of users added
+        """
+        total = 0
+        for start in range(0, len(users), batch_size):
+            batch = users[start:start + batch_size]
+            for user in batch:
+                self.add_user(user['id'], user.get('username'), user.get('email'))
+                for role_id in user.get('roles', []):
+                    self.set_user_role(user['id'], role_id)
+                if user.get('gid') != None:
+                    self.set_user_gid(user['id'], user['gid'])
+            total += len(batch)
+            if progress != None:
+                progress(len(batch))
+        return total
+
     def get_users(self):
         """
         Get a list of user_id s based on the current authorization model.
@@ -106,6 +368,44 @@ class MetaAuthorize(object):
 
         raise NotImplementedError("Class %s doesn't implement get_users(self)" % (self.__class__.__name__))
 
+    def get_fingerprints(self):
+        """
+        Reads compact fingerprints of the users, organizations, groups, memberships and datasets in bulk,
+        so that they can be compared with CKAN's by diff_fingerprints.
+
+        Returns
+        -------
+        A dictionary of sets with
+            'users': (id, username, email) tuples, a missing username or email is ''
+            'admins': the ids of the users with the 'admin' role
+            'organizations': (id, name) tuples
+            'org_members': (organization id, user id) tuples of the users with the 'member' role of an organization
+            'groups': the group ids
+            'group_members': (group id, user id) tuples
+            'datasets': (id, owner organization id) tuples
+        """
+        raise NotImplementedError("Class %s doesn't implement get_fingerprints(self)" % (self.__class__.__name__))
+
+    def apply_deltas(self, deltas, batch_size=1000, progress=None):
+        """
+        Applies the changes computed by diff_fingerprints, except 'add_datasets' which need the
+        dataset dictionaries to be provisioned.
+
+        Parameters
+        ----------
+        deltas : dict
+            The changes, see diff_fingerprints
+        batch_size : int
+            The number of changes applied per batch
+        progress : function
+            Called with the name of the change and the number of changes applied after each batch (optional)
+
+        Returns
+        -------
+        The number of changes applied
+        """
+        raise NotImplementedError("Class %s doesn't implement apply_deltas(self, deltas, batch_size, progress)" % (self.__class__.__name__))
+
     def add_dataset(self, dataset_id, fields, owner_id):
         """
         Add a dataset with the current id (dataset_id), fields and owner_id to the authorization model.
@@ -113,6 +413,20 @@ class MetaAuthorize(object):
 
         raise NotImplementedError("Class %s doesn't implement add_dataset(self, dataset_id, fields, owner_id)" % (self.__class__.__name__))
 
+    def provision_dataset(self, dataset_id, owner_id, dname=None, harvest_id=None, descriptions=None, templates=None):
+        """
+        Add a dataset with its templates, their fields and the roles using them to the authorization model in one unit of work.
+        """
+
+        raise NotImplementedError("Class %s doesn't implement provision_dataset(self, dataset_id, owner_id, dname, harvest_id, descriptions, templates)" % (self.__class__.__name__))
+
+    def provision_datasets(self, datasets):
+        """
+        Provisions several datasets, given as dictionaries of the provision_dataset arguments, and returns the ids
+        of those whose templates were created. Each dataset is provisioned on its own unless the model batches them.
+        """
+        return [dataset['dataset_id'] for dataset in datasets if self.provision_dataset(**dataset)]
+
     def add_metadata_fields(self, dataset_id, fields):
         """
         Add a field to the current dataset in the authorization model.
@@ -148,8 +462,63 @@ class MetaAuthorize(object):
         """
 
         raise NotImplementedError("Class %s doesn't implement set_visible_fields(self, dataset_id, user_id, whitelist)" % (self.__class__.__name__))
+
+    def resolve_view(self, dataset_id, user_id):
+        """
+        Resolve everything needed to display a dataset to a user as a single ViewDecision.
+
+        Implementations backed by a remote store should override this to answer in one round trip,
+        this default composes the individual lookups.
+
+        Parameters
+        ----------
+        dataset_id : string
+            The id/uuid of the dataset to display
+        user_id : string
+            The id/uuid of the user viewing the dataset, 'public' for anonymous users
+
+        Returns
+        -------
+        A ViewDecision, or None if the dataset is not in the authorization model.
+        """
+        if self.get_dataset(dataset_id) == None:
+            return None
+        unrestricted = self.is_unrestricted(dataset_id) or self.is_unrestricted_for_user(dataset_id, user_id)
+        fields = self.get_metadata_fields(dataset_id)
+        public_ids = set(self.get_visible_fields(dataset_id, 'public'))
+        return ViewDecision.build(
+            unrestricted,
+            fields,
+            self.get_visible_fields(dataset_id, user_id),
+            [name for name, id in fields.items() if id in public_ids]
+        )
+
+    def resolve_views(self, dataset_ids, user_id):
+        """
+        Resolve the ViewDecisions for several datasets displayed to the same user, e.g. a page of search results.
+
+        Implementations backed by a remote store should override this to answer in one round trip,
+        this default resolves each dataset in turn.
+
+        Parameters
+        ----------
+        dataset_ids : list of strings
+            The ids/uuids of the datasets to display
+        user_id : string
+            The id/uuid of the user viewing the datasets, 'public' for anonymous users
+
+        Returns
+        -------
+        A dictionary of dataset ids to ViewDecisions, datasets not in the authorization model are left out.
+        """
+        result = {}
+        for dataset_id in dataset_ids:
+            decision = self.resolve_view(dataset_id, user_id)
+            if decision != None:
+                result[dataset_id] = decision
+        return result
     
-    def keys_match(self, unfiltered_content, known_fields):
+    def keys_match(self, unfiltered_content, known_fields, memo=None):
         """
         Checks if fields in unfiltered_content are already known (in known_fields)
         
@@ -159,6 +528,8 @@ class MetaAuthorize(object):
             The dictionary to check for new fields
         known_fields: dict
             Dictionary representing known fields that the dictionary should contain
+        memo: dict, optional
+            Parsed JSON values shared between the calls of a request, see _decode
 
         Returns
         -------
@@ -170,13 +541,16 @@ class MetaAuthorize(object):
             raise TypeError("Only dicts can be checked for new fields! Attempted to check " + str(type(input)))
 
         #Iterate over unfiltered_content and return the keys and a generated UUID if they do not already exist in fields
-        flattened = {(k, uuid.uuid4()) for k in flatten(self._decode(unfiltered_content), reducer='path').keys() if k not in known_fields.keys()}
+        flattened = {(k, uuid.uuid4()) for k in flatten(self._decode(unfiltered_content, memo), reducer='path').keys() if k not in known_fields.keys()}
         return flattened
 
-    def filter_dict(self, unfiltered_content, fields, whitelist):
+    def filter_dict(self, unfiltered_content, fields, whitelist, memo=None):
         """
         Filter a dictionary, returning only white-listed keys.
 
+        Only leaves are matched: a nested value is kept if its '/' separated path is a white-listed
+        field, dictionaries are kept only for the white-listed leaves they contain.
+
         Parameters
         ----------
         unfiltered_content : dict
@@ -185,71 +559,56 @@ class MetaAuthorize(object):
             Dictionary representing the fields and ids the dictionary should contain.
         whitelist: list of uuids
             The list of permitted field ids.
+        memo: dict, optional
+            Parsed JSON values shared between the calls of a request, see _decode
 
         Returns
         -------
         a new dictionary with keys and values corresponding to fields and whitelist.      
         """
 
-        def is_visible(key):
-            """
-            Predicate to establish that a key entry can be made public based on data in fields.
-
-            Parameters
-            ----------
-            key: unicode
-                The encoded string key for the entry.
-
-            Returns
-            -------
-            True if the entry should be seen by public and False if not.
-            """
-            #Unusable in python 3
-            #key_string = key.encode("UTF-8")
-            #return key_string in fields and fields[key_string] in whitelist
-
-            return key in fields and fields[key] in whitelist
-
-        def test_if_flat(key, val):
-            """
-            Helper function to handle recursion on the case of val being a dict, otherwise 
-            returns the value if whitelisted or None.
-
-            Parameters
-            ----------
-            key: string
-                The parameter name
-            val: string or dict
-                The parameter value
-            
-            Returns
-            -------
-            The recursed value of for key or None if 
-            """
-            if not isinstance(val, dict):
-                return val
-            else:
-                return self.filter_dict(val, fields, whitelist)
-
         # Trivially check input type
         if not isinstance(unfiltered_content, dict):
             raise TypeError("Only dicts can be filtered recursively! Attempted to filter " + str(type(input)))
-        flattened = {k: test_if_flat(k, v) for k, v in flatten(self._decode(unfiltered_content), reducer='path').items() if is_visible(k)}
         # do not clear the original dictionary, which is needed for admin access.
-        # UNFLATTEN filtered dictionary
-        #log.info("Flattened dict {}".format(flattened))
-        unflattened = unflatten(flattened, splitter='path')
-        # STRINGIFY required json fields
-        return unflattened
+        return _apply_filter_plan(self._filter_plan(fields, whitelist), self._decode(unfiltered_content, memo))
 
-    def _decode(self, input):
+    @staticmethod
+    def _filter_plan(fields, whitelist):
+        """
+        Returns the compiled filter plan for the fields permitted by whitelist.
+
+        Plans are cached on the set of permitted field paths, so datasets sharing a template
+        (e.g. the default Minimal template) share a plan.
+
+        Parameters
+        ----------
+        fields: dict
+            Dictionary representing the fields and ids the dictionary should contain.
+        whitelist: list of uuids
+            The list of permitted field ids.
+
+        Returns
+        -------
+        The root of the plan, a dictionary of keys to _PlanNodes.
+        """
+        if not isinstance(whitelist, (set, frozenset)):
+            whitelist = set(whitelist)
+        return _compile_filter_plan(frozenset(name for name, id in fields.items() if id in whitelist))
+
+    def _decode(self, input, memo=None):
         """
         Decode dictionary containing string encoded JSON objects. 
 
+        Which strings are parsed depends on decode_mode, see DecodeMode.
+
         Parameters
         ----------
         input: dict or stringified JSON
             The dictionary to decode
+        memo: dict, optional
+            Parsed values keyed by their JSON text. Share one dict between the calls made for a
+            request so that values repeated across datasets are only parsed once.
 
         Returns
         -------
@@ -263,37 +622,50 @@ class MetaAuthorize(object):
         else:
             raise TypeError("_decode can only decode str or dict inputs! Got {}".format(str(type(input))))
 
-        if root != None:
-            for key,value in root.items():
-                # If the value is a string attempt to parse it as json
-                #log.info("Attempting to decode: %s - %s ", key, str(type(value)))
-                #TODO - this may need to change for python3
-                if type(value) == str:
-                    #log.info("%s is a str/unicode!", key)
-                    parsed_json = MetaAuthorize._parse_json(value, key)
-
-                    # If the string parsed 
-                    if parsed_json != None:
-                        # into a dictonary 
-                        if type(parsed_json) == dict:
-                            # decode the parsed dict
-                            parsed_json = self._decode(parsed_json)
-                            #log.info('%s - parsed type %s', key, type(parsed_json))
-                            # replace the value at the current key
-                            root[key] = parsed_json
-                        # into a list
-                        elif type(parsed_json) == list:
-                            # replace the value at the current key
-                            root[key] = parsed_json
-
-
-                # Else if the value is a dictonary, recurse!
-                elif type(value) == dict:
-                    root[key] = self._decode(value)
-
-                
+        if type(root) == dict:
+            self.__decode_values(root, memo, _STRINGIFIED_FIELDS if self.decode_mode is DecodeMode.SCHEMA else None)
         return root
 
+    def __decode_values(self, root, memo, schema=None):
+        """
+        Replaces the string values of root holding a JSON dict or list with the decoded value, in place.
+        If schema is given only the keys it contains are parsed.
+        """
+        for key,value in root.items():
+            # If the value is a string attempt to parse it as json
+            if type(value) == str:
+                if schema != None and key not in schema:
+                    continue
+                parsed_json = self.__parse_value(value, memo)
+                # Only dictionaries and lists replace the string
+                if parsed_json != None:
+                    root[key] = parsed_json
+
+            # Else if the value is a dictonary, recurse!
+            elif type(value) == dict:
+                self.__decode_values(value, memo)
+
+    def __parse_value(self, value, memo):
+        """
+        Returns the decoded dict or list held by the string value, or None if it holds anything else.
+        """
+        # Only dicts and lists are kept, so any other string can be skipped without parsing
+        if self.decode_mode is not DecodeMode.FULL and not _looks_like_json(value):
+            return None
+        if memo != None and value in memo:
+            return _clone(memo[value])
+        parsed_json = MetaAuthorize._parse_json(value)
+        if type(parsed_json) == dict:
+            # decode the parsed dict
+            self.__decode_values(parsed_json, memo)
+        elif type(parsed_json) != list:
+            parsed_json = None
+        if memo != None:
+            # Callers may alter the value returned, the memo keeps its own copy
+            memo[value] = parsed_json
+            return _clone(parsed_json)
+        return parsed_json
+
     def _encode(self, input):
 
         for key,value in input.items():
@@ -316,3 +688,126 @@ class MetaAuthorize(object):
         except TypeError:
             #log.warn("Value could not be parsed as JSON, %s", key)
             return None
+
+
+class _PlanNode(object):
+    """
+    A node of a compiled filter plan.
+
+    Attributes
+    ----------
+    leaf : bool
+        True if a non-dict value at this path is permitted.
+    children : dict
+        The keys permitted below this path and their _PlanNodes.
+    """
+    __slots__ = ('leaf', 'children')
+
+    def __init__(self):
+        self.leaf = False
+        self.children = {}
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_filter_plan(allowed_paths):
+    """
+    Compiles a frozenset of permitted '/' separated field paths into a tree of _PlanNodes.
+    """
+    root = {}
+    for path in allowed_paths:
+        children = root
+        parts = path.split('/')
+        for part in parts[:-1]:
+            children = children.setdefault(part, _PlanNode()).children
+        children.setdefault(parts[-1], _PlanNode()).leaf = True
+    return root
+
+
+def _apply_filter_plan(plan, content):
+    """
+    Filters content in a single traversal, keeping the values permitted by plan.
+
+    Parameters
+    ----------
+    plan : dict
+        Dictionary of permitted keys and their _PlanNodes, as returned by _compile_filter_plan.
+    content : dict
+        The decoded dictionary to filter.
+
+    Returns
+    -------
+    A new dictionary, dictionaries without any permitted value are left out. An empty dictionary
+    is kept when its own path is permitted, as the legacy filter did.
+    """
+    result = {}
+    for key, value in content.items():
+        if isinstance(key, str) and '/' in key:
+            _apply_filter_plan_path(plan, key.split('/'), value, result)
+            continue
+        node = plan.get(key)
+        if node == None:
+            continue
+        if isinstance(value, dict) and not value:
+            if node.leaf:
+                result[key] = {}
+        elif isinstance(value, dict):
+            if node.children:
+                filtered = _apply_filter_plan(node.children, value)
+                if filtered:
+                    result[key] = filtered
+        elif node.leaf:
+            result[key] = value
+    return result
+
+
+def _apply_filter_plan_path(plan, parts, value, result):
+    """
+    Slow path of _apply_filter_plan for keys containing '/', which are nested in the result
+    the same way as the equivalent path of nested keys.
+    """
+    node = None
+    children = plan
+    for part in parts:
+        node = children.get(part)
+        if node == None:
+            return
+        children = node.children
+    if isinstance(value, dict) and not value:
+        if not node.leaf:
+            return
+    elif isinstance(value, dict):
+        value = _apply_filter_plan(node.children, value) if node.children else {}
+        if not value:
+            return
+    elif not node.leaf:
+        return
+    target = result
+    for part in parts[:-1]:
+        target = target.setdefault(part, {})
+        if not isinstance(target, dict):
+            return
+    if isinstance(value, dict) and isinstance(target.get(parts[-1]), dict):
+        target[parts[-1]].update(value)
+    else:
+        target[parts[-1]] = value
+
+
+def _looks_like_json(value):
+    """
+    Cheaply checks whether a string could hold a JSON dict or list.
+    """
+    first = value[:1]
+    if first.isspace():
+        first = value.lstrip()[:1]
+    return first == '{' or first == '['
+
+
+def _clone(value):
+    """
+    Copies a decoded JSON value, faster than copy.deepcopy as only dicts and lists need copying.
+    """
+    if type(value) == dict:
+        return {k: _clone(v) for k, v in value.items()}
+    if type(value) == list:
+        return [_clone(v) for v in value]
+    return value
@@ -7,8 +7,10 @@ import copy
 from . import constants
 import json
 import datetime
+import atexit
 
-from ckanext.vitality.meta_authorize import MetaAuthorize, MetaAuthorizeType
+from ckanext.vitality.meta_authorize import MetaAuthorize, MetaAuthorizeType, DecodeMode, config_opts
+from ckanext.vitality.provisioning import ProvisioningBuffer
 
 from pprint import pprint
 
@@ -18,6 +20,7 @@ import ckan.plugins.toolkit as toolkit
 import ckan.plugins.interfaces as interfaces
 from ckan.common import config
 import ckanext.vitality.cli as cli
+import ckanext.vitality.jobs as jobs
 
 #TODO add variable for address
 
@@ -50,6 +53,14 @@ class VitalityPlugin(plugins.SingletonPlugin):
 
     # Authorization Interface
     meta_authorize = None
+    # Serve anonymous search results from the projection computed in before_index
+    public_projection = True
+    # Run the bulk operations of the authorization model as background jobs, see ckan.vitality.jobs.*
+    background_jobs = True
+    # Seconds the actions reading the authorization model wait for the queued writes, see ckan.vitality.write_behind.*
+    flush_timeout = 10
+    # Buffers the provisioning of harvested datasets, None to provision each dataset when indexed, see ckan.vitality.harvest_buffer.*
+    provisioning = None
 
     def get_commands(self):
         return cli.get_commands()
@@ -75,15 +86,32 @@ class VitalityPlugin(plugins.SingletonPlugin):
             "package_create" : self.package_create,
             "package_delete" : self.package_delete,
             "user_show" : self.user_show,
-            "harvest_source_clear" : self.harvest_source_clear
+            "harvest_source_clear" : self.harvest_source_clear,
+            "vitality_cache_stats" : self.vitality_cache_stats,
+            "vitality_job_status" : self.vitality_job_status
         }
 
+    # Reports the access cache counters of this worker, sysadmins only
+    def vitality_cache_stats(self, context, data_dict=None):
+        toolkit.check_access('sysadmin', context, data_dict)
+        return self.meta_authorize.get_cache_stats()
+
+    # Reports the status and progress of a vitality background job, sysadmins only
+    def vitality_job_status(self, context, data_dict=None):
+        toolkit.check_access('sysadmin', context, data_dict)
+        return jobs.job_status(toolkit.get_or_bust(data_dict, 'id'))
+
     # Testing to try to hook into the harvester clear
     @toolkit.chained_action
     def harvest_source_clear(self, action, context, data_dict=None):
         log.info("Clearing harvest")
         result = action(context, data_dict)
-        self.meta_authorize.delete_harvest(data_dict['id'])
+        if self.background_jobs:
+            # Large sources would time out the web worker
+            job = jobs.enqueue(jobs.delete_harvest, [data_dict['id']], "vitality delete harvest " + data_dict['id'])
+            log.info("Queued job %s deleting the datasets of harvest source %s", job.id, data_dict['id'])
+        else:
+            self.meta_authorize.delete_harvest(data_dict['id'])
         return result
 
     # Unused right now, but useful for logging
@@ -97,6 +125,8 @@ class VitalityPlugin(plugins.SingletonPlugin):
     def organization_member_create(self, action, context, data_dict=None):
         #log.info("A member has been added by %s", context['auth_user_obj'].name)
         org_id= data_dict['id']
+        # The user or organization may have been created moments ago
+        self.meta_authorize.flush(self.flush_timeout)
         user_id = self.meta_authorize.get_user_by_username(data_dict['username'])['id']
         # Get roles for org
         org_roles = self.meta_authorize.get_roles(org_id)
@@ -114,6 +144,7 @@ class VitalityPlugin(plugins.SingletonPlugin):
         log.info("Collected ids")
         log.info(org_id)
         log.info(user_id)
+        self.meta_authorize.flush(self.flush_timeout)
         role_id = self.meta_authorize.get_roles(org_id)['member']
         self.meta_authorize.detach_user_role(user_id, role_id)
         return action(context,data_dict)
@@ -123,6 +154,7 @@ class VitalityPlugin(plugins.SingletonPlugin):
     def user_update(self, action, context, data_dict=None):
         #log.info("An user has been edited by %s", context['auth_user_obj'].name)
         ckan_user_info = toolkit.get_action('user_show')(context,data_dict)
+        self.meta_authorize.flush(self.flush_timeout)
         neo4j_user_info = self.meta_authorize.get_user(ckan_user_info['id'])
         log.info(data_dict)
         # Unsure if username can be changed, but this can work around it if so
@@ -173,6 +205,7 @@ class VitalityPlugin(plugins.SingletonPlugin):
         ckan_org_info = toolkit.get_action('organization_show')(context, data_dict)
         ckan_org_id= ckan_org_info['id']
         ckan_org_name = data_dict['name']
+        self.meta_authorize.flush(self.flush_timeout)
         neo4j_org_name = self.meta_authorize.get_organization(ckan_org_id)['name']
         if(neo4j_org_name != ckan_org_name):
             self.meta_authorize.set_organization_name(ckan_org_id, ckan_org_name)
@@ -186,6 +219,8 @@ class VitalityPlugin(plugins.SingletonPlugin):
         org_name = data_dict['title_translated-en']
         org_id = result['id']
         user_list = []
+        if data_dict['users']:
+            self.meta_authorize.flush(self.flush_timeout)
         for user in data_dict['users']:
             # TODO If user is an admin for the organization, give them admin form access too
             user_id = self.meta_authorize.get_user_by_username(user['name'])['id']
@@ -230,6 +265,8 @@ class VitalityPlugin(plugins.SingletonPlugin):
         #log.info("An package has been deleted by %s", context['auth_user_obj'].name)
         dataset_id = data_dict['id']
         log.info("Deleting package " + dataset_id)
+        if self.provisioning != None:
+            self.provisioning.discard(dataset_id)
         self.meta_authorize.delete_dataset(dataset_id)
         return action(context, data_dict)
 
@@ -287,15 +324,46 @@ class VitalityPlugin(plugins.SingletonPlugin):
 
         # Load neo4j connection parameters from config
         # Initalize meta_authorize
-        self.meta_authorize = MetaAuthorize.create(MetaAuthorizeType.GRAPH, {
-            'host': config.get('ckan.vitality.neo4j.host', "bolt://localhost:7687"),
-            'user': config.get('ckan.vitality.neo4j.user', "neo4j"),
-            'password': config.get('ckan.vitality.neo4j.password', "password")
-        })
+        self.meta_authorize = MetaAuthorize.create(MetaAuthorizeType[config.get('ckan.vitality.backend', "graph").upper()], config_opts(config))
+        self.meta_authorize.decode_mode = DecodeMode[config.get('ckan.vitality.decode_mode', "sniff").upper()]
         self.default_dataset_access = config.get('ckan.vitality.default_access', "Minimal")
+        self.public_projection = toolkit.asbool(config.get('ckan.vitality.public_projection', True))
+        self.flush_timeout = float(config.get('ckan.vitality.write_behind.flush_timeout', 10))
+        self.background_jobs = toolkit.asbool(config.get('ckan.vitality.jobs.enabled', True))
+        if toolkit.asbool(config.get('ckan.vitality.harvest_buffer.enabled', False)):
+            self.provisioning = ProvisioningBuffer(self.meta_authorize,
+                batch_size=int(config.get('ckan.vitality.harvest_buffer.batch_size', 500)),
+                flush_interval=float(config.get('ckan.vitality.harvest_buffer.flush_interval', 5)))
+            # The datasets of the last job, if it did not stay idle for flush_interval before shutdown
+            atexit.register(self.provisioning.flush)
+
+        # Warn about missing constraints/indexes, see `ckan vitality init-schema`
+        if toolkit.asbool(config.get('ckan.vitality.neo4j.verify_schema', False)):
+            self.verify_schema()
         
+    def verify_schema(self):
+        """Logs a warning for each Neo4j constraint or index that is missing or not online yet.
+
+        Returns
+        -------
+        True if all of them are online, False otherwise
+        """
+        try:
+            statuses = self.meta_authorize.get_schema_status()
+        except Exception as ex:
+            log.error("Could not verify the vitality Neo4j schema: %s", ex)
+            return False
+        missing = [status for status in statuses if status['state'] != 'ONLINE']
+        for status in missing:
+            log.warning("Vitality Neo4j %s %s on :%s(%s) is %s, run 'ckan vitality init-schema'",
+                status['kind'], status['name'], status['label'], status['property'], status['state'])
+        return len(missing) == 0
+
     # IPackageController -> When displaying a dataset
     def after_show(self,context, pkg_dict):
+        # package_show can read from the search index, the public projection is for after_search only
+        pkg_dict.pop(constants.PUBLIC_VIEW_FIELD, None)
+
         if context['package'].type != 'dataset':
             log.info("Not a dataset, returning")
             return pkg_dict
@@ -327,27 +395,23 @@ class VitalityPlugin(plugins.SingletonPlugin):
             user = context['auth_user_obj']
             user_id = user.id
 
-        
-        if(self.meta_authorize.is_unrestricted(dataset_id)):
-            log.info("Dataset is unrestricted")
-            return pkg_dict
-            
-        if(self.meta_authorize.is_unrestricted_for_user(dataset_id, user_id)):
-            log.info("User has full access")
+
+        # Resolve the user's access to the dataset in a single round trip
+        decision = self.meta_authorize.resolve_view(dataset_id, user_id)
+        if(decision == None or decision.unrestricted):
+            log.info("Dataset is unrestricted or user has full access")
             return pkg_dict
-        
-        # Description
-        if 'notes' in pkg_dict and pkg_dict['notes']:
-            notes = pkg_dict['notes']
 
         log.info(dataset_id)
         # Load white-listed fields
-        visible_fields = self.meta_authorize.get_visible_fields(dataset_id, user_id)
+        visible_fields = decision.visible
 
         # Load dataset fields
-        dataset_fields = self.meta_authorize.get_metadata_fields(dataset_id)
+        dataset_fields = decision.fields
+        # Stringified JSON values are decoded once, keys_match and filter_dict share the result
+        memo = {}
         # Extra keys are checked here
-        extra_keys = self.meta_authorize.keys_match(pkg_dict, dataset_fields)
+        extra_keys = self.meta_authorize.keys_match(pkg_dict, dataset_fields, memo)
         if extra_keys != set():
             log.info("Extra keys found in after show! Warning!")
             log.info(extra_keys)
@@ -356,7 +420,7 @@ class VitalityPlugin(plugins.SingletonPlugin):
             #TODO Call and implement add metadata fields
 
         # Filter metadata fields
-        filtered = self.meta_authorize.filter_dict(pkg_dict, dataset_fields, visible_fields)
+        filtered = self.meta_authorize.filter_dict(pkg_dict, dataset_fields, visible_fields, memo)
         # Replace pkg_dict with filtered
         pkg_dict.clear()
         for k,v in filtered.items():
@@ -364,7 +428,7 @@ class VitalityPlugin(plugins.SingletonPlugin):
 
 
         # Inject public visibility settings
-        pkg_dict['public-visibility'] = self.meta_authorize.get_public_fields(dataset_id)
+        pkg_dict['public-visibility'] = list(decision.public_fields)
 
         # Inject empty resources list if resources has been filtered.
         if 'resources' not in pkg_dict:
@@ -392,7 +456,7 @@ class VitalityPlugin(plugins.SingletonPlugin):
             else:
                 user = toolkit.g.userobj
                 user_id = user.id
-        except Exception as e:
+        except Exception:
             # This is a bit of a band-aid fix for an issue during seeding
             #   where the context doesn't properly get passed from cli.py so
             #   the user information cannot be accessed. user_id isn't needed for
@@ -404,69 +468,131 @@ class VitalityPlugin(plugins.SingletonPlugin):
             user_id = 'public'
         # However, at a time only loads a portion of the results
         datasets = search_results['results']
-        
+
+        # Public projections precomputed by before_index, only meant for anonymous users
+        public_views = [pkg_dict.pop(constants.PUBLIC_VIEW_FIELD, None) for pkg_dict in datasets]
+        if user_id != 'public' or not self.public_projection:
+            public_views = [None] * len(datasets)
+
+        # Resolve the user's access to every dataset on the page in a single round trip,
+        #   skipping the ones served from their projection
+        decisions = self.meta_authorize.resolve_views(
+            [pkg_dict["id"] for pkg_dict, public_view in zip(datasets, public_views) if "id" in pkg_dict and public_view == None],
+            user_id
+        )
+        # Datasets on a page often share stringified JSON values (contacts, references), decode each only once
+        memo = {}
+
         # Go through each of the datasets returned in the results
         for x in range(len(datasets)):
             
             pkg_dict = search_results['results'][x]
+            public_view = public_views[x]
 
             # Loop code is copied from after_show due to pkg_dict similarity
             if "id" in pkg_dict:
+                if public_view != None:
+                    # Serve the projection without touching the graph
+                    if not public_view.get('unrestricted'):
+                        pkg_dict.clear()
+                        pkg_dict.update(public_view['view'])
+                    continue
+
                 dataset_id = pkg_dict["id"]
+                decision = decisions.get(dataset_id)
 
-                if(self.meta_authorize.get_dataset(dataset_id) == None):
+                if(decision == None):
                     log.info(dataset_id)
                     log.info("Dataset not in model. Returning")
-                elif(self.meta_authorize.is_unrestricted(dataset_id)):
-                    log.info("Dataset is unrestricted")
-                elif(self.meta_authorize.is_unrestricted_for_user(dataset_id, user_id)):
-                    log.info("User has full access")
+                elif(decision.unrestricted):
+                    log.info("Dataset is unrestricted or user has full access")
                 else:
-                    # Load dataset fields
-                    dataset_fields = self.meta_authorize.get_metadata_fields(dataset_id)
-                    
-                    log.info("retrieved fields")
-                    # Load white-listed fields
-                    visible_fields = self.meta_authorize.get_visible_fields(dataset_id, user_id)
-
-                    # If no relation exists between user and dataset, treat as public
-                    if len(visible_fields) == 0:
-                        visible_fields = self.meta_authorize.get_visible_fields(dataset_id, 'public')
-                    
-                    # Filter metadata fields
-                    filtered = self.meta_authorize.filter_dict(pkg_dict, dataset_fields, visible_fields)
-
-                    # Replace pkg_dict with filtered
-                    pkg_dict.clear()
-                    for k,v in filtered.items():
-                        pkg_dict[k] = v
-
-                    # Inject public visibility settings
-                    pkg_dict['public-visibility'] = self.meta_authorize.get_public_fields(dataset_id)
-
-                    # Inject empty resources list if resources has been filtered.
-                    if 'resources' not in pkg_dict:
-                        pkg_dict['resources'] = []
-
-                    # If the metadata is restricted in any way will add a "resource" so a tag can be generated
-                    # TODO Check if restricted for current user AS WELL AS for public user (so we can harvest in as restricted)
-                    # TODO Find somewhere to add URL back to VITALITY for tag
-                    pkg_dict['resources'].append({"format" : "VITALITY"})
-
-                    
-                    ## If current user does not have full access to the metadata, tag the dataset as such
-                    #user_dataset_access = self.meta_authorize.get_template_access_for_user(dataset_id, user_id)
-                    #if(user_dataset_access != "Full"):
-                        #pkg_dict['resources'].append({"format" : "Restricted metadata"})
-                    
-
-                    # Add filler for specific fields with no value present so they can be harvested
-                    if 'notes_translated' not in pkg_dict or not pkg_dict['notes_translated']:
-                        pkg_dict['notes_translated'] = {"fr": "-", "en":"-"}
-                    if 'xml_location_url' not in pkg_dict or not pkg_dict['xml_location_url']:
-                        pkg_dict['xml_location_url'] = '-'
+                    self.filter_search_result(pkg_dict, decision, memo)
         return search_results
 
+    def filter_search_result(self, pkg_dict, decision, memo=None):
+        """Filters a search result in place to what decision allows.
+
+        Parameters
+        ----------
+        pkg_dict : dict
+            The search result to filter
+        decision : ViewDecision
+            The restricted access the current user has to the dataset
+        memo : dict
+            Stringified values already decoded during this request
+
+        Returns
+        -------
+        None
+        """
+        # Load dataset fields
+        dataset_fields = decision.fields
+        
+        log.info("retrieved fields")
+        # Load white-listed fields
+        visible_fields = decision.visible
+
+        # If no relation exists between user and dataset, treat as public
+        if len(visible_fields) == 0:
+            visible_fields = decision.public_visible
+        
+        # Filter metadata fields
+        filtered = self.meta_authorize.filter_dict(pkg_dict, dataset_fields, visible_fields, memo)
+
+        # Replace pkg_dict with filtered
+        pkg_dict.clear()
+        for k,v in filtered.items():
+            pkg_dict[k] = v
+
+        # Inject public visibility settings
+        pkg_dict['public-visibility'] = list(decision.public_fields)
+
+        # Inject empty resources list if resources has been filtered.
+        if 'resources' not in pkg_dict:
+            pkg_dict['resources'] = []
+
+        # If the metadata is restricted in any way will add a "resource" so a tag can be generated
+        # TODO Check if restricted for current user AS WELL AS for public user (so we can harvest in as restricted)
+        # TODO Find somewhere to add URL back to VITALITY for tag
+        pkg_dict['resources'].append({"format" : "VITALITY"})
+
+        
+        ## If current user does not have full access to the metadata, tag the dataset as such
+        #user_dataset_access = self.meta_authorize.get_template_access_for_user(dataset_id, user_id)
+        #if(user_dataset_access != "Full"):
+            #pkg_dict['resources'].append({"format" : "Restricted metadata"})
+        
+
+        # Add filler for specific fields with no value present so they can be harvested
+        if 'notes_translated' not in pkg_dict or not pkg_dict['notes_translated']:
+            pkg_dict['notes_translated'] = {"fr": "-", "en":"-"}
+        if 'xml_location_url' not in pkg_dict or not pkg_dict['xml_location_url']:
+            pkg_dict['xml_location_url'] = '-'
+
+    def public_view(self, pkg_dict):
+        """Computes the search result an anonymous user gets for pkg_dict.
+
+        Parameters
+        ----------
+        pkg_dict : dict
+            The search result as stored in the index, it is not modified
+
+        Returns
+        -------
+        A dictionary with 'unrestricted' set to True if the public sees pkg_dict as is,
+        otherwise 'view' holds the filtered search result
+        """
+        decision = self.meta_authorize.resolve_view(pkg_dict['id'], 'public')
+        if decision == None and self.provisioning != None:
+            # Harvested and not provisioned yet
+            decision = self.provisioning.pending_view(pkg_dict['id'])
+        if decision == None or decision.unrestricted:
+            return {'unrestricted': True}
+        view = copy.deepcopy(pkg_dict)
+        self.filter_search_result(view, decision)
+        return {'unrestricted': False, 'view': view}
+
     def after_create(self, context, pkg_dict):
         log.info("HIT after_create")
         return pkg_dict
@@ -501,75 +627,59 @@ class VitalityPlugin(plugins.SingletonPlugin):
     def before_index(self, pkg_dict):
         log.info("HIT before index")
         self.add_dataset(pkg_dict)
+        if self.public_projection and pkg_dict.get('type') == 'dataset':
+            self.add_public_view(pkg_dict)
         return pkg_dict
 
+    def add_public_view(self, pkg_dict):
+        """Stores the public projection of a dataset alongside its index document.
+
+        The dicts search results are loaded from (validated_data_dict, data_dict with
+        use_default_schema) are given a PUBLIC_VIEW_FIELD that after_search serves to
+        anonymous users without resolving their access.
+
+        Parameters
+        ----------
+        pkg_dict : dict
+            The index document passed to before_index
+
+        Returns
+        -------
+        None
+        """
+        for key in ('validated_data_dict', 'data_dict'):
+            if not pkg_dict.get(key):
+                continue
+            try:
+                data_dict = json.loads(pkg_dict[key])
+                data_dict.pop(constants.PUBLIC_VIEW_FIELD, None)
+                data_dict[constants.PUBLIC_VIEW_FIELD] = self.public_view(data_dict)
+                pkg_dict[key] = json.dumps(data_dict)
+            except Exception as ex:
+                # after_search falls back to resolving access for datasets without a projection
+                log.warning("Could not compute the public view of %s: %s", pkg_dict['id'], ex)
+
     def add_dataset(self, pkg_dict):
         if(pkg_dict['type'] != 'dataset'):
             log.info("This is not a dataset. Returning")
             return pkg_dict
 
-        dataset_id = pkg_dict["id"]
-        log.info('Adding ' + dataset_id)
-        # Generate the default templates (full and min). For non-default templates use uuid to generate ID
+        dataset = dataset_provisioning(pkg_dict, self.default_dataset_access)
+        log.info('Adding ' + dataset['dataset_id'])
 
-        if 'title' in pkg_dict:
-            self.meta_authorize.add_dataset(dataset_id, pkg_dict['owner_org'], dname=pkg_dict['title'])
-        else:
-            self.meta_authorize.add_dataset(dataset_id, pkg_dict['owner_org'], dname=pkg_dict['title_translated']['en'])
-
-
-        if 'h_source_id' in pkg_dict:
-            log.info("Adding harvest source id")
-            self.meta_authorize.set_dataset_harvest_id(dataset_id, pkg_dict['h_source_id'])
+        if self.provisioning != None:
+            # Harvested datasets are provisioned together, the others at once
+            self.provisioning.add(dataset)
+            return
 
-        templates = self.meta_authorize.get_templates(dataset_id)
-        if len(templates) > 0:
-            log.info("Dataset already exists in Neo4j. Skipping")
+        # The dataset, templates, elements and access are created in a single transaction,
+        #   templates are only added if the dataset has none yet
+        if self.meta_authorize.provision_dataset(**dataset):
+            log.info('Added templates')
         else:
-            log.info('Adding templates')
-            try:
-                if 'notes' in pkg_dict and pkg_dict['notes']:
-                    dataset_notes = json.loads(pkg_dict['notes'])
-                else:
-                    dataset_notes = json.loads(pkg_dict['notes_translated'])
-                self.meta_authorize.set_dataset_description(dataset_id, "en", dataset_notes['en'])
-                self.meta_authorize.set_dataset_description(dataset_id, "fr", dataset_notes['fr'])
-            except ValueError as err:
-                log.info("No description found")
-
-            # Generate an id, name, and description for the default templates (full and minimal)
-            # TODO Create a better description based on the final
-            full_id = str(uuid.uuid4())
-            full_name = 'Full'
-            full_description = "This is the full, unrestricted template. Choosing this will display the full set of metadata for the assigned role."
-            minimal_id = str(uuid.uuid4())
-            minimal_name = "Minimal"
-            minimal_description = "This template restricts some metadata for the chosen role. Restricted fields include location and temporal data"
-
-            # Adds the full and minimal template
-            self.meta_authorize.add_template_full(dataset_id, full_id, full_name, generate_default_fields(), full_description)
-            self.meta_authorize.add_template(dataset_id, minimal_id, minimal_name, minimal_description)
-
-            self.meta_authorize.set_visible_fields(
-                minimal_id,
-                generate_whitelist(
-                    default_public_fields(self.meta_authorize.get_metadata_fields(dataset_id))
-                )
-            )
-        
-            # Always add access for public and admin roles
-            # TODO Discuss change default for public?
-            self.meta_authorize.set_template_access('admin', full_id)
-            if self.default_dataset_access == "Full":
-                self.meta_authorize.set_template_access('public', full_id)
-            else:
-                self.meta_authorize.set_template_access('public', minimal_id)
-
-            # Add access for any roles in the organization
-            for role in self.meta_authorize.get_roles(pkg_dict['owner_org']).values():
-                self.meta_authorize.set_template_access(str(role), full_id)
+            log.info("Dataset already exists in Neo4j. Skipping")
 
-            #Add serves for organizations
+        #Add serves for organizations
 
 '''
 Utility for printing pkg_dict structure
@@ -645,6 +755,80 @@ def default_public_fields(fields):
     return result
 
 
+def dataset_provisioning(pkg_dict, default_access="Minimal"):
+    """
+    Returns the arguments of MetaAuthorize.provision_dataset for a dataset, with its default templates (Full and Minimal)
+
+    Parameters
+    ----------
+    pkg_dict : dict
+        The dataset, as indexed or as returned by package_show
+    default_access : string
+        The template used by the public, see ckan.vitality.default_access
+
+    Returns
+    -------
+    A dictionary of the dataset_id, owner_id, dname, harvest_id, descriptions and templates arguments
+    """
+    dataset_id = pkg_dict["id"]
+    # Generate the default templates (full and min). For non-default templates use uuid to generate ID
+    if 'title' in pkg_dict:
+        dataset_name = pkg_dict['title']
+    else:
+        dataset_name = pkg_dict['title_translated']['en']
+
+    harvest_id = None
+    if 'h_source_id' in pkg_dict:
+        log.info("Adding harvest source id")
+        harvest_id = pkg_dict['h_source_id']
+
+    descriptions = None
+    try:
+        if 'notes' in pkg_dict and pkg_dict['notes']:
+            dataset_notes = json.loads(pkg_dict['notes'])
+        else:
+            dataset_notes = json.loads(pkg_dict['notes_translated'])
+        descriptions = {"en": dataset_notes['en'], "fr": dataset_notes['fr']}
+    except (ValueError, TypeError, KeyError):
+        log.info("No description found")
+
+    # Generate an id, name, and description for the default templates (full and minimal)
+    # TODO Create a better description based on the final
+    fields = generate_default_fields()
+    full_template = {
+        'id': str(uuid.uuid4()),
+        'name': 'Full',
+        'description': "This is the full, unrestricted template. Choosing this will display the full set of metadata for the assigned role.",
+        'fields': fields,
+        # Always add access for admin roles, and for any roles in the organization
+        'roles': ['admin'],
+        'org_roles': True
+    }
+    minimal_template = {
+        'id': str(uuid.uuid4()),
+        'name': "Minimal",
+        'description': "This template restricts some metadata for the chosen role. Restricted fields include location and temporal data",
+        'fields': generate_whitelist(default_public_fields(fields)),
+        'roles': []
+    }
+
+    # Always add access for public
+    # TODO Discuss change default for public?
+    if default_access == "Full":
+        full_template['roles'].append('public')
+    else:
+        minimal_template['roles'].append('public')
+
+    return {
+        'dataset_id': dataset_id,
+        'owner_id': pkg_dict['owner_org'],
+        'dname': dataset_name,
+        'harvest_id': harvest_id,
+        'descriptions': descriptions,
+        'templates': [full_template, minimal_template]
+    }
+
+
 def generate_default_fields():
     """ 
     Generates a dictionary containing the default fields and associated uuids.
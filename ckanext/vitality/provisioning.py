@@ -0,0 +1,169 @@
+import logging
+import threading
+import time
+
+from ckanext.vitality.meta_authorize import ViewDecision
+
+log = logging.getLogger(__name__)
+
+
+class ProvisioningBuffer(object):
+    """
+    Provisions the datasets indexed during a harvest job in batches.
+
+    ...
+
+    before_index provisions every dataset it indexes. Harvested datasets (those with a harvest_id) are
+    buffered and written together with MetaAuthorize.provision_datasets, a single transaction per batch,
+    when the batch is full, when a dataset of another harvest source arrives (the next job), and once no
+    dataset arrived for flush_interval seconds, as at the end of a job. Other datasets are provisioned at
+    once. If a batch fails, its datasets are provisioned one by one so that one bad dataset does not hold
+    back the others.
+
+    Until the batch is written, the public view of a buffered dataset is resolved from its pending
+    templates, see pending_view.
+
+    Attributes
+    ----------
+    meta_authorize : MetaAuthorize
+        The model the datasets are provisioned in.
+    batch_size : int
+        The number of datasets written per transaction.
+    flush_interval : float
+        Seconds without a new dataset before the buffered ones are written.
+
+    Methods
+    -------
+    add(dataset)
+        Provisions a dataset, buffered if it is harvested.
+    flush()
+        Provisions the buffered datasets.
+    discard(dataset_id)
+        Drops a buffered dataset.
+    pending_view(dataset_id)
+        Resolves the public access to a buffered dataset.
+    """
+
+    def __init__(self, meta_authorize, batch_size=500, flush_interval=5):
+        self.meta_authorize = meta_authorize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Dataset ids to provision_dataset arguments, in the order they were indexed
+        self.__pending = {}
+        self.__harvest_id = None
+        self.__last_added = None
+        self.__timer = None
+        self.__lock = threading.RLock()
+
+    def add(self, dataset):
+        """
+        Provisions a dataset, buffered if it is harvested
+
+        Parameters
+        ----------
+        dataset : dict
+            The provision_dataset arguments, see dataset_provisioning
+        """
+        if dataset.get('harvest_id') == None:
+            self.meta_authorize.provision_dataset(**dataset)
+            return
+        with self.__lock:
+            if self.__pending and dataset['harvest_id'] != self.__harvest_id:
+                self.flush()
+            self.__harvest_id = dataset['harvest_id']
+            # A dataset indexed again replaces its pending arguments
+            self.__pending[dataset['dataset_id']] = dataset
+            self.__last_added = time.monotonic()
+            if len(self.__pending) >= self.batch_size:
+                self.flush()
+            elif self.__timer == None:
+                self.__schedule(self.flush_interval)
+
+    def flush(self):
+        """
+        Provisions the buffered datasets
+
+        Returns
+        -------
+        The number of datasets provisioned
+        """
+        with self.__lock:
+            if self.__timer != None:
+                self.__timer.cancel()
+                self.__timer = None
+            datasets = list(self.__pending.values())
+            if not datasets:
+                return 0
+            try:
+                self.meta_authorize.provision_datasets(datasets)
+                log.info("Provisioned %d harvested datasets", len(datasets))
+            except Exception as ex:
+                log.warning("Could not provision %d harvested datasets together, provisioning them one by one: %s", len(datasets), ex)
+                for dataset in datasets:
+                    try:
+                        self.meta_authorize.provision_dataset(**dataset)
+                    except Exception as ex:
+                        log.error("Could not provision dataset %s: %s", dataset['dataset_id'], ex)
+            self.__pending.clear()
+            return len(datasets)
+
+    def discard(self, dataset_id):
+        """
+        Drops a buffered dataset, e.g. when it is deleted before being provisioned
+
+        Parameters
+        ----------
+        dataset_id : string
+            The id/uuid of the dataset
+        """
+        with self.__lock:
+            self.__pending.pop(dataset_id, None)
+
+    def pending_view(self, dataset_id):
+        """
+        Resolves the access the public has to a buffered dataset from its templates, the way
+        MetaAuthorize.resolve_view would once it is provisioned
+
+        Parameters
+        ----------
+        dataset_id : string
+            The id/uuid of the dataset
+
+        Returns
+        -------
+        A ViewDecision, None if the dataset is not buffered
+        """
+        with self.__lock:
+            dataset = self.__pending.get(dataset_id)
+        if dataset == None:
+            return None
+        templates = dataset.get('templates') or []
+        fields = {}
+        for template in templates:
+            fields.update(template.get('fields', {}))
+        public_templates = [template for template in templates if 'public' in template.get('roles', [])]
+        public_fields = []
+        for template in public_templates:
+            public_fields += [name for name in template.get('fields', {}) if name not in public_fields]
+        # As the models do, the public is unrestricted without a template, otherwise the first template decides
+        unrestricted = not public_templates or public_templates[0].get('name') == 'Full'
+        return ViewDecision.build(unrestricted, fields, [fields[name] for name in public_fields], public_fields)
+
+    def __schedule(self, delay):
+        self.__timer = threading.Timer(delay, self.__expire)
+        self.__timer.daemon = True
+        self.__timer.start()
+
+    def __expire(self):
+        """
+        Flushes once no dataset was added for flush_interval seconds, otherwise waits for the remainder
+        """
+        with self.__lock:
+            self.__timer = None
+            if not self.__pending:
+                return
+            idle = time.monotonic() - self.__last_added
+            if idle >= self.flush_interval:
+                self.flush()
+            else:
+                self.__schedule(self.flush_interval - idle)
@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+def seed_datasets(meta_authorize, search, show, provisioning, checkpoint, batch_size=500, workers=4, restart=False, echo=None):
+    """
+    Provisions the datasets of CKAN into the authorization model, the work of `ckan vitality seed-datasets`
+
+    Datasets are read by pages sorted by id, each page starting after the last id of the previous one, so that
+    datasets created during the run do not shift the pages. The last id, the number of datasets seeded and the
+    ids of those that failed are saved to the checkpoint after each page. A run resumes after the last id of the
+    checkpoint, retrying the datasets that failed first. The checkpoint is removed once every dataset is seeded.
+
+    Parameters
+    ----------
+    meta_authorize : MetaAuthorize
+        The model the datasets are provisioned in
+    search : function
+        Called with the id to start after (None for the first page) and the number of datasets to return,
+        returns the total number of datasets and the page of package dicts sorted by id
+    show : function
+        Called with the id of a dataset to retry, returns its package dict, None if it was deleted since
+    provisioning : function
+        Called with a package dict, returns the arguments of MetaAuthorize.provision_dataset
+    checkpoint : string
+        The path of the file the progress is saved to
+    batch_size : int
+        The number of datasets read per page
+    workers : int
+        The number of datasets provisioned in parallel
+    restart : bool
+        Whether to ignore the checkpoint and start from the first dataset
+    echo : function
+        Called with the progress messages (optional)
+
+    Returns
+    -------
+    The exit status of the command, 0 if every dataset was seeded and 1 if some are left to retry
+    """
+    echo = echo or log.info
+    state = {'last_id': None, 'seeded': 0, 'failed': []}
+    if not restart and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            state = json.load(f)
+        echo("Resuming after dataset {} ({} seeded, {} to retry)".format(state['last_id'], state['seeded'], len(state['failed'])))
+
+    def provision(pkg_dict):
+        """
+        Provisions a dataset, returns its id if it failed
+        """
+        try:
+            meta_authorize.provision_dataset(**provisioning(pkg_dict))
+        except Exception as ex:
+            log.error("Could not seed dataset %s: %s", pkg_dict['id'], ex)
+            return pkg_dict['id']
+        return None
+
+    def retry(id):
+        pkg_dict = show(id)
+        if pkg_dict == None:
+            # Deleted since
+            return None
+        return provision(pkg_dict)
+
+    started = time.monotonic()
+    done = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Datasets that failed in the interrupted run
+        retried = state['failed']
+        state['failed'] = [id for id in pool.map(retry, retried) if id != None]
+        state['seeded'] += len(retried) - len(state['failed'])
+
+        remaining = None
+        while True:
+            count, results = search(state['last_id'], batch_size)
+            if remaining == None:
+                remaining = count
+            if not results:
+                break
+            failed = [id for id in pool.map(provision, results) if id != None]
+            state['last_id'] = results[-1]['id']
+            state['seeded'] += len(results) - len(failed)
+            state['failed'] += failed
+            write_checkpoint(checkpoint, state)
+
+            done += len(results)
+            rate = done / max(time.monotonic() - started, 0.001)
+            echo("Seeded {}/{} datasets, {:.1f} datasets/s, ETA {:.0f}s".format(done, remaining, rate, max(remaining - done, 0) / rate))
+
+    if state['failed']:
+        write_checkpoint(checkpoint, state)
+        echo("{} datasets failed, run seed-datasets again to retry them".format(len(state['failed'])))
+        return 1
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    echo("Seeded {} datasets".format(state['seeded']))
+    return 0
+
+
+def write_checkpoint(path, state):
+    """
+    Saves the progress of a command, replacing the previous checkpoint at once so that an interruption
+    cannot leave it half written
+    """
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
@@ -0,0 +1,1060 @@
+"""
+An in process stand-in for the neo4j driver, for tests and benchmarks of _GraphMetaAuth without a Bolt server
+
+Cypher is not parsed. Each query of impl/queries.py is answered by a Python function of the same name below,
+over an in memory graph, and any other query text raises NotImplementedError. The functions follow the
+MATCH semantics of their query, e.g. GET_USER_BY_ID returns no row for an unknown user.
+
+The functions are written by hand after the query text, so a change to the text of a query is not checked
+until its function is changed to match. test_fake_neo4j.py runs each write query on its own and checks the
+graph it leaves, and requires a test for every new write query.
+
+The driver counts sessions, transactions and queries, see FakeDriver.stats and FakeDriver.queries, so
+the round trips of a call can be asserted:
+
+    driver = FakeDriver()
+    model = _GraphMetaAuth(None, None, None, driver=driver)
+    driver.reset()
+    model.resolve_views(dataset_ids, user_id)
+    assert driver.stats['transactions'] == 1
+"""
+import re
+from collections import Counter
+
+from ckanext.vitality.impl import queries
+
+
+class FakeGraph(object):
+    """
+    Nodes with a label and properties, and typed relationships between them
+
+    Changes made in a transaction are recorded so that they can be rolled back, see begin and rollback
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.relationships = {}
+        self.outgoing = {}
+        self.incoming = {}
+        # (label, id) to the node ids with that label and id property
+        self.index = {}
+        self.schema = {}
+        self.__next = 0
+        self.__undo = None
+
+    def __id(self):
+        self.__next += 1
+        return self.__next
+
+    def __record(self, undo):
+        if self.__undo != None:
+            self.__undo.append(undo)
+
+    def begin(self):
+        self.__undo = []
+
+    def commit(self):
+        self.__undo = None
+
+    def rollback(self):
+        undo, self.__undo = self.__undo, None
+        for step in reversed(undo or []):
+            step()
+
+    # Nodes
+
+    def __index(self, node, add):
+        label, properties = self.nodes[node]
+        if properties.get('id') == None:
+            return
+        nodes = self.index.setdefault((label, properties['id']), [])
+        if add:
+            nodes.append(node)
+        else:
+            nodes.remove(node)
+
+    def create(self, label, properties=None):
+        node = self.__id()
+        self.__restore_node(node, label, dict(properties or {}))
+        self.__record(lambda: self.__remove_node(node))
+        return node
+
+    def __restore_node(self, node, label, properties):
+        self.nodes[node] = (label, properties)
+        self.outgoing[node] = []
+        self.incoming[node] = []
+        self.__index(node, True)
+
+    def __remove_node(self, node):
+        self.__index(node, False)
+        del self.nodes[node]
+        del self.outgoing[node]
+        del self.incoming[node]
+
+    def delete(self, node):
+        """
+        Deletes a node along with its relationships, i.e. DETACH DELETE
+        """
+        if node not in self.nodes:
+            return
+        for relationship in self.outgoing[node] + self.incoming[node]:
+            self.unrelate(relationship)
+        label, properties = self.nodes[node]
+        self.__remove_node(node)
+        self.__record(lambda: self.__restore_node(node, label, properties))
+
+    def label(self, node):
+        return self.nodes[node][0]
+
+    def get(self, node, key):
+        return self.nodes[node][1].get(key)
+
+    def set(self, node, properties, replace=False):
+        """
+        Sets the properties of a node, SET n = properties when replacing and SET n += properties otherwise
+        """
+        old = dict(self.nodes[node][1])
+        self.__index(node, False)
+        if replace:
+            self.nodes[node][1].clear()
+        for key, value in properties.items():
+            if value == None:
+                self.nodes[node][1].pop(key, None)
+            else:
+                self.nodes[node][1][key] = value
+        self.__index(node, True)
+        self.__record(lambda: self.set(node, old, True))
+
+    def match(self, label, **properties):
+        """
+        Returns the nodes with the label and properties, MATCH (n:label {properties})
+        """
+        if 'id' in properties:
+            candidates = list(self.index.get((label, properties['id']), []))
+        else:
+            candidates = [node for node, (node_label, _) in self.nodes.items() if node_label == label]
+        return [node for node in candidates if all(self.get(node, key) == value for key, value in properties.items())]
+
+    def first(self, label, **properties):
+        nodes = self.match(label, **properties)
+        return nodes[0] if nodes else None
+
+    def merge(self, label, id, properties):
+        """
+        Returns the node with the label and id, created with properties if there is none, MERGE ... ON CREATE SET n = properties
+        """
+        node = self.first(label, id=id)
+        if node == None:
+            node = self.create(label, dict(properties, id=id) if 'id' not in properties else properties)
+        return node
+
+    # Relationships
+
+    def relate(self, type, start, end):
+        relationship = self.__id()
+        self.__restore_relationship(relationship, type, start, end)
+        self.__record(lambda: self.__remove_relationship(relationship))
+        return relationship
+
+    def merge_relationship(self, type, start, end):
+        for relationship in self.outgoing[start]:
+            if self.relationships[relationship] == (type, start, end):
+                return relationship
+        return self.relate(type, start, end)
+
+    def __restore_relationship(self, relationship, type, start, end):
+        self.relationships[relationship] = (type, start, end)
+        self.outgoing[start].append(relationship)
+        self.incoming[end].append(relationship)
+
+    def __remove_relationship(self, relationship):
+        type, start, end = self.relationships.pop(relationship)
+        self.outgoing[start].remove(relationship)
+        self.incoming[end].remove(relationship)
+
+    def unrelate(self, relationship):
+        if relationship not in self.relationships:
+            return
+        type, start, end = self.relationships[relationship]
+        self.__remove_relationship(relationship)
+        self.__record(lambda: self.__restore_relationship(relationship, type, start, end))
+
+    def out(self, node, type, label):
+        """
+        Returns the (relationship, node) pairs of (node)-[:type]->(:label)
+        """
+        result = []
+        for relationship in self.outgoing.get(node, []):
+            rtype, start, end = self.relationships[relationship]
+            if rtype == type and self.label(end) == label:
+                result.append((relationship, end))
+        return result
+
+    def into(self, node, type, label):
+        """
+        Returns the (relationship, node) pairs of (node)<-[:type]-(:label)
+        """
+        result = []
+        for relationship in self.incoming.get(node, []):
+            rtype, start, end = self.relationships[relationship]
+            if rtype == type and self.label(start) == label:
+                result.append((relationship, start))
+        return result
+
+    def ends(self, node, type, label):
+        return [end for _, end in self.out(node, type, label)]
+
+    def starts(self, node, type, label):
+        return [start for _, start in self.into(node, type, label)]
+
+
+class FakeResult(list):
+    """
+    The records of a query, each a dictionary
+    """
+
+    def single(self):
+        return self[0] if self else None
+
+
+class FakeTransaction(object):
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def run(self, query, **parameters):
+        name = _NAMES.get(query)
+        if name == None:
+            name = _schema_statement(query)
+        if name == None:
+            raise NotImplementedError("The fake neo4j driver does not run %r" % query)
+        self.driver.stats['queries'] += 1
+        self.driver.queries[name] += 1
+        return FakeResult(globals()['_' + name](self.driver.graph, query, **parameters))
+
+
+class FakeSession(object):
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        pass
+
+    def __transaction(self, kind, function, args, kwargs):
+        self.driver.stats['transactions'] += 1
+        self.driver.stats[kind] += 1
+        graph = self.driver.graph
+        graph.begin()
+        try:
+            result = function(FakeTransaction(self.driver), *args, **kwargs)
+        except Exception:
+            graph.rollback()
+            raise
+        graph.commit()
+        return result
+
+    def read_transaction(self, function, *args, **kwargs):
+        return self.__transaction('read_transactions', function, args, kwargs)
+
+    def write_transaction(self, function, *args, **kwargs):
+        return self.__transaction('write_transactions', function, args, kwargs)
+
+
+class FakeDriver(object):
+    """
+    Stands in for neo4j.Driver, pass it to _GraphMetaAuth as driver
+
+    Attributes
+    ----------
+    graph : FakeGraph
+        The in memory graph the queries run against
+    stats : Counter
+        The number of sessions, transactions, read_transactions, write_transactions and queries
+    queries : Counter
+        The number of times each query of impl/queries.py ran, by name
+    """
+
+    def __init__(self, graph=None):
+        self.graph = graph if graph != None else FakeGraph()
+        self.stats = Counter()
+        self.queries = Counter()
+
+    def session(self, **config):
+        self.stats['sessions'] += 1
+        return FakeSession(self)
+
+    def reset(self):
+        """
+        Resets the counters, keeping the graph
+        """
+        self.stats.clear()
+        self.queries.clear()
+
+    def close(self):
+        pass
+
+
+# Query text to the name of its constant in impl/queries.py
+_NAMES = {getattr(queries, name): name for name in dir(queries) if name.isupper() and not name.startswith('_') and isinstance(getattr(queries, name), str)}
+
+_SCHEMA = re.compile(r"CREATE (CONSTRAINT|INDEX) (\w+) IF NOT EXISTS FOR \(n:(\w+)\) (?:REQUIRE|ON) \(?n\.(\w+)\)?")
+
+
+def _schema_statement(query):
+    """
+    Returns the name of the schema statement formatted from CREATE_UNIQUE_CONSTRAINT or CREATE_INDEX, None for other queries
+    """
+    match = _SCHEMA.match(query)
+    if match == None:
+        return None
+    return 'CREATE_UNIQUE_CONSTRAINT' if match.group(1) == 'CONSTRAINT' else 'CREATE_INDEX'
+
+
+def _ids(graph, nodes):
+    return [{'id': graph.get(node, 'id')} for node in nodes]
+
+
+# Reads
+
+def _GET_DATASET_OWNER(graph, query, id):
+    return [{'id': graph.get(o, 'id')} for d in graph.match('dataset', id=id) for o in graph.starts(d, 'owns', 'organization')]
+
+
+def _GET_DATASET(graph, query, id):
+    return _ids(graph, graph.match('dataset', id=id))
+
+
+def _GET_GROUP(graph, query, id):
+    return _ids(graph, graph.match('group', id=id))
+
+
+def _GET_ORG_BY_ID(graph, query, id):
+    return [{'id': graph.get(o, 'id'), 'name': graph.get(o, 'name')} for o in graph.match('organization', id=id)]
+
+
+def _GET_ORG_BY_NAME(graph, query, name):
+    return [{'id': graph.get(o, 'id'), 'name': graph.get(o, 'name')} for o in graph.match('organization', name=name)]
+
+
+def _GET_PRIVATE_DATASET(graph, query, id):
+    return [{'id': graph.get(y, 'id'), 'name': graph.get(y, 'name')} for x in graph.match('dataset', id=id)
+        for y in graph.starts(x, 'has_public_dataset', 'dataset')]
+
+
+def _GET_PUBLIC_DATASET(graph, query, id):
+    return [{'id': graph.get(y, 'id'), 'name': graph.get(y, 'name')} for x in graph.match('dataset', id=id)
+        for y in graph.ends(x, 'has_public_dataset', 'dataset')]
+
+
+def _GET_TEMPLATE_DATASET(graph, query, template_id):
+    return [{'id': graph.get(d, 'id')} for t in graph.match('template', id=template_id) for d in graph.starts(t, 'has_template', 'dataset')]
+
+
+def _GET_TEMPLATE_NAME(graph, query, template_id):
+    return [{'name': graph.get(t, 'name')} for t in graph.match('template', id=template_id)]
+
+
+def _role_templates(graph, dataset_id, role_id):
+    """
+    The templates of (:dataset {id:dataset_id})-[:has_template]->(t:template)<-[:uses_template]-(:role {id:role_id}), one per path
+    """
+    return [t for d in graph.match('dataset', id=dataset_id) for t in graph.ends(d, 'has_template', 'template')
+        for r in graph.starts(t, 'uses_template', 'role') if graph.get(r, 'id') == role_id]
+
+
+def _user_templates(graph, dataset_id, user_id):
+    """
+    The templates of (:dataset {id:dataset_id})-[:has_template]->(t:template)<-[:uses_template]-(:role)<-[:has_role]-(:user {id:user_id}),
+        one per path
+    """
+    return [t for d in graph.match('dataset', id=dataset_id) for t in _dataset_user_templates(graph, d, user_id)]
+
+
+def _dataset_user_templates(graph, d, user_id):
+    return [t for t in graph.ends(d, 'has_template', 'template') for r in graph.starts(t, 'uses_template', 'role')
+        for u in graph.starts(r, 'has_role', 'user') if graph.get(u, 'id') == user_id]
+
+
+def _GET_TEMPLATE_ACCESS_FOR_ROLE(graph, query, dataset_id, role_id):
+    return _ids(graph, _role_templates(graph, dataset_id, role_id))
+
+
+def _GET_TEMPLATE_ACCESS_FOR_USER(graph, query, dataset_id, user_id):
+    return _ids(graph, _user_templates(graph, dataset_id, user_id))
+
+
+def _user(graph, u):
+    return {'id': graph.get(u, 'id'), 'username': graph.get(u, 'username'), 'email': graph.get(u, 'email')}
+
+
+def _GET_USER_BY_ID(graph, query, id):
+    return [_user(graph, u) for u in graph.match('user', id=id)]
+
+
+def _GET_USER_BY_USERNAME(graph, query, username):
+    return [_user(graph, u) for u in graph.match('user', username=username)]
+
+
+def _IS_UNRESTRICTED_FOR_USER(graph, query, dataset_id, user_id):
+    return [{'name': graph.get(t, 'name')} for t in _user_templates(graph, dataset_id, user_id)]
+
+
+def _elements(graph, d):
+    """
+    The (name, id) of (d)-[:has_template]->(:template)-[:can_see]->(e:element), one per path
+    """
+    return [[graph.get(e, 'name'), graph.get(e, 'id')] for t in graph.ends(d, 'has_template', 'template') for e in graph.ends(t, 'can_see', 'element')]
+
+
+def _distinct(records):
+    result = []
+    for record in records:
+        if record not in result:
+            result.append(record)
+    return result
+
+
+def _READ_ELEMENTS(graph, query, dataset_id):
+    return _distinct([{'name': name, 'id': id} for d in graph.match('dataset', id=dataset_id) for name, id in _elements(graph, d)])
+
+
+def _roles(graph, nodes):
+    return [{'name': graph.get(r, 'name'), 'id': graph.get(r, 'id')} for r in nodes]
+
+
+def _READ_ROLES(graph, query):
+    return _roles(graph, graph.match('role'))
+
+
+def _READ_ROLES_FOR_ORG(graph, query, org_id):
+    return _roles(graph, [r for o in graph.match('organization', id=org_id) for r in graph.ends(o, 'manages_role', 'role')])
+
+
+def _READ_TEMPLATES(graph, query, dataset_id):
+    return [{'name': graph.get(t, 'name'), 'id': graph.get(t, 'id')} for d in graph.match('dataset', id=dataset_id)
+        for t in graph.ends(d, 'has_template', 'template')]
+
+
+def _READ_ALL_TEMPLATES(graph, query):
+    return _ids(graph, graph.match('template'))
+
+
+def _READ_ALL_TEMPLATES_BY_NAME(graph, query, name):
+    return _ids(graph, graph.match('template', name=name))
+
+
+def _READ_PROVISIONED_DATASETS(graph, query):
+    return _ids(graph, [d for d in graph.match('dataset') if graph.out(d, 'has_template', 'template')])
+
+
+def _READ_HARVEST_DATASETS(graph, query, harvest_id):
+    return _ids(graph, graph.match('dataset', harvest_source=harvest_id))
+
+
+def _READ_USERS(graph, query):
+    return _ids(graph, graph.match('user'))
+
+
+def _READ_USERS_ADMINS(graph, query):
+    return _ids(graph, [u for r in graph.match('role', id='admin') for u in graph.starts(r, 'has_role', 'user')])
+
+
+def _READ_VISIBLE_FIELDS(graph, query, dataset_id, user_id):
+    return _ids(graph, [e for t in _user_templates(graph, dataset_id, user_id) for e in graph.ends(t, 'can_see', 'element')])
+
+
+def _READ_VISIBLE_FIELDS_PROPERTY(graph, query, dataset_id, user_id):
+    return [{'id': id} for t in _user_templates(graph, dataset_id, user_id) for id in graph.get(t, 'visible') or []]
+
+
+def _RESOLVE_VIEWS(graph, query, dataset_ids, user_id):
+    listed = query == queries.RESOLVE_VIEWS_PROPERTY
+
+    def visible(templates):
+        if listed:
+            return [id for t in templates for id in graph.get(t, 'visible') or []]
+        return [graph.get(e, 'id') for t in templates for e in graph.ends(t, 'can_see', 'element')]
+
+    result = []
+    for dataset_id in dataset_ids:
+        for d in graph.match('dataset', id=dataset_id):
+            public_templates = _dataset_user_templates(graph, d, 'public')
+            user_templates = _dataset_user_templates(graph, d, user_id)
+            result.append({
+                'id': graph.get(d, 'id'),
+                'elements': _elements(graph, d),
+                'public_templates': [graph.get(t, 'name') for t in public_templates],
+                'user_templates': [graph.get(t, 'name') for t in user_templates],
+                'public_visible': visible(public_templates),
+                'visible': visible(user_templates)
+            })
+    return result
+
+
+_RESOLVE_VIEWS_PROPERTY = _RESOLVE_VIEWS
+
+
+def _user_roles(graph, user_id, role_id):
+    """
+    The relationships of (:user {id:user_id})-[h:has_role]->(:role {id:role_id})
+    """
+    return [h for u in graph.match('user', id=user_id) for h, r in graph.out(u, 'has_role', 'role') if graph.get(r, 'id') == role_id]
+
+
+def _HAS_ROLE(graph, query, user_id, role_id):
+    return [{'h': h} for h in _user_roles(graph, user_id, role_id)]
+
+
+# Writes
+
+def _create(label):
+    def create(graph, query, id, properties=None):
+        node = graph.create(label, {'id': id})
+        graph.set(node, properties or {})
+        return []
+    return create
+
+
+_WRITE_DATASET = _create('dataset')
+_WRITE_GROUP = _create('group')
+_WRITE_ORG = _create('organization')
+_WRITE_ROLE = _create('role')
+_WRITE_TEMPLATE = _create('template')
+_WRITE_USER = _create('user')
+
+
+def _GET_ROLE(graph, query, id):
+    return _ids(graph, graph.match('role', id=id))
+
+
+def _GET_TEMPLATE(graph, query, id):
+    return _ids(graph, graph.match('template', id=id))
+
+
+def _GET_USER(graph, query, id):
+    return _ids(graph, graph.match('user', id=id))
+
+
+def _WRITE_METADATA_FIELD(graph, query, template_id, properties):
+    for t in graph.match('template', id=template_id):
+        graph.relate('can_see', t, graph.create('element', properties))
+    return []
+
+
+def _WRITE_SHARED_METADATA_FIELD(graph, query, id, template_id, properties):
+    for t in graph.match('template', id=template_id):
+        graph.merge_relationship('can_see', t, graph.merge('element', id, properties))
+    return []
+
+
+def _DELETE_DATASET(graph, query, id):
+    _delete_dataset_nodes(graph, query, id)
+    return []
+
+
+def _detach_delete(label):
+    def delete(graph, query, id):
+        for node in graph.match(label, id=id):
+            graph.delete(node)
+        return []
+    return delete
+
+
+_DELETE_ORGANIZATION = _detach_delete('organization')
+_DELETE_USER = _detach_delete('user')
+
+
+def _set_properties(label):
+    def set_properties(graph, query, id, properties):
+        for node in graph.match(label, id=id):
+            graph.set(node, properties)
+        return []
+    return set_properties
+
+
+_SET_DATASET_PROPERTIES = _set_properties('dataset')
+_SET_USER_PROPERTIES = _set_properties('user')
+
+
+def _SET_ORGANIZATION_NAME(graph, query, id, name):
+    return _set_properties('organization')(graph, query, id, {'name': name})
+
+
+# Relationships
+
+def _template_fields(graph, element_id, template_id):
+    """
+    The relationships of (:element {id:element_id})<-[c:can_see]-(:template {id:template_id})
+    """
+    return [c for t in graph.match('template', id=template_id) for c, e in graph.out(t, 'can_see', 'element') if graph.get(e, 'id') == element_id]
+
+
+def _DETACH_ALL_FIELDS_FROM_TEMPLATE(graph, query, template_id):
+    for t in graph.match('template', id=template_id):
+        for c, e in graph.out(t, 'can_see', 'element'):
+            graph.unrelate(c)
+    return []
+
+
+def _GET_TEMPLATE_FIELD(graph, query, element_id, template_id):
+    return [{'c': c} for c in _template_fields(graph, element_id, template_id)]
+
+
+def _bind(type, start_label, start_key, end_label, end_key):
+    """
+    MATCH (a:start_label {id:$start_key}), (b:end_label {id:$end_key}) CREATE (a)-[:type]->(b)
+    """
+    def bind(graph, query, **parameters):
+        for a in graph.match(start_label, id=parameters[start_key]):
+            for b in graph.match(end_label, id=parameters[end_key]):
+                graph.relate(type, a, b)
+        return []
+    return bind
+
+
+_BIND_FIELD_TO_TEMPLATE = _bind('can_see', 'template', 'template_id', 'element', 'element_id')
+_BIND_DATASET_TO_ORG = _bind('owns', 'organization', 'org_id', 'dataset', 'dataset_id')
+_BIND_ROLE_TO_ORG = _bind('manages_role', 'organization', 'org_id', 'role', 'role_id')
+_BIND_ROLE_TO_TEMPLATE = _bind('uses_template', 'role', 'role_id', 'template', 'template_id')
+_BIND_TEMPLATE_TO_DATASET = _bind('has_template', 'dataset', 'dataset_id', 'template', 'template_id')
+_BIND_USER_TO_GROUP = _bind('has_member', 'group', 'group_id', 'user', 'user_id')
+_BIND_USER_TO_ORG = _bind('serves', 'user', 'user_id', 'organization', 'org_id')
+_BIND_USER_TO_ROLE = _bind('has_role', 'user', 'user_id', 'role', 'role_id')
+
+
+def _DETACH_FIELD_FROM_TEMPLATE(graph, query, element_id, template_id):
+    for c in _template_fields(graph, element_id, template_id):
+        graph.unrelate(c)
+    return []
+
+
+def _set_visible(graph, template_id, update):
+    for t in graph.match('template', id=template_id):
+        graph.set(t, {'visible': update(list(graph.get(t, 'visible') or []))})
+    return []
+
+
+def _SET_TEMPLATE_FIELDS(graph, query, template_id, element_ids):
+    return _set_visible(graph, template_id, lambda visible: list(element_ids))
+
+
+def _ADD_TEMPLATE_FIELDS(graph, query, template_id, element_ids):
+    return _set_visible(graph, template_id, lambda visible: visible + [id for id in element_ids if id not in visible])
+
+
+def _REMOVE_TEMPLATE_FIELD(graph, query, template_id, element_id):
+    return _set_visible(graph, template_id, lambda visible: [id for id in visible if id != element_id])
+
+
+def _dataset_orgs(graph, dataset_id):
+    """
+    The relationships of (:organization)-[w:owns]->(:dataset {id:dataset_id}), with the organization
+    """
+    return [(w, o) for d in graph.match('dataset', id=dataset_id) for w, o in graph.into(d, 'owns', 'organization')]
+
+
+def _GET_DATASET_ORG(graph, query, org_id, dataset_id):
+    return [{'id': w} for w, o in _dataset_orgs(graph, dataset_id) if graph.get(o, 'id') == org_id]
+
+
+def _DETACH_DATASET_FROM_ORGS(graph, query, dataset_id):
+    for w, o in _dataset_orgs(graph, dataset_id):
+        graph.unrelate(w)
+    return []
+
+
+def _DETACH_ROLE_FROM_DATASET_TEMPLATES(graph, query, template_id, role_id):
+    datasets = set(d for t in graph.match('template', id=template_id) for d in graph.starts(t, 'has_template', 'dataset'))
+    for r in graph.match('role', id=role_id):
+        for u, t in graph.out(r, 'uses_template', 'template'):
+            if datasets.intersection(graph.starts(t, 'has_template', 'dataset')):
+                graph.unrelate(u)
+    return []
+
+
+def _template_owners(graph, template_id):
+    return [(h, d) for t in graph.match('template', id=template_id) for h, d in graph.into(t, 'has_template', 'dataset')]
+
+
+def _GET_TEMPLATE_OWNER(graph, query, template_id):
+    return [{'h': h} for h, d in _template_owners(graph, template_id)]
+
+
+def _DETACH_TEMPLATE_FROM_DATASET(graph, query, template_id, dataset_id):
+    for h, d in _template_owners(graph, template_id):
+        if graph.get(d, 'id') == dataset_id:
+            graph.unrelate(h)
+    return []
+
+
+def _DETACH_USER_FROM_ORG_ROLES(graph, query, role_id, user_id):
+    orgs = set(o for r in graph.match('role', id=role_id) for o in graph.starts(r, 'manages_role', 'organization'))
+    for u in graph.match('user', id=user_id):
+        for h, r in graph.out(u, 'has_role', 'role'):
+            if orgs.intersection(graph.starts(r, 'manages_role', 'organization')):
+                graph.unrelate(h)
+    return []
+
+
+def _DETACH_USER_FROM_ROLE(graph, query, role_id, user_id):
+    for h in _user_roles(graph, user_id, role_id):
+        graph.unrelate(h)
+    return []
+
+
+# Provisioning
+
+def _PROVISION_DATASET(graph, query, dataset_id, owner_id, properties, updates):
+    d = graph.first('dataset', id=dataset_id)
+    if d == None:
+        d = graph.create('dataset', {'id': dataset_id})
+        graph.set(d, properties)
+    graph.set(d, updates)
+    for o in graph.match('organization', id=owner_id):
+        if not graph.into(d, 'owns', 'organization'):
+            graph.relate('owns', o, d)
+    return [{'has_templates': bool(graph.out(d, 'has_template', 'template'))}]
+
+
+def _PROVISION_TEMPLATES(graph, query, dataset_id, properties, templates):
+    for d in graph.match('dataset', id=dataset_id):
+        graph.set(d, properties)
+        for template in templates:
+            t = graph.create('template', {'id': template['id']})
+            graph.set(t, template.get('properties') or {})
+            graph.relate('has_template', d, t)
+    return []
+
+
+def _PROVISION_ELEMENTS(graph, query, elements):
+    shared = query == queries.PROVISION_SHARED_ELEMENTS
+    for element in elements:
+        if shared:
+            e = graph.merge('element', element['properties']['id'], element['properties'])
+        else:
+            e = graph.create('element', element['properties'])
+        for template_id in element['templates']:
+            for t in graph.match('template', id=template_id):
+                if shared:
+                    graph.merge_relationship('can_see', t, e)
+                else:
+                    graph.relate('can_see', t, e)
+    return []
+
+
+_PROVISION_SHARED_ELEMENTS = _PROVISION_ELEMENTS
+
+
+def _PROVISION_TEMPLATE_ACCESS(graph, query, owner_id, templates):
+    for template in templates:
+        for t in graph.match('template', id=template['id']):
+            org_role_ids = []
+            if template.get('org_roles'):
+                org_role_ids = [graph.get(r, 'id') for o in graph.match('organization', id=owner_id) for r in graph.ends(o, 'manages_role', 'role')]
+            for role_id in list(template.get('roles') or []) + org_role_ids:
+                for r in graph.match('role', id=role_id):
+                    graph.merge_relationship('uses_template', r, t)
+    return []
+
+
+def _PROVISION_DATASETS(graph, query, datasets):
+    return [dict(_PROVISION_DATASET(graph, query, dataset['id'], dataset['owner_id'], dataset['properties'], dataset['updates'])[0], id=dataset['id'])
+        for dataset in datasets]
+
+
+def _PROVISION_DATASETS_TEMPLATES(graph, query, datasets):
+    for dataset in datasets:
+        _PROVISION_TEMPLATES(graph, query, dataset['id'], dataset['properties'], dataset['templates'])
+    return []
+
+
+def _PROVISION_DATASETS_TEMPLATE_ACCESS(graph, query, templates):
+    for template in templates:
+        _PROVISION_TEMPLATE_ACCESS(graph, query, template['owner_id'], [template])
+    return []
+
+
+# Bulk seeding
+
+def _SEED_USERS(graph, query, users):
+    for user in users:
+        u = graph.first('user', id=user['id'])
+        if u == None:
+            u = graph.create('user', {'id': user['id']})
+            graph.set(u, user['properties'])
+        graph.set(u, user['updates'])
+        for role_id in user['roles']:
+            for r in graph.match('role', id=role_id):
+                graph.merge_relationship('has_role', u, r)
+    return [{'seeded': len(users)}]
+
+
+# Reconciliation
+
+def _member_roles(graph, org_id):
+    return [r for o in graph.match('organization', id=org_id) for r in graph.ends(o, 'manages_role', 'role') if graph.get(r, 'name') == 'member']
+
+
+def _FINGERPRINT_USERS(graph, query):
+    admins = set(record['id'] for record in _READ_USERS_ADMINS(graph, query))
+    return [dict(_user(graph, u), admin=graph.get(u, 'id') in admins) for u in graph.match('user')]
+
+
+def _FINGERPRINT_ORGANIZATIONS(graph, query):
+    return [{'id': graph.get(o, 'id'), 'name': graph.get(o, 'name'),
+        'members': [graph.get(u, 'id') for r in _member_roles(graph, graph.get(o, 'id')) for u in graph.starts(r, 'has_role', 'user')]}
+        for o in graph.match('organization')]
+
+
+def _FINGERPRINT_GROUPS(graph, query):
+    return [{'id': graph.get(g, 'id'), 'members': [graph.get(u, 'id') for u in graph.ends(g, 'has_member', 'user')]} for g in graph.match('group')]
+
+
+def _FINGERPRINT_DATASETS(graph, query):
+    return [{'id': record['id'], 'owner': record['owner']} for record in _SNAPSHOT_DATASETS(graph, query)]
+
+
+def _unwind(handler, key='id'):
+    """
+    UNWIND $ids AS id followed by the query of handler
+    """
+    def unwind(graph, query, ids):
+        for id in ids:
+            handler(graph, query, **{key: id})
+        return []
+    return unwind
+
+
+def _RECONCILE_UPDATE_USERS(graph, query, users):
+    for user in users:
+        for u in graph.match('user', id=user['id']):
+            graph.set(u, {'username': user['username'], 'email': user['email']})
+    return []
+
+
+def _bind_admin(graph, query, id):
+    for r in graph.match('role', id='admin'):
+        for u in graph.match('user', id=id):
+            graph.merge_relationship('has_role', u, r)
+
+
+def _RECONCILE_BIND_ORG_MEMBERS(graph, query, members):
+    for member in members:
+        for r in _member_roles(graph, member['org_id']):
+            for u in graph.match('user', id=member['user_id']):
+                graph.merge_relationship('has_role', u, r)
+    return []
+
+
+def _RECONCILE_DETACH_ORG_MEMBERS(graph, query, members):
+    for member in members:
+        for r in _member_roles(graph, member['org_id']):
+            for h, u in graph.into(r, 'has_role', 'user'):
+                if graph.get(u, 'id') == member['user_id']:
+                    graph.unrelate(h)
+    return []
+
+
+def _RECONCILE_BIND_GROUP_MEMBERS(graph, query, members):
+    for member in members:
+        for g in graph.match('group', id=member['group_id']):
+            for u in graph.match('user', id=member['user_id']):
+                graph.merge_relationship('has_member', g, u)
+    return []
+
+
+def _RECONCILE_DETACH_GROUP_MEMBERS(graph, query, members):
+    for member in members:
+        for g in graph.match('group', id=member['group_id']):
+            for h, u in graph.out(g, 'has_member', 'user'):
+                if graph.get(u, 'id') == member['user_id']:
+                    graph.unrelate(h)
+    return []
+
+
+def _delete_dataset_nodes(graph, query, id):
+    for d in graph.match('dataset', id=id):
+        for t in graph.ends(d, 'has_template', 'template'):
+            for e in graph.ends(t, 'can_see', 'element'):
+                if graph.get(e, 'shared') == None:
+                    graph.delete(e)
+            graph.delete(t)
+        graph.delete(d)
+
+
+_RECONCILE_DELETE_USERS = _unwind(_DELETE_USER)
+_RECONCILE_BIND_ADMINS = _unwind(_bind_admin)
+_RECONCILE_DETACH_ADMINS = _unwind(lambda graph, query, user_id: _DETACH_USER_FROM_ROLE(graph, query, 'admin', user_id), 'user_id')
+_RECONCILE_DELETE_GROUPS = _unwind(_detach_delete('group'))
+_RECONCILE_DELETE_DATASETS = _unwind(_delete_dataset_nodes)
+
+
+# Harvest deletion
+
+def _DELETE_HARVEST_ELEMENTS(graph, query, harvest_id, batch_size):
+    elements = list(dict.fromkeys(e for d in graph.match('dataset', harvest_source=harvest_id)
+        for t in graph.ends(d, 'has_template', 'template') for e in graph.ends(t, 'can_see', 'element')
+        if graph.get(e, 'shared') == None))[:batch_size]
+    for e in elements:
+        graph.delete(e)
+    return [{'deleted': len(elements)}]
+
+
+def _DELETE_HARVEST_TEMPLATES(graph, query, harvest_id, batch_size):
+    templates = list(dict.fromkeys(t for d in graph.match('dataset', harvest_source=harvest_id)
+        for t in graph.ends(d, 'has_template', 'template')))[:batch_size]
+    for t in templates:
+        graph.delete(t)
+    return [{'deleted': len(templates)}]
+
+
+def _DELETE_HARVEST_DATASETS(graph, query, harvest_id, batch_size):
+    datasets = graph.match('dataset', harvest_source=harvest_id)[:batch_size]
+    ids = [graph.get(d, 'id') for d in datasets]
+    for d in datasets:
+        graph.delete(d)
+    return [{'ids': ids}]
+
+
+# Bulk access changes
+
+def _use_template(graph, r, t):
+    """
+    Makes a role use a template instead of the other templates of the same dataset
+    """
+    for d in graph.starts(t, 'has_template', 'dataset'):
+        for u, other in graph.out(r, 'uses_template', 'template'):
+            if d in graph.starts(other, 'has_template', 'dataset'):
+                graph.unrelate(u)
+    graph.relate('uses_template', r, t)
+
+
+def _FULL_ACCESS_BATCH(graph, query, role_id, batch_size):
+    updated = 0
+    for r in graph.match('role', id=role_id):
+        templates = [t for d in graph.match('dataset') for t in graph.ends(d, 'has_template', 'template')
+            if graph.get(t, 'name') == 'Full' and r not in graph.starts(t, 'uses_template', 'role')]
+        for t in templates[:batch_size]:
+            _use_template(graph, r, t)
+            updated += 1
+    return [{'updated': updated}]
+
+
+def _MINIMAL_ACCESS_BATCH(graph, query, dataset_id, batch_size):
+    updated = 0
+    for d in graph.match('dataset', id=dataset_id):
+        owner_roles = set(r for o in graph.starts(d, 'owns', 'organization') for r in graph.ends(o, 'manages_role', 'role'))
+        for m in [t for t in graph.ends(d, 'has_template', 'template') if graph.get(t, 'name') == 'Minimal']:
+            roles = [r for r in graph.match('role') if graph.get(r, 'id') != 'admin' and r not in owner_roles
+                and r not in graph.starts(m, 'uses_template', 'role')]
+            for r in roles[:batch_size - updated]:
+                _use_template(graph, r, m)
+                updated += 1
+    return [{'updated': updated}]
+
+
+# Migrations
+
+def _READ_DATASET_ELEMENT_NAMES(graph, query):
+    return _distinct([{'name': graph.get(e, 'name')} for e in graph.match('element') if graph.get(e, 'shared') == None])
+
+
+def _WRITE_SHARED_ELEMENT(graph, query, id, properties):
+    graph.merge('element', id, properties)
+    return []
+
+
+def _FOLD_ELEMENTS(graph, query, name, id, batch_size):
+    folded = 0
+    for s in graph.match('element', id=id):
+        for e in [e for e in graph.match('element', name=name) if graph.get(e, 'shared') == None][:batch_size - folded]:
+            e_id = graph.get(e, 'id')
+            for t in graph.starts(e, 'can_see', 'template'):
+                graph.merge_relationship('can_see', t, s)
+            datasets = _distinct([d for t in graph.starts(e, 'can_see', 'template') for d in graph.starts(t, 'has_template', 'dataset')])
+            for d in datasets:
+                for t in graph.ends(d, 'has_template', 'template'):
+                    visible = graph.get(t, 'visible')
+                    if visible != None and e_id in visible:
+                        graph.set(t, {'visible': [graph.get(s, 'id') if x == e_id else x for x in visible]})
+            graph.delete(e)
+            folded += 1
+    return [{'folded': folded}]
+
+
+def _LIST_TEMPLATE_FIELDS(graph, query, batch_size):
+    templates = [t for t in graph.match('template') if graph.get(t, 'visible') == None][:batch_size]
+    for t in templates:
+        graph.set(t, {'visible': [graph.get(e, 'id') for e in graph.ends(t, 'can_see', 'element')]})
+    return [{'listed': len(templates)}]
+
+
+# Snapshot
+
+def _SNAPSHOT_USERS(graph, query):
+    return [dict(_user(graph, u), gid=graph.get(u, 'gid'), roles=[graph.get(r, 'id') for r in graph.ends(u, 'has_role', 'role')])
+        for u in graph.match('user')]
+
+
+def _SNAPSHOT_ORGANIZATIONS(graph, query):
+    return [{'id': graph.get(o, 'id'), 'name': graph.get(o, 'name')} for o in graph.match('organization')]
+
+
+def _SNAPSHOT_ROLES(graph, query):
+    return [{'id': graph.get(r, 'id'), 'name': graph.get(r, 'name'), 'orgs': [graph.get(o, 'id') for o in graph.starts(r, 'manages_role', 'organization')]}
+        for r in graph.match('role')]
+
+
+def _SNAPSHOT_DATASETS(graph, query):
+    result = []
+    for d in graph.match('dataset'):
+        owners = [graph.get(o, 'id') for o in graph.starts(d, 'owns', 'organization')]
+        result.append({'id': graph.get(d, 'id'), 'name': graph.get(d, 'name'), 'harvest_source': graph.get(d, 'harvest_source'),
+            'owner': owners[0] if owners else None, 'elements': _elements(graph, d)})
+    return result
+
+
+def _SNAPSHOT_TEMPLATES(graph, query):
+    listed = query == queries.SNAPSHOT_TEMPLATES_PROPERTY
+    result = []
+    for d in graph.match('dataset'):
+        for t in graph.ends(d, 'has_template', 'template'):
+            result.append({
+                'dataset_id': graph.get(d, 'id'),
+                'id': graph.get(t, 'id'),
+                'name': graph.get(t, 'name'),
+                'roles': [graph.get(r, 'id') for r in graph.starts(t, 'uses_template', 'role')],
+                'visible': list(graph.get(t, 'visible') or []) if listed else [graph.get(e, 'id') for e in graph.ends(t, 'can_see', 'element')]
+            })
+    return result
+
+
+_SNAPSHOT_TEMPLATES_PROPERTY = _SNAPSHOT_TEMPLATES
+
+
+# Schema
+
+def _CREATE_UNIQUE_CONSTRAINT(graph, query):
+    kind, name, label, property = _SCHEMA.match(query).groups()
+    graph.schema.setdefault(name, (kind, label, property))
+    return []
+
+
+_CREATE_INDEX = _CREATE_UNIQUE_CONSTRAINT
+
+
+def _SHOW_CONSTRAINTS(graph, query):
+    return [{'name': name, 'type': 'UNIQUENESS', 'labelsOrTypes': [label], 'properties': [property]}
+        for name, (kind, label, property) in graph.schema.items() if kind == 'CONSTRAINT']
+
+
+def _SHOW_INDEXES(graph, query):
+    return [{'name': name, 'type': 'RANGE', 'state': 'ONLINE', 'labelsOrTypes': [label], 'properties': [property],
+        'owningConstraint': name if kind == 'CONSTRAINT' else None} for name, (kind, label, property) in graph.schema.items()]
@@ -0,0 +1,196 @@
+"""
+Tests for impl/bitset_meta_auth.py
+Can use -v on run to return verbose tests with more detail
+"""
+import unittest
+from ckanext.vitality.impl.bitset_meta_auth import _BitsetMetaAuth
+from ckanext.vitality.impl.graph_meta_auth import _GraphMetaAuth
+from ckanext.vitality.invalidation import InvalidationBus, LocalTransport
+from ckanext.vitality.tests.fake_neo4j import FakeDriver
+from ckanext.vitality.tests.test_graph_meta_auth import seed
+
+
+def snapshot():
+    return {
+        'users': {'public': ['public'], 'admin': ['admin'], 'u1': ['member1']},
+        'roles': {'public': {'name': 'public', 'orgs': []}, 'admin': {'name': 'admin', 'orgs': []}, 'member1': {'name': 'member', 'orgs': ['o1']}},
+        'datasets': {
+            'd1': {
+                'owner': 'o1',
+                'harvest_source': 'h1',
+                'fields': {'id': 'e1', 'title': 'e2', 'spatial': 'e3'},
+                'templates': {
+                    't1': {'name': 'Full', 'roles': ['admin', 'member1'], 'visible': ['e1', 'e2', 'e3']},
+                    't2': {'name': 'Minimal', 'roles': ['public'], 'visible': ['e1', 'e2']}
+                }
+            }
+        }
+    }
+
+
+class RecordingSource(object):
+    """
+    Stands in for the source model, recording the calls made to it
+    """
+
+    def __init__(self, snapshot):
+        self.calls = []
+        self.snapshot = snapshot
+
+    def export_snapshot(self):
+        self.calls.append(('export_snapshot',))
+        return self.snapshot
+
+    def set_user_role(self, user_id, role_id):
+        self.calls.append(('set_user_role', user_id, role_id))
+
+    def get_user_by_username(self, username):
+        return {'id': 'u1', 'username': username}
+
+
+class TestBitsetMetaAuth(unittest.TestCase):
+    """
+    Runs testing methods related to the bitset authorization model
+    """
+
+    def setUp(self):
+        self.model = _BitsetMetaAuth(snapshot=snapshot())
+
+    def test_visible_fields(self):
+        """
+        Tests the visible fields of the users of a snapshot
+        Expected outcome is the fields of the templates used by the roles of each user, none for unknown users
+        """
+        self.assertCountEqual(self.model.get_visible_fields('d1', 'public'), ['e1', 'e2'])
+        self.assertCountEqual(self.model.get_visible_fields('d1', 'u1'), ['e1', 'e2', 'e3'])
+        self.assertEqual(self.model.get_visible_fields('d1', 'u2'), [])
+        self.assertEqual(self.model.get_visible_fields('d2', 'public'), [])
+
+    def test_unrestricted(self):
+        """
+        Tests full access checks
+        Expected outcome is unrestricted for users of the Full template and users without a template
+        """
+        self.assertFalse(self.model.is_unrestricted('d1'))
+        self.assertTrue(self.model.is_unrestricted_for_user('d1', 'admin'))
+        self.assertTrue(self.model.is_unrestricted_for_user('d1', 'u2'))
+
+    def test_resolve_views(self):
+        """
+        Tests resolving the views of several datasets
+        Expected outcome is a ViewDecision for existing datasets only, with the public field names
+        """
+        decisions = self.model.resolve_views(['d1', 'd2'], 'public')
+        self.assertEqual(list(decisions), ['d1'])
+        self.assertFalse(decisions['d1'].unrestricted)
+        self.assertEqual(decisions['d1'].visible, frozenset(['e1', 'e2']))
+        self.assertCountEqual(decisions['d1'].public_fields, ['id', 'title'])
+        self.assertEqual(dict(decisions['d1'].fields), {'id': 'e1', 'title': 'e2', 'spatial': 'e3'})
+
+    def test_replay_provision_dataset(self):
+        """
+        Tests provisioning a dataset in memory
+        Expected outcome is templates used by the given roles and by the roles of the owner organization
+        """
+        self.assertTrue(self.model.provision_dataset('d2', 'o1', templates=[
+            {'id': 't3', 'name': 'Full', 'fields': {'id': 'e4', 'abstract': 'e5'}, 'roles': ['admin'], 'org_roles': True},
+            {'id': 't4', 'name': 'Minimal', 'fields': {'id': 'e4'}, 'roles': ['public']}
+        ]))
+        self.assertFalse(self.model.provision_dataset('d2', 'o1', templates=[{'id': 't5', 'fields': {}}]))
+        self.assertEqual(self.model.get_templates('d2'), {'Full': 't3', 'Minimal': 't4'})
+        self.assertCountEqual(self.model.get_visible_fields('d2', 'u1'), ['e4', 'e5'])
+        self.assertEqual(self.model.get_visible_fields('d2', 'public'), ['e4'])
+
+    def test_replay_access_changes(self):
+        """
+        Tests changing the fields visible to a template and the template used by a role
+        Expected outcome is the new access, with a role using a single template per dataset
+        """
+        self.model.set_element_access_for_template('d1', 'Minimal', 'spatial')
+        self.assertCountEqual(self.model.get_visible_fields('d1', 'public'), ['e1', 'e2', 'e3'])
+        self.model.delete_element_access_for_template('d1', 'Minimal', 'title')
+        self.assertCountEqual(self.model.get_visible_fields('d1', 'public'), ['e1', 'e3'])
+        self.model.set_template_access('public', 't1')
+        self.assertEqual(self.model.get_template_access_for_role('d1', 'public'), 'Full')
+        self.assertTrue(self.model.is_unrestricted('d1'))
+
+    def test_replay_delete_harvest(self):
+        """
+        Tests deleting the datasets of a harvest source
+        Expected outcome is the datasets and their templates are gone
+        """
+        self.model.delete_harvest('h1')
+        self.assertEqual(self.model.get_dataset('d1'), None)
+        self.assertEqual(self.model.get_templates('d1'), {})
+
+    def test_source(self):
+        """
+        Tests a model with a source
+        Expected outcome is writes made to the source and replayed, other calls passed to the source
+        """
+        source = RecordingSource(snapshot())
+        model = _BitsetMetaAuth(source)
+        model.set_user_role('u2', 'admin')
+        self.assertEqual(source.calls, [('export_snapshot',), ('set_user_role', 'u2', 'admin')])
+        self.assertTrue(model.is_unrestricted_for_user('d1', 'u2'))
+        self.assertEqual(model.get_user_by_username('user1'), {'id': 'u1', 'username': 'user1'})
+        with self.assertRaises(AttributeError):
+            _BitsetMetaAuth().get_user_by_username('user1')
+
+    def test_max_age(self):
+        """
+        Tests reloading the snapshot of the source
+        Expected outcome is a new snapshot once the model is older than max_age
+        """
+        now = [0]
+        source = RecordingSource(snapshot())
+        model = _BitsetMetaAuth(source, max_age=60, clock=lambda: now[0])
+        source.snapshot = dict(snapshot(), users={'public': ['admin']})
+        now[0] = 30
+        self.assertFalse(model.is_unrestricted('d1'))
+        now[0] = 61
+        self.assertTrue(model.is_unrestricted('d1'))
+        self.assertEqual(len(source.calls), 2)
+
+    def test_invalidation(self):
+        """
+        Tests a write made to the graph by another worker, each worker publishing on the same transport
+        Expected outcome is the model reloads on the first read refresh_interval after the message, not for its own writes
+        """
+        now = [0]
+        driver = FakeDriver()
+        transport = LocalTransport()
+        source = _GraphMetaAuth(None, None, None, driver=driver, invalidation=InvalidationBus(transport))
+        other = _GraphMetaAuth(None, None, None, driver=driver, invalidation=InvalidationBus(transport))
+        seed(source)
+        model = _BitsetMetaAuth(source, clock=lambda: now[0], invalidation=source.invalidation, refresh_interval=1)
+        now[0] = 1
+        self.assertFalse(model.is_unrestricted_for_user('d1', 'public'))
+        driver.reset()
+        model.set_user_role('public', 'admin')
+        self.assertTrue(model.is_unrestricted_for_user('d1', 'public'))
+        self.assertEqual(driver.stats['read_transactions'], 0)
+
+        other.detach_user_role('public', 'admin')
+        self.assertTrue(model.is_unrestricted_for_user('d1', 'public'))
+        now[0] = 2
+        self.assertFalse(model.is_unrestricted_for_user('d1', 'public'))
+
+    def test_source_calls(self):
+        """
+        Tests the calls MetaAuthorize defines that the bitset model does not hold the data of
+        Expected outcome is they are answered by the source, deltas are replayed, NotImplementedError without a source
+        """
+        source = _GraphMetaAuth(None, None, None, driver=FakeDriver())
+        seed(source)
+        model = _BitsetMetaAuth(source)
+        self.assertEqual(model.get_fingerprints(), source.get_fingerprints())
+        model.apply_deltas({'delete_datasets': ['d1']})
+        self.assertEqual(model.get_dataset('d1'), None)
+        for call in (lambda model: model.get_fingerprints(), lambda model: model.get_groups(), lambda model: model.apply_deltas({})):
+            with self.assertRaises(NotImplementedError):
+                call(_BitsetMetaAuth())
+
+# Required to run unit test
+if __name__ == '__main__':
+    unittest.main()
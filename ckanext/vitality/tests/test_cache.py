@@ -0,0 +1,156 @@
+"""
+Tests for cache.py.
+Can use -v on run to return verbose tests with more detail
+"""
+import unittest
+import uuid
+from ckanext.vitality.cache import AccessCache, KnownDatasets, create_cache, create_known_datasets, dataset_tag, user_tag, ALL_TAG
+
+
+class FakeClock(object):
+    """
+    Manually advanced clock used to test expiry
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAccessCache(unittest.TestCase):
+    """
+    Runs testing methods related to the AccessCache
+    """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = AccessCache(max_size=2, ttl=10, clock=self.clock)
+
+    def test_get_miss_then_hit(self):
+        """
+        A stored entry should be returned and counted as a hit
+        Expected outcome is one miss followed by one hit
+        """
+        self.assertEqual(self.cache.get('a'), (False, None))
+        self.cache.set('a', ['x'], [dataset_tag('d1')])
+        self.assertEqual(self.cache.get('a'), (True, ['x']))
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_get_returns_copy(self):
+        """
+        Mutating a returned value should not change the cached entry
+        Expected outcome is the original dict
+        """
+        self.cache.set('a', {'id': '1'})
+        self.cache.get('a')[1]['id'] = '2'
+        self.assertEqual(self.cache.get('a')[1], {'id': '1'})
+
+    def test_lru_eviction(self):
+        """
+        The least recently used entry should be evicted once the cache is full
+        Expected outcome is 'b' evicted as 'a' was read after it was stored
+        """
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertTrue(self.cache.get('a')[0])
+        self.assertFalse(self.cache.get('b')[0])
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_ttl_expiry(self):
+        """
+        Entries older than the ttl should be treated as misses
+        """
+        self.cache.set('a', 1)
+        self.clock.now = 9.9
+        self.assertTrue(self.cache.get('a')[0])
+        self.clock.now = 10
+        self.assertFalse(self.cache.get('a')[0])
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_invalidate_by_tag(self):
+        """
+        Invalidating a tag should only drop the entries grouped under it
+        """
+        self.cache.set('a', 1, [dataset_tag('d1'), user_tag('u1')])
+        self.cache.set('b', 2, [dataset_tag('d2'), user_tag('u1')])
+        self.cache.invalidate(dataset_tag('d1'))
+        self.assertFalse(self.cache.get('a')[0])
+        self.assertTrue(self.cache.get('b')[0])
+        self.cache.invalidate(user_tag('u1'))
+        self.assertFalse(self.cache.get('b')[0])
+
+    def test_create_cache_disabled(self):
+        """
+        The cache should only be created when enabled in the settings
+        """
+        self.assertIsNone(create_cache(None))
+        self.assertIsNone(create_cache({'enabled': 'false'}))
+        cache = create_cache({'enabled': 'true', 'max_size': '5', 'ttl': '1'})
+        self.assertEqual(cache.max_size, 5)
+        self.assertEqual(cache.ttl, 1.0)
+
+
+class TestKnownDatasets(unittest.TestCase):
+    """
+    Runs testing methods related to KnownDatasets
+    """
+
+    def setUp(self):
+        self.known = KnownDatasets()
+        self.id = str(uuid.uuid4())
+
+    def test_load(self):
+        """
+        Datasets should only be known once loaded, UUIDs whatever their case
+        """
+        self.assertFalse(self.id in self.known)
+        self.assertTrue(self.known.load([self.id, 'd1'], self.known.begin_load()))
+        self.assertTrue(self.id.upper() in self.known)
+        self.assertTrue('d1' in self.known)
+        self.assertFalse('d2' in self.known)
+
+    def test_invalidate(self):
+        """
+        Invalidating a dataset tag should discard the dataset, ALL_TAG every dataset until loaded again
+        """
+        self.known.load([self.id, 'd1'], self.known.begin_load())
+        self.known.invalidate(dataset_tag(self.id), user_tag('d1'))
+        self.assertFalse(self.id in self.known)
+        self.assertTrue('d1' in self.known)
+        self.known.add(self.id)
+        self.assertTrue(self.id in self.known)
+        self.known.invalidate(ALL_TAG)
+        self.assertFalse(self.known.loaded)
+        self.assertFalse('d1' in self.known)
+
+    def test_changes_while_loading(self):
+        """
+        The changes made while the ids are read should be applied over them, a clear should drop the load
+        """
+        version = self.known.begin_load()
+        self.known.invalidate(dataset_tag('d1'))
+        self.known.add('d2')
+        self.assertTrue(self.known.load(['d1', 'd3'], version))
+        self.assertEqual(['d2', 'd3'], [id for id in ['d1', 'd2', 'd3'] if id in self.known])
+
+        self.known.clear()
+        version = self.known.begin_load()
+        self.known.clear()
+        self.assertFalse(self.known.load(['d1'], version))
+        self.assertFalse(self.known.loaded)
+
+    def test_create_known_datasets_disabled(self):
+        """
+        The set should only be created when enabled in the settings
+        """
+        self.assertIsNone(create_known_datasets(None))
+        self.assertIsNone(create_known_datasets({'enabled': 'false'}))
+        self.assertIsInstance(create_known_datasets({'enabled': 'true'}), KnownDatasets)
+
+# Required to run unit test
+if __name__ == '__main__':
+    unittest.main()
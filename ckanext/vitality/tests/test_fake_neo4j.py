@@ -0,0 +1,649 @@
+"""
+Tests for the write queries of impl/queries.py as answered by fake_neo4j.py, one test per query
+Each query is run on its own against the seeded graph and the graph it leaves is checked
+Can use -v on run to return verbose tests with more detail
+"""
+import re
+import unittest
+from ckanext.vitality.meta_authorize import MetaAuthorize, MetaAuthorizeType
+from ckanext.vitality.impl import queries
+from ckanext.vitality.tests.fake_neo4j import FakeDriver
+from ckanext.vitality.tests.test_graph_meta_auth import seed
+
+
+def write_queries():
+    """
+    Returns the names of the queries of impl/queries.py that change the graph or its schema
+    """
+    return sorted(name for name in dir(queries) if name.isupper() and not name.startswith('_')
+        and isinstance(getattr(queries, name), str) and re.search(r"\b(CREATE|MERGE|DELETE|SET|REMOVE)\b", getattr(queries, name)))
+
+
+class TestFakeWrites(unittest.TestCase):
+    """
+    Runs testing methods related to the graph each write query leaves
+    """
+
+    def setUp(self):
+        self.driver = FakeDriver()
+        self.model = MetaAuthorize.create(MetaAuthorizeType.GRAPH, {'driver': self.driver})
+        seed(self.model)
+        self.graph = self.driver.graph
+        self.member = self.model.get_roles('o1')['member']
+
+    def run_query(self, query, **parameters):
+        """
+        Runs a query of impl/queries.py, or its text, in a write transaction and returns its records
+        """
+        with self.driver.session() as session:
+            return session.write_transaction(lambda tx: list(tx.run(getattr(queries, query, query), **parameters)))
+
+    def node(self, label, id):
+        return self.graph.first(label, id=id)
+
+    def properties(self, label, id):
+        node = self.node(label, id)
+        return dict(self.graph.nodes[node][1]) if node != None else None
+
+    def ids(self, label):
+        return sorted(self.graph.get(node, 'id') for node in self.graph.match(label))
+
+    def edges(self, type):
+        """
+        Returns the (start id, end id) pairs of the relationships of a type, once per relationship
+        """
+        return sorted((self.graph.get(start, 'id'), self.graph.get(end, 'id'))
+            for rtype, start, end in self.graph.relationships.values() if rtype == type)
+
+    def test_every_write_query(self):
+        """
+        Tests that every write query has a test below
+        Expected outcome is a test_<query name> method for each query that changes the graph
+        """
+        self.assertEqual([name for name in write_queries() if not hasattr(self, 'test_' + name.lower())], [])
+
+    def test_add_template_fields(self):
+        """
+        Tests adding fields to the visible property of a template, twice with an overlap
+        Expected outcome is the property lists each field once, in the order added
+        """
+        self.run_query('ADD_TEMPLATE_FIELDS', template_id='t2', element_ids=['e2', 'e3'])
+        self.run_query('ADD_TEMPLATE_FIELDS', template_id='t2', element_ids=['e3', 'e1'])
+        self.assertEqual(self.properties('template', 't2')['visible'], ['e2', 'e3', 'e1'])
+
+    def test_bind_dataset_to_org(self):
+        """
+        Tests binding a new dataset to an organization
+        Expected outcome is an owns relationship from the organization to the dataset
+        """
+        self.graph.create('dataset', {'id': 'd2'})
+        self.run_query('BIND_DATASET_TO_ORG', org_id='o1', dataset_id='d2')
+        self.assertEqual(self.edges('owns'), [('o1', 'd1'), ('o1', 'd2')])
+
+    def test_bind_field_to_template(self):
+        """
+        Tests binding an element to a template
+        Expected outcome is a can_see relationship from the template to the element
+        """
+        self.run_query('BIND_FIELD_TO_TEMPLATE', element_id='e3', template_id='t2')
+        self.assertIn(('t2', 'e3'), self.edges('can_see'))
+
+    def test_bind_role_to_org(self):
+        """
+        Tests binding a new role to an organization
+        Expected outcome is a manages_role relationship next to the one of the member role
+        """
+        self.graph.create('role', {'id': 'r1'})
+        self.run_query('BIND_ROLE_TO_ORG', org_id='o1', role_id='r1')
+        self.assertEqual(self.edges('manages_role'), sorted([('o1', self.member), ('o1', 'r1')]))
+
+    def test_bind_role_to_template(self):
+        """
+        Tests binding the public role to the Full template
+        Expected outcome is a uses_template relationship, kept next to the one to the Minimal template
+        """
+        self.run_query('BIND_ROLE_TO_TEMPLATE', role_id='public', template_id='t1')
+        self.assertEqual([edge for edge in self.edges('uses_template') if edge[0] == 'public'], [('public', 't1'), ('public', 't2')])
+
+    def test_bind_template_to_dataset(self):
+        """
+        Tests binding a new template to a dataset
+        Expected outcome is a has_template relationship from the dataset
+        """
+        self.graph.create('template', {'id': 't3'})
+        self.run_query('BIND_TEMPLATE_TO_DATASET', template_id='t3', dataset_id='d1')
+        self.assertEqual(self.edges('has_template'), [('d1', 't1'), ('d1', 't2'), ('d1', 't3')])
+
+    def test_bind_user_to_group(self):
+        """
+        Tests binding a user to a new group
+        Expected outcome is a has_member relationship from the group to the user
+        """
+        self.graph.create('group', {'id': 'g1'})
+        self.run_query('BIND_USER_TO_GROUP', group_id='g1', user_id='u1')
+        self.assertEqual(self.edges('has_member'), [('g1', 'u1')])
+
+    def test_bind_user_to_org(self):
+        """
+        Tests binding a user to an organization
+        Expected outcome is a serves relationship from the user to the organization
+        """
+        self.run_query('BIND_USER_TO_ORG', user_id='u1', org_id='o1')
+        self.assertEqual(self.edges('serves'), [('u1', 'o1')])
+
+    def test_bind_user_to_role(self):
+        """
+        Tests giving the admin role to a user
+        Expected outcome is a has_role relationship next to the member role of the user
+        """
+        self.run_query('BIND_USER_TO_ROLE', role_id='admin', user_id='u1')
+        self.assertEqual(self.edges('has_role'), sorted([('public', 'public'), ('u1', self.member), ('u1', 'admin')]))
+
+    def test_create_index(self):
+        """
+        Tests creating an index formatted from CREATE_INDEX
+        Expected outcome is the index in the schema of the graph
+        """
+        self.run_query(queries.CREATE_INDEX.format(name='vitality_dataset_harvest_source', label='dataset', property='harvest_source'))
+        self.assertEqual(self.graph.schema['vitality_dataset_harvest_source'], ('INDEX', 'dataset', 'harvest_source'))
+
+    def test_create_unique_constraint(self):
+        """
+        Tests creating a constraint formatted from CREATE_UNIQUE_CONSTRAINT
+        Expected outcome is the constraint in the schema of the graph
+        """
+        self.run_query(queries.CREATE_UNIQUE_CONSTRAINT.format(name='vitality_user_id', label='user', property='id'))
+        self.assertEqual(self.graph.schema['vitality_user_id'], ('CONSTRAINT', 'user', 'id'))
+
+    def test_delete_dataset(self):
+        """
+        Tests deleting a dataset one of whose elements is shared
+        Expected outcome is the dataset, its templates and its other elements are gone, the organization is kept
+        """
+        self.graph.set(self.node('element', 'e1'), {'shared': True})
+        self.run_query('DELETE_DATASET', id='d1')
+        self.assertEqual(self.ids('dataset'), [])
+        self.assertEqual(self.ids('template'), [])
+        self.assertEqual(self.ids('element'), ['e1'])
+        self.assertEqual(self.ids('organization'), ['o1'])
+
+    def test_delete_harvest_datasets(self):
+        """
+        Tests deleting the datasets of a harvest source
+        Expected outcome is the ids of the datasets deleted, their templates are kept for DELETE_HARVEST_TEMPLATES
+        """
+        self.assertEqual(self.run_query('DELETE_HARVEST_DATASETS', harvest_id='h1', batch_size=10), [{'ids': ['d1']}])
+        self.assertEqual(self.ids('dataset'), [])
+        self.assertEqual(self.ids('template'), ['t1', 't2'])
+        self.assertEqual(self.edges('has_template'), [])
+
+    def test_delete_harvest_elements(self):
+        """
+        Tests deleting the elements of a harvest source, two per batch
+        Expected outcome is two elements deleted then the last one, the templates are kept
+        """
+        self.assertEqual(self.run_query('DELETE_HARVEST_ELEMENTS', harvest_id='h1', batch_size=2), [{'deleted': 2}])
+        self.assertEqual(len(self.ids('element')), 1)
+        self.assertEqual(self.run_query('DELETE_HARVEST_ELEMENTS', harvest_id='h1', batch_size=2), [{'deleted': 1}])
+        self.assertEqual(self.ids('element'), [])
+        self.assertEqual(self.ids('template'), ['t1', 't2'])
+
+    def test_delete_harvest_templates(self):
+        """
+        Tests deleting the templates of a harvest source
+        Expected outcome is the templates and the roles using them are detached, the dataset is kept
+        """
+        self.assertEqual(self.run_query('DELETE_HARVEST_TEMPLATES', harvest_id='h1', batch_size=10), [{'deleted': 2}])
+        self.assertEqual(self.ids('template'), [])
+        self.assertEqual(self.ids('dataset'), ['d1'])
+        self.assertEqual(self.edges('uses_template'), [])
+
+    def test_delete_organization(self):
+        """
+        Tests deleting an organization
+        Expected outcome is the organization and its relationships are gone, its member role is kept
+        """
+        self.run_query('DELETE_ORGANIZATION', id='o1')
+        self.assertEqual(self.ids('organization'), [])
+        self.assertEqual(self.edges('owns'), [])
+        self.assertEqual(self.edges('manages_role'), [])
+        self.assertIn(self.member, self.ids('role'))
+
+    def test_delete_user(self):
+        """
+        Tests deleting a user
+        Expected outcome is the user and its has_role relationships are gone, the roles are kept
+        """
+        self.run_query('DELETE_USER', id='u1')
+        self.assertEqual(self.ids('user'), ['public'])
+        self.assertEqual(self.edges('has_role'), [('public', 'public')])
+        self.assertIn(self.member, self.ids('role'))
+
+    def test_detach_all_fields_from_template(self):
+        """
+        Tests detaching every element from the Full template
+        Expected outcome is no can_see relationship from the template, the elements are kept
+        """
+        self.run_query('DETACH_ALL_FIELDS_FROM_TEMPLATE', template_id='t1')
+        self.assertEqual(self.edges('can_see'), [('t2', 'e1'), ('t2', 'e2')])
+        self.assertEqual(self.ids('element'), ['e1', 'e2', 'e3'])
+
+    def test_detach_dataset_from_orgs(self):
+        """
+        Tests detaching a dataset from its organization
+        Expected outcome is no owns relationship, the organization is kept
+        """
+        self.run_query('DETACH_DATASET_FROM_ORGS', dataset_id='d1')
+        self.assertEqual(self.edges('owns'), [])
+        self.assertEqual(self.ids('organization'), ['o1'])
+
+    def test_detach_field_from_template(self):
+        """
+        Tests detaching an element from the Minimal template
+        Expected outcome is the element is only detached from that template
+        """
+        self.run_query('DETACH_FIELD_FROM_TEMPLATE', element_id='e2', template_id='t2')
+        self.assertEqual(self.edges('can_see'), [('t1', 'e1'), ('t1', 'e2'), ('t1', 'e3'), ('t2', 'e1')])
+
+    def test_detach_role_from_dataset_templates(self):
+        """
+        Tests detaching the admin role from the templates of the dataset of the Minimal template
+        Expected outcome is the admin role no longer uses the Full template of the dataset
+        """
+        self.run_query('DETACH_ROLE_FROM_DATASET_TEMPLATES', template_id='t2', role_id='admin')
+        self.assertEqual(self.edges('uses_template'), sorted([(self.member, 't1'), ('public', 't2')]))
+
+    def test_detach_template_from_dataset(self):
+        """
+        Tests detaching a template from its dataset
+        Expected outcome is no has_template relationship to the template, the template is kept
+        """
+        self.run_query('DETACH_TEMPLATE_FROM_DATASET', template_id='t2', dataset_id='d1')
+        self.assertEqual(self.edges('has_template'), [('d1', 't1')])
+        self.assertEqual(self.ids('template'), ['t1', 't2'])
+
+    def test_detach_user_from_org_roles(self):
+        """
+        Tests detaching a user from the roles of an organization
+        Expected outcome is the user no longer has the member role
+        """
+        self.run_query('DETACH_USER_FROM_ORG_ROLES', role_id=self.member, user_id='u1')
+        self.assertEqual(self.edges('has_role'), [('public', 'public')])
+
+    def test_detach_user_from_role(self):
+        """
+        Tests detaching the public user from the public role
+        Expected outcome is only the member role of the other user is left
+        """
+        self.run_query('DETACH_USER_FROM_ROLE', role_id='public', user_id='public')
+        self.assertEqual(self.edges('has_role'), [('u1', self.member)])
+
+    def test_fold_elements(self):
+        """
+        Tests folding the title elements into a shared one, with the Minimal template listing its fields
+        Expected outcome is the title element is gone, the templates see the shared element instead and the listed id is replaced
+        """
+        self.graph.create('element', {'id': 's1', 'name': 'title', 'shared': True})
+        self.graph.set(self.node('template', 't2'), {'visible': ['e1', 'e2']})
+        self.assertEqual(self.run_query('FOLD_ELEMENTS', name='title', id='s1', batch_size=10), [{'folded': 1}])
+        self.assertEqual(self.ids('element'), ['e1', 'e3', 's1'])
+        self.assertEqual(self.edges('can_see'), [('t1', 'e1'), ('t1', 'e3'), ('t1', 's1'), ('t2', 'e1'), ('t2', 's1')])
+        self.assertEqual(self.properties('template', 't2')['visible'], ['e1', 's1'])
+
+    def test_full_access_batch(self):
+        """
+        Tests giving the public the Full template of every dataset, twice
+        Expected outcome is the public uses the Full template instead of the Minimal one, nothing left to update the second time
+        """
+        self.assertEqual(self.run_query('FULL_ACCESS_BATCH', role_id='public', batch_size=10), [{'updated': 1}])
+        self.assertEqual([edge for edge in self.edges('uses_template') if edge[0] == 'public'], [('public', 't1')])
+        self.assertEqual(self.run_query('FULL_ACCESS_BATCH', role_id='public', batch_size=10), [{'updated': 0}])
+
+    def test_list_template_fields(self):
+        """
+        Tests listing the fields of the templates in their visible property, one per batch
+        Expected outcome is a template listed per batch until none is left, with the can_see relationships kept
+        """
+        self.assertEqual(self.run_query('LIST_TEMPLATE_FIELDS', batch_size=1), [{'listed': 1}])
+        self.assertEqual(self.run_query('LIST_TEMPLATE_FIELDS', batch_size=1), [{'listed': 1}])
+        self.assertEqual(self.run_query('LIST_TEMPLATE_FIELDS', batch_size=1), [{'listed': 0}])
+        self.assertEqual(sorted(self.properties('template', 't1')['visible']), ['e1', 'e2', 'e3'])
+        self.assertEqual(sorted(self.properties('template', 't2')['visible']), ['e1', 'e2'])
+        self.assertEqual(len(self.edges('can_see')), 5)
+
+    def test_minimal_access_batch(self):
+        """
+        Tests giving the Minimal template of a dataset to every role, with the public using the Full one
+        Expected outcome is only the public is updated, the admin and the member roles of the owner keep the Full template
+        """
+        self.model.set_template_access('public', 't1')
+        self.assertEqual(self.run_query('MINIMAL_ACCESS_BATCH', dataset_id='d1', batch_size=10), [{'updated': 1}])
+        self.assertEqual(self.edges('uses_template'), sorted([('admin', 't1'), (self.member, 't1'), ('public', 't2')]))
+
+    def test_provision_dataset(self):
+        """
+        Tests provisioning a new dataset, then the existing one with other properties
+        Expected outcome is the new dataset owned by the organization, the existing one keeps its name and is reported as having templates
+        """
+        self.assertEqual(self.run_query('PROVISION_DATASET', dataset_id='d2', owner_id='o1', properties={'name': 'Dataset 2'},
+            updates={'harvest_source': 'h2'}), [{'has_templates': False}])
+        self.assertEqual(self.properties('dataset', 'd2'), {'id': 'd2', 'name': 'Dataset 2', 'harvest_source': 'h2'})
+        self.assertEqual(self.run_query('PROVISION_DATASET', dataset_id='d1', owner_id='o1', properties={'name': 'Renamed'},
+            updates={}), [{'has_templates': True}])
+        self.assertEqual(self.properties('dataset', 'd1')['name'], 'Dataset 1')
+        self.assertEqual(self.edges('owns'), [('o1', 'd1'), ('o1', 'd2')])
+
+    def test_provision_datasets(self):
+        """
+        Tests provisioning a new and an existing dataset at once
+        Expected outcome is a record per dataset, the properties set on create only and the updates on both
+        """
+        records = self.run_query('PROVISION_DATASETS', datasets=[
+            {'id': 'd2', 'owner_id': 'o1', 'properties': {'name': 'Dataset 2'}, 'updates': {}},
+            {'id': 'd1', 'owner_id': 'o1', 'properties': {}, 'updates': {'harvest_source': 'h2'}}
+        ])
+        self.assertEqual(records, [{'id': 'd2', 'has_templates': False}, {'id': 'd1', 'has_templates': True}])
+        self.assertEqual(self.properties('dataset', 'd2'), {'id': 'd2', 'name': 'Dataset 2'})
+        self.assertEqual(self.properties('dataset', 'd1')['harvest_source'], 'h2')
+        self.assertEqual(self.edges('owns'), [('o1', 'd1'), ('o1', 'd2')])
+
+    def test_provision_datasets_templates(self):
+        """
+        Tests creating the templates of a batch of datasets
+        Expected outcome is the templates with their properties, bound to their dataset
+        """
+        self.graph.create('dataset', {'id': 'd2'})
+        self.run_query('PROVISION_DATASETS_TEMPLATES', datasets=[
+            {'id': 'd2', 'properties': {'name': 'Dataset 2'}, 'templates': [{'id': 't3', 'properties': {'name': 'Full'}}]}
+        ])
+        self.assertEqual(self.properties('dataset', 'd2'), {'id': 'd2', 'name': 'Dataset 2'})
+        self.assertEqual(self.properties('template', 't3'), {'id': 't3', 'name': 'Full'})
+        self.assertIn(('d2', 't3'), self.edges('has_template'))
+
+    def test_provision_datasets_template_access(self):
+        """
+        Tests giving a template to a role and the roles of the owner, twice
+        Expected outcome is a single uses_template relationship per role
+        """
+        self.graph.create('template', {'id': 't3'})
+        templates = [{'id': 't3', 'owner_id': 'o1', 'roles': ['admin'], 'org_roles': True}]
+        self.run_query('PROVISION_DATASETS_TEMPLATE_ACCESS', templates=templates)
+        self.run_query('PROVISION_DATASETS_TEMPLATE_ACCESS', templates=templates)
+        self.assertEqual([edge for edge in self.edges('uses_template') if edge[1] == 't3'], sorted([('admin', 't3'), (self.member, 't3')]))
+
+    def test_provision_elements(self):
+        """
+        Tests creating an element seen by two templates
+        Expected outcome is the element with its properties and a can_see relationship from each template
+        """
+        self.run_query('PROVISION_ELEMENTS', elements=[{'properties': {'id': 'e4', 'name': 'notes'}, 'templates': ['t1', 't2']}])
+        self.assertEqual(self.properties('element', 'e4'), {'id': 'e4', 'name': 'notes'})
+        self.assertEqual([edge for edge in self.edges('can_see') if edge[1] == 'e4'], [('t1', 'e4'), ('t2', 'e4')])
+
+    def test_provision_shared_elements(self):
+        """
+        Tests provisioning a shared element twice, the second time with another name and template
+        Expected outcome is a single element with the properties it was created with, seen once by each template
+        """
+        self.run_query('PROVISION_SHARED_ELEMENTS', elements=[{'properties': {'id': 's1', 'name': 'notes', 'shared': True}, 'templates': ['t1']}])
+        self.run_query('PROVISION_SHARED_ELEMENTS', elements=[{'properties': {'id': 's1', 'name': 'other', 'shared': True}, 'templates': ['t1', 't2']}])
+        self.assertEqual(self.properties('element', 's1'), {'id': 's1', 'name': 'notes', 'shared': True})
+        self.assertEqual(len(self.graph.match('element', id='s1')), 1)
+        self.assertEqual([edge for edge in self.edges('can_see') if edge[1] == 's1'], [('t1', 's1'), ('t2', 's1')])
+
+    def test_provision_templates(self):
+        """
+        Tests creating the templates of a dataset
+        Expected outcome is the templates with their properties, bound to the dataset
+        """
+        self.graph.create('dataset', {'id': 'd2'})
+        self.run_query('PROVISION_TEMPLATES', dataset_id='d2', properties={'name': 'Dataset 2'},
+            templates=[{'id': 't3', 'properties': {'name': 'Full'}}, {'id': 't4', 'properties': {'name': 'Minimal'}}])
+        self.assertEqual(self.properties('dataset', 'd2'), {'id': 'd2', 'name': 'Dataset 2'})
+        self.assertEqual(self.properties('template', 't4'), {'id': 't4', 'name': 'Minimal'})
+        self.assertEqual([edge for edge in self.edges('has_template') if edge[0] == 'd2'], [('d2', 't3'), ('d2', 't4')])
+
+    def test_provision_template_access(self):
+        """
+        Tests giving a template to the public and the roles of the owner, twice
+        Expected outcome is a single uses_template relationship per role
+        """
+        self.graph.create('template', {'id': 't3'})
+        templates = [{'id': 't3', 'roles': ['public'], 'org_roles': True}]
+        self.run_query('PROVISION_TEMPLATE_ACCESS', owner_id='o1', templates=templates)
+        self.run_query('PROVISION_TEMPLATE_ACCESS', owner_id='o1', templates=templates)
+        self.assertEqual([edge for edge in self.edges('uses_template') if edge[1] == 't3'], sorted([('public', 't3'), (self.member, 't3')]))
+
+    def test_reconcile_bind_admins(self):
+        """
+        Tests giving the admin role to a user and an unknown user, twice
+        Expected outcome is a single has_role relationship for the known user
+        """
+        self.run_query('RECONCILE_BIND_ADMINS', ids=['u1', 'u2'])
+        self.run_query('RECONCILE_BIND_ADMINS', ids=['u1'])
+        self.assertEqual([edge for edge in self.edges('has_role') if edge[1] == 'admin'], [('u1', 'admin')])
+
+    def test_reconcile_bind_group_members(self):
+        """
+        Tests adding a user to a group and an unknown group, twice
+        Expected outcome is a single has_member relationship to the known group
+        """
+        self.graph.create('group', {'id': 'g1'})
+        self.run_query('RECONCILE_BIND_GROUP_MEMBERS', members=[{'group_id': 'g1', 'user_id': 'u1'}, {'group_id': 'g2', 'user_id': 'u1'}])
+        self.run_query('RECONCILE_BIND_GROUP_MEMBERS', members=[{'group_id': 'g1', 'user_id': 'u1'}])
+        self.assertEqual(self.edges('has_member'), [('g1', 'u1')])
+
+    def test_reconcile_bind_org_members(self):
+        """
+        Tests adding the public user and an existing member to an organization
+        Expected outcome is both users have the member role once
+        """
+        self.run_query('RECONCILE_BIND_ORG_MEMBERS', members=[{'org_id': 'o1', 'user_id': 'public'}, {'org_id': 'o1', 'user_id': 'u1'}])
+        self.assertEqual([edge for edge in self.edges('has_role') if edge[1] == self.member], [('public', self.member), ('u1', self.member)])
+
+    def test_reconcile_delete_datasets(self):
+        """
+        Tests deleting a dataset and an unknown one
+        Expected outcome is the dataset, its templates and its elements are gone
+        """
+        self.run_query('RECONCILE_DELETE_DATASETS', ids=['d1', 'd2'])
+        self.assertEqual(self.ids('dataset'), [])
+        self.assertEqual(self.ids('template'), [])
+        self.assertEqual(self.ids('element'), [])
+
+    def test_reconcile_delete_groups(self):
+        """
+        Tests deleting a group with a member
+        Expected outcome is the group and its has_member relationship are gone, the user is kept
+        """
+        self.graph.relate('has_member', self.graph.create('group', {'id': 'g1'}), self.node('user', 'u1'))
+        self.run_query('RECONCILE_DELETE_GROUPS', ids=['g1'])
+        self.assertEqual(self.ids('group'), [])
+        self.assertEqual(self.edges('has_member'), [])
+        self.assertEqual(self.ids('user'), ['public', 'u1'])
+
+    def test_reconcile_delete_users(self):
+        """
+        Tests deleting every user
+        Expected outcome is no user and no has_role relationship left
+        """
+        self.run_query('RECONCILE_DELETE_USERS', ids=['u1', 'public'])
+        self.assertEqual(self.ids('user'), [])
+        self.assertEqual(self.edges('has_role'), [])
+
+    def test_reconcile_detach_admins(self):
+        """
+        Tests taking the admin role from a user
+        Expected outcome is the user keeps its other roles
+        """
+        self.model.set_user_role('u1', 'admin')
+        self.run_query('RECONCILE_DETACH_ADMINS', ids=['u1'])
+        self.assertEqual(self.edges('has_role'), sorted([('public', 'public'), ('u1', self.member)]))
+
+    def test_reconcile_detach_group_members(self):
+        """
+        Tests removing a user from a group
+        Expected outcome is no has_member relationship, the group is kept
+        """
+        self.graph.relate('has_member', self.graph.create('group', {'id': 'g1'}), self.node('user', 'u1'))
+        self.run_query('RECONCILE_DETACH_GROUP_MEMBERS', members=[{'group_id': 'g1', 'user_id': 'u1'}])
+        self.assertEqual(self.edges('has_member'), [])
+        self.assertEqual(self.ids('group'), ['g1'])
+
+    def test_reconcile_detach_org_members(self):
+        """
+        Tests removing a user from an organization
+        Expected outcome is the user no longer has the member role, the role is kept
+        """
+        self.run_query('RECONCILE_DETACH_ORG_MEMBERS', members=[{'org_id': 'o1', 'user_id': 'u1'}])
+        self.assertEqual(self.edges('has_role'), [('public', 'public')])
+        self.assertIn(self.member, self.ids('role'))
+
+    def test_reconcile_update_users(self):
+        """
+        Tests updating the username and email of a user, the email to null
+        Expected outcome is the new username and no email property
+        """
+        self.run_query('RECONCILE_UPDATE_USERS', users=[{'id': 'u1', 'username': 'renamed', 'email': None}])
+        self.assertEqual(self.properties('user', 'u1'), {'id': 'u1', 'username': 'renamed'})
+
+    def test_remove_template_field(self):
+        """
+        Tests removing a field from a template listing its fields and from one without the property
+        Expected outcome is the field is no longer listed, and an empty list for the other template
+        """
+        self.graph.set(self.node('template', 't2'), {'visible': ['e1', 'e2']})
+        self.run_query('REMOVE_TEMPLATE_FIELD', template_id='t2', element_id='e1')
+        self.run_query('REMOVE_TEMPLATE_FIELD', template_id='t1', element_id='e1')
+        self.assertEqual(self.properties('template', 't2')['visible'], ['e2'])
+        self.assertEqual(self.properties('template', 't1')['visible'], [])
+
+    def test_seed_users(self):
+        """
+        Tests seeding a new and an existing user with roles
+        Expected outcome is the properties set on create only and the updates on both, with the roles given
+        """
+        records = self.run_query('SEED_USERS', users=[
+            {'id': 'u2', 'properties': {'username': 'user2'}, 'updates': {'email': 'user2@example.com'}, 'roles': ['admin']},
+            {'id': 'u1', 'properties': {'username': 'ignored'}, 'updates': {'email': 'renamed@example.com'}, 'roles': ['public']}
+        ])
+        self.assertEqual(records, [{'seeded': 2}])
+        self.assertEqual(self.properties('user', 'u2'), {'id': 'u2', 'username': 'user2', 'email': 'user2@example.com'})
+        self.assertEqual(self.properties('user', 'u1'), {'id': 'u1', 'username': 'user1', 'email': 'renamed@example.com'})
+        self.assertEqual(self.edges('has_role'), sorted([('public', 'public'), ('u1', self.member), ('u1', 'public'), ('u2', 'admin')]))
+
+    def test_set_dataset_properties(self):
+        """
+        Tests setting a description and removing the harvest source of a dataset
+        Expected outcome is the other properties are kept
+        """
+        self.run_query('SET_DATASET_PROPERTIES', id='d1', properties={'description_fr': 'Un jeu de donnees', 'harvest_source': None})
+        self.assertEqual(self.properties('dataset', 'd1'), {'id': 'd1', 'name': 'Dataset 1', 'description_en': 'A dataset', 'description_fr': 'Un jeu de donnees'})
+
+    def test_set_organization_name(self):
+        """
+        Tests renaming an organization
+        Expected outcome is the new name
+        """
+        self.run_query('SET_ORGANIZATION_NAME', id='o1', name='Renamed')
+        self.assertEqual(self.properties('organization', 'o1'), {'id': 'o1', 'name': 'Renamed'})
+
+    def test_set_template_fields(self):
+        """
+        Tests replacing the fields listed by a template
+        Expected outcome is the new list, with the can_see relationships kept
+        """
+        self.run_query('SET_TEMPLATE_FIELDS', template_id='t2', element_ids=['e1'])
+        self.assertEqual(self.properties('template', 't2')['visible'], ['e1'])
+        self.assertEqual(len(self.edges('can_see')), 5)
+
+    def test_set_user_properties(self):
+        """
+        Tests setting the GID and removing the email of a user
+        Expected outcome is the other properties are kept
+        """
+        self.run_query('SET_USER_PROPERTIES', id='u1', properties={'gid': 'g-1', 'email': None})
+        self.assertEqual(self.properties('user', 'u1'), {'id': 'u1', 'username': 'user1', 'gid': 'g-1'})
+
+    def test_write_dataset(self):
+        """
+        Tests writing a dataset
+        Expected outcome is a dataset node with the properties
+        """
+        self.run_query('WRITE_DATASET', id='d2', properties={'name': 'Dataset 2'})
+        self.assertEqual(self.properties('dataset', 'd2'), {'id': 'd2', 'name': 'Dataset 2'})
+
+    def test_write_group(self):
+        """
+        Tests writing a group
+        Expected outcome is a group node with only its id
+        """
+        self.run_query('WRITE_GROUP', id='g1')
+        self.assertEqual(self.properties('group', 'g1'), {'id': 'g1'})
+
+    def test_write_metadata_field(self):
+        """
+        Tests writing an element of a template
+        Expected outcome is the element with its properties, seen by the template
+        """
+        self.run_query('WRITE_METADATA_FIELD', template_id='t2', properties={'id': 'e4', 'name': 'notes'})
+        self.assertEqual(self.properties('element', 'e4'), {'id': 'e4', 'name': 'notes'})
+        self.assertEqual([edge for edge in self.edges('can_see') if edge[1] == 'e4'], [('t2', 'e4')])
+
+    def test_write_org(self):
+        """
+        Tests writing an organization
+        Expected outcome is an organization node with the properties
+        """
+        self.run_query('WRITE_ORG', id='o2', properties={'name': 'Org 2'})
+        self.assertEqual(self.properties('organization', 'o2'), {'id': 'o2', 'name': 'Org 2'})
+
+    def test_write_role(self):
+        """
+        Tests writing a role
+        Expected outcome is a role node with the properties
+        """
+        self.run_query('WRITE_ROLE', id='r1', properties={'name': 'editor'})
+        self.assertEqual(self.properties('role', 'r1'), {'id': 'r1', 'name': 'editor'})
+
+    def test_write_shared_element(self):
+        """
+        Tests writing a shared element twice with another name
+        Expected outcome is a single element with the properties it was created with
+        """
+        self.run_query('WRITE_SHARED_ELEMENT', id='s1', properties={'id': 's1', 'name': 'title', 'shared': True})
+        self.run_query('WRITE_SHARED_ELEMENT', id='s1', properties={'id': 's1', 'name': 'other', 'shared': True})
+        self.assertEqual(len(self.graph.match('element', id='s1')), 1)
+        self.assertEqual(self.properties('element', 's1'), {'id': 's1', 'name': 'title', 'shared': True})
+
+    def test_write_shared_metadata_field(self):
+        """
+        Tests writing a shared element for two templates, the first one twice
+        Expected outcome is a single element seen once by each template
+        """
+        properties = {'id': 's1', 'name': 'notes', 'shared': True}
+        self.run_query('WRITE_SHARED_METADATA_FIELD', id='s1', template_id='t1', properties=properties)
+        self.run_query('WRITE_SHARED_METADATA_FIELD', id='s1', template_id='t2', properties=properties)
+        self.run_query('WRITE_SHARED_METADATA_FIELD', id='s1', template_id='t1', properties=properties)
+        self.assertEqual(len(self.graph.match('element', id='s1')), 1)
+        self.assertEqual([edge for edge in self.edges('can_see') if edge[1] == 's1'], [('t1', 's1'), ('t2', 's1')])
+
+    def test_write_template(self):
+        """
+        Tests writing a template
+        Expected outcome is a template node with the properties
+        """
+        self.run_query('WRITE_TEMPLATE', id='t3', properties={'name': 'Full'})
+        self.assertEqual(self.properties('template', 't3'), {'id': 't3', 'name': 'Full'})
+
+    def test_write_user(self):
+        """
+        Tests writing a user
+        Expected outcome is a user node with the properties
+        """
+        self.run_query('WRITE_USER', id='u2', properties={'username': 'user2'})
+        self.assertEqual(self.properties('user', 'u2'), {'id': 'u2', 'username': 'user2'})
+
+# Required to run unit test
+if __name__ == '__main__':
+    unittest.main()
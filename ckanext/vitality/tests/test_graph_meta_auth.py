@@ -1,31 +1,266 @@
 """
-Tests for graph_meta_authorize.py.
+Tests for graph_meta_authorize.py, run against the in process driver of fake_neo4j.py
 Note for unittest may want to separate the different tests into classes & functions
 rather than keeping all within one
 Can use -v on run to return verbose tests with more detail
 
-testDict is used to simulate pkg_dict throughout the file
-Using data directly from the model is avoided to narrow down cases 
-    if something doesn't match the tests, but perhaps some proper
-    mock data should be used here at some point in the future
+The fake driver answers the queries of impl/queries.py from an in memory graph and counts
+sessions, transactions and queries, so round trips can be asserted without a Bolt server
 """
 
 import unittest
-from ckanext.vitality_prototype.meta_authorize import MetaAuthorize, MetaAuthorizeType
+from ckanext.vitality.meta_authorize import MetaAuthorize, MetaAuthorizeType, diff_fingerprints
+from ckanext.vitality.impl import queries
+from ckanext.vitality.impl.graph_meta_auth import _GraphMetaAuth
+from ckanext.vitality.cache import AccessCache, KnownDatasets, CacheGroup
+from ckanext.vitality.invalidation import InvalidationBus, LocalTransport
+from ckanext.vitality.tests.fake_neo4j import FakeDriver
+
+
+def seed(model):
+    model.add_role('admin', 'admin')
+    model.add_role('public', 'public')
+    model.add_user('public', 'public')
+    model.set_user_role('public', 'public')
+    model.add_user('u1', 'user1', 'user1@example.com')
+    model.add_org('o1', [{'id': 'u1'}], 'Org 1')
+    model.provision_dataset('d1', 'o1', 'Dataset 1', 'h1', {'en': 'A dataset'}, [
+        {'id': 't1', 'name': 'Full', 'fields': {'id': 'e1', 'title': 'e2', 'spatial': 'e3'}, 'roles': ['admin'], 'org_roles': True},
+        {'id': 't2', 'name': 'Minimal', 'fields': {'id': 'e1', 'title': 'e2'}, 'roles': ['public']}
+    ])
+
 
 class TestNeo4j(unittest.TestCase):
-    testAuthorize = MetaAuthorize.create(MetaAuthorizeType.GRAPH, {
-            'host': "bolt://localhost:7476",
-            'user': "neo4j",
-            'password': "password"
-        })
+    """
+    Runs testing methods related to the graph authorization model
+    """
+
+    def setUp(self):
+        self.driver = FakeDriver()
+        self.testAuthorize = MetaAuthorize.create(MetaAuthorizeType.GRAPH, {'driver': self.driver})
+        seed(self.testAuthorize)
+        self.driver.reset()
 
     def test_createData(self):
+        """
+        Tests adding a user
+        Expected outcome is the user can be found by username
+        """
         self.testAuthorize.add_user("test", "test")
-        self.assertTrue(True)
+        self.assertEqual(self.testAuthorize.get_user_by_username("test")['id'], "test")
+
+    def test_provision_dataset(self):
+        """
+        Tests the access of a provisioned dataset
+        Expected outcome is the members of the organization see every field, the public the Minimal ones
+        """
+        self.assertEqual(self.testAuthorize.get_templates('d1'), {'Full': 't1', 'Minimal': 't2'})
+        self.assertCountEqual(self.testAuthorize.get_visible_fields('d1', 'u1'), ['e1', 'e2', 'e3'])
+        self.assertCountEqual(self.testAuthorize.get_visible_fields('d1', 'public'), ['e1', 'e2'])
+        self.assertFalse(self.testAuthorize.is_unrestricted('d1'))
+        self.assertFalse(self.testAuthorize.provision_dataset('d1', 'o1', templates=[{'id': 't3', 'fields': {}}]))
+
+    def test_round_trips(self):
+        """
+        Tests the transactions and queries of the calls made for each dataset shown
+        Expected outcome is a single read transaction running a single query to resolve several views
+        """
+        decisions = self.testAuthorize.resolve_views(['d1', 'd2'], 'public')
+        self.assertEqual(list(decisions), ['d1'])
+        self.assertEqual(self.driver.stats['transactions'], 1)
+        self.assertEqual(self.driver.stats['read_transactions'], 1)
+        self.assertEqual(self.driver.queries, {'RESOLVE_VIEWS': 1})
+        self.driver.reset()
+        self.testAuthorize.provision_dataset('d2', 'o1', templates=[{'id': 't4', 'name': 'Full', 'fields': {'id': 'e4'}, 'roles': ['public']}])
+        self.assertEqual(self.driver.stats['write_transactions'], 1)
+        self.assertEqual(self.driver.stats['queries'], 4)
+        self.assertTrue(self.testAuthorize.is_unrestricted('d2'))
+
+    def test_add_users(self):
+        """
+        Tests seeding users in batches
+        Expected outcome is one write transaction per batch, existing users keep their username
+        """
+        seeded = []
+        total = self.testAuthorize.add_users([
+            {'id': 'u1', 'username': 'renamed', 'gid': 'guest'},
+            {'id': 'u2', 'username': 'user2', 'email': 'user2@example.com', 'gid': 'guest', 'roles': ['admin']},
+            {'id': 'u3', 'username': 'user3', 'roles': []}
+        ], 2, seeded.append)
+        self.assertEqual(total, 3)
+        self.assertEqual(seeded, [2, 1])
+        self.assertEqual(self.driver.stats['write_transactions'], 2)
+        self.assertEqual(self.driver.queries, {'SEED_USERS': 2})
+        self.assertEqual(self.testAuthorize.get_user('u1')['username'], 'user1')
+        self.assertEqual(self.testAuthorize.get_user_by_username('user2')['email'], 'user2@example.com')
+        self.assertEqual(self.testAuthorize.get_admins(), ['u2'])
+
+    def test_rollback(self):
+        """
+        Tests a transaction failing part way
+        Expected outcome is none of the writes of the transaction are kept
+        """
+        def fail(tx):
+            tx.run(queries.WRITE_USER, id='u2', properties={})
+            raise RuntimeError("fail")
+
+        with self.assertRaises(RuntimeError):
+            with self.driver.session() as session:
+                session.write_transaction(fail)
+        self.assertEqual(self.testAuthorize.get_user('u2'), None)
+
+    def test_export_snapshot(self):
+        """
+        Tests exporting the access model
+        Expected outcome is the templates, their roles and visible fields
+        """
+        snapshot = self.testAuthorize.export_snapshot()
+        self.assertEqual(snapshot['datasets']['d1']['fields'], {'id': 'e1', 'title': 'e2', 'spatial': 'e3'})
+        self.assertEqual(snapshot['datasets']['d1']['templates']['t2'], {'name': 'Minimal', 'roles': ['public'], 'visible': ['e1', 'e2']})
+        self.assertEqual(snapshot['organizations'], {'o1': 'Org 1'})
+
+    def test_reconcile(self):
+        """
+        Tests reconciling the graph with fingerprints read from CKAN
+        Expected outcome is the graph has the fingerprints of CKAN, but for the datasets left to provision
+        """
+        fingerprints = self.testAuthorize.get_fingerprints()
+        self.assertEqual(fingerprints['users'], {('public', 'public', ''), ('u1', 'user1', 'user1@example.com')})
+        self.assertEqual(fingerprints['org_members'], {('o1', 'u1')})
+        self.assertEqual(fingerprints['datasets'], {('d1', 'o1')})
+        self.assertEqual(self.driver.stats['transactions'], 1)
+
+        ckan = {
+            'users': {('u1', 'user1', 'renamed@example.com'), ('u2', 'user2', ''), ('u3', 'user3', '')},
+            'admins': {'u3'},
+            'organizations': {('o1', 'Org 1'), ('o2', 'Org 2')},
+            'org_members': {('o2', 'u1'), ('o2', 'u2')},
+            'groups': {'g1'},
+            'group_members': {('g1', 'u2')},
+            'datasets': {('d1', 'o2'), ('d2', 'o2')}
+        }
+        deltas = diff_fingerprints(ckan, fingerprints)
+        self.assertEqual(deltas['delete_users'], [])
+        self.assertEqual(deltas['remove_org_members'], [('o1', 'u1')])
+        self.assertEqual(deltas['add_datasets'], [{'id': 'd1', 'owner': 'o2'}, {'id': 'd2', 'owner': 'o2'}])
+        self.assertEqual(deltas['delete_datasets'], ['d1'])
+        self.assertEqual(diff_fingerprints(fingerprints, fingerprints), {name: [] for name in deltas})
+
+        self.driver.reset()
+        applied = []
+        self.testAuthorize.apply_deltas(deltas, 1, lambda name, count: applied.append(name))
+        self.assertEqual(self.driver.queries['SEED_USERS'], 2)
+        self.assertEqual(self.driver.queries['RECONCILE_BIND_ORG_MEMBERS'], 2)
+        self.assertEqual(applied.count('add_org_members'), 2)
+        reconciled = self.testAuthorize.get_fingerprints()
+        self.assertEqual(diff_fingerprints(ckan, reconciled), dict(diff_fingerprints(ckan, ckan), add_datasets=deltas['add_datasets']))
+        self.assertEqual(self.testAuthorize.get_dataset('d1'), None)
+
+    def test_delete_harvest(self):
+        """
+        Tests deleting the datasets of a harvest source, two nodes per batch
+        Expected outcome is the datasets of the source are gone with their templates and elements, the others are kept
+        """
+        self.testAuthorize.provision_dataset('d2', 'o1', harvest_id='h1', templates=[{'id': 't3', 'name': 'Full', 'fields': {'id': 'e4'}}])
+        self.testAuthorize.provision_dataset('d3', 'o1', harvest_id='h2', templates=[{'id': 't4', 'name': 'Full', 'fields': {'id': 'e5'}}])
+        self.driver.reset()
+        progress = []
+        self.assertEqual(self.testAuthorize.delete_harvest('h1', 2, progress.append), {'datasets': 2, 'templates': 3, 'elements': 4})
+        self.assertEqual(progress, [2, 4, 6, 7, 9])
+        self.assertEqual(self.driver.queries['DELETE_HARVEST_ELEMENTS'], 3)
+        self.assertEqual(self.driver.queries['DELETE_HARVEST_DATASETS'], 2)
+        self.assertEqual(self.testAuthorize.get_dataset('d1'), None)
+        self.assertEqual(self.testAuthorize.get_dataset('d2'), None)
+        self.assertEqual(self.testAuthorize.get_templates('d3'), {'Full': 't4'})
+        self.assertEqual(self.driver.graph.match('element', id='e1'), [])
+        self.assertEqual(len(self.driver.graph.match('element', id='e5')), 1)
+
+    def test_delete_dataset_property(self):
+        """
+        Tests deleting a dataset with TemplateMode.PROPERTY, where the template of the public lists its elements
+        in its visible property and has no can_see edge
+        Expected outcome is the dataset is gone with all its templates and elements
+        """
+        driver = FakeDriver()
+        model = MetaAuthorize.create(MetaAuthorizeType.GRAPH, {'driver': driver, 'template_mode': 'property'})
+        seed(model)
+        model.set_template_access('public', 't1')
+        model.delete_dataset('d1')
+        self.assertEqual(model.get_dataset('d1'), None)
+        self.assertEqual(driver.graph.match('template'), [])
+        self.assertEqual(driver.graph.match('element'), [])
+
+    def test_access_batches(self):
+        """
+        Tests giving the public full access to every dataset, then minimal access to one, one template per batch
+        Expected outcome is each batch is its own transaction and the public sees every field, then the Minimal ones
+        """
+        self.testAuthorize.provision_dataset('d2', 'o1', templates=[
+            {'id': 't3', 'name': 'Full', 'fields': {'id': 'e4'}, 'roles': ['admin']},
+            {'id': 't4', 'name': 'Minimal', 'fields': {}, 'roles': ['public']}
+        ])
+        self.driver.reset()
+        progress = []
+        self.assertEqual(self.testAuthorize.set_full_access_to_datasets('public', 1, progress.append), 2)
+        self.assertEqual(progress, [1, 2])
+        self.assertEqual(self.driver.queries['FULL_ACCESS_BATCH'], 3)
+        self.assertCountEqual(self.testAuthorize.get_visible_fields('d1', 'public'), ['e1', 'e2', 'e3'])
+        self.assertCountEqual(self.testAuthorize.get_visible_fields('d2', 'public'), ['e4'])
+
+        self.assertEqual(self.testAuthorize.set_minimal_access_to_dataset('d1', 1), 1)
+        self.assertCountEqual(self.testAuthorize.get_visible_fields('d1', 'public'), ['e1', 'e2'])
+        self.assertCountEqual(self.testAuthorize.get_visible_fields('d1', 'u1'), ['e1', 'e2', 'e3'])
+        self.assertCountEqual(self.testAuthorize.get_visible_fields('d2', 'public'), ['e4'])
+
+    def test_delete_organization_cache(self):
+        """
+        Tests deleting an organization with the decisions of its member and on its dataset cached
+        Expected outcome is the decisions made before the delete are read from the graph again after it
+        """
+        model = _GraphMetaAuth(None, None, None, driver=self.driver, cache=AccessCache())
+        model.get_visible_fields('d1', 'u1')
+        model.is_unrestricted_for_user('d1', 'public')
+        self.driver.reset()
+        model.get_visible_fields('d1', 'u1')
+        model.is_unrestricted_for_user('d1', 'public')
+        self.assertEqual(self.driver.stats['transactions'], 0)
+        model.delete_organization('o1')
+        self.driver.reset()
+        model.get_visible_fields('d1', 'u1')
+        model.is_unrestricted_for_user('d1', 'public')
+        self.assertEqual(self.driver.stats['read_transactions'], 2)
+
+    def test_known_datasets(self):
+        """
+        Tests provisioning datasets again with the known datasets of two workers
+        Expected outcome is no write for provisioned datasets, until a worker deletes one
+        """
+        transport = LocalTransport()
+        workers = []
+        for _ in range(2):
+            known = KnownDatasets()
+            workers.append(_GraphMetaAuth(None, None, None, driver=self.driver, known_datasets=known,
+                invalidation=InvalidationBus(transport, cache=CacheGroup(known))))
+        first, second = workers
+        templates = [{'id': 't3', 'name': 'Full', 'fields': {'id': 'e4'}, 'roles': ['admin']}]
+
+        self.assertFalse(first.provision_dataset('d1', 'o1', templates=templates))
+        self.assertEqual(self.driver.queries['READ_PROVISIONED_DATASETS'], 1)
+        self.assertEqual(first.get_dataset('d1'), 'd1')
+        self.assertEqual(first.provision_datasets([{'dataset_id': 'd1', 'owner_id': 'o1', 'templates': templates}]), [])
+        self.assertEqual(self.driver.stats['transactions'], 1)
+
+        self.assertFalse(second.provision_dataset('d1', 'o1', templates=templates))
+        second.delete_dataset('d1')
+        self.assertEqual(first.get_dataset('d1'), None)
+        self.assertTrue(first.provision_dataset('d1', 'o1', templates=templates))
+        self.assertEqual(first.get_templates('d1'), {'Full': 't3'})
+        self.driver.reset()
+        self.assertFalse(second.provision_dataset('d1', 'o1', templates=templates))
+        self.assertEqual(self.driver.stats['write_transactions'], 1)
+        self.assertFalse(second.provision_dataset('d1', 'o1', templates=templates))
+        self.assertEqual(self.driver.stats['write_transactions'], 1)
 
 # Required to run unit test
 if __name__ == '__main__':
     unittest.main()
-
-
@@ -0,0 +1,61 @@
+"""
+Tests for invalidation.py.
+Can use -v on run to return verbose tests with more detail
+"""
+import unittest
+from ckanext.vitality.cache import AccessCache, dataset_tag, ALL_TAG
+from ckanext.vitality.invalidation import InvalidationBus, LocalTransport
+
+
+class TestInvalidationBus(unittest.TestCase):
+    """
+    Runs testing methods related to sharing invalidations between workers,
+    each worker is simulated by its own cache and bus on a shared LocalTransport
+    """
+
+    def setUp(self):
+        self.transport = LocalTransport()
+        self.cache_a = AccessCache()
+        self.cache_b = AccessCache()
+        self.bus_a = InvalidationBus(self.transport, cache=self.cache_a)
+        self.bus_b = InvalidationBus(self.transport, cache=self.cache_b)
+
+    def test_publish_invalidates_other_worker(self):
+        """
+        A write published by one worker should drop the entry cached by the other
+        """
+        self.cache_b.set('a', 1, [dataset_tag('d1')])
+        self.cache_b.set('b', 2, [dataset_tag('d2')])
+        self.bus_a.publish([dataset_tag('d1')])
+        self.assertFalse(self.cache_b.get('a')[0])
+        self.assertTrue(self.cache_b.get('b')[0])
+
+    def test_publish_ignored_by_origin(self):
+        """
+        A worker should not process its own messages, it invalidated its cache before publishing
+        """
+        self.cache_a.set('a', 1, [dataset_tag('d1')])
+        self.bus_a.publish([dataset_tag('d1')])
+        self.assertTrue(self.cache_a.get('a')[0])
+
+    def test_publish_all(self):
+        """
+        Publishing the ALL_TAG should clear the other caches
+        """
+        self.cache_b.set('a', 1, [dataset_tag('d1')])
+        self.bus_a.publish([ALL_TAG])
+        self.assertEqual(self.cache_b.stats()['size'], 0)
+
+    def test_publish_only(self):
+        """
+        A bus without a cache, as used from the command line, should publish without subscribing
+        """
+        bus = InvalidationBus(self.transport)
+        self.cache_a.set('a', 1, [dataset_tag('d1')])
+        bus.publish([dataset_tag('d1')])
+        self.assertFalse(self.cache_a.get('a')[0])
+        self.assertEqual(len(self.transport.subscribers[bus.channel]), 2)
+
+# Required to run unit test
+if __name__ == '__main__':
+    unittest.main()
@@ -10,7 +10,7 @@ Using data directly from the model is avoided to narrow down cases
     mock data should be used here at some point in the future
 """
 import unittest
-import ckanext.vitality_prototype.meta_authorize as meta_authorize
+import ckanext.vitality.meta_authorize as meta_authorize
 
 
 
@@ -245,6 +245,39 @@ class TestDecode(unittest.TestCase):
         self.assertIsInstance(testDict, dict)
         self.assertDictEqual(testDict, compareDict)
 
+    def test_decode_notJsonLike_unchanged(self):
+        """
+        Tests decode with strings that parse as JSON but are not objects or arrays
+        Expected outcome is the strings are left as they are
+        """
+        testDict = {u'a': u'123', u'b': u'"quoted"', u'c': u'true', u'd': u'  {"e": 1}'}
+        compareDict = {u'a': u'123', u'b': u'"quoted"', u'c': u'true', u'd': {u'e': 1}}
+        self.assertDictEqual(self.testClass_decode._decode(testDict), compareDict)
+
+    def test_decode_memo_returnsCopies(self):
+        """
+        Tests decode with a memo shared between two dicts holding the same stringified value
+        Expected outcome is equal but independent decoded values
+        """
+        memo = {}
+        first = self.testClass_decode._decode({u'a': u'{"b": [1, 2]}'}, memo)
+        second = self.testClass_decode._decode({u'a': u'{"b": [1, 2]}'}, memo)
+        self.assertEqual(len(memo), 1)
+        self.assertDictEqual(first, second)
+        first[u'a'][u'b'].append(3)
+        self.assertEqual(second[u'a'][u'b'], [1, 2])
+
+    def test_decode_schema_onlyStringifiedFields(self):
+        """
+        Tests decode in schema mode
+        Expected outcome is only the top level fields listed in STRINGIFIED_FIELDS are decoded
+        """
+        testClass = meta_authorize.MetaAuthorize()
+        testClass.decode_mode = meta_authorize.DecodeMode.SCHEMA
+        testDict = {u'spatial': u'{"type": "Point"}', u'title': u'{"en": "Title"}'}
+        compareDict = {u'spatial': {u'type': u'Point'}, u'title': u'{"en": "Title"}'}
+        self.assertDictEqual(testClass._decode(testDict), compareDict)
+
     # Test with a sample of pkgDict
     # TODO still need to finish this one
     def test_decode_sample_pkgDict(self):
@@ -545,6 +578,45 @@ class TestFilterDict(unittest.TestCase):
         self.assertDictEqual(filteredDict, {})
         pass
 
+    def test_filter_nestedLeaf_partialWhitelist(self):
+        """
+        Test filter_dict to see if only the white-listed leaves of a nested dict are kept
+        Expected outcome is the nested dict with the total only
+        """
+        whitelist = ['f028aef9-951c-44bb-906d-f3d50e8d1782']
+        filteredDict = self.test_filterDict.filter_dict({'tracking_summary': {'total': 6, 'recent': 6}}, self.testFields, whitelist)
+        self.assertDictEqual(filteredDict, {'tracking_summary': {'total': 6}})
+
+    def test_filter_nestedParent_onlyWhitelist(self):
+        """
+        Test filter_dict to see if white-listing a parent field alone keeps a nested dict
+        Expected outcome is an empty dict, only leaves are matched
+        """
+        whitelist = ['f25104ef-3b01-48f7-bbf0-5755cbea40da']
+        filteredDict = self.test_filterDict.filter_dict({'tracking_summary': {'total': 6, 'recent': 6}}, self.testFields, whitelist)
+        self.assertDictEqual(filteredDict, {})
+
+    def test_filter_slashKey_singleWhitelist(self):
+        """
+        Test filter_dict with a key containing '/', which is matched and nested like its path
+        Expected outcome is the value nested under tracking_summary
+        """
+        whitelist = ['f028aef9-951c-44bb-906d-f3d50e8d1782']
+        filteredDict = self.test_filterDict.filter_dict({'tracking_summary/total': 6}, self.testFields, whitelist)
+        self.assertDictEqual(filteredDict, {'tracking_summary': {'total': 6}})
+
+    def test_filter_emptyDict_whitelisted(self):
+        """
+        Test filter_dict with an empty dict, also stringified and under a '/' key, at a white-listed path
+        Expected outcome is the empty dict kept as the legacy filter did, and left out when only its children are white-listed
+        """
+        whitelist = ['f25104ef-3b01-48f7-bbf0-5755cbea40da']
+        self.assertDictEqual(self.test_filterDict.filter_dict({'tracking_summary': {}}, self.testFields, whitelist), {'tracking_summary': {}})
+        self.assertDictEqual(self.test_filterDict.filter_dict({'tracking_summary': '{}'}, self.testFields, whitelist), {'tracking_summary': {}})
+        whitelist = ['f028aef9-951c-44bb-906d-f3d50e8d1782']
+        self.assertDictEqual(self.test_filterDict.filter_dict({'tracking_summary/total': {}}, self.testFields, whitelist), {'tracking_summary': {'total': {}}})
+        self.assertDictEqual(self.test_filterDict.filter_dict({'tracking_summary': {}}, self.testFields, whitelist), {})
+
 # Tests the methods in the class that raise not implemented errors
 # Not expecting much here, but just in case an accidental change occurs
 class TestNotImplemented(unittest.TestCase):
@@ -805,6 +877,39 @@ class TestKeysMatch(unittest.TestCase):
         with self.assertRaises(TypeError):
             self.test_keysMatch.keys_match(test_str, test_fields)
 
+# Tests the ViewDecision returned by resolve_view
+class TestViewDecision(unittest.TestCase):
+    """
+    Class for testing the immutable ViewDecision in meta authorize
+    """
+
+    test_fields = {
+        'id': '8dfa8f2b-4e13-48c1-8a49-d706ecfae5f2',
+        'title': 'c124c58b-1723-4d7d-908e-772ef7713950'
+    }
+
+    def test_viewDecision_immutable(self):
+        """
+        Changing the inputs or the decision itself should not be possible once built
+        Expected outcome is an unchanged decision and errors on assignment
+        """
+        fields = dict(self.test_fields)
+        decision = meta_authorize.ViewDecision.build(False, fields, ['8dfa8f2b-4e13-48c1-8a49-d706ecfae5f2'], ['id'])
+        fields['extra'] = 'edcb7683-79a8-4b0d-8524-a8c0d313f932'
+        self.assertNotIn('extra', decision.fields)
+        with self.assertRaises(TypeError):
+            decision.fields['extra'] = 'edcb7683-79a8-4b0d-8524-a8c0d313f932'
+        with self.assertRaises(AttributeError):
+            decision.unrestricted = True
+
+    def test_viewDecision_publicVisible(self):
+        """
+        Public field names should map back to their element ids
+        Expected outcome is the id of the public field only
+        """
+        decision = meta_authorize.ViewDecision.build(False, self.test_fields, [], ['id'])
+        self.assertSetEqual(set(decision.public_visible), {'8dfa8f2b-4e13-48c1-8a49-d706ecfae5f2'})
+
 # Required to run unit test
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
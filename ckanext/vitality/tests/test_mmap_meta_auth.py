@@ -0,0 +1,160 @@
+"""
+Tests for impl/mmap_meta_auth.py, run against snapshot files in a temporary directory
+Can use -v on run to return verbose tests with more detail
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from ckanext.vitality.impl.mmap_meta_auth import _MmapMetaAuth, write_snapshot
+from ckanext.vitality.meta_authorize import MetaAuthorize, MetaAuthorizeType
+from ckanext.vitality.tests.fake_neo4j import FakeDriver
+from ckanext.vitality.tests.test_graph_meta_auth import seed
+
+
+def snapshot():
+    return {
+        'users': {'public': ['public'], 'admin': ['admin'], 'u1': ['member1']},
+        'organizations': {'o1': 'Org 1'},
+        'roles': {'public': {'name': 'public', 'orgs': []}, 'admin': {'name': 'admin', 'orgs': []}, 'member1': {'name': 'member', 'orgs': ['o1']}},
+        'datasets': {
+            'd1': {
+                'owner': 'o1',
+                'harvest_source': 'h1',
+                'fields': {'id': 'e1', 'title': 'e2', 'spatial': 'e3'},
+                'templates': {
+                    't1': {'name': 'Full', 'roles': ['admin', 'member1'], 'visible': ['e1', 'e2', 'e3']},
+                    't2': {'name': 'Minimal', 'roles': ['public'], 'visible': ['e1', 'e2']}
+                }
+            },
+            'd0': {
+                'owner': 'o1',
+                'harvest_source': None,
+                'fields': {'id': 'e4'},
+                'templates': {'t3': {'name': 'Full', 'roles': ['public'], 'visible': ['e4']}}
+            }
+        }
+    }
+
+
+class TestMmapMetaAuth(unittest.TestCase):
+    """
+    Runs testing methods related to the memory mapped authorization model
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.file = os.path.join(self.path, 'vitality.snapshot')
+        write_snapshot(snapshot(), self.file)
+        self.now = [0]
+        self.model = _MmapMetaAuth(self.file, check_interval=60, clock=lambda: self.now[0])
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_visible_fields(self):
+        """
+        Tests the visible fields of the users of a snapshot
+        Expected outcome is the fields of the templates used by the roles of each user, none for unknown users
+        """
+        self.assertCountEqual(self.model.get_visible_fields('d1', 'public'), ['e1', 'e2'])
+        self.assertCountEqual(self.model.get_visible_fields('d1', 'u1'), ['e1', 'e2', 'e3'])
+        self.assertEqual(self.model.get_visible_fields('d1', 'u2'), [])
+        self.assertEqual(self.model.get_visible_fields('d2', 'public'), [])
+        self.assertEqual(self.model.get_metadata_fields('d1'), {'id': 'e1', 'title': 'e2', 'spatial': 'e3'})
+        self.assertEqual(self.model.get_templates('d1'), {'Full': 't1', 'Minimal': 't2'})
+
+    def test_unrestricted(self):
+        """
+        Tests full access checks
+        Expected outcome is unrestricted for users of the Full template and users without a template
+        """
+        self.assertFalse(self.model.is_unrestricted('d1'))
+        self.assertTrue(self.model.is_unrestricted('d0'))
+        self.assertTrue(self.model.is_unrestricted_for_user('d1', 'admin'))
+        self.assertTrue(self.model.is_unrestricted_for_user('d1', 'u2'))
+        self.assertEqual(self.model.get_template_access_for_role('d1', 'public'), 'Minimal')
+        self.assertEqual(self.model.get_template_access_for_user('d1', 'u1'), 'Full')
+
+    def test_resolve_views(self):
+        """
+        Tests resolving the views of several datasets
+        Expected outcome is a ViewDecision for existing datasets only, with the public field names
+        """
+        decisions = self.model.resolve_views(['d1', 'd2'], 'public')
+        self.assertEqual(list(decisions), ['d1'])
+        self.assertFalse(decisions['d1'].unrestricted)
+        self.assertEqual(decisions['d1'].visible, frozenset(['e1', 'e2']))
+        self.assertCountEqual(decisions['d1'].public_fields, ['id', 'title'])
+        self.assertCountEqual(self.model.get_public_fields('d1'), ['id', 'title'])
+
+    def test_users_and_orgs(self):
+        """
+        Tests the users, roles and organizations of a snapshot
+        Expected outcome is the sorted indexes find every id
+        """
+        self.assertCountEqual(self.model.get_users(), ['public', 'admin', 'u1'])
+        self.assertEqual(self.model.get_admins(), ['admin'])
+        self.assertEqual(self.model.get_orgs(), ['o1'])
+        self.assertEqual(self.model.get_organization('o1'), {'id': 'o1', 'name': 'Org 1'})
+        self.assertEqual(self.model.get_roles('o1'), {'member': 'member1'})
+        self.assertEqual(self.model.get_roles('o2'), {})
+
+    def test_publish(self):
+        """
+        Tests publishing a new snapshot over the mapped one
+        Expected outcome is the new snapshot is mapped once check_interval passed
+        """
+        write_snapshot(dict(snapshot(), users={'public': ['admin']}), self.file)
+        self.now[0] = 30
+        self.assertFalse(self.model.is_unrestricted('d1'))
+        self.now[0] = 61
+        self.assertTrue(self.model.is_unrestricted('d1'))
+        self.assertEqual(os.listdir(self.path), ['vitality.snapshot'])
+
+    def test_missing_file(self):
+        """
+        Tests a model started before a snapshot is published
+        Expected outcome is an empty model until the snapshot is published
+        """
+        model = _MmapMetaAuth(os.path.join(self.path, 'missing.snapshot'), check_interval=0)
+        self.assertEqual(model.get_dataset('d1'), None)
+        write_snapshot(snapshot(), model.path)
+        self.assertTrue(model.reload())
+        self.assertEqual(model.get_dataset('d1'), 'd1')
+        with self.assertRaises(NotImplementedError):
+            model.add_user('u2')
+        with self.assertRaises(AttributeError):
+            model.set_user_role('u2', 'admin')
+
+    def test_newer_than_snapshot(self):
+        """
+        Tests reading a dataset, an organization and a user created since the snapshot was published
+        Expected outcome is they are read from the source, the others from the snapshot, fingerprints from the source
+        """
+        source = MetaAuthorize.create(MetaAuthorizeType.GRAPH, {'driver': FakeDriver()})
+        seed(source)
+        model = _MmapMetaAuth(self.file, source, check_interval=0)
+        model.provision_dataset('d5', 'o1', templates=[
+            {'id': 't5', 'name': 'Full', 'fields': {'id': 'e5', 'spatial': 'e6'}, 'roles': ['admin']},
+            {'id': 't6', 'name': 'Minimal', 'fields': {'id': 'e5'}, 'roles': ['public']}
+        ])
+        model.add_org('o2', [], 'Org 2')
+        model.add_user('u2', 'user2')
+
+        decisions = model.resolve_views(['d1', 'd5', 'd6'], 'public')
+        self.assertCountEqual(decisions, ['d1', 'd5'])
+        self.assertFalse(decisions['d5'].unrestricted)
+        self.assertEqual(decisions['d5'].visible, frozenset(['e5']))
+        self.assertEqual(model.get_dataset('d5'), 'd5')
+        self.assertEqual(model.get_templates('d5'), {'Full': 't5', 'Minimal': 't6'})
+        self.assertFalse(model.is_unrestricted('d5'))
+        self.assertEqual(model.get_organization('o2'), {'id': 'o2', 'name': 'Org 2'})
+        self.assertIn('member', model.get_roles('o2'))
+        self.assertEqual(model.get_roles('o1'), {'member': 'member1'})
+        self.assertEqual(model.get_template_access_for_user('d1', 'u2'), source.get_template_access_for_user('d1', 'u2'))
+        self.assertEqual(model.get_fingerprints(), source.get_fingerprints())
+
+# Required to run unit test
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,8 @@
 """Tests for plugin.py."""
 from uuid import uuid4
-import ckanext.vitality_prototype.plugin as plugin
+import ckanext.vitality.plugin as plugin
 
-testClass = plugin.Vitality_PrototypePlugin()
+testClass = plugin.VitalityPlugin()
 
 def test_plugin():
     pass
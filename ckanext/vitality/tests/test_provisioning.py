@@ -0,0 +1,115 @@
+"""
+Tests for provisioning.py, provisioning in the graph model of fake_neo4j.py
+Can use -v on run to return verbose tests with more detail
+"""
+import time
+import unittest
+from ckanext.vitality.meta_authorize import MetaAuthorize, MetaAuthorizeType
+from ckanext.vitality.provisioning import ProvisioningBuffer
+from ckanext.vitality.tests.fake_neo4j import FakeDriver
+from ckanext.vitality.tests.test_graph_meta_auth import seed
+
+
+def harvested(dataset_id, harvest_id='h2'):
+    return {'dataset_id': dataset_id, 'owner_id': 'o1', 'dname': dataset_id, 'harvest_id': harvest_id, 'templates': [
+        {'id': dataset_id + '-full', 'name': 'Full', 'fields': {'id': dataset_id + '-e1', 'spatial': dataset_id + '-e2'}, 'roles': ['admin'], 'org_roles': True},
+        {'id': dataset_id + '-minimal', 'name': 'Minimal', 'fields': {'id': dataset_id + '-e1'}, 'roles': ['public']}
+    ]}
+
+
+class TestProvisioningBuffer(unittest.TestCase):
+    """
+    Runs testing methods related to buffering the provisioning of harvested datasets
+    """
+
+    def setUp(self):
+        self.driver = FakeDriver()
+        self.model = MetaAuthorize.create(MetaAuthorizeType.GRAPH, {'driver': self.driver})
+        seed(self.model)
+        self.buffer = ProvisioningBuffer(self.model, batch_size=2, flush_interval=60)
+        self.driver.reset()
+
+    def test_batch(self):
+        """
+        Tests adding harvested datasets up to the batch size
+        Expected outcome is no write until the batch is full, then a single transaction for the batch
+        """
+        self.buffer.add(harvested('d2'))
+        self.assertEqual(self.driver.stats['write_transactions'], 0)
+        self.assertEqual(self.model.get_dataset('d2'), None)
+        self.buffer.add(harvested('d3'))
+        self.assertEqual(self.driver.stats['write_transactions'], 1)
+        self.assertEqual(self.driver.queries['PROVISION_DATASETS'], 1)
+        self.assertEqual(self.model.get_templates('d3'), {'Full': 'd3-full', 'Minimal': 'd3-minimal'})
+        self.assertCountEqual(self.model.get_visible_fields('d2', 'u1'), ['d2-e1', 'd2-e2'])
+        self.assertCountEqual(self.model.get_visible_fields('d2', 'public'), ['d2-e1'])
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_not_harvested(self):
+        """
+        Tests adding a dataset that is not harvested, then datasets of two harvest sources
+        Expected outcome is the first dataset is provisioned at once, the datasets of the first source when the second starts
+        """
+        self.buffer.add(harvested('d2', None))
+        self.assertEqual(self.model.get_templates('d2'), {'Full': 'd2-full', 'Minimal': 'd2-minimal'})
+        self.buffer.add(harvested('d3', 'h2'))
+        self.buffer.add(harvested('d4', 'h3'))
+        self.assertNotEqual(self.model.get_dataset('d3'), None)
+        self.assertEqual(self.model.get_dataset('d4'), None)
+        self.buffer.discard('d4')
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_existing(self):
+        """
+        Tests buffering a dataset that already has templates along with a new one
+        Expected outcome is only the new dataset gets templates, the harvest source of both is set
+        """
+        self.buffer.add(harvested('d1'))
+        self.buffer.add(harvested('d2'))
+        self.assertEqual(self.model.get_templates('d1'), {'Full': 't1', 'Minimal': 't2'})
+        self.assertEqual(self.model.get_templates('d2'), {'Full': 'd2-full', 'Minimal': 'd2-minimal'})
+        self.assertEqual(self.driver.graph.get(self.driver.graph.first('dataset', id='d1'), 'harvest_source'), 'h2')
+
+    def test_fallback(self):
+        """
+        Tests a batch that cannot be written together
+        Expected outcome is the datasets are provisioned one by one
+        """
+        def fail(datasets):
+            raise Exception("Transaction failed")
+        self.model.provision_datasets = fail
+        self.buffer.add(harvested('d2'))
+        self.buffer.add(harvested('d3'))
+        self.assertEqual(self.driver.queries['PROVISION_DATASET'], 2)
+        self.assertNotEqual(self.model.get_dataset('d3'), None)
+
+    def test_pending_view(self):
+        """
+        Tests the public view of a buffered dataset
+        Expected outcome is the same decision as resolved by the model once provisioned
+        """
+        self.buffer.add(harvested('d2'))
+        self.assertEqual(self.buffer.pending_view('d1'), None)
+        pending = self.buffer.pending_view('d2')
+        self.buffer.flush()
+        resolved = self.model.resolve_view('d2', 'public')
+        self.assertEqual(pending.unrestricted, resolved.unrestricted)
+        self.assertEqual(dict(pending.fields), dict(resolved.fields))
+        self.assertEqual(pending.public_visible, resolved.public_visible)
+        self.assertEqual(self.buffer.pending_view('d2'), None)
+
+    def test_idle(self):
+        """
+        Tests a harvest job ending before the batch is full
+        Expected outcome is the buffered datasets are provisioned after flush_interval
+        """
+        self.buffer.flush_interval = 0.05
+        self.buffer.add(harvested('d2'))
+        deadline = time.monotonic() + 5
+        while self.model.get_dataset('d2') == None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertNotEqual(self.model.get_dataset('d2'), None)
+
+# Required to run unit test
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+"""
+Tests for the public projection of plugin.py, served from the graph model of fake_neo4j.py
+Runs in the CKAN test environment, see test.ini
+Can use -v on run to return verbose tests with more detail
+"""
+import copy
+import json
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+from ckanext.vitality import constants
+from ckanext.vitality.meta_authorize import MetaAuthorize, MetaAuthorizeType
+from ckanext.vitality.tests.fake_neo4j import FakeDriver
+from ckanext.vitality.tests.test_graph_meta_auth import seed
+import ckanext.vitality.plugin as plugin
+import ckanext.vitality.jobs as jobs
+
+
+def dataset():
+    return {'id': 'd1', 'type': 'dataset', 'title': 'Dataset 1', 'spatial': '{"type": "Point", "coordinates": [-63.5, 44.6]}'}
+
+
+class TestPublicProjection(unittest.TestCase):
+    """
+    Runs testing methods related to the public projection stored by before_index and served by after_search
+    """
+
+    def setUp(self):
+        self.driver = FakeDriver()
+        self.plugin = plugin.VitalityPlugin()
+        self.plugin.meta_authorize = MetaAuthorize.create(MetaAuthorizeType.GRAPH, {'driver': self.driver})
+        self.plugin.public_projection = True
+        self.plugin.provisioning = None
+        seed(self.plugin.meta_authorize)
+
+    def index(self):
+        """
+        Returns the search result of d1 as loaded from the index document before_index stored
+        """
+        document = {'id': 'd1', 'validated_data_dict': json.dumps(dataset()), 'data_dict': json.dumps(dataset())}
+        self.plugin.add_public_view(document)
+        return json.loads(document['validated_data_dict'])
+
+    def search(self, result, userobj=None):
+        self.driver.reset()
+        with mock.patch.object(plugin.toolkit, 'g', SimpleNamespace(userobj=userobj)):
+            return self.plugin.after_search({'results': [result], 'count': 1}, {})['results'][0]
+
+    def filtered(self, user_id):
+        """
+        Returns d1 filtered by filter_search_result for a user, as resolved live
+        """
+        result = dataset()
+        self.plugin.filter_search_result(result, self.plugin.meta_authorize.resolve_view('d1', user_id))
+        return result
+
+    def test_anonymous(self):
+        """
+        Tests an anonymous search
+        Expected outcome is the projection is served without a graph transaction, equal to the live filtered result
+        """
+        result = self.index()
+        self.assertFalse(result[constants.PUBLIC_VIEW_FIELD]['unrestricted'])
+        served = self.search(result)
+        self.assertEqual(self.driver.stats['transactions'], 0)
+        self.assertEqual(served, self.filtered('public'))
+        self.assertNotIn('spatial', served)
+
+    def test_authenticated(self):
+        """
+        Tests a search by a member of the organization owning the dataset
+        Expected outcome is the projection is dropped and the access of the user resolved live, i.e. the full dataset
+        """
+        result = self.search(self.index(), SimpleNamespace(id='u1'))
+        self.assertEqual(result, dataset())
+        self.assertEqual(self.driver.stats['transactions'], 1)
+
+    def test_unrestricted(self):
+        """
+        Tests an anonymous search of a dataset the public sees in full
+        Expected outcome is the result as indexed, without the projection
+        """
+        self.plugin.meta_authorize.set_template_access('public', 't1')
+        self.assertEqual(self.search(self.index()), dataset())
+        self.assertEqual(self.driver.stats['transactions'], 0)
+
+    def test_disabled(self):
+        """
+        Tests an anonymous search with ckan.vitality.public_projection off
+        Expected outcome is the access of the public resolved live, with the same result as the projection
+        """
+        result = self.index()
+        self.plugin.public_projection = False
+        served = self.search(copy.deepcopy(result))
+        self.assertEqual(self.driver.stats['transactions'], 1)
+        self.assertEqual(served, self.filtered('public'))
+
+    def test_set_full_access(self):
+        """
+        Tests the set_full_access_to_datasets job run by `ckan vitality set-all-datasets-public --background`
+        Expected outcome is the datasets are reindexed once the public has full access, and the projection of the
+        public is dropped from the next anonymous search
+        """
+        self.index()
+        indexed = {}
+        rebuild = mock.Mock(side_effect=lambda **kwargs: indexed.update(result=self.index()))
+        with mock.patch.object(jobs, 'config', {'ckan.vitality.public_projection': 'true'}), \
+                mock.patch.object(jobs, '_meta_authorize', return_value=self.plugin.meta_authorize), \
+                mock.patch.object(jobs.search, 'rebuild', rebuild), mock.patch.object(jobs.search, 'commit') as commit:
+            jobs.set_full_access_to_datasets('public')
+        rebuild.assert_called_once_with(defer_commit=True)
+        commit.assert_called_once_with()
+        self.assertTrue(indexed['result'][constants.PUBLIC_VIEW_FIELD]['unrestricted'])
+        self.assertEqual(self.search(indexed['result']), dataset())
+
+# Required to run unit test
+if __name__ == '__main__':
+    unittest.main()
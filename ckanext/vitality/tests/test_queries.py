@@ -0,0 +1,237 @@
+"""
+Tests for impl/queries.py and the way _GraphMetaAuth runs them.
+Can use -v on run to return verbose tests with more detail
+"""
+import re
+import unittest
+from ckanext.vitality.impl import queries
+from ckanext.vitality.impl.graph_meta_auth import _GraphMetaAuth, shared_element_id
+
+
+class RecordingResult(list):
+    """
+    Stands in for a neo4j result
+    """
+
+    def single(self):
+        return self[0] if self else None
+
+
+class RecordingTx(object):
+    """
+    Stands in for a neo4j transaction, recording each query and its parameters and returning the records given per query
+    """
+
+    def __init__(self, results=None):
+        self.calls = []
+        self.results = results or {}
+
+    def run(self, query, **parameters):
+        self.calls.append((query, parameters))
+        return RecordingResult(self.results.get(query, []))
+
+
+class TestQueries(unittest.TestCase):
+    """
+    Runs testing methods related to the query catalog
+    """
+
+    def test_catalog_queries_are_constant(self):
+        """
+        Every transaction function should run a query from the catalog as is
+        Expected outcome is no query text outside of the catalog
+        """
+        catalog = {getattr(queries, name) for name in dir(queries) if name.isupper() and isinstance(getattr(queries, name), str)}
+        tx = RecordingTx()
+        _GraphMetaAuth._GraphMetaAuth__get_dataset(tx, "d1")
+        _GraphMetaAuth._GraphMetaAuth__read_visible_fields(tx, "d1", "u1")
+        _GraphMetaAuth._GraphMetaAuth__bind_user_to_role(tx, "u1", "r1")
+        for query, parameters in tx.calls:
+            self.assertIn(query, catalog)
+
+    def test_no_pattern_exists(self):
+        """
+        Tests the catalog for the exists(pattern) form, deprecated in Neo4j 5
+        Expected outcome is every existence check written as EXISTS { MATCH ... }
+        """
+        for name in dir(queries):
+            query = getattr(queries, name)
+            if name.isupper() and isinstance(query, str):
+                self.assertNotRegex(query, re.compile(r'exists\s*\(\s*\(', re.IGNORECASE), name)
+
+    def test_values_passed_as_parameters(self):
+        """
+        Tests that ids and names are never inlined in the query text
+        Expected outcome is the same query text for different ids, with the ids as parameters
+        """
+        tx = RecordingTx()
+        _GraphMetaAuth._GraphMetaAuth__get_dataset(tx, "d1")
+        _GraphMetaAuth._GraphMetaAuth__get_dataset(tx, "d2'")
+        self.assertEqual(tx.calls[0][0], tx.calls[1][0])
+        self.assertEqual(tx.calls[1][1], {'id': "d2'"})
+
+    def test_write_optional_properties(self):
+        """
+        Tests that optional properties are passed as a map, leaving out missing ones
+        Expected outcome is a properties parameter with only the given values
+        """
+        tx = RecordingTx()
+        _GraphMetaAuth._GraphMetaAuth__write_template(tx, "t1", name="Full")
+        self.assertEqual(tx.calls[-1], (queries.WRITE_TEMPLATE, {'id': "t1", 'properties': {'name': "Full"}}))
+
+    def test_set_dataset_description(self):
+        """
+        Tests that the language specific description property is set through a map
+        Expected outcome is a description_<language> key holding the sanitized description
+        """
+        tx = RecordingTx()
+        _GraphMetaAuth._GraphMetaAuth__set_dataset_description(tx, "d1", "en", "It's a dataset!")
+        self.assertEqual(tx.calls[-1], (queries.SET_DATASET_PROPERTIES, {'id': "d1", 'properties': {'description_en': "Its a dataset"}}))
+
+    def test_read_schema(self):
+        """
+        Tests reading the constraints and indexes of the database
+        Expected outcome is constraint states from their backing index, and indexes backing a constraint counted as lookup indexes
+        """
+        tx = RecordingTx({
+            queries.SHOW_CONSTRAINTS: [
+                {'name': "vitality_dataset_id", 'type': "UNIQUENESS", 'labelsOrTypes': ["dataset"], 'properties': ["id"]}
+            ],
+            queries.SHOW_INDEXES: [
+                {'name': "vitality_dataset_id", 'type': "BTREE", 'state': "ONLINE", 'labelsOrTypes': ["dataset"], 'properties': ["id"], 'owningConstraint': "vitality_dataset_id"},
+                {'name': "vitality_user_username", 'type': "BTREE", 'state': "POPULATING", 'labelsOrTypes': ["user"], 'properties': ["username"], 'owningConstraint': None},
+                {'name': "token_lookup", 'type': "LOOKUP", 'state': "ONLINE", 'labelsOrTypes': None, 'properties': None, 'owningConstraint': None}
+            ]
+        })
+        self.assertDictEqual(_GraphMetaAuth._GraphMetaAuth__read_schema(tx), {
+            ('constraint', "dataset", "id"): "ONLINE",
+            ('index', "dataset", "id"): "ONLINE",
+            ('index', "user", "username"): "POPULATING"
+        })
+
+    def test_provision_dataset(self):
+        """
+        Tests provisioning a new dataset with two templates sharing a field
+        Expected outcome is one element per field, bound to every template listing it, and template access in the same transaction
+        """
+        tx = RecordingTx({queries.PROVISION_DATASET: [{'has_templates': False}]})
+        created = _GraphMetaAuth._GraphMetaAuth__provision_dataset(tx, "d1", "o1", "Dataset 1!", "h1", {'en': "Notes"}, [
+            {'id': "full", 'name': "Full", 'fields': {'id': "e1", 'spatial': "e2"}, 'roles': ['admin'], 'org_roles': True},
+            {'id': "minimal", 'name': "Minimal", 'fields': {'id': "e1"}, 'roles': ['public']}
+        ])
+        self.assertTrue(created)
+        self.assertEqual([query for query, parameters in tx.calls], [
+            queries.PROVISION_DATASET, queries.PROVISION_TEMPLATES, queries.PROVISION_ELEMENTS, queries.PROVISION_TEMPLATE_ACCESS
+        ])
+        self.assertEqual(tx.calls[0][1]['properties'], {'name': "Dataset 1"})
+        self.assertEqual(tx.calls[0][1]['updates'], {'harvest_source': "h1"})
+        self.assertEqual(tx.calls[1][1]['properties'], {'description_en': "Notes"})
+        elements = {element['properties']['id']: element for element in tx.calls[2][1]['elements']}
+        self.assertEqual(elements["e1"]['templates'], ["full", "minimal"])
+        self.assertTrue(elements["e1"]['properties']['required'])
+        self.assertEqual(elements["e2"]['templates'], ["full"])
+        self.assertEqual([(t['roles'], t['org_roles']) for t in tx.calls[3][1]['templates']], [(['admin'], True), (['public'], False)])
+
+    def test_provision_existing_dataset(self):
+        """
+        Tests provisioning a dataset that already has templates
+        Expected outcome is only the dataset query is run
+        """
+        tx = RecordingTx({queries.PROVISION_DATASET: [{'has_templates': True}]})
+        created = _GraphMetaAuth._GraphMetaAuth__provision_dataset(tx, "d1", "o1", None, None, None, [{'id': "full", 'fields': {'id': "e1"}}])
+        self.assertFalse(created)
+        self.assertEqual(len(tx.calls), 1)
+
+    def test_provision_shared_elements(self):
+        """
+        Tests provisioning a dataset with shared elements
+        Expected outcome is elements merged rather than created, and marked as shared
+        """
+        tx = RecordingTx({queries.PROVISION_DATASET: [{'has_templates': False}]})
+        _GraphMetaAuth._GraphMetaAuth__provision_dataset(tx, "d1", "o1", None, None, None, [
+            {'id': "full", 'fields': {'spatial': shared_element_id('spatial')}}
+        ], True)
+        self.assertEqual(tx.calls[2][0], queries.PROVISION_SHARED_ELEMENTS)
+        self.assertEqual(tx.calls[2][1]['elements'][0]['properties'], {'name': 'spatial', 'id': shared_element_id('spatial'), 'shared': True})
+
+    def test_shared_element_id(self):
+        """
+        Tests the ids of shared elements
+        Expected outcome is the same id for the same field name, different ids for different names
+        """
+        self.assertEqual(shared_element_id('citation/en'), shared_element_id('citation/en'))
+        self.assertNotEqual(shared_element_id('citation/en'), shared_element_id('citation/fr'))
+
+    def test_fold_elements(self):
+        """
+        Tests folding per dataset elements into a shared element
+        Expected outcome is the number of folded elements from the query, 0 if there are none
+        """
+        tx = RecordingTx({queries.FOLD_ELEMENTS: [{'folded': 3}]})
+        self.assertEqual(_GraphMetaAuth._GraphMetaAuth__fold_elements(tx, 'spatial', shared_element_id('spatial'), 10), 3)
+        self.assertEqual(tx.calls[0][1], {'name': 'spatial', 'id': shared_element_id('spatial'), 'batch_size': 10})
+        self.assertEqual(_GraphMetaAuth._GraphMetaAuth__fold_elements(RecordingTx(), 'spatial', shared_element_id('spatial'), 10), 0)
+
+    def test_bind_listed_fields(self):
+        """
+        Tests binding fields to a template listing its visible elements
+        Expected outcome is a single query setting the ids when overwriting, and one appending them otherwise
+        """
+        tx = RecordingTx()
+        _GraphMetaAuth._GraphMetaAuth__bind_fields_to_template(tx, "t1", {'id': "e1", 'spatial': "e2"}, True, True)
+        _GraphMetaAuth._GraphMetaAuth__bind_fields_to_template(tx, "t1", {'title': "e3"}, False, True)
+        self.assertEqual(tx.calls, [
+            (queries.SET_TEMPLATE_FIELDS, {'template_id': "t1", 'element_ids': ["e1", "e2"]}),
+            (queries.ADD_TEMPLATE_FIELDS, {'template_id': "t1", 'element_ids': ["e3"]})
+        ])
+
+    def test_read_listed_fields(self):
+        """
+        Tests reading the visible fields of templates listing their visible elements
+        Expected outcome is the property queries are used for reads and view resolution
+        """
+        tx = RecordingTx({queries.READ_VISIBLE_FIELDS_PROPERTY: [{'id': "e1"}]})
+        self.assertEqual(_GraphMetaAuth._GraphMetaAuth__read_visible_fields(tx, "d1", "u1", True), ["e1"])
+        _GraphMetaAuth._GraphMetaAuth__resolve_views(tx, ["d1"], "u1", True)
+        self.assertEqual([query for query, parameters in tx.calls], [queries.READ_VISIBLE_FIELDS_PROPERTY, queries.RESOLVE_VIEWS_PROPERTY])
+
+    def test_provision_listed_fields(self):
+        """
+        Tests provisioning a dataset whose templates list their visible elements
+        Expected outcome is a visible property on each template, and elements linked to the first template only
+        """
+        tx = RecordingTx({queries.PROVISION_DATASET: [{'has_templates': False}]})
+        _GraphMetaAuth._GraphMetaAuth__provision_dataset(tx, "d1", "o1", None, None, None, [
+            {'id': "full", 'fields': {'id': "e1", 'spatial': "e2"}},
+            {'id': "minimal", 'fields': {'id': "e1"}}
+        ], False, True)
+        self.assertEqual([t['properties']['visible'] for t in tx.calls[1][1]['templates']], [["e1", "e2"], ["e1"]])
+        self.assertEqual([element['templates'] for element in tx.calls[2][1]['elements']], [["full"], ["full"]])
+
+    def test_read_snapshot(self):
+        """
+        Tests reading a snapshot of the access model
+        Expected outcome is the templates nested in their dataset, templates of unknown datasets left out
+        """
+        tx = RecordingTx({
+            queries.SNAPSHOT_USERS: [{'id': "u1", 'username': "user1", 'email': None, 'gid': None, 'roles': ["r1"]}],
+            queries.SNAPSHOT_ORGANIZATIONS: [{'id': "o1", 'name': "Org 1"}],
+            queries.SNAPSHOT_ROLES: [{'id': "r1", 'name': "member", 'orgs': ["o1"]}],
+            queries.SNAPSHOT_DATASETS: [{'id': "d1", 'name': "Dataset 1", 'owner': "o1", 'harvest_source': None, 'elements': [["id", "e1"], ["id", "e1"]]}],
+            queries.SNAPSHOT_TEMPLATES_PROPERTY: [
+                {'dataset_id': "d1", 'id': "t1", 'name': "Full", 'roles': ["r1"], 'visible': ["e1"]},
+                {'dataset_id': "d2", 'id': "t2", 'name': "Full", 'roles': [], 'visible': []}
+            ]
+        })
+        self.assertEqual(_GraphMetaAuth._GraphMetaAuth__read_snapshot(tx, True), {
+            'users': {"u1": ["r1"]},
+            'profiles': {"u1": {'username': "user1", 'email': None, 'gid': None}},
+            'organizations': {"o1": "Org 1"},
+            'roles': {"r1": {'name': "member", 'orgs': ["o1"]}},
+            'datasets': {"d1": {'name': "Dataset 1", 'owner': "o1", 'harvest_source': None, 'fields': {"id": "e1"},
+                'templates': {"t1": {'name': "Full", 'roles': ["r1"], 'visible': ["e1"]}}}}
+        })
+
+# Required to run unit test
+if __name__ == '__main__':
+    unittest.main()
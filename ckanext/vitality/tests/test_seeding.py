@@ -0,0 +1,127 @@
+"""
+Tests for seeding.py, seeding the graph model of fake_neo4j.py from a stand in for the CKAN catalog
+Can use -v on run to return verbose tests with more detail
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from ckanext.vitality.meta_authorize import MetaAuthorize, MetaAuthorizeType
+from ckanext.vitality.seeding import seed_datasets
+from ckanext.vitality.tests.fake_neo4j import FakeDriver
+from ckanext.vitality.tests.test_graph_meta_auth import seed
+
+
+class Interrupted(Exception):
+    """
+    Stands in for the command being killed
+    """
+
+
+class Catalog(object):
+    """
+    Stands in for the CKAN catalog, paging by id as package_search does with the fq of seed-datasets
+    """
+
+    def __init__(self, ids):
+        self.datasets = {id: {'id': id, 'owner_org': 'o1'} for id in ids}
+        self.searches = []
+        self.interrupt_after = None
+
+    def search(self, last_id, rows):
+        if self.interrupt_after != None and len(self.searches) >= self.interrupt_after:
+            raise Interrupted()
+        self.searches.append(last_id)
+        ids = sorted(id for id in self.datasets if last_id == None or id > last_id)
+        return len(self.datasets), [self.datasets[id] for id in ids[:rows]]
+
+    def show(self, id):
+        return self.datasets.get(id)
+
+
+class TestSeedDatasets(unittest.TestCase):
+    """
+    Runs testing methods related to `ckan vitality seed-datasets`
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.path, 'seed.json')
+        self.driver = FakeDriver()
+        self.model = MetaAuthorize.create(MetaAuthorizeType.GRAPH, {'driver': self.driver})
+        seed(self.model)
+        self.catalog = Catalog(['s%02d' % i for i in range(10)])
+        self.provisioned = []
+        self.failing = set()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def provisioning(self, pkg_dict):
+        if pkg_dict['id'] in self.failing:
+            raise Exception("Transaction failed")
+        self.provisioned.append(pkg_dict['id'])
+        return {'dataset_id': pkg_dict['id'], 'owner_id': pkg_dict['owner_org'], 'templates': [
+            {'id': pkg_dict['id'] + '-full', 'name': 'Full', 'fields': {'id': pkg_dict['id'] + '-e1'}, 'roles': ['admin']}
+        ]}
+
+    def run_seed(self, restart=False):
+        return seed_datasets(self.model, self.catalog.search, self.catalog.show, self.provisioning, self.checkpoint,
+            batch_size=3, workers=2, restart=restart, echo=lambda message: None)
+
+    def test_resume(self):
+        """
+        Tests a run interrupted after two pages with a failing dataset, then resumed twice
+        Expected outcome is a checkpoint after the last id of the second page, the failed dataset retried
+        and every dataset provisioned exactly once, exit status 1 until none is left to retry
+        """
+        self.failing.add('s04')
+        self.catalog.interrupt_after = 2
+        with self.assertRaises(Interrupted):
+            self.run_seed()
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f), {'last_id': 's05', 'seeded': 5, 'failed': ['s04']})
+
+        self.catalog.interrupt_after = None
+        self.catalog.searches = []
+        self.assertEqual(self.run_seed(), 1)
+        self.assertEqual(self.catalog.searches[0], 's05')
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f), {'last_id': 's09', 'seeded': 9, 'failed': ['s04']})
+
+        self.failing.clear()
+        self.assertEqual(self.run_seed(), 0)
+        self.assertFalse(os.path.exists(self.checkpoint))
+        self.assertEqual(sorted(self.provisioned), ['s%02d' % i for i in range(10)])
+        for id in self.provisioned:
+            self.assertEqual(self.model.get_templates(id), {'Full': id + '-full'})
+
+    def test_deleted(self):
+        """
+        Tests retrying a dataset deleted since it failed
+        Expected outcome is the dataset is dropped from the checkpoint and the run succeeds
+        """
+        self.failing.add('s01')
+        self.assertEqual(self.run_seed(), 1)
+        del self.catalog.datasets['s01']
+        self.assertEqual(self.run_seed(), 0)
+        self.assertNotIn('s01', self.provisioned)
+
+    def test_restart(self):
+        """
+        Tests a run ignoring the checkpoint of an interrupted one
+        Expected outcome is the datasets are read again from the first page
+        """
+        self.catalog.interrupt_after = 1
+        with self.assertRaises(Interrupted):
+            self.run_seed()
+        self.catalog.interrupt_after = None
+        self.catalog.searches = []
+        self.assertEqual(self.run_seed(restart=True), 0)
+        self.assertEqual(self.catalog.searches[0], None)
+        self.assertEqual(len(self.provisioned), 13)
+
+# Required to run unit test
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+"""
+Tests for impl/simple_meta_auth.py, run against a temporary directory
+Can use -v on run to return verbose tests with more detail
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from ckanext.vitality.meta_authorize import MetaAuthorize, MetaAuthorizeType, config_opts, diff_fingerprints
+from ckanext.vitality.impl.simple_meta_auth import _SimpleMetaAuth, JOURNAL_FILE, SNAPSHOT_FILE
+
+
+class TestSimpleMetaAuth(unittest.TestCase):
+    """
+    Runs testing methods related to the journaled authorization model
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.model = self.open()
+        self.model.add_role('public', 'public')
+        self.model.add_role('admin', 'admin')
+        self.model.add_user('public', 'public')
+        self.model.set_user_role('public', 'public')
+        self.model.add_user('u1', 'user1', 'user1@example.com')
+        self.model.add_org('o1', [{'id': 'u1'}], 'Org 1')
+        self.model.provision_dataset('d1', 'o1', 'Dataset 1', 'h1', {'en': 'A dataset'}, [
+            {'id': 't1', 'name': 'Full', 'fields': {'id': 'e1', 'title': 'e2', 'spatial': 'e3'}, 'roles': ['admin'], 'org_roles': True},
+            {'id': 't2', 'name': 'Minimal', 'fields': {'id': 'e1', 'title': 'e2'}, 'roles': ['public']}
+        ])
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def open(self, compact_every=1000):
+        return _SimpleMetaAuth(self.path, compact_every=compact_every, poll_interval=0)
+
+    def assertModel(self, model):
+        self.assertCountEqual(model.get_visible_fields('d1', 'u1'), ['e1', 'e2', 'e3'])
+        self.assertCountEqual(model.get_visible_fields('d1', 'public'), ['e1', 'e2'])
+        self.assertEqual(model.get_user_by_username('user1'), {'id': 'u1', 'username': 'user1', 'email': 'user1@example.com'})
+        self.assertEqual(model.get_organization('o1'), {'id': 'o1', 'name': 'Org 1'})
+        self.assertEqual(model.get_roles('o1'), self.model.get_roles('o1'))
+
+    def test_replay(self):
+        """
+        Tests reopening the model from its journal
+        Expected outcome is the same access and details as the model that wrote the journal
+        """
+        self.assertModel(self.model)
+        self.assertFalse(os.path.exists(os.path.join(self.path, SNAPSHOT_FILE)))
+        self.assertModel(self.open())
+
+    def test_compact(self):
+        """
+        Tests compacting the journal into a snapshot
+        Expected outcome is an empty journal, and the same model when reopened from the snapshot
+        """
+        self.model.compact()
+        self.assertEqual(os.path.getsize(os.path.join(self.path, JOURNAL_FILE)), 0)
+        self.assertModel(self.open())
+        model = self.open(compact_every=2)
+        model.set_dataset_description('d1', 'fr', 'Un jeu de donnees')
+        model.set_element_access_for_template('d1', 'Minimal', 'spatial')
+        self.assertEqual(os.path.getsize(os.path.join(self.path, JOURNAL_FILE)), 0)
+        self.assertCountEqual(self.open().get_visible_fields('d1', 'public'), ['e1', 'e2', 'e3'])
+
+    def test_shared_files(self):
+        """
+        Tests two models sharing the same directory
+        Expected outcome is each model sees the writes of the other, including across a compaction
+        """
+        other = self.open()
+        other.set_template_access('public', 't1')
+        self.model.refresh()
+        self.assertTrue(self.model.is_unrestricted('d1'))
+        other.compact()
+        other.delete_user('u1')
+        self.model.refresh()
+        self.assertEqual(self.model.get_users(), other.get_users())
+        self.model.add_user('u2', 'user2')
+        other.refresh()
+        self.assertEqual(other.get_user('u2'), {'id': 'u2', 'username': 'user2', 'email': None})
+
+    def test_add_org(self):
+        """
+        Tests adding an organization without a source model
+        Expected outcome is the id of the member role only depends on the organization id
+        """
+        other = _SimpleMetaAuth(tempfile.mkdtemp(), poll_interval=0)
+        try:
+            other.add_org('o1', [], 'Org 1')
+            self.assertEqual(other.get_roles('o1'), self.model.get_roles('o1'))
+        finally:
+            shutil.rmtree(other.path)
+
+    def test_config(self):
+        """
+        Tests creating the model from the ckan.vitality.* settings, as the plugin and the commands do
+        Expected outcome is the model configured for the backend, sharing the files of the existing one, and
+        invalidations only published by default when workers keep state to invalidate
+        """
+        model = MetaAuthorize.create(MetaAuthorizeType.SIMPLE, config_opts({'ckan.vitality.simple.path': self.path,
+            'ckan.vitality.simple.compact_every': '10'}))
+        self.assertIsInstance(model, _SimpleMetaAuth)
+        self.assertEqual(config_opts({})['invalidation']['transport'], "none")
+        self.assertEqual(config_opts({'ckan.vitality.cache.enabled': 'true'})['invalidation']['transport'], "redis")
+        self.assertEqual(config_opts({'ckan.vitality.backend': 'bitset'})['invalidation']['transport'], "redis")
+        self.assertEqual(model.compact_every, 10)
+        self.assertModel(model)
+
+    def test_reads(self):
+        """
+        Tests the reads of the fields, users and organizations, from the model that wrote them and a reopened one
+        Expected outcome is the fields of the dataset, those the public can see, and the users and organizations added
+        """
+        for model in (self.model, self.open()):
+            self.assertEqual(model.get_metadata_fields('d1'), {'id': 'e1', 'title': 'e2', 'spatial': 'e3'})
+            self.assertCountEqual(model.get_visible_fields('d1', 'public'), ['e1', 'e2'])
+            self.assertCountEqual(model.get_public_fields('d1'), ['id', 'title'])
+            self.assertCountEqual(model.get_users(), ['public', 'u1'])
+            self.assertEqual(model.get_orgs(), ['o1'])
+
+    def test_reconcile(self):
+        """
+        Tests reconciling the model with fingerprints read from CKAN, as `ckan vitality reconcile` does
+        Expected outcome is the model, and a model reopened from the journal, has the fingerprints of CKAN
+        but for the datasets left to provision
+        """
+        fingerprints = self.model.get_fingerprints()
+        self.assertEqual(fingerprints['users'], {('public', 'public', ''), ('u1', 'user1', 'user1@example.com')})
+        self.assertEqual(fingerprints['organizations'], {('o1', 'Org 1')})
+        self.assertEqual(fingerprints['org_members'], {('o1', 'u1')})
+        self.assertEqual(fingerprints['datasets'], {('d1', 'o1')})
+
+        ckan = {
+            'users': {('u1', 'user1', 'renamed@example.com'), ('u2', 'user2', ''), ('u3', 'user3', '')},
+            'admins': {'u3'},
+            'organizations': {('o1', 'Org 1'), ('o2', 'Org 2')},
+            'org_members': {('o2', 'u1'), ('o2', 'u2')},
+            'groups': {'g1'},
+            'group_members': {('g1', 'u2')},
+            'datasets': {('d1', 'o2'), ('d2', 'o2')}
+        }
+        deltas = diff_fingerprints(ckan, fingerprints)
+        applied = []
+        self.assertEqual(self.model.apply_deltas(deltas, progress=lambda name, count: applied.append(name)),
+            sum(len(changes) for name, changes in deltas.items() if name != 'add_datasets'))
+        self.assertIn('add_org_members', applied)
+        self.assertNotIn('add_datasets', applied)
+        expected = dict(diff_fingerprints(ckan, ckan), add_datasets=deltas['add_datasets'])
+        self.assertEqual(diff_fingerprints(ckan, self.model.get_fingerprints()), expected)
+        self.assertEqual(diff_fingerprints(ckan, self.open().get_fingerprints()), expected)
+        self.assertEqual(self.model.get_dataset('d1'), None)
+        self.assertEqual(self.model.get_user('u1')['email'], 'renamed@example.com')
+
+# Required to run unit test
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+"""
+Tests for impl/sql_meta_auth.py, run against an in memory SQLite database
+Can use -v on run to return verbose tests with more detail
+"""
+import unittest
+from sqlalchemy import create_engine
+from ckanext.vitality.meta_authorize import diff_fingerprints
+from ckanext.vitality.impl.sql_meta_auth import _SqlMetaAuth
+
+
+class TestSqlMetaAuth(unittest.TestCase):
+    """
+    Runs testing methods related to the SQL authorization model
+    """
+
+    def setUp(self):
+        self.model = _SqlMetaAuth(create_engine('sqlite://'))
+        self.model.init_tables()
+        self.model.add_role('public', 'public')
+        self.model.add_role('admin', 'admin')
+        self.model.add_user('public', 'public')
+        self.model.set_user_role('public', 'public')
+        self.model.add_user('u1', 'user1', 'user1@example.com')
+        self.model.add_org('o1', [{'id': 'u1'}], 'Org 1')
+        self.model.provision_dataset('d1', 'o1', 'Dataset 1', 'h1', {'en': 'A dataset'}, [
+            {'id': 't1', 'name': 'Full', 'fields': {'id': 'e1', 'title': 'e2', 'spatial': 'e3'}, 'roles': ['admin'], 'org_roles': True},
+            {'id': 't2', 'name': 'Minimal', 'fields': {'id': 'e1', 'title': 'e2'}, 'roles': ['public']}
+        ])
+
+    def test_provision_dataset(self):
+        """
+        Tests provisioning a dataset with a template for the organization's roles and one for the public
+        Expected outcome is the members of the organization see every field, the public the Minimal ones
+        """
+        self.assertEqual(self.model.get_dataset('d1'), 'd1')
+        self.assertEqual(self.model.get_templates('d1'), {'Full': 't1', 'Minimal': 't2'})
+        self.assertEqual(self.model.get_metadata_fields('d1'), {'id': 'e1', 'title': 'e2', 'spatial': 'e3'})
+        self.assertCountEqual(self.model.get_visible_fields('d1', 'u1'), ['e1', 'e2', 'e3'])
+        self.assertCountEqual(self.model.get_visible_fields('d1', 'public'), ['e1', 'e2'])
+        self.assertEqual(self.model.get_template_access_for_user('d1', 'u1'), 'Full')
+        self.assertFalse(self.model.provision_dataset('d1', 'o1', templates=[{'id': 't3', 'fields': {}}]))
+
+    def test_unrestricted(self):
+        """
+        Tests full access checks
+        Expected outcome is unrestricted for users of the Full template and users without a template
+        """
+        self.assertFalse(self.model.is_unrestricted('d1'))
+        self.assertTrue(self.model.is_unrestricted_for_user('d1', 'u1'))
+        self.assertTrue(self.model.is_unrestricted_for_user('d1', 'u2'))
+
+    def test_resolve_views(self):
+        """
+        Tests resolving the views of several datasets with one query
+        Expected outcome is a ViewDecision for existing datasets only, with the public field names
+        """
+        decisions = self.model.resolve_views(['d1', 'd2'], 'public')
+        self.assertEqual(list(decisions), ['d1'])
+        self.assertFalse(decisions['d1'].unrestricted)
+        self.assertEqual(decisions['d1'].visible, frozenset(['e1', 'e2']))
+        self.assertCountEqual(decisions['d1'].public_fields, ['id', 'title'])
+        self.assertTrue(self.model.resolve_view('d1', 'u1').unrestricted)
+
+    def test_access_changes(self):
+        """
+        Tests changing the fields visible to a template and the template used by a role
+        Expected outcome is the new access, with a role using a single template per dataset
+        """
+        self.model.set_element_access_for_template('d1', 'Minimal', 'spatial')
+        self.model.set_element_access_for_template('d1', 'Minimal', 'spatial')
+        self.model.delete_element_access_for_template('d1', 'Minimal', 'title')
+        self.assertCountEqual(self.model.get_visible_fields('d1', 'public'), ['e1', 'e3'])
+        self.model.set_template_access('public', 't1')
+        self.assertEqual(self.model.get_template_access_for_role('d1', 'public'), 'Full')
+        self.assertTrue(self.model.is_unrestricted('d1'))
+        self.model.set_visible_fields('t2', {'id': 'e1'})
+        self.model.set_template_access('public', 't2')
+        self.assertEqual(self.model.get_visible_fields('d1', 'public'), ['e1'])
+
+    def test_users_and_orgs(self):
+        """
+        Tests the users, roles and organizations of the model
+        Expected outcome is the member role of the organization given to its users
+        """
+        self.assertEqual(self.model.get_user_by_username('user1'), {'id': 'u1', 'username': 'user1', 'email': 'user1@example.com'})
+        self.assertEqual(self.model.get_organization('o1'), {'id': 'o1', 'name': 'Org 1'})
+        self.assertEqual(list(self.model.get_roles('o1')), ['member'])
+        self.model.set_user_role('u1', 'admin')
+        self.assertEqual(self.model.get_admins(), ['u1'])
+        self.model.delete_user('u1')
+        self.assertEqual(self.model.get_user('u1'), None)
+        self.assertEqual(self.model.get_admins(), [])
+
+    def test_delete_harvest(self):
+        """
+        Tests deleting the datasets of a harvest source
+        Expected outcome is the datasets, their templates and elements are gone
+        """
+        self.model.delete_harvest('h1')
+        self.assertEqual(self.model.get_dataset('d1'), None)
+        self.assertEqual(self.model.get_templates('d1'), {})
+        self.assertEqual(self.model.get_metadata_fields('d1'), {})
+
+    def test_import_snapshot(self):
+        """
+        Tests importing a snapshot exported from the graph model
+        Expected outcome is the access of the snapshot, replacing the rows of the datasets it contains
+        """
+        self.model.import_snapshot({
+            'users': {'u2': ['admin']},
+            'profiles': {'u2': {'username': 'user2', 'email': None, 'gid': None}},
+            'organizations': {},
+            'roles': {},
+            'datasets': {'d1': {'name': 'Dataset 1', 'owner': 'o1', 'harvest_source': None, 'fields': {'id': 'e1', 'title': 'e2'},
+                'templates': {'t4': {'name': 'Full', 'roles': ['admin', 'public'], 'visible': ['e1', 'e2']}}}}
+        })
+        self.assertEqual(self.model.get_templates('d1'), {'Full': 't4'})
+        self.assertTrue(self.model.is_unrestricted('d1'))
+        self.assertCountEqual(self.model.get_visible_fields('d1', 'u2'), ['e1', 'e2'])
+        self.assertEqual(self.model.get_user_by_username('user2')['id'], 'u2')
+
+    def test_reconcile(self):
+        """
+        Tests reconciling the tables with fingerprints read from CKAN, one change per transaction
+        Expected outcome is the tables have the fingerprints of CKAN, but for the datasets left to provision
+        """
+        fingerprints = self.model.get_fingerprints()
+        self.assertEqual(fingerprints['users'], {('public', 'public', ''), ('u1', 'user1', 'user1@example.com')})
+        self.assertEqual(fingerprints['organizations'], {('o1', 'Org 1')})
+        self.assertEqual(fingerprints['org_members'], {('o1', 'u1')})
+        self.assertEqual(fingerprints['datasets'], {('d1', 'o1')})
+
+        ckan = {
+            'users': {('u1', 'user1', 'renamed@example.com'), ('u2', 'user2', ''), ('u3', 'user3', '')},
+            'admins': {'u3'},
+            'organizations': {('o1', 'Org 1'), ('o2', 'Org 2')},
+            'org_members': {('o2', 'u1'), ('o2', 'u2')},
+            'groups': {'g1'},
+            'group_members': {('g1', 'u2')},
+            'datasets': {('d1', 'o2'), ('d2', 'o2')}
+        }
+        deltas = diff_fingerprints(ckan, fingerprints)
+        applied = []
+        self.model.apply_deltas(deltas, 1, lambda name, count: applied.append(name))
+        self.assertEqual(applied.count('add_users'), 2)
+        self.assertEqual(applied.count('add_org_members'), 2)
+        self.assertNotIn('add_datasets', applied)
+        reconciled = self.model.get_fingerprints()
+        self.assertEqual(diff_fingerprints(ckan, reconciled), dict(diff_fingerprints(ckan, ckan), add_datasets=deltas['add_datasets']))
+        self.assertEqual(self.model.get_dataset('d1'), None)
+        self.assertEqual(self.model.get_templates('d1'), {})
+
+# Required to run unit test
+if __name__ == '__main__':
+    unittest.main()
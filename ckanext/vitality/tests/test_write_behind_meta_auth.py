@@ -0,0 +1,110 @@
+"""
+Tests for impl/write_behind_meta_auth.py, writing to the graph model of fake_neo4j.py through a journal in a temporary directory
+Can use -v on run to return verbose tests with more detail
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from ckanext.vitality.meta_authorize import MetaAuthorize, MetaAuthorizeType
+from ckanext.vitality.impl.write_behind_meta_auth import _WriteBehindMetaAuth
+from ckanext.vitality.tests.fake_neo4j import FakeDriver
+from ckanext.vitality.tests.test_graph_meta_auth import seed
+
+
+class TestWriteBehindMetaAuth(unittest.TestCase):
+    """
+    Runs testing methods related to the write behind authorization model
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.driver = FakeDriver()
+        self.graph = MetaAuthorize.create(MetaAuthorizeType.GRAPH, {'driver': self.driver})
+        seed(self.graph)
+        self.model = _WriteBehindMetaAuth(self.graph, os.path.join(self.path, 'journal.db'), poll_interval=0.01, max_attempts=2, start=False)
+        self.driver.reset()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_queue(self):
+        """
+        Tests writing through the journal
+        Expected outcome is no graph transaction until the writes are applied, then the writes in order
+        """
+        self.model.add_user('u2', 'user2', 'user2@example.com', 'guest')
+        self.model.set_user_role('u2', self.graph.get_roles('o1')['member'])
+        self.driver.reset()
+        self.assertEqual(self.model.get_user('u2'), None)
+        self.assertEqual(self.driver.stats['write_transactions'], 0)
+        self.assertEqual(self.model.pending(), 2)
+        self.assertEqual(self.model.apply_pending(), 2)
+        self.assertEqual(self.model.pending(), 0)
+        self.assertCountEqual(self.model.get_visible_fields('d1', 'u2'), ['e1', 'e2', 'e3'])
+
+    def test_coalesce(self):
+        """
+        Tests writes replacing pending ones
+        Expected outcome is the last name of each language is applied, nothing of a deleted dataset
+        """
+        self.model.set_dataset_description('d1', 'en', 'First')
+        self.model.set_dataset_description('d1', 'fr', 'Premier')
+        self.model.set_dataset_description('d1', 'en', 'Second')
+        self.assertEqual(self.model.pending(), 2)
+        self.model.set_dataset_name('d1', 'Renamed')
+        self.model.delete_dataset('d1')
+        self.assertEqual(self.model.pending(), 1)
+        self.assertTrue(self.model.flush())
+        self.assertEqual(self.driver.queries, {'DELETE_DATASET': 1})
+        self.assertEqual(self.model.get_dataset('d1'), None)
+
+    def test_failure(self):
+        """
+        Tests a write failing
+        Expected outcome is the write is retried, then marked as failed and the following writes applied
+        """
+        self.graph.driver = None
+        self.model.set_user_email('u1', 'renamed@example.com')
+        self.assertEqual(self.model.apply_pending(), 0)
+        self.assertEqual(self.model.pending(), 1)
+        self.assertEqual(self.model.apply_pending(), 0)
+        self.assertEqual(self.model.pending(), 0)
+        self.assertEqual(self.model.failed(), [(1, 'set_user_email', ['u1', 'renamed@example.com'])])
+        self.graph.driver = self.driver
+        self.model.add_user('u2', 'user2')
+        self.assertEqual(self.model.apply_pending(), 1)
+        self.assertEqual(self.model.get_user('u2')['username'], 'user2')
+        self.assertEqual(self.model.get_user('u1')['email'], 'user1@example.com')
+
+    def test_provision_after_org(self):
+        """
+        Tests provisioning a dataset right after queuing its organization
+        Expected outcome is the organization is written first, the dataset is owned by it and visible to its members
+        """
+        self.model.add_user('u2', 'user2')
+        self.model.add_org('o2', [{'id': 'u2'}], 'Org 2')
+        self.model.provision_dataset('d2', 'o2', 'Dataset 2', None, None, [
+            {'id': 't3', 'name': 'Full', 'fields': {'id': 'e4', 'title': 'e5'}, 'roles': ['admin'], 'org_roles': True}
+        ])
+        self.assertEqual(self.model.pending(), 0)
+        self.assertEqual(self.driver.graph.ends(self.driver.graph.first('organization', id='o2'), 'owns', 'dataset'), [self.driver.graph.first('dataset', id='d2')])
+        self.assertCountEqual(self.model.get_visible_fields('d2', 'u2'), ['e4', 'e5'])
+
+    def test_background(self):
+        """
+        Tests applying the writes from the consumer thread
+        Expected outcome is flush returns once the writes are read back from the graph
+        """
+        model = _WriteBehindMetaAuth(self.graph, self.model.path, poll_interval=0.01)
+        try:
+            model.set_organization_name('o1', 'Renamed')
+            self.assertTrue(model.flush(5, model.fence()))
+            self.assertEqual(model.get_organization('o1')['name'], 'Renamed')
+        finally:
+            model.close()
+        self.assertTrue(MetaAuthorize.flush(self.graph))
+
+# Required to run unit test
+if __name__ == '__main__':
+    unittest.main()